@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+HLS下载器公共组件
+供命令行版、GUI版和Web后端共享的下载基础设施
+"""
+
+from .session import create_session, get_shared_session, session_stats
+from .async_engine import (
+    AsyncSegmentEngine,
+    asyncio_available,
+    ENGINES,
+    ENGINE_THREAD,
+    ENGINE_ASYNCIO,
+)
+from .merge import OrderedSegmentWriter, DEFAULT_STREAM_BUFFER, copy_file_into
+from .ffmpeg import FFmpegProcess, FFmpegProgress, ffmpeg_available, format_seconds
+from .remux import TSRemuxer, split_nal_units
+from .crypto import StreamingDecryptor, segment_iv, DecryptPool, get_decrypt_pool
+from .segment import SegmentSink, SEGMENT_CHUNK_SIZE, absolute_url, segment_file_name
+from .keys import KeyCache, shared_key_cache
+from .concurrency import AdaptiveLimiter
+from .manifest import SegmentManifest, temp_dir_name
+from .byterange import (
+    RangeJob,
+    RangeReceiver,
+    plan_range_jobs,
+    count_range_jobs,
+    parse_byterange,
+    response_offset,
+    DEFAULT_MAX_RANGE_REQUEST,
+)
+from .multipart import (
+    ParallelRangeDownload,
+    split_size,
+    split_ranges,
+    DEFAULT_SEGMENT_CONNECTIONS,
+    DEFAULT_SPLIT_THRESHOLD,
+)
+from .schedule import PlaybackScheduler, job_indices, DEFAULT_LOOKAHEAD_FACTOR
+from .hedge import HedgeTracker, SegmentRace, watching, DEFAULT_HEDGE_FRACTION
+from .segtable import SegmentTable, SegmentRecord, KeyInfo, MapInfo
+from .playlist_stream import PlaylistStream, MediaPlaylistParser, stream_playlist, parse_media_playlist
+from .mirrors import Mirror, MirrorSet, equivalent_variants, load_mirrors
+from .retry import RetryPolicy, RetryStats, RETRYABLE_STATUS, classify_error
+from .live import LivePlaylist
+from .fmp4 import InitSection, InitSectionCache, init_section_of, range_header
+from .variants import (
+    VariantPolicy,
+    VariantChoice,
+    parse_variant_policy,
+    select_variant,
+    choose_variant,
+    describe_variant,
+    DEFAULT_VARIANT_POLICY,
+)
+
+__all__ = [
+    "AsyncSegmentEngine",
+    "asyncio_available",
+    "ENGINES",
+    "ENGINE_THREAD",
+    "ENGINE_ASYNCIO",
+    "OrderedSegmentWriter",
+    "DEFAULT_STREAM_BUFFER",
+    "copy_file_into",
+    "FFmpegProcess",
+    "FFmpegProgress",
+    "ffmpeg_available",
+    "format_seconds",
+    "TSRemuxer",
+    "split_nal_units",
+    "StreamingDecryptor",
+    "segment_iv",
+    "DecryptPool",
+    "get_decrypt_pool",
+    "SegmentSink",
+    "SEGMENT_CHUNK_SIZE",
+    "absolute_url",
+    "segment_file_name",
+    "KeyCache",
+    "shared_key_cache",
+    "AdaptiveLimiter",
+    "SegmentManifest",
+    "temp_dir_name",
+    "RangeJob",
+    "RangeReceiver",
+    "plan_range_jobs",
+    "count_range_jobs",
+    "parse_byterange",
+    "response_offset",
+    "DEFAULT_MAX_RANGE_REQUEST",
+    "ParallelRangeDownload",
+    "split_size",
+    "split_ranges",
+    "DEFAULT_SEGMENT_CONNECTIONS",
+    "DEFAULT_SPLIT_THRESHOLD",
+    "PlaybackScheduler",
+    "job_indices",
+    "DEFAULT_LOOKAHEAD_FACTOR",
+    "HedgeTracker",
+    "SegmentRace",
+    "watching",
+    "DEFAULT_HEDGE_FRACTION",
+    "SegmentTable",
+    "SegmentRecord",
+    "KeyInfo",
+    "MapInfo",
+    "PlaylistStream",
+    "MediaPlaylistParser",
+    "stream_playlist",
+    "parse_media_playlist",
+    "Mirror",
+    "MirrorSet",
+    "equivalent_variants",
+    "load_mirrors",
+    "RetryPolicy",
+    "RetryStats",
+    "RETRYABLE_STATUS",
+    "classify_error",
+    "LivePlaylist",
+    "InitSection",
+    "InitSectionCache",
+    "init_section_of",
+    "range_header",
+    "VariantPolicy",
+    "VariantChoice",
+    "parse_variant_policy",
+    "select_variant",
+    "choose_variant",
+    "describe_variant",
+    "DEFAULT_VARIANT_POLICY",
+    "create_session",
+    "get_shared_session",
+    "session_stats",
+]
@@ -0,0 +1,429 @@
+# -*- coding: utf-8 -*-
+"""
+基于 asyncio 的分片下载引擎
+单线程事件循环即可维持数百个并发分片请求，替代一分片一线程的线程池
+"""
+
+import asyncio
+import os
+import time
+import urllib.request
+
+from .segment import SEGMENT_CHUNK_SIZE, absolute_url, segment_file_name
+from .byterange import RangeJob, RangeReceiver, response_offset
+from .multipart import split_size
+from .schedule import PlaybackScheduler
+
+try:
+    import aiohttp
+except ImportError:  # aiohttp 为可选依赖
+    aiohttp = None
+
+
+ENGINE_THREAD = "thread"
+ENGINE_ASYNCIO = "asyncio"
+ENGINES = (ENGINE_THREAD, ENGINE_ASYNCIO)
+
+
+def asyncio_available():
+    """是否已安装 asyncio 引擎所需的 aiohttp"""
+    return aiohttp is not None
+
+
+def wake_on(future, loop):
+    """
+    concurrent.futures.Future 完成时唤醒事件循环
+
+    返回在事件循环中等待用的 asyncio.Future，由完成 future 的线程（如播放列表解析线程）
+    通过 call_soon_threadsafe 设置结果。与 asyncio.wrap_future 不同，不会反过来取消 future，
+    事件循环结束之后 future 才完成也不会出错。
+    """
+    waiter = loop.create_future()
+
+    def wake(_):
+        try:
+            loop.call_soon_threadsafe(_set_done, waiter)
+        except RuntimeError:
+            # 事件循环已经结束
+            pass
+
+    future.add_done_callback(wake)
+    return waiter
+
+
+def _set_done(waiter):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+def cookie_header_for(cookie_jar, url):
+    """按 URL 从 cookie jar 中取出 Cookie 请求头，域名/路径匹配规则与 requests 一致"""
+    if not cookie_jar:
+        return None
+    request = urllib.request.Request(url)
+    cookie_jar.add_cookie_header(request)
+    return request.get_header("Cookie")
+
+
+class AsyncSegmentEngine:
+    """
+    asyncio 分片下载引擎
+
+    与线程池版本保持相同的语义：清单中已完成的分片直接跳过（断点续传），
+    失败时按下载器的重试策略退避重试，加密分片在接收时增量解密。
+    对冲请求与原请求先完成的一方胜出后，另一方的任务直接取消。
+    """
+
+    def __init__(self, downloader, concurrency, log=None, on_result=None, limiter=None, hedger=None):
+        """
+        Args:
+            downloader: M3U8Downloader 或 M3U8DownloaderGUI 实例
+            concurrency: 同时进行的分片请求数（使用 limiter 时为连接数上限）
+            log: 日志函数 log(message)
+            on_result: 每个分片完成后的回调 on_result((index, success, file_path))
+            limiter: 并发控制器（AdaptiveLimiter，也可以是固定并发数的），为 None 时用信号量限制并发数
+            hedger: 尾部对冲调度（HedgeTracker），为 None 时不对冲
+        """
+        if aiohttp is None:
+            raise RuntimeError("asyncio 引擎需要安装 aiohttp: pip install aiohttp")
+        self.downloader = downloader
+        self.concurrency = max(1, int(concurrency))
+        self.log = log or (lambda message: None)
+        self.on_result = on_result
+        self.limiter = limiter
+        self.hedger = hedger
+        self._semaphore = None
+        self._slot_changed = None
+
+    def _cancelled(self):
+        return getattr(self.downloader, "cancel_flag", False)
+
+    def _proxy_for(self, url):
+        proxies = getattr(self.downloader, "proxies", None)
+        if not proxies:
+            return None
+        scheme = "https" if url.startswith("https://") else "http"
+        return proxies.get(scheme)
+
+    async def _acquire(self):
+        if self.limiter is None:
+            await self._semaphore.acquire()
+            return None
+        async with self._slot_changed:
+            while True:
+                token = self.limiter.try_acquire()
+                if token is not None:
+                    return token
+                await self._slot_changed.wait()
+
+    async def _release(self, token, ok, nbytes=0, ttfb=None):
+        if self.limiter is None:
+            self._semaphore.release()
+            return
+        self.limiter.release(token, ok, nbytes, ttfb)
+        async with self._slot_changed:
+            self._slot_changed.notify_all()
+
+    async def _fetch_segment(self, http, index, segment, race=None, hedge=False):
+        segment_url = absolute_url(segment, self.downloader.url)
+        file_path = self.downloader.temp_dir / segment_file_name(index)
+        # 对冲请求写入单独的临时文件，胜出后再改名
+        sink_path = file_path.with_name(f"{file_path.name}.hedge") if hedge else file_path
+
+        if not hedge and self.downloader.manifest.is_done(index, segment_url, file_path):
+            self.downloader.store_segment(index, file_path)
+            return (index, True, file_path)
+
+        loop = asyncio.get_running_loop()
+        policy = self.downloader.retry_policy
+        mirrors = getattr(self.downloader, "mirrors", None)
+        # 中断的传输保留写入端，下一次尝试用 Range 续传；有镜像线路时失败后换线重试
+        sink = None
+        split = None
+        failed = set()
+        try:
+            for attempt in range(policy.attempts):
+                if self._cancelled():
+                    return (index, False, None)
+                # 每次尝试单独占用并发名额，失败退让后重试按新的并发数排队
+                token = await self._acquire()
+                mirror = mirrors.acquire(failed) if mirrors else None
+                request_url = mirror.segment_url(index, segment) if mirror else segment_url
+                ok = False
+                nbytes = 0
+                ttfb = None
+                error = None
+                started = time.monotonic()
+                try:
+                    request_headers = self._request_headers(request_url)
+                    resume = sink.resume_headers() if sink else None
+                    if resume:
+                        request_headers = {**request_headers, **resume}
+
+                    async with http.get(request_url, headers=request_headers, proxy=self._proxy_for(request_url)) as response:
+                        ttfb = time.monotonic() - started
+                        response.raise_for_status()
+                        if sink is None:
+                            split = split_size(response.status, response.headers,
+                                               self.downloader.segment_connections, self.downloader.split_threshold)
+                            if split:
+                                # 超大分片：不读取这个响应，在线程池中用多个 Range 请求并行下载
+                                # （对冲请求直接放弃，原请求已在并行下载）
+                                ok = True
+                                break
+                        if sink and not (resume and sink.continues(response.status, response.headers)):
+                            # 服务器忽略了 Range 或资源已变化，从头下载
+                            sink.abort()
+                            sink = None
+                        if sink is None:
+                            # 获取密钥可能发起网络请求，放到线程池执行
+                            if segment.key:
+                                sink = await loop.run_in_executor(None, self.downloader.open_segment_sink, index, sink_path, segment)
+                            else:
+                                sink = self.downloader.open_segment_sink(index, sink_path, segment)
+                            sink.begin(response.headers)
+                        else:
+                            self.downloader.retry_stats.record_resume(sink.bytes_received)
+                        async for chunk in response.content.iter_chunked(SEGMENT_CHUNK_SIZE):
+                            sink.write(chunk)
+                            nbytes += len(chunk)
+
+                    # 对冲中先登记胜出，落败的一方不再写入分片文件
+                    if race and not race.claim(hedge):
+                        return (index, False, None)
+                    # 交给解密进程池时需要等待子进程，不能阻塞事件循环
+                    if sink.offload:
+                        data = await loop.run_in_executor(None, sink.finish)
+                    else:
+                        data = sink.finish()
+                    if data is None and sink_path != file_path:
+                        os.replace(sink_path, file_path)
+                    if data is not None:
+                        await loop.run_in_executor(None, self.downloader.store_segment, index, file_path, data)
+                    else:
+                        self.downloader.manifest.mark_done(index, segment_url, sink.bytes_written, sink.crc32, sink.expected_size)
+                    ok = True
+                    sink = None
+                    return (index, True, file_path)
+                except Exception as e:
+                    error = e
+                finally:
+                    # 对冲落败被取消不算失败，不影响自适应并发
+                    await self._release(token, ok or bool(race and race.lost(hedge)), nbytes, ttfb)
+                    if mirror:
+                        mirrors.release(mirror, nbytes, time.monotonic() - started,
+                                        None if race and race.lost(hedge) else ok)
+
+                delay = policy.backoff(error, attempt, self.downloader.retry_stats)
+                if mirror:
+                    failed.add(mirror)
+                    if attempt + 1 < policy.attempts and mirrors.untried(failed):
+                        delay = 0
+                if sink and (delay is None or not sink.resume_headers()):
+                    sink.abort()
+                    sink = None
+                if delay is None:
+                    self.log(f"[!] 分片 {index} 下载失败: {error}")
+                    return (index, False, None)
+                await asyncio.sleep(delay)
+            if split and not hedge:
+                try:
+                    return await loop.run_in_executor(None, self.downloader.download_segment_parallel,
+                                                      index, segment, segment_url, file_path, split)
+                finally:
+                    # 多连接下载在线程中归还的名额不会唤醒等待的协程，这里补发通知
+                    if self.limiter is not None:
+                        async with self._slot_changed:
+                            self._slot_changed.notify_all()
+            return (index, False, None)
+        finally:
+            # 取消或放弃时删除未完成的 .part 文件
+            if sink:
+                sink.abort()
+
+    def _request_headers(self, url):
+        headers = dict(self.downloader.headers)
+        cookie = cookie_header_for(self.downloader.cookie_jar, url)
+        if cookie:
+            headers['Cookie'] = cookie
+        return headers
+
+    def _open_range_sink(self, member):
+        file_path = self.downloader.temp_dir / segment_file_name(member.index)
+        sink = self.downloader.open_segment_sink(member.index, file_path, member.segment)
+        sink.expect(member.length)
+        return sink
+
+    async def _finish_range_member(self, loop, member, url, sink):
+        file_path = self.downloader.temp_dir / segment_file_name(member.index)
+        try:
+            if sink.offload:
+                data = await loop.run_in_executor(None, sink.finish)
+            else:
+                data = sink.finish()
+        except Exception:
+            sink.abort()
+            raise
+        if data is not None:
+            await loop.run_in_executor(None, self.downloader.store_segment, member.index, file_path, data)
+        else:
+            self.downloader.manifest.mark_done(member.index, url, sink.bytes_written, sink.crc32, member.length)
+        return (member.index, True, file_path)
+
+    async def _fetch_range_job(self, http, job):
+        """下载一组合并的 EXT-X-BYTERANGE 分片，返回每个分片的结果"""
+        results = {}
+        pending = []
+        for member in job.members:
+            file_path = self.downloader.temp_dir / segment_file_name(member.index)
+            if self.downloader.manifest.is_done(member.index, job.url, file_path):
+                self.downloader.store_segment(member.index, file_path)
+                results[member.index] = (member.index, True, file_path)
+            else:
+                pending.append(member)
+
+        # 先在线程池中取好密钥，之后创建写入端不会阻塞事件循环
+        loop = asyncio.get_running_loop()
+        keys = {id(member.segment.key): member.segment.key for member in pending if member.segment.key}
+        for key in keys.values():
+            await loop.run_in_executor(None, self.downloader.get_decrypt_key, key)
+
+        headers = self._request_headers(job.url)
+        policy = self.downloader.retry_policy
+        attempt = 0
+        while pending and not self._cancelled():
+            token = await self._acquire()
+            ok = False
+            nbytes = 0
+            ttfb = None
+            error = None
+            receiver = None
+            try:
+                start = pending[0].start
+                request_headers = {**headers, 'Range': f'bytes={start}-{pending[-1].end - 1}'}
+                started = time.monotonic()
+                async with http.get(job.url, headers=request_headers, proxy=self._proxy_for(job.url)) as response:
+                    ttfb = time.monotonic() - started
+                    response.raise_for_status()
+                    offset = response_offset(response.status, response.headers, start)
+                    receiver = RangeReceiver(pending, offset, self._open_range_sink)
+                    async for chunk in response.content.iter_chunked(SEGMENT_CHUNK_SIZE):
+                        nbytes += len(chunk)
+                        for member in receiver.feed(chunk):
+                            results[member.index] = await self._finish_range_member(loop, member, job.url, receiver.take(member))
+                        # 服务器忽略 Range 返回整个文件时，收够即停
+                        if receiver.done:
+                            break
+                if not receiver.done:
+                    raise IOError(f"字节范围响应不完整: {receiver.offset}/{receiver.end}")
+                ok = True
+            except Exception as e:
+                error = e
+            finally:
+                if receiver:
+                    receiver.abort()
+                await self._release(token, ok, nbytes, ttfb)
+
+            remaining = [member for member in pending if member.index not in results]
+            # 这次请求已收完部分分片，只是后面断开，不计入失败次数
+            if len(remaining) < len(pending):
+                attempt = 0
+            pending = remaining
+            if not pending:
+                break
+            delay = policy.backoff(error, attempt, self.downloader.retry_stats)
+            if delay is None:
+                self.log(f"[!] 分片 {pending[0].index}-{pending[-1].index} 下载失败: {error}")
+                break
+            await asyncio.sleep(delay)
+            attempt += 1
+
+        for member in pending:
+            results[member.index] = (member.index, False, None)
+        return [results[member.index] for member in job.members]
+
+    async def _fetch_job(self, http, job, race=None, hedge=False):
+        if isinstance(job, RangeJob):
+            return await self._fetch_range_job(http, job)
+        result = await self._fetch_segment(http, *job, race=race, hedge=hedge)
+        # 对冲中的分片只由胜出的一方（或双方都失败时最后退出的一方）报告结果
+        if race and not result[1] and not race.give_up(hedge):
+            return []
+        return [result]
+
+    async def run(self, jobs, scheduler=None):
+        """
+        下载所有分片
+
+        任务按播放顺序调度，同时进行的任务不超过并发数，且集中在最小的未完成分片附近。
+        jobs 需要等待（播放列表还在解析）时不阻塞事件循环，解析线程解析出新的分片后唤醒它。
+
+        Args:
+            jobs: [(index, segment), ...]，其中也可以包含合并字节范围请求的 RangeJob
+            scheduler: PlaybackScheduler，为 None 时按 jobs 和并发数创建
+
+        Returns:
+            下载失败的分片 [(index, False, None), ...]；每个分片的结果（包括成功的）通过 on_result 回调报告
+        """
+        if scheduler is None:
+            scheduler = PlaybackScheduler(jobs, self.concurrency)
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._slot_changed = asyncio.Condition()
+        connector = aiohttp.TCPConnector(limit=self.concurrency, ttl_dns_cache=300)
+        timeout = aiohttp.ClientTimeout(sock_connect=30, sock_read=30)
+        # 显式配置了代理时不再读取系统代理
+        trust_env = getattr(self.downloader, "proxies", None) is None
+
+        failed = []
+        hedger = self.hedger
+        loop = asyncio.get_running_loop()
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout, trust_env=trust_env) as http:
+            # 任务 -> (SegmentRace, 是否为对冲请求)
+            tasks = {}
+            # 调度器等待的 Future（播放列表解析、初始化段下载），以及它完成时唤醒事件循环的 asyncio.Future
+            watched = waiter = None
+            try:
+                while not self._cancelled():
+                    primary = sum(1 for race, hedge in tasks.values() if not hedge)
+                    for job in scheduler.take(self.concurrency - primary):
+                        race = hedger.start(job) if hedger else None
+                        tasks[asyncio.ensure_future(self._fetch_job(http, job, race))] = (race, False)
+                        primary += 1
+                    if hedger:
+                        for job, race in hedger.due(scheduler.pending + primary):
+                            tasks[asyncio.ensure_future(self._fetch_job(http, job, race, True))] = (race, True)
+                    waiting = scheduler.waiting
+                    if not tasks and waiting is None:
+                        break
+                    aws = tasks
+                    # waiting 已完成却没被取走说明名额已满，等进行中的任务完成即可
+                    if waiting is not None and not waiting.done():
+                        if waiting is not watched:
+                            watched, waiter = waiting, wake_on(waiting, loop)
+                        aws = [*tasks, waiter]
+                    wait_timeout = hedger.next_check(scheduler.pending + primary) if hedger else None
+                    done, _ = await asyncio.wait(aws, timeout=wait_timeout, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        if task is waiter:
+                            # 有新的任务可取，下一轮 take()
+                            continue
+                        del tasks[task]
+                        if task.cancelled():
+                            continue
+                        for result in task.result():
+                            if hedger:
+                                hedger.done(result[0])
+                            scheduler.complete(result)
+                            if not result[1]:
+                                failed.append(result)
+                            if self.on_result:
+                                self.on_result(result)
+                    # 胜负已分的对冲，取消落败的一方
+                    for task, (race, hedge) in tasks.items():
+                        if race and race.lost(hedge):
+                            task.cancel()
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+        return failed
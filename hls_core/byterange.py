@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+"""
+EXT-X-BYTERANGE 支持
+把同一资源上首尾相接的字节范围分片合并成一次 Range 请求，再按分片切开写入
+"""
+
+from concurrent.futures import Future
+
+from .segment import absolute_url, parse_content_range
+
+
+# 合并后单个 Range 请求的默认大小上限
+DEFAULT_MAX_RANGE_REQUEST = 8 * 1024 * 1024
+
+
+def parse_byterange(value, previous_end=None):
+    """
+    解析 EXT-X-BYTERANGE 的值 "length[@offset]"
+
+    Args:
+        value: 标签值
+        previous_end: 同一资源上一个分片的结束位置，省略 offset 时从这里开始
+
+    Returns:
+        (start, length)
+    """
+    length, _, offset = str(value).partition('@')
+    if offset:
+        start = int(offset)
+    elif previous_end is not None:
+        start = previous_end
+    else:
+        raise ValueError(f"EXT-X-BYTERANGE 缺少偏移量: {value}")
+    return start, int(length)
+
+
+class RangeMember:
+    """合并请求中的一个分片"""
+
+    __slots__ = ('index', 'segment', 'start', 'length')
+
+    def __init__(self, index, segment, start, length):
+        self.index = index
+        self.segment = segment
+        self.start = start
+        self.length = length
+
+    @property
+    def end(self):
+        return self.start + self.length
+
+
+class RangeJob:
+    """对同一资源连续字节范围的一次 Range 请求，包含一个或多个分片"""
+
+    def __init__(self, url, members):
+        self.url = url
+        self.members = members
+
+    @property
+    def start(self):
+        return self.members[0].start
+
+    @property
+    def end(self):
+        return self.members[-1].end
+
+    @property
+    def size(self):
+        return self.end - self.start
+
+    def __len__(self):
+        return len(self.members)
+
+
+def plan_range_jobs(segments, base_url, max_request_bytes=DEFAULT_MAX_RANGE_REQUEST):
+    """
+    规划下载任务
+
+    带 EXT-X-BYTERANGE 的分片按资源和偏移合并：同一URL上首尾相接、合计不超过
+    max_request_bytes 的分片放进同一个 RangeJob；普通分片原样保留。
+
+    逐个生成任务，与 PlaybackScheduler 配合时只在需要下一个任务时才读取后面的分片。
+    segments 中表示需要等待的 Future 原样交出，交出前先交出已经合并好的 RangeJob。
+
+    Args:
+        segments: (index, segment) 的可迭代对象，按播放列表顺序，其中可以有 Future
+        base_url: 播放列表URL，用于解析分片的相对地址
+        max_request_bytes: 单次请求的大小上限，0 表示不合并
+
+    Yields:
+        RangeJob、原来的 (index, segment) 或 Future；RangeJob 在确定不再追加分片后才生成
+    """
+    last_end = {}
+    current = None
+    for item in segments:
+        if isinstance(item, Future):
+            if current is not None:
+                yield current
+                current = None
+            yield item
+            continue
+        index, segment = item
+        if not getattr(segment, 'byterange', None):
+            if current is not None:
+                yield current
+                current = None
+            yield (index, segment)
+            continue
+
+        url = absolute_url(segment, base_url)
+        start, length = parse_byterange(segment.byterange, last_end.get(url))
+        last_end[url] = start + length
+        member = RangeMember(index, segment, start, length)
+
+        if (current is not None and current.url == url and current.end == start
+                and current.size + length <= max_request_bytes):
+            current.members.append(member)
+        else:
+            if current is not None:
+                yield current
+            current = RangeJob(url, [member])
+    if current is not None:
+        yield current
+
+
+def count_range_jobs(jobs):
+    """
+    统计任务中的合并请求
+
+    Returns:
+        (RangeJob 个数, 其中的分片数)
+    """
+    requests = segments = 0
+    for job in jobs:
+        if isinstance(job, RangeJob):
+            requests += 1
+            segments += len(job)
+    return requests, segments
+
+
+def response_offset(status, headers, requested_start):
+    """
+    Range 响应第一个字节在资源中的偏移
+
+    服务器忽略 Range 返回 200 时从资源开头算起，由 RangeReceiver 跳过不需要的部分。
+    """
+    if status != 206:
+        return 0
+    content_range = parse_content_range(headers.get('Content-Range'))
+    if not content_range or content_range[0] > requested_start:
+        raise ValueError(f"无效的 Content-Range: {headers.get('Content-Range')}")
+    return content_range[0]
+
+
+class RangeReceiver:
+    """
+    把一个 Range 响应按分片切开
+
+    feed() 依次接收响应数据，写入对应分片的写入端（首次收到该分片数据时
+    调用 open_sink 创建），返回本次数据块中接收完整的分片。
+    """
+
+    def __init__(self, members, offset, open_sink):
+        """
+        Args:
+            members: 需要接收的 RangeMember 列表（按偏移排序）
+            offset: 响应第一个字节在资源中的偏移（206 为请求起点，200 为0）
+            open_sink: open_sink(member) -> SegmentSink
+        """
+        self.members = members
+        self.offset = offset
+        self.open_sink = open_sink
+        self.sinks = {}
+        self.end = members[-1].end
+
+    @property
+    def done(self):
+        return self.offset >= self.end
+
+    def feed(self, chunk):
+        view = memoryview(chunk)
+        start = self.offset
+        stop = start + len(view)
+        completed = []
+        for member in self.members:
+            if member.end <= start or member.start >= stop:
+                continue
+            sink = self.sinks.get(member.index)
+            if sink is None:
+                sink = self.sinks[member.index] = self.open_sink(member)
+            lo = max(member.start, start)
+            hi = min(member.end, stop)
+            sink.write(view[lo - start:hi - start])
+            if hi == member.end:
+                completed.append(member)
+        self.offset = stop
+        return completed
+
+    def take(self, member):
+        """取出接收完整的分片的写入端"""
+        return self.sinks.pop(member.index)
+
+    def abort(self):
+        """放弃所有未完成的分片"""
+        for sink in self.sinks.values():
+            sink.abort()
+        self.sinks.clear()
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+自适应并发控制
+按吞吐量和首字节时间（TTFB）调整同时进行的分片请求数，取代固定的并发数
+"""
+
+import statistics
+import threading
+import time
+
+
+class AdaptiveLimiter:
+    """
+    AIMD 并发控制器
+
+    以"一轮"（完成的请求数达到当前并发上限）为采样窗口：吞吐量没有下降且
+    TTFB 稳定时增大并发，起步阶段每轮翻倍（类似 TCP 慢启动），之后每轮加1；
+    请求失败、超时或 TTFB 明显升高时按比例减小并发。
+
+    每个请求先 acquire() 取得令牌，结束后带着结果 release()。令牌记录了发起
+    请求时的"代"，退让之前发出的请求再失败不会重复退让。
+
+    adaptive 为 False 时并发数固定为 max_limit，不再调整，只用来限制同时进行的请求数
+    （超大分片的多连接下载等额外连接也计入其中）。
+    """
+
+    def __init__(self, max_limit, initial=2, min_limit=1,
+                 latency_tolerance=1.5, error_backoff=0.5, latency_backoff=0.75, adaptive=True):
+        """
+        Args:
+            max_limit: 并发上限（即原来的 max_workers）
+            initial: 初始并发数
+            min_limit: 并发下限
+            latency_tolerance: TTFB 中位数超过基线的倍数时视为拥塞
+            error_backoff: 请求失败时并发数乘以的系数
+            latency_backoff: TTFB 升高时并发数乘以的系数
+            adaptive: 是否按吞吐量和延迟调整并发数；False 时固定为 max_limit
+        """
+        self.adaptive = adaptive
+        if not adaptive:
+            initial = min_limit = max_limit
+        self.max_limit = max(1, int(max_limit))
+        self.min_limit = max(1, min(int(min_limit), self.max_limit))
+        self.limit = min(self.max_limit, max(self.min_limit, int(initial)))
+        self.latency_tolerance = latency_tolerance
+        self.error_backoff = error_backoff
+        self.latency_backoff = latency_backoff
+
+        self.in_flight = 0
+        self.peak = self.limit
+        self.decreases = 0
+
+        self._cond = threading.Condition()
+        self._generation = 0
+        self._slow_start = True
+        self._base_ttfb = None
+        self._last_throughput = 0.0
+        self._reset_window(time.monotonic())
+
+    def _reset_window(self, now):
+        self._window_start = now
+        self._window_bytes = 0
+        self._window_done = 0
+        self._window_ttfb = []
+
+    def _take(self):
+        self.in_flight += 1
+        return self._generation
+
+    def acquire(self):
+        """阻塞直到有空闲名额，返回令牌"""
+        with self._cond:
+            while self.in_flight >= self.limit:
+                self._cond.wait()
+            return self._take()
+
+    def try_acquire(self):
+        """有空闲名额时返回令牌，否则返回 None"""
+        with self._cond:
+            if self.in_flight >= self.limit:
+                return None
+            return self._take()
+
+    def release(self, token, ok, nbytes=0, ttfb=None):
+        """
+        归还名额并记录请求结果
+
+        Args:
+            token: acquire() 返回的令牌
+            ok: 请求是否成功
+            nbytes: 接收的字节数
+            ttfb: 首字节时间（秒），未收到响应头时为 None
+        """
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+            if not self.adaptive:
+                return
+            now = time.monotonic()
+            if not ok:
+                if token == self._generation:
+                    self._decrease(self.error_backoff, now)
+            else:
+                self._window_bytes += nbytes
+                self._window_done += 1
+                if ttfb is not None:
+                    self._window_ttfb.append(ttfb)
+                if self._window_done >= self.limit:
+                    self._end_window(now)
+
+    def _end_window(self, now):
+        throughput = self._window_bytes / max(now - self._window_start, 1e-6)
+        ttfb = statistics.median(self._window_ttfb) if self._window_ttfb else None
+
+        if ttfb is not None and self._base_ttfb is not None and ttfb > self._base_ttfb * self.latency_tolerance:
+            # 基线缓慢上浮，网络条件整体变化后不会一直退让
+            self._base_ttfb *= 1.1
+            self._decrease(self.latency_backoff, now)
+            return
+
+        if ttfb is not None:
+            self._base_ttfb = ttfb if self._base_ttfb is None else min(self._base_ttfb, ttfb)
+
+        if throughput >= self._last_throughput * 0.97:
+            if self._slow_start:
+                self.limit = min(self.max_limit, self.limit * 2)
+            else:
+                self.limit = min(self.max_limit, self.limit + 1)
+            self.peak = max(self.peak, self.limit)
+        else:
+            self._slow_start = False
+        self._last_throughput = throughput
+        self._reset_window(now)
+
+    def _decrease(self, factor, now):
+        self.limit = max(self.min_limit, int(self.limit * factor))
+        self.decreases += 1
+        self._generation += 1
+        self._slow_start = False
+        self._last_throughput = 0.0
+        self._reset_window(now)
+
+    def summary(self):
+        """返回 (当前并发, 峰值并发, 退让次数)"""
+        with self._cond:
+            return self.limit, self.peak, self.decreases
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+"""
+分片解密
+AES-128-CBC 增量解密，按16字节对齐的块处理，只在最后一块处理PKCS7填充；
+以及基于进程池 + 共享内存的多核解密
+"""
+
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+from Crypto.Cipher import AES
+from Crypto.Util.Padding import unpad
+
+
+def segment_iv(iv_bytes, segment_index):
+    """返回分片使用的IV；未指定IV时按HLS规范使用序列号"""
+    if iv_bytes is None:
+        return segment_index.to_bytes(16, byteorder='big')
+    return iv_bytes
+
+
+class StreamingDecryptor:
+    """
+    增量 AES-128-CBC 解密器
+
+    update() 接收任意长度的密文块，返回可以安全输出的明文；最后一个明文块
+    暂时保留，直到 finalize() 时再去除PKCS7填充。内存占用只与单次传入的块大小有关。
+    """
+
+    def __init__(self, key_bytes, iv_bytes):
+        self._cipher = AES.new(key_bytes, AES.MODE_CBC, iv_bytes)
+        self._tail = b''
+        self._held = b''
+
+    def update(self, chunk):
+        """解密一块密文，返回可写出的明文"""
+        if self._tail:
+            chunk = self._tail + chunk
+        aligned = len(chunk) - len(chunk) % AES.block_size
+        if aligned == 0:
+            self._tail = bytes(chunk)
+            return b''
+
+        view = memoryview(chunk)
+        plain = self._cipher.decrypt(view[:aligned])
+        self._tail = bytes(view[aligned:])
+
+        out = self._held + plain[:-AES.block_size] if self._held else plain[:-AES.block_size]
+        self._held = plain[-AES.block_size:]
+        return out
+
+    def finalize(self):
+        """结束解密，返回去除填充后的最后一块"""
+        last = self._held
+        self._held = b''
+        try:
+            last = unpad(last, AES.block_size) if last else last
+        except ValueError:
+            # 如果解除填充失败，保留原始解密数据
+            pass
+        # 长度不是16的整数倍的尾部数据无法解密，原样保留
+        tail, self._tail = self._tail, b''
+        return last + tail
+
+
+def _attach_shared_memory(name):
+    """在子进程中打开共享内存，不交给 resource_tracker 管理（由父进程负责释放）"""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python 3.13 之前没有 track 参数。fork 出的子进程与父进程共用同一个
+        # resource_tracker，重复登记无害；spawn 的子进程有自己的 tracker，需要撤销登记
+        import multiprocessing
+        from multiprocessing import resource_tracker
+        shm = shared_memory.SharedMemory(name=name)
+        if multiprocessing.get_start_method() == 'spawn':
+            try:
+                resource_tracker.unregister(shm._name, 'shared_memory')
+            except Exception:
+                pass
+        return shm
+
+
+def _decrypt_in_shared_memory(name, length, key_bytes, iv_bytes):
+    """
+    子进程中原地解密共享内存中的分片
+
+    Returns:
+        解密并去除填充后的明文长度
+    """
+    shm = _attach_shared_memory(name)
+    try:
+        view = shm.buf[:length]
+        aligned = length - length % AES.block_size
+        if aligned == 0:
+            view.release()
+            return length
+
+        block = view[:aligned]
+        AES.new(key_bytes, AES.MODE_CBC, iv_bytes).decrypt(block, output=block)
+        block.release()
+
+        # 去除PKCS7填充，填充无效时保留原始解密数据
+        plain_length = aligned
+        pad = view[aligned - 1]
+        if 1 <= pad <= AES.block_size and all(b == pad for b in view[aligned - pad:aligned]):
+            plain_length = aligned - pad
+
+        # 长度不是16的整数倍的尾部数据无法解密，原样接在明文后面
+        if aligned < length:
+            tail = bytes(view[aligned:length])
+            view[plain_length:plain_length + len(tail)] = tail
+            plain_length += len(tail)
+        view.release()
+        return plain_length
+    finally:
+        shm.close()
+
+
+def _warm_up():
+    """空任务，用于提前启动子进程"""
+    return None
+
+
+class OffloadedDecryption:
+    """
+    交给解密进程池处理的单个分片
+
+    密文直接写入共享内存，子进程原地解密，分片数据不经过 pickle 序列化。
+    """
+
+    def __init__(self, pool, key_bytes, iv_bytes, size_hint=None):
+        self.pool = pool
+        self.key_bytes = key_bytes
+        self.iv_bytes = iv_bytes
+        self.length = 0
+        self._shm = shared_memory.SharedMemory(create=True, size=max(size_hint or 0, 1024 * 1024))
+
+    def reserve(self, size):
+        """预留至少 size 字节的空间（通常来自 Content-Length）"""
+        if size <= self._shm.size:
+            return
+        larger = shared_memory.SharedMemory(create=True, size=size)
+        larger.buf[:self.length] = self._shm.buf[:self.length]
+        self._release_shm()
+        self._shm = larger
+
+    def write(self, chunk):
+        """追加密文，空间不足时换用更大的共享内存"""
+        end = self.length + len(chunk)
+        if end > self._shm.size:
+            self.reserve(max(end, self._shm.size * 2))
+        self._shm.buf[self.length:end] = chunk
+        self.length = end
+
+    def result(self):
+        """
+        在进程池中解密并等待结果
+
+        Returns:
+            明文的 memoryview，调用 release() 前有效
+        """
+        future = self.pool.submit(_decrypt_in_shared_memory, self._shm.name, self.length, self.key_bytes, self.iv_bytes)
+        plain_length = future.result()
+        return self._shm.buf[:plain_length]
+
+    def _release_shm(self):
+        self._shm.close()
+        self._shm.unlink()
+
+    def release(self):
+        """释放共享内存"""
+        if self._shm is not None:
+            self._release_shm()
+            self._shm = None
+
+
+class DecryptPool:
+    """解密进程池：把AES解密从下载线程移到独立进程，避免与网络读取争抢GIL"""
+
+    def __init__(self, processes):
+        self.processes = processes
+        if os.name == 'posix':
+            # 子进程挂载共享内存时会登记到 resource_tracker；先在本进程启动它，子进程共用同一个，
+            # 否则每个子进程各自启动一个，退出时去 unlink 早已释放（或仍在使用）的共享内存
+            from multiprocessing import resource_tracker
+            resource_tracker.ensure_running()
+        self._executor = ProcessPoolExecutor(max_workers=processes)
+        # 在创建者线程中立即启动子进程；fork 方式下若等到下载线程首次提交时才启动，
+        # 子进程可能继承其他线程持有的锁，偶发整个进程池卡住
+        for future in [self._executor.submit(_warm_up) for _ in range(processes)]:
+            future.result()
+
+    def submit(self, fn, *args):
+        return self._executor.submit(fn, *args)
+
+    def open(self, key_bytes, iv_bytes, size_hint=None):
+        """为一个分片创建解密任务"""
+        return OffloadedDecryption(self, key_bytes, iv_bytes, size_hint)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+
+_pool_lock = threading.Lock()
+_decrypt_pool = None
+
+
+def get_decrypt_pool(processes):
+    """
+    获取进程级共享的解密进程池
+
+    processes 为0时不启用。进程池在首次使用时按当时的进程数创建，之后的任务共用同一个池。
+    """
+    global _decrypt_pool
+    if not processes or processes < 1:
+        return None
+    with _pool_lock:
+        if _decrypt_pool is None:
+            _decrypt_pool = DecryptPool(processes)
+        return _decrypt_pool
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""
+FFmpeg 子进程
+分片可以按序写入 ffmpeg 的标准输入，封装与下载同时进行；
+-progress 输出逐块解析后回调给调用方，不再等进程结束后一次性读取
+"""
+
+import shutil
+import subprocess
+import sys
+import threading
+from collections import deque
+
+
+# 出错时保留的 ffmpeg 错误输出行数
+STDERR_TAIL_LINES = 20
+
+
+def ffmpeg_available():
+    """PATH 中是否有 ffmpeg"""
+    return shutil.which('ffmpeg') is not None
+
+
+def format_seconds(seconds):
+    """如 "01:02:03" """
+    seconds = int(seconds)
+    return f"{seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+class FFmpegProgress:
+    """-progress 输出的一个进度块"""
+
+    __slots__ = ('out_time', 'total_size', 'speed', 'done')
+
+    def __init__(self, out_time=0.0, total_size=0, speed=None, done=False):
+        self.out_time = out_time
+        self.total_size = total_size
+        self.speed = speed
+        self.done = done
+
+    def describe(self, duration=None):
+        """如 "00:01:23/00:10:00，12.3 MB，35.2x" """
+        text = format_seconds(self.out_time)
+        if duration:
+            text += f"/{format_seconds(duration)}"
+        text += f"，{self.total_size / 1024 / 1024:.1f} MB"
+        if self.speed:
+            text += f"，{self.speed}"
+        return text
+
+
+def parse_progress(lines):
+    """
+    解析 -progress 输出，每遇到 progress=continue/end 产出一个 FFmpegProgress
+
+    Args:
+        lines: 可迭代的文本行
+    """
+    fields = {}
+    for line in lines:
+        key, sep, value = line.strip().partition('=')
+        if not sep:
+            continue
+        if key != 'progress':
+            fields[key] = value.strip()
+            continue
+
+        progress = FFmpegProgress(done=value.strip() == 'end')
+        # out_time_us 是微秒；旧版本的 out_time_ms 实际上也是微秒
+        micros = fields.get('out_time_us') or fields.get('out_time_ms')
+        try:
+            progress.out_time = max(int(micros) / 1000000, 0.0)
+        except (TypeError, ValueError):
+            pass
+        try:
+            progress.total_size = int(fields.get('total_size', 0))
+        except ValueError:
+            pass
+        speed = fields.get('speed')
+        if speed and speed != 'N/A':
+            progress.speed = speed
+        fields = {}
+        yield progress
+
+
+class FFmpegProcess:
+    """
+    运行一次 ffmpeg 转封装（-c copy）
+
+    stdout 上的 -progress 输出由后台线程解析，每个进度块调用一次 on_progress；
+    stderr 由另一个线程读取，只保留最后几行用于报错，两个管道都不会写满阻塞 ffmpeg。
+    """
+
+    def __init__(self, input_args, output_file, on_progress=None, pipe_input=False):
+        """
+        Args:
+            input_args: 输入参数，如 ['-f', 'concat', '-safe', '0', '-i', 'filelist.txt']
+            output_file: 输出文件
+            on_progress: on_progress(FFmpegProgress)，在后台线程中调用
+            pipe_input: 是否从标准输入读取（通过 stdin 属性写入数据）
+
+        Raises:
+            FileNotFoundError: 没有安装 ffmpeg
+        """
+        self.output_file = output_file
+        self.on_progress = on_progress
+        self.progress = FFmpegProgress()
+        self._stderr = deque(maxlen=STDERR_TAIL_LINES)
+        cmd = ['ffmpeg', '-hide_banner', '-nostats', '-loglevel', 'error', '-progress', 'pipe:1',
+               *input_args, '-c', 'copy', '-y', str(output_file)]
+        # Windows 下不弹出控制台窗口
+        self.process = subprocess.Popen(cmd, stdin=subprocess.PIPE if pipe_input else subprocess.DEVNULL,
+                                        stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                        creationflags=subprocess.CREATE_NO_WINDOW if sys.platform == 'win32' else 0)
+        self._readers = [
+            threading.Thread(target=self._read_progress, daemon=True),
+            threading.Thread(target=self._read_stderr, daemon=True),
+        ]
+        for reader in self._readers:
+            reader.start()
+
+    @classmethod
+    def concat(cls, filelist, output_file, on_progress=None):
+        """按 concat 文件列表合并已下载的分片"""
+        return cls(['-f', 'concat', '-safe', '0', '-i', str(filelist)], output_file, on_progress)
+
+    @classmethod
+    def pipe(cls, output_file, on_progress=None):
+        """从标准输入读取按序写入的分片（自动识别 TS 或 fMP4）"""
+        return cls(['-i', 'pipe:0'], output_file, on_progress, pipe_input=True)
+
+    @property
+    def stdin(self):
+        """pipe 模式下分片写入的管道（二进制文件对象）"""
+        return self.process.stdin
+
+    def _read_progress(self):
+        lines = (line.decode('utf-8', errors='replace') for line in self.process.stdout)
+        for progress in parse_progress(lines):
+            self.progress = progress
+            if self.on_progress:
+                try:
+                    self.on_progress(progress)
+                except Exception:
+                    pass
+
+    def _read_stderr(self):
+        for line in self.process.stderr:
+            text = line.decode('utf-8', errors='replace').rstrip()
+            if text:
+                self._stderr.append(text)
+
+    def wait(self):
+        """
+        关闭标准输入并等待 ffmpeg 结束
+
+        Returns:
+            退出码
+        """
+        if self.process.stdin and not self.process.stdin.closed:
+            try:
+                self.process.stdin.close()
+            except OSError:
+                # ffmpeg 已提前退出，管道已断开
+                pass
+        returncode = self.process.wait()
+        for reader in self._readers:
+            reader.join()
+        return returncode
+
+    def kill(self):
+        """放弃封装（下载失败或取消时）"""
+        if self.process.poll() is None:
+            self.process.kill()
+        self.wait()
+
+    @property
+    def failed(self):
+        """ffmpeg 已经异常退出（如输入格式无法识别）"""
+        return self.process.poll() not in (None, 0)
+
+    @property
+    def error(self):
+        """ffmpeg 最后几行错误输出"""
+        return "\n".join(self._stderr)
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+fMP4/CMAF 支持
+EXT-X-MAP 初始化段按 URI 和字节范围缓存，只下载一次；合并时只在输出开头
+（以及初始化段发生变化的位置）写入一次，后面直接拼接各分片的 moof/mdat
+"""
+
+from .byterange import parse_byterange
+from .keys import KeyCache
+from .segment import absolute_url
+
+
+# 一个播放列表通常只有一个初始化段，带不连续点的流也很少超过几个
+DEFAULT_INIT_CACHE_SIZE = 32
+
+
+class InitSection:
+    """下载（并解密）后的初始化段"""
+
+    __slots__ = ('url', 'byterange', 'data')
+
+    def __init__(self, url, byterange, data):
+        self.url = url
+        self.byterange = byterange
+        self.data = data
+
+    @property
+    def key(self):
+        """缓存键，也用来判断相邻分片的初始化段是否相同"""
+        return self.url, self.byterange
+
+    def __len__(self):
+        return len(self.data)
+
+
+def init_section_of(segment, base_url):
+    """
+    分片所属的初始化段 (url, byterange)，没有 EXT-X-MAP 时为 None
+
+    byterange 统一成 "length@offset"，省略偏移量时从资源开头算起。
+    """
+    section = getattr(segment, 'init_section', None)
+    if section is None or not section.uri:
+        return None
+    byterange = None
+    if section.byterange:
+        start, length = parse_byterange(section.byterange, 0)
+        byterange = f"{length}@{start}"
+    return absolute_url(section, base_url), byterange
+
+
+def range_header(byterange):
+    """"length@offset" 对应的 Range 请求头"""
+    start, length = parse_byterange(byterange)
+    return {'Range': f'bytes={start}-{start + length - 1}'}
+
+
+class InitSectionCache:
+    """
+    初始化段缓存
+
+    按 (URL, 字节范围) 索引，并发请求同一初始化段时只下载一次（复用 KeyCache 的
+    单飞逻辑）；不设过期时间，整个任务期间有效。
+    """
+
+    def __init__(self, max_entries=DEFAULT_INIT_CACHE_SIZE):
+        self._cache = KeyCache(ttl=None, max_entries=max_entries)
+
+    def get(self, url, byterange, fetch):
+        """
+        获取初始化段
+
+        Args:
+            url: 初始化段的绝对URL
+            byterange: "length@offset" 或 None
+            fetch: 缓存未命中时调用，返回（已解密的）初始化段 bytes
+
+        Returns:
+            InitSection；下载失败时抛出 fetch 的异常
+        """
+        data = self._cache.get((url, byterange), fetch)
+        return InitSection(url, byterange, data)
+
+    def cached(self, url, byterange):
+        """初始化段是否已下载，get() 不会再发请求"""
+        return self._cache.peek((url, byterange)) is not None
+
+    @property
+    def fetches(self):
+        return self._cache.fetches
@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+"""
+尾部对冲请求
+下载接近结束时，落在慢速节点上的一两个分片往往拖住整个任务；
+对耗时明显偏长的分片再发一个相同的请求，先完成的为准
+"""
+
+import socket
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from .byterange import RangeJob
+
+
+# 对冲请求最多占分片请求数的比例
+DEFAULT_HEDGE_FRACTION = 0.05
+
+# 耗时超过最近完成分片第95百分位的2倍时发起对冲；进入尾部阶段后改用中位数的2倍。
+# 只按百分位本身判断时，正常的波动就会用掉全部对冲名额
+HEDGE_PERCENTILE = 0.95
+HEDGE_DELAY_FACTOR = 2.0
+
+# 至少有这么多个耗时样本才开始判断
+MIN_LATENCY_SAMPLES = 8
+
+# 只统计最近完成的分片，网络状况变化后阈值随之调整
+LATENCY_WINDOW = 256
+
+
+def interrupt_response(response):
+    """
+    从其他线程中断正在读取的流式响应（requests）
+
+    关闭套接字的读写方向，阻塞在读取上的线程立即收到连接断开；
+    直接 close() 不会唤醒正在读取的线程，慢速连接上要等到读满一个数据块或超时。
+    """
+    connection = getattr(getattr(response, 'raw', None), '_connection', None)
+    sock = getattr(connection, 'sock', None)
+    if sock is None:
+        return
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+
+
+class SegmentRace:
+    """
+    同一分片的原请求与对冲请求
+
+    先下载成功的一方调用 claim() 胜出并报告结果，同时中断另一方正在读取的响应
+    （asyncio 引擎直接取消任务）；失败的一方调用 give_up()，只有双方都失败时才报告失败。
+    胜出后保存分片失败（且重试用尽）的一方由自己报告失败，另一方此时已经被中断。
+    """
+
+    __slots__ = ('_lock', '_responses', 'running', 'winner', 'hedged')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._responses = {}
+        self.running = 1
+        self.winner = None
+        self.hedged = False
+
+    @property
+    def settled(self):
+        """已有一方下载成功"""
+        return self.winner is not None
+
+    def join(self):
+        """对冲请求加入；分片已有结果时返回 False"""
+        with self._lock:
+            if self.winner is not None or not self.running:
+                return False
+            self.running += 1
+            self.hedged = True
+            return True
+
+    def claim(self, hedge):
+        """
+        下载成功的一方登记为胜出者
+
+        Args:
+            hedge: 是否为对冲请求
+
+        Returns:
+            是否胜出（另一方已先完成时返回 False，调用方丢弃自己的数据）
+        """
+        with self._lock:
+            if self.winner is None:
+                self.winner = hedge
+                other = self._responses.get(not hedge)
+                if other is not None:
+                    interrupt_response(other)
+                return True
+            return self.winner == hedge
+
+    def _attach(self, hedge, response):
+        with self._lock:
+            if response is None:
+                self._responses.pop(hedge, None)
+            elif self.lost(hedge):
+                interrupt_response(response)
+            else:
+                self._responses[hedge] = response
+
+    def give_up(self, hedge):
+        """
+        下载失败或已落败的一方退出
+
+        Args:
+            hedge: 是否为对冲请求
+
+        Returns:
+            是否由它报告失败：它已胜出（胜出后保存失败），或双方都没有胜出且另一方也已退出
+        """
+        with self._lock:
+            self.running -= 1
+            if self.winner == hedge:
+                return True
+            return not self.running and self.winner is None
+
+    def lost(self, hedge):
+        """另一方已经胜出"""
+        return self.winner is not None and self.winner != hedge
+
+
+@contextmanager
+def watching(race, hedge, response):
+    """
+    读取响应期间登记到 race，另一方胜出时可以中断它
+
+    响应关闭（连接归还连接池）之前解除登记，不会误断之后复用这个连接的请求。
+    race 为 None 时什么也不做。
+    """
+    if race is None:
+        yield response
+        return
+    race._attach(hedge, response)
+    try:
+        yield response
+    finally:
+        race._attach(hedge, None)
+
+
+class HedgeTracker:
+    """
+    对冲调度
+
+    记录每个进行中分片的开始时间和最近完成分片的耗时：耗时超过同类分片第95百分位的2倍，
+    或者剩余分片数降到 tail 以内（尾部阶段）后超过中位数2倍的分片，再发一个相同的请求。
+    对冲请求总数不超过分片数的 max_fraction，每个分片最多对冲一次。
+    字节范围合并请求（RangeJob）不对冲。
+
+    只在调度循环所在的线程（或事件循环）中调用。
+    """
+
+    def __init__(self, total, tail, max_fraction=DEFAULT_HEDGE_FRACTION):
+        """
+        Args:
+            total: 分片总数
+            tail: 剩余（未开始 + 进行中）分片数不超过这个值时进入尾部阶段，一般取并发数
+            max_fraction: 对冲请求上限占分片数的比例，0 表示不对冲
+        """
+        self.max_fraction = max_fraction
+        self.set_total(total)
+        self.tail = tail
+        self.hedges = 0
+        self.wins = 0
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._running = {}
+
+    def set_total(self, total):
+        """按分片总数设置对冲上限；总数为0（播放列表还在解析）时不对冲"""
+        self.budget = max(1, int(total * self.max_fraction)) if self.max_fraction > 0 and total else 0
+
+    def start(self, job):
+        """
+        登记一个开始下载的任务
+
+        Returns:
+            单个分片返回其 SegmentRace，RangeJob 返回 None
+        """
+        if isinstance(job, RangeJob):
+            return None
+        race = SegmentRace()
+        self._running[job[0]] = (job, race, time.monotonic())
+        return race
+
+    def done(self, index):
+        """登记分片的结果（成功或失败），没有对冲过的分片计入耗时样本"""
+        entry = self._running.pop(index, None)
+        if entry is None:
+            return
+        job, race, started = entry
+        if race.hedged:
+            if race.winner is True:
+                self.wins += 1
+        else:
+            self._latencies.append(time.monotonic() - started)
+
+    def _limit(self, remaining):
+        if self.hedges >= self.budget or len(self._latencies) < MIN_LATENCY_SAMPLES:
+            return None
+        samples = sorted(self._latencies)
+        if remaining <= self.tail:
+            return samples[len(samples) // 2] * HEDGE_DELAY_FACTOR
+        return samples[min(int(len(samples) * HEDGE_PERCENTILE), len(samples) - 1)] * HEDGE_DELAY_FACTOR
+
+    def due(self, remaining):
+        """
+        取出现在应当对冲的分片
+
+        Args:
+            remaining: 尚未完成的分片数（未开始 + 进行中）
+
+        Returns:
+            [(job, race), ...]，按开始时间从早到晚
+        """
+        limit = self._limit(remaining)
+        if limit is None:
+            return []
+        now = time.monotonic()
+        hedges = []
+        for job, race, started in sorted(self._running.values(), key=lambda entry: entry[2]):
+            if self.hedges >= self.budget:
+                break
+            if now - started > limit and not race.hedged and race.join():
+                self.hedges += 1
+                hedges.append((job, race))
+        return hedges
+
+    def next_check(self, remaining):
+        """
+        距离下一个分片达到对冲阈值的秒数，供调度循环设置等待超时
+
+        Returns:
+            秒数；当前没有可能需要对冲的分片时返回 None
+        """
+        limit = self._limit(remaining)
+        if limit is None:
+            return None
+        now = time.monotonic()
+        waits = [started + limit - now for job, race, started in self._running.values()
+                 if not (race.hedged or race.settled)]
+        return max(min(waits), 0.0) if waits else None
+
+    def summary(self):
+        """如 "对冲请求 3 次，其中 2 次先于原请求完成" """
+        return f"对冲请求 {self.hedges} 次，其中 {self.wins} 次先于原请求完成"
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+解密密钥缓存
+进程级共享、按密钥绝对URL索引，同一密钥并发请求时只下载一次
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+# 默认缓存有效期（秒）和最大条目数
+DEFAULT_KEY_TTL = 600
+DEFAULT_KEY_CACHE_SIZE = 256
+
+
+class _Flight:
+    """一次正在进行的密钥下载，其他线程等待它的结果"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class KeyCache:
+    """
+    单飞（single-flight）密钥缓存
+
+    多个线程同时请求同一个未缓存的密钥时，只有第一个线程真正下载，其余线程
+    等待并共享结果；下载失败不会被缓存。条目按 TTL 过期，并按 LRU 淘汰。
+    """
+
+    def __init__(self, ttl=DEFAULT_KEY_TTL, max_entries=DEFAULT_KEY_CACHE_SIZE):
+        """
+        Args:
+            ttl: 密钥缓存有效期（秒），None 表示不过期
+            max_entries: 最多缓存的密钥数量
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.fetches = 0
+        self._entries = OrderedDict()
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def _lookup(self, key_url):
+        entry = self._entries.get(key_url)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and time.monotonic() >= expires_at:
+            del self._entries[key_url]
+            return None
+        self._entries.move_to_end(key_url)
+        return value
+
+    def peek(self, key_url):
+        """已缓存（且未过期）的值，没有时返回 None；不下载，也不计入命中次数"""
+        with self._lock:
+            return self._lookup(key_url)
+
+    def get(self, key_url, fetch):
+        """
+        获取密钥
+
+        Args:
+            key_url: 密钥的绝对URL
+            fetch: 缓存未命中时调用的下载函数，返回密钥 bytes
+
+        Returns:
+            密钥 bytes；下载失败时抛出 fetch 的异常
+        """
+        with self._lock:
+            value = self._lookup(key_url)
+            if value is not None:
+                self.hits += 1
+                return value
+            flight = self._flights.get(key_url)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._flights[key_url] = flight
+
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            with self._lock:
+                self.hits += 1
+            return flight.value
+
+        try:
+            flight.value = fetch()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key_url, None)
+                if flight.error is None:
+                    self.fetches += 1
+                    expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+                    self._entries[key_url] = (flight.value, expires_at)
+                    self._entries.move_to_end(key_url)
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+            flight.event.set()
+        return flight.value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# 进程级共享缓存：批量任务、Web任务之间复用同一CDN的密钥
+shared_key_cache = KeyCache()
@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+"""
+直播/事件播放列表录制
+按目标时长周期刷新媒体播放列表，以媒体序号去重，只交出新出现的分片；
+支持低延迟HLS（LL-HLS）的部分分片、预加载提示和阻塞式刷新
+"""
+
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+from .byterange import parse_byterange
+
+
+# 连续多少个目标时长没有新分片时视为直播已停止
+DEFAULT_STALL_TARGETS = 6
+
+# 阻塞式刷新时服务器最多挂起约3个目标时长，请求超时在此基础上留出余量
+BLOCKING_RELOAD_TARGETS = 3
+BLOCKING_RELOAD_MARGIN = 5
+
+
+class LiveUnit:
+    """
+    低延迟模式下交给下载器的一个下载单元：完整分片或部分分片（EXT-X-PART）
+
+    提供下载器用到的 m3u8.Segment 属性；部分分片按所属分片的媒体序号计算默认IV，
+    并沿用所属分片的初始化段（EXT-X-MAP）。
+    """
+
+    __slots__ = ('uri', 'byterange', 'duration', 'key', 'iv_sequence', 'init_section')
+
+    def __init__(self, uri, byterange, duration, key, iv_sequence, init_section=None):
+        self.uri = uri
+        self.byterange = byterange
+        self.duration = duration
+        self.key = key
+        self.iv_sequence = iv_sequence
+        self.init_section = init_section
+
+
+class LivePlaylist:
+    """
+    直播播放列表的增量跟踪
+
+    只记录下一个要交出的位置，不保存历史分片，长时间录制时内存占用不变。
+    每次 update() 传入刷新得到的播放列表，返回其中新出现的分片；
+    刷新间隔按 RFC 8216 6.3.4：有新分片时等待一个目标时长，没有变化时等待一半。
+
+    播放列表带 EXT-X-PART-INF 时进入低延迟模式：已完成的分片整段下载，正在生成的
+    分片按 EXT-X-PART 逐个下载，EXT-X-PRELOAD-HINT 提示的下一个部分分片提前请求；
+    交出的单元按播放顺序连续编号。服务器支持阻塞式刷新（EXT-X-SERVER-CONTROL:
+    CAN-BLOCK-RELOAD=YES）时，用 _HLS_msn/_HLS_part 请求下一个分片，不再定时等待。
+    """
+
+    def __init__(self, duration_limit=None, stall_targets=DEFAULT_STALL_TARGETS):
+        """
+        Args:
+            duration_limit: 录制时长上限（秒，按分片的 EXTINF 累计），None 表示不限
+            stall_targets: 连续多少个目标时长没有新分片时停止录制
+        """
+        self.duration_limit = duration_limit
+        self.stall_targets = stall_targets
+        self.last_sequence = None
+        self.target_duration = 10.0
+        self.part_target = None
+        self.can_block_reload = False
+        self.low_latency = None
+        self.recorded_duration = 0.0
+        self.segments = 0
+        self.parts = 0
+        self.missed = 0
+        self.ended = False
+        self.limit_reached = False
+        self._unchanged_for = 0.0
+
+        # 低延迟模式的状态：下一个分片的媒体序号、其中下一个部分分片、下一个单元的编号
+        self._next_msn = None
+        self._next_part = 0
+        self._next_index = 0
+        self._hint = None
+        self._range_end = {}
+        self._reload_position = None
+
+    @property
+    def done(self):
+        return self.ended or self.limit_reached
+
+    @property
+    def stalled(self):
+        """长时间没有新分片（直播已停止但没有写 EXT-X-ENDLIST）"""
+        return self._unchanged_for >= self.target_duration * self.stall_targets
+
+    @property
+    def blocking(self):
+        """是否使用阻塞式刷新"""
+        return self.can_block_reload and self._reload_position is not None
+
+    def update(self, playlist):
+        """
+        合并一次刷新结果
+
+        Args:
+            playlist: m3u8 媒体播放列表对象
+
+        Returns:
+            (gap, segments)：gap 为来不及下载就已移出播放列表的序号 range，
+            segments 为新分片 [(index, segment), ...]。普通模式以媒体序号作为分片序号，
+            低延迟模式下为连续编号的 LiveUnit，gap 始终为空
+        """
+        if playlist.target_duration:
+            self.target_duration = float(playlist.target_duration)
+        server_control = getattr(playlist, 'server_control', None)
+        self.can_block_reload = bool(server_control and server_control.can_block_reload == 'YES')
+        part_inf = getattr(playlist, 'part_inf', None)
+        if part_inf and part_inf.part_target:
+            self.part_target = float(part_inf.part_target)
+        if self.low_latency is None and playlist.segments:
+            self.low_latency = self.part_target is not None
+        first = playlist.media_sequence or 0
+
+        if self.low_latency:
+            segments = self._update_parts(playlist, first)
+            gap = range(0)
+        else:
+            gap, segments = self._update_segments(playlist, first)
+
+        if playlist.is_endlist and not self.limit_reached:
+            # 同一次刷新里的分片都已交出后才算结束
+            self.ended = True
+        self._reload_position = self._next_position(playlist, first)
+        return gap, segments
+
+    def _update_segments(self, playlist, first):
+        gap = range(0)
+        segments = []
+        for offset, segment in enumerate(playlist.segments):
+            sequence = first + offset
+            if self.last_sequence is not None and sequence <= self.last_sequence:
+                continue
+            if self.limit_reached:
+                break
+            if not segments and self.last_sequence is not None and sequence > self.last_sequence + 1:
+                gap = range(self.last_sequence + 1, sequence)
+                self.missed += len(gap)
+            segments.append((sequence, segment))
+            self.last_sequence = sequence
+            self.segments += 1
+            self._add_duration(segment.duration)
+        return gap, segments
+
+    def _update_parts(self, playlist, first):
+        units = []
+        if self._next_msn is None:
+            self._next_msn = first
+        for offset, segment in enumerate(playlist.segments):
+            msn = first + offset
+            if msn < self._next_msn:
+                continue
+            if self.limit_reached:
+                break
+            if msn > self._next_msn:
+                # 刷新不及时，中间的分片已移出播放列表
+                self.missed += msn - self._next_msn
+                self._next_msn = msn
+                self._next_part = 0
+
+            complete = segment.uri is not None
+            parts = segment.parts or []
+            hinted = self._hint_position(parts)
+            if complete and self._next_part == 0 and hinted is None:
+                units.append(self._take(LiveUnit(segment.uri, self._resolve_range('segment', segment.uri, segment.byterange),
+                                                 segment.duration, segment.key, msn, segment.init_section)))
+                self.segments += 1
+                self._advance()
+                continue
+
+            if hinted is not None:
+                # 预加载提示的部分分片已经在下载，跳过它
+                self._add_duration(parts[hinted].duration)
+                self.parts += 1
+                self._next_part = hinted + 1
+                self._hint = None
+            elif self._next_part > len(parts):
+                # 已取了一部分的分片，其余部分分片已移出播放列表
+                self.missed += 1
+                self._advance()
+                continue
+
+            for part in parts[self._next_part:]:
+                if self.limit_reached:
+                    break
+                units.append(self._take(LiveUnit(part.uri, self._resolve_range('part', part.uri, part.byterange),
+                                                 part.duration, segment.key, msn, segment.init_section)))
+                self.parts += 1
+                self._next_part += 1
+            if complete and not self.limit_reached:
+                self.segments += 1
+                self._advance()
+
+        hint = getattr(playlist, 'preload_hint', None)
+        if self._hint is not None and (hint is None or hint.uri != self._hint[1]):
+            # 提示的部分分片没有出现在播放列表中，服务器已改变计划
+            self._hint = None
+        if (hint is not None and self._hint is None and not self.limit_reached and not playlist.is_endlist
+                and hint.hint_type == 'PART' and hint.byterange_start is None and playlist.segments):
+            # 提前请求下一个部分分片，服务器在它生成后立即返回
+            last = playlist.segments[-1]
+            sequence = self._next_msn
+            index = self._next_index
+            units.append(self._take(LiveUnit(hint.uri, None, 0, last.key, sequence, last.init_section), count=False))
+            self._hint = (index, hint.uri)
+        return units
+
+    def _hint_position(self, parts):
+        if self._hint is None:
+            return None
+        for position, part in enumerate(parts):
+            if part.uri == self._hint[1] and not part.byterange:
+                return position
+        return None
+
+    def hint_failed(self, index):
+        """
+        预加载提示的请求失败时调用
+
+        它之后还没有交出其他单元时，放弃这次提示，等该部分分片出现在播放列表中再下载。
+        """
+        if self._hint is not None and self._hint[0] == index and self._next_index == index + 1:
+            self._hint = None
+            return True
+        return False
+
+    def _take(self, unit, count=True):
+        index = self._next_index
+        self._next_index += 1
+        if count:
+            self._add_duration(unit.duration)
+        return index, unit
+
+    def _advance(self):
+        self._next_msn += 1
+        self._next_part = 0
+
+    def _add_duration(self, duration):
+        self.recorded_duration += duration or 0
+        if self.duration_limit and self.recorded_duration >= self.duration_limit:
+            self.limit_reached = True
+
+    def _resolve_range(self, kind, uri, byterange):
+        """把省略偏移量的 BYTERANGE 换算成 "length@offset"，跨多次刷新保持连续"""
+        if not byterange:
+            return None
+        previous = self._range_end.get(kind)
+        previous_end = previous[1] if previous and previous[0] == uri else None
+        start, length = parse_byterange(byterange, previous_end)
+        self._range_end[kind] = (uri, start + length)
+        return f"{length}@{start}"
+
+    def _next_position(self, playlist, first):
+        """播放列表中最后一个分片之后的位置 (msn, part)，用于阻塞式刷新"""
+        if not playlist.segments:
+            return None
+        last = playlist.segments[-1]
+        msn = first + len(playlist.segments) - 1
+        if last.uri is None:
+            return msn, len(last.parts or [])
+        return msn + 1, 0 if self.part_target is not None else None
+
+    def reload_url(self, url):
+        """下一次刷新的URL；阻塞式刷新时附加 _HLS_msn/_HLS_part 参数"""
+        if not self.blocking:
+            return url
+        msn, part = self._reload_position
+        parts = urlsplit(url)
+        query = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if k not in ('_HLS_msn', '_HLS_part')]
+        query.append(('_HLS_msn', str(msn)))
+        if part is not None:
+            query.append(('_HLS_part', str(part)))
+        return urlunsplit(parts._replace(query=urlencode(query)))
+
+    @property
+    def reload_timeout(self):
+        """阻塞式刷新的请求超时（秒）"""
+        return self.target_duration * BLOCKING_RELOAD_TARGETS + BLOCKING_RELOAD_MARGIN
+
+    def reload_delay(self, changed):
+        """
+        距离本次刷新开始多久后再次刷新
+
+        Args:
+            changed: 本次刷新是否有新分片
+        """
+        interval = self.part_target if self.low_latency else self.target_duration
+        if self.blocking and changed:
+            # 服务器挂起请求直到下一个（部分）分片生成，不需要等待
+            delay = 0.0
+        else:
+            delay = interval if changed else interval / 2
+        self._unchanged_for = 0.0 if changed else self._unchanged_for + delay
+        return delay
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+断点续传清单
+记录已完整写入的分片，重启任务时只信任清单中登记过、大小和 CRC32 都一致的分片文件
+"""
+
+import hashlib
+import json
+import os
+import threading
+import zlib
+from pathlib import Path
+from urllib.parse import urlsplit
+
+
+MANIFEST_NAME = "manifest.jsonl"
+
+# 续传时校验分片文件 CRC32 每次读入的大小
+CRC_CHUNK_SIZE = 1024 * 1024
+
+
+def temp_dir_name(base_name, url):
+    """
+    分片临时目录名
+
+    由文件名和播放列表URL的哈希组成，不含时间戳，同一任务重启后能找到上次的目录。
+    """
+    digest = hashlib.sha1(url.encode("utf-8")).hexdigest()[:10]
+    return f"{base_name}_{digest}_temp"
+
+
+def _url_key(url):
+    # 带签名参数的分片URL每次获取播放列表都会变化，只比较路径
+    parts = urlsplit(url or "")
+    return parts.netloc, parts.path
+
+
+def file_crc32(file_path):
+    """按块读取文件计算 CRC32"""
+    crc32 = 0
+    with open(file_path, "rb") as f:
+        while True:
+            chunk = f.read(CRC_CHUNK_SIZE)
+            if not chunk:
+                return crc32
+            crc32 = zlib.crc32(chunk, crc32)
+
+
+class SegmentManifest:
+    """
+    分片清单
+
+    以 JSON Lines 形式追加写入临时目录下的 manifest.jsonl，每个分片完成时追加一行：
+    index、url、expected（Content-Length）、size（写入的字节数）、crc32、state。
+    进程中途退出时最后一行可能不完整，加载时忽略该行。
+
+    只有写入磁盘的分片文件会登记。流式合并时直接从内存交给写入器的分片不落盘、
+    不登记：它们只存在于上次的输出文件中，而输出文件在重启后从头重写，这些分片
+    需要重新下载。
+    """
+
+    def __init__(self, temp_dir):
+        self.path = Path(temp_dir) / MANIFEST_NAME
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._file = None
+        self._needs_newline = False
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, "rb") as f:
+                content = f.read()
+        except FileNotFoundError:
+            return
+        self._needs_newline = bool(content) and not content.endswith(b"\n")
+        for line in content.splitlines():
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(entry, dict) and isinstance(entry.get("index"), int):
+                self._entries[entry["index"]] = entry
+
+    def is_done(self, index, url, file_path):
+        """
+        分片是否已完整下载：清单中已登记、URL路径一致、文件大小一致且 CRC32 一致
+
+        不解密的超大分片由多个连接直接写入，登记时没有计算 CRC32（为 None），只比较大小。
+        """
+        entry = self._entries.get(index)
+        if not entry or entry.get("state") != "done":
+            return False
+        if _url_key(entry.get("url")) != _url_key(url):
+            return False
+        try:
+            if os.path.getsize(file_path) != entry.get("size"):
+                return False
+            return entry.get("crc32") is None or file_crc32(file_path) == entry["crc32"]
+        except OSError:
+            return False
+
+    def mark_done(self, index, url, size, crc32, expected=None):
+        """登记一个已完成的分片（分片文件已原子重命名到最终位置之后调用）"""
+        entry = {
+            "index": index,
+            "url": url,
+            "expected": expected,
+            "size": size,
+            "crc32": crc32,
+            "state": "done",
+        }
+        with self._lock:
+            self._entries[index] = entry
+            if self._file is None:
+                self._file = open(self.path, "a", encoding="utf-8")
+                if self._needs_newline:
+                    self._file.write("\n")
+            self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self._file.flush()
+
+    @property
+    def completed(self):
+        return sum(1 for entry in self._entries.values() if entry.get("state") == "done")
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
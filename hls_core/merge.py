@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+"""
+分片合并
+内核态文件拼接，以及边下载边按序写入最终文件的重排序缓冲区
+"""
+
+import os
+import sys
+import threading
+from pathlib import Path
+
+
+# 乱序分片在内存中的默认缓冲上限
+DEFAULT_STREAM_BUFFER = 64 * 1024 * 1024
+
+# 无法使用内核拷贝时的读写缓冲大小
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
+def _kernel_copy(in_fd, out_fd, size):
+    """
+    用 copy_file_range / sendfile 在内核中复制数据，返回已复制的字节数
+
+    数据从输入文件开头按显式偏移读取，写入输出文件的当前位置。
+    两种系统调用都不可用（或文件系统不支持）时返回已完成的部分，由调用方补齐。
+    """
+    copied = 0
+    if hasattr(os, 'copy_file_range'):
+        try:
+            while copied < size:
+                n = os.copy_file_range(in_fd, out_fd, size - copied, copied)
+                if n == 0:
+                    break
+                copied += n
+            return copied
+        except OSError:
+            pass
+
+    # macOS 等平台的 sendfile 只能写入 socket
+    if hasattr(os, 'sendfile') and sys.platform.startswith('linux'):
+        try:
+            while copied < size:
+                n = os.sendfile(out_fd, in_fd, copied, size - copied)
+                if n == 0:
+                    break
+                copied += n
+        except OSError:
+            pass
+    return copied
+
+
+def copy_file_into(outfile, path):
+    """
+    把文件内容追加到已打开的输出文件
+
+    优先走内核拷贝，数据不经过 Python 内存；否则用固定大小的缓冲区 readinto 分块复制。
+
+    Args:
+        outfile: 以二进制写模式打开的输出文件
+        path: 要追加的文件
+
+    Returns:
+        复制的字节数
+    """
+    outfile.flush()
+    out_fd = outfile.fileno()
+    with open(path, 'rb', buffering=0) as infile:
+        in_fd = infile.fileno()
+        size = os.fstat(in_fd).st_size
+        copied = _kernel_copy(in_fd, out_fd, size)
+        if copied >= size:
+            return copied
+
+        infile.seek(copied)
+        buffer = bytearray(COPY_BUFFER_SIZE)
+        view = memoryview(buffer)
+        while True:
+            n = infile.readinto(buffer)
+            if not n:
+                break
+            outfile.write(view[:n])
+            copied += n
+        outfile.flush()
+        return copied
+
+
+class OrderedSegmentWriter:
+    """
+    按序合并写入器
+
+    分片可以按任意顺序提交；只要从 next_index 开始的前缀连续，就立刻追加到
+    输出文件。乱序到达的分片先放在内存中，超过 max_buffer_bytes 时落盘到
+    spill_dir，等轮到它时再写入并删除。
+
+    fMP4 分片随分片提交其初始化段，只有与上一个写入的初始化段不同时才写入。
+    输出也可以是已打开的管道（如 ffmpeg 的标准输入），分片按序流入外部进程。
+    """
+
+    def __init__(self, output_file, spill_dir, max_buffer_bytes=DEFAULT_STREAM_BUFFER, start_index=0):
+        """
+        Args:
+            output_file: 输出文件路径，或已打开的二进制写入对象（close() 时一并关闭）
+            spill_dir: 缓冲溢出时存放临时分片的目录
+            max_buffer_bytes: 乱序分片在内存中的最大字节数
+            start_index: 第一个分片的序号
+        """
+        if hasattr(output_file, 'write'):
+            self.output_file = None
+            self._outfile = output_file
+        else:
+            self.output_file = Path(output_file)
+            self._outfile = open(self.output_file, 'wb')
+        self.spill_dir = Path(spill_dir)
+        self.max_buffer_bytes = max_buffer_bytes
+        self.next_index = start_index
+        self.bytes_written = 0
+        self.buffered_bytes = 0
+        self.spilled = 0
+        self.init_sections = 0
+        self.error = None
+        self._init_key = None
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def submit(self, index, data=None, path=None, init=None):
+        """
+        提交一个分片
+
+        Args:
+            index: 分片序号
+            data: 分片内容（bytes）
+            path: 已在磁盘上的分片文件，与 data 二选一；写入后不会删除
+            init: fMP4 分片的初始化段（InitSection），普通 TS 分片为 None
+        """
+        with self._lock:
+            if index < self.next_index or index in self._pending:
+                return
+            if index == self.next_index:
+                self._write(data, path, init)
+                self.next_index += 1
+                self._drain()
+                return
+
+            if path is not None:
+                self._pending[index] = ('file', Path(path), init)
+            elif self.buffered_bytes + len(data) > self.max_buffer_bytes:
+                spill_path = self.spill_dir / f"pending_{index:05d}.ts"
+                with open(spill_path, 'wb') as f:
+                    f.write(data)
+                self.spilled += 1
+                self._pending[index] = ('spill', spill_path, init)
+            else:
+                self.buffered_bytes += len(data)
+                self._pending[index] = ('memory', data, init)
+
+    def skip(self, index):
+        """跳过一个不会到达的分片（下载失败或直播中已错过），后面的分片照常写入"""
+        with self._lock:
+            if index < self.next_index or index in self._pending:
+                return
+            if index == self.next_index:
+                self.next_index += 1
+                self._drain()
+            else:
+                self._pending[index] = ('skip', None, None)
+
+    def _drain(self):
+        while self.next_index in self._pending:
+            kind, value, init = self._pending.pop(self.next_index)
+            if kind == 'skip':
+                pass
+            elif kind == 'memory':
+                self.buffered_bytes -= len(value)
+                self._write(value, None, init)
+            else:
+                self._write(None, value, init)
+                if kind == 'spill':
+                    os.remove(value)
+            self.next_index += 1
+
+    def _write(self, data, path, init=None):
+        if self.error is not None:
+            # 写入失败后输出可能只写了半个分片，不能再接着写
+            raise self.error
+        try:
+            self._write_segment(data, path, init)
+        except OSError as e:
+            self.error = e
+            raise
+
+    def _write_segment(self, data, path, init):
+        if init is not None and init.key != self._init_key:
+            self._outfile.write(init.data)
+            self.bytes_written += len(init.data)
+            self.init_sections += 1
+            self._init_key = init.key
+        if path is not None:
+            self.bytes_written += copy_file_into(self._outfile, path)
+        else:
+            self._outfile.write(data)
+            self.bytes_written += len(data)
+
+    @property
+    def pending_count(self):
+        return len(self._pending)
+
+    def close(self):
+        """关闭输出文件，丢弃仍未轮到的乱序分片"""
+        with self._lock:
+            for kind, value, _ in self._pending.values():
+                if kind == 'spill' and value.exists():
+                    os.remove(value)
+            self._pending.clear()
+            self.buffered_bytes = 0
+            if not self._outfile.closed:
+                try:
+                    self._outfile.close()
+                except BrokenPipeError:
+                    # 管道另一端的进程已退出，由调用方检查它的退出码
+                    pass
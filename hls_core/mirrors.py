@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+冗余线路
+主播放列表常把同一码率在多个 CDN 主机上各列一份（冗余流）；
+全部保留为镜像线路，分片请求按各主机的实测速度分摊，某条线路出错时换用其他线路
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+from .playlist_stream import parse_media_playlist
+from .segment import absolute_url
+from .variants import variant_resolution
+
+
+# 请求失败的线路暂停使用的时间（秒），连续失败时每次翻倍
+MIRROR_COOLDOWN = 2.0
+MIRROR_MAX_COOLDOWN = 60.0
+
+# 单请求速度的指数加权平均中新样本所占比例
+RATE_SMOOTHING = 0.3
+
+
+def _identity(playlist):
+    info = playlist.stream_info
+    if info is None:
+        return None
+    return info.bandwidth, variant_resolution(playlist), info.codecs
+
+
+def equivalent_variants(playlists, chosen):
+    """
+    主播放列表中与 chosen 等价的变体（冗余流），包括 chosen 本身
+
+    BANDWIDTH、分辨率和 CODECS 都相同即视为同一码率的不同线路。按主播放列表中的顺序返回，
+    排在前面的作为主线路。
+    """
+    identity = _identity(chosen)
+    if identity is None:
+        return [chosen]
+    return [playlist for playlist in playlists if playlist is chosen or _identity(playlist) == identity]
+
+
+class Mirror:
+    """一条线路：媒体播放列表URL，以及这条线路的分片表"""
+
+    def __init__(self, url, table=None):
+        """
+        Args:
+            url: 媒体播放列表URL
+            table: 这条线路的 SegmentTable；None 表示主线路，直接使用下载时传入的分片
+        """
+        self.url = url
+        self.host = urlparse(url).netloc
+        self.table = table
+        self.active = 0
+        self.requests = 0
+        self.failures = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.rate = None
+        self._streak = 0
+        self._resume_at = 0.0
+
+    def segment_url(self, index, segment):
+        """第 index 个分片在这条线路上的URL"""
+        if self.table is None:
+            return absolute_url(segment, self.url)
+        return self.table.url(index)
+
+
+class MirrorSet:
+    """
+    同一码率的多条线路
+
+    每个请求选择预计最早完成的线路，即 (进行中的请求数 + 1) / 单请求速度 最小的一条，
+    速度快的主机分到更多并发；还没有测速的线路按已知最快的速度估计，保证每条线路都会被试用。
+    请求失败的线路暂停使用一段时间（连续失败时翻倍），期间只在其他线路都不可用时才选它。
+    线程安全。
+    """
+
+    def __init__(self, mirrors, skipped=()):
+        """
+        Args:
+            mirrors: Mirror 列表，第一条为主线路
+            skipped: 不可用的线路 [(url, 原因), ...]，只用于日志
+        """
+        self.mirrors = list(mirrors)
+        self.skipped = list(skipped)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.mirrors)
+
+    @property
+    def primary(self):
+        return self.mirrors[0]
+
+    def acquire(self, exclude=()):
+        """
+        为一个请求选择线路并登记为进行中，之后必须调用 release()
+
+        Args:
+            exclude: 这个分片已经失败过的线路，其他线路都试过之后才会再选
+        """
+        with self._lock:
+            now = time.monotonic()
+            candidates = [mirror for mirror in self.mirrors if mirror not in exclude] or self.mirrors
+            candidates = [mirror for mirror in candidates if mirror._resume_at <= now] or candidates
+            rates = [mirror.rate for mirror in self.mirrors if mirror.rate]
+            default = max(rates) if rates else 1.0
+            mirror = min(candidates, key=lambda m: (m.active + 1) / (m.rate or default))
+            mirror.active += 1
+            return mirror
+
+    def release(self, mirror, nbytes=0, seconds=0.0, ok=True):
+        """
+        登记请求结束
+
+        Args:
+            nbytes: 收到的字节数
+            seconds: 请求耗时（含等待响应）
+            ok: True 成功（计入速度），False 失败（线路暂停使用），None 中途放弃（如对冲落败）
+        """
+        with self._lock:
+            mirror.active -= 1
+            mirror.requests += 1
+            mirror.bytes += nbytes
+            mirror.seconds += seconds
+            if ok:
+                mirror._streak = 0
+                mirror._resume_at = 0.0
+                if nbytes and seconds > 0:
+                    sample = nbytes / seconds
+                    mirror.rate = sample if mirror.rate is None else mirror.rate + RATE_SMOOTHING * (sample - mirror.rate)
+            elif ok is not None:
+                mirror.failures += 1
+                mirror._streak += 1
+                cooldown = min(MIRROR_MAX_COOLDOWN, MIRROR_COOLDOWN * 2 ** (mirror._streak - 1))
+                mirror._resume_at = time.monotonic() + cooldown
+
+    def untried(self, failed):
+        """除 failed 之外是否还有其他线路（分片失败后可以立即换线重试）"""
+        return any(mirror not in failed for mirror in self.mirrors)
+
+    def _name(self, mirror):
+        hosts = [m.host for m in self.mirrors]
+        return mirror.host if hosts.count(mirror.host) == 1 else mirror.url
+
+    def describe(self):
+        """日志行：可用的线路和被忽略的线路"""
+        lines = [f"[*] 同一码率共有 {len(self.mirrors)} 条线路: {'、'.join(self._name(m) for m in self.mirrors)}"]
+        for url, reason in self.skipped:
+            lines.append(f"[!] 忽略线路 {url}: {reason}")
+        return lines
+
+    def report(self):
+        """日志行：每条线路的请求数、下载量和单请求速度"""
+        total = sum(mirror.bytes for mirror in self.mirrors) or 1
+        lines = []
+        for mirror in self.mirrors:
+            speed = mirror.bytes / mirror.seconds if mirror.seconds else 0.0
+            line = (f"[*]   {self._name(mirror)}: {mirror.requests} 个请求，{mirror.bytes / 1024 / 1024:.1f} MB"
+                     f"（{mirror.bytes * 100 / total:.0f}%），单请求 {speed / 1024 / 1024:.2f} MB/s")
+            if mirror.failures:
+                line += f"，失败 {mirror.failures} 次"
+            lines.append(line)
+        return lines
+
+
+def load_mirrors(urls, fetch):
+    """
+    并行获取各线路的媒体播放列表
+
+    各线路的播放列表逐行解析为 SegmentTable。第一条能获取的线路作为主线路；
+    分片数或起始媒体序号与主线路不同的线路忽略。
+
+    Args:
+        urls: 各线路的媒体播放列表URL，首选的在前
+        fetch: fetch(url) -> 播放列表文本
+
+    Returns:
+        (主线路的 SegmentTable, MirrorSet)；所有线路都获取失败时抛出第一条线路的异常
+    """
+    urls = list(dict.fromkeys(urls))
+
+    def load(url):
+        try:
+            return parse_media_playlist(fetch(url), url), None
+        except Exception as e:
+            return None, e
+
+    with ThreadPoolExecutor(max_workers=len(urls)) as executor:
+        loaded = list(executor.map(load, urls))
+
+    available = [(url, playlist) for url, (playlist, error) in zip(urls, loaded) if playlist is not None]
+    if not available:
+        raise loaded[0][1]
+    skipped = [(url, error) for url, (playlist, error) in zip(urls, loaded) if playlist is None]
+
+    primary_url, primary = available[0]
+    mirrors = [Mirror(primary_url)]
+    for url, playlist in available[1:]:
+        if len(playlist) != len(primary) or playlist.media_sequence != primary.media_sequence:
+            skipped.append((url, "分片列表与主线路不一致"))
+        else:
+            mirrors.append(Mirror(url, playlist))
+    return primary, MirrorSet(mirrors, skipped)
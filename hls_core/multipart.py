@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+"""
+超大分片的多连接下载
+几百MB的单个分片（或只有一个分片的播放列表）拆成若干 Range 请求并行下载，
+写入同一个文件的对应偏移；不加密的分片下载完直接作为分片文件，加密的再整体解密
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .segment import SEGMENT_CHUNK_SIZE, parse_content_range
+
+
+# 默认每个大分片的连接数，以及超过多大的分片才拆分
+DEFAULT_SEGMENT_CONNECTIONS = 4
+DEFAULT_SPLIT_THRESHOLD = 64 * 1024 * 1024
+
+# 每段不小于这个大小，避免把刚过阈值的分片拆得过碎
+MIN_PART_SIZE = 4 * 1024 * 1024
+
+
+def split_size(status, headers, connections, threshold):
+    """
+    判断一个完整响应（200）对应的分片是否应该拆成多个连接下载
+
+    需要服务器声明 Accept-Ranges: bytes、未压缩传输，且 Content-Length 不小于 threshold。
+
+    Returns:
+        分片大小（字节），不需要拆分时返回 None
+    """
+    if connections <= 1 or status != 200:
+        return None
+    if headers.get('Accept-Ranges', '').lower() != 'bytes':
+        return None
+    if headers.get('Content-Encoding', 'identity').lower() != 'identity':
+        return None
+    try:
+        size = int(headers.get('Content-Length') or 0)
+    except ValueError:
+        return None
+    return size if size >= max(threshold, 1) else None
+
+
+def split_ranges(size, connections, min_part=MIN_PART_SIZE):
+    """把 [0, size) 平均分成不超过 connections 段，返回 [(start, end), ...]（end 不含）"""
+    count = max(1, min(connections, size // max(min_part, 1)))
+    step = -(-size // count)
+    return [(start, min(start + step, size)) for start in range(0, size, step)]
+
+
+class _Part:
+    __slots__ = ('start', 'end', 'done', 'received')
+
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end
+        self.done = 0
+        # 这个连接写入的字节数（改为单连接下载后也计入），用于判断重试前是否有进展
+        self.received = 0
+
+    @property
+    def length(self):
+        return self.end - self.start
+
+
+class ParallelRangeDownload:
+    """
+    多连接下载一个资源到本地文件
+
+    每段单独按重试策略重试，中断后从该段已写入的位置继续（有进展的中断不计入失败次数）。
+    服务器忽略 Range 返回 200 时，第一个收到 200 的连接改为单连接下载整个资源，其他分段放弃，
+    不会每个连接都把资源开头重复传输一遍。
+    给定 limiter 时每个请求各占一个并发名额，多连接下载不会超出下载器的并发数和连接池大小。
+    """
+
+    def __init__(self, url, size, path, connections, open_response, retry_policy, stats=None, cancelled=None,
+                 limiter=None):
+        """
+        Args:
+            url: 资源URL
+            size: 资源大小（字节）
+            path: 写入的本地文件
+            connections: 并行连接数
+            open_response: open_response(headers) -> 流式响应对象（requests.Response，支持 with）
+            retry_policy: RetryPolicy
+            stats: RetryStats
+            cancelled: 返回 True 时放弃下载
+            limiter: AdaptiveLimiter，每次请求前取得名额，结束后带着结果归还
+        """
+        self.url = url
+        self.size = size
+        self.path = path
+        self.open_response = open_response
+        self.retry_policy = retry_policy
+        self.stats = stats
+        self.cancelled = cancelled
+        self.limiter = limiter
+        self.parts = [_Part(start, end) for start, end in split_ranges(size, connections)]
+        self._failed = False
+        # 改为单连接下载时的整个资源分段，以及负责下载它的分段
+        self._lock = threading.Lock()
+        self._single = None
+        self._owner = None
+
+    @property
+    def ranges_ignored(self):
+        """服务器是否忽略了 Range（已改为单连接下载）"""
+        return self._single is not None
+
+    def run(self):
+        """下载所有分段，任一分段重试用尽时抛出其异常"""
+        with open(self.path, 'wb') as f:
+            f.truncate(self.size)
+        with ThreadPoolExecutor(max_workers=len(self.parts)) as executor:
+            futures = [executor.submit(self._fetch, part) for part in self.parts]
+            for future in futures:
+                future.result()
+
+    def _stopped(self):
+        return self._failed or bool(self.cancelled and self.cancelled())
+
+    def _target(self, part):
+        """分段实际要下载的范围：改为单连接下载后负责的分段下载整个资源，其他分段返回 None"""
+        with self._lock:
+            if self._single is None:
+                return part
+            return self._single if self._owner is part else None
+
+    def _fall_back(self, part):
+        """收到 200 的分段改为单连接下载整个资源；已有其他分段在下载时返回 None"""
+        with self._lock:
+            if self._single is None:
+                self._single = _Part(0, self.size)
+                self._owner = part
+            return self._single if self._owner is part else None
+
+    def _fetch(self, part):
+        attempt = 0
+        while True:
+            received = part.received
+            try:
+                return self._attempt(part)
+            except Exception as e:
+                if self._target(part) is None:
+                    return
+                # 这次请求有进展，只是后面断开，不计入失败次数
+                if part.received > received:
+                    attempt = 0
+                delay = self.retry_policy.backoff(e, attempt, self.stats)
+                if delay is None or not self.retry_policy.sleep(delay, self._stopped):
+                    # 一段失败整个分片就失败了，其他分段不再继续
+                    self._failed = True
+                    raise
+            attempt += 1
+
+    def _attempt(self, part):
+        if self._stopped():
+            raise IOError("下载已取消")
+        target = self._target(part)
+        if target is None:
+            return
+        # 每个请求占用一个并发名额，与普通分片请求一样计入自适应并发的统计
+        token = self.limiter.acquire() if self.limiter else None
+        nbytes = 0
+        ok = False
+        ttfb = None
+        try:
+            position = target.start + target.done
+            headers = {'Range': f'bytes={position}-{target.end - 1}'}
+            started = time.monotonic()
+            with self.open_response(headers) as response:
+                ttfb = time.monotonic() - started
+                response.raise_for_status()
+                if response.status_code == 206:
+                    content_range = parse_content_range(response.headers.get('Content-Range'))
+                    if not content_range or content_range[0] > position:
+                        raise IOError(f"无效的 Content-Range: {response.headers.get('Content-Range')}")
+                    skip = position - content_range[0]
+                else:
+                    # 服务器忽略 Range：这个响应就是整个资源，由一个连接接着下载到结尾
+                    target = self._fall_back(part)
+                    if target is None:
+                        ok = True
+                        return
+                    position = target.done
+                    skip = position
+                with open(self.path, 'r+b') as f:
+                    f.seek(position)
+                    for chunk in response.iter_content(SEGMENT_CHUNK_SIZE):
+                        if skip:
+                            if len(chunk) <= skip:
+                                skip -= len(chunk)
+                                continue
+                            chunk = chunk[skip:]
+                            skip = 0
+                        chunk = chunk[:target.length - target.done]
+                        f.write(chunk)
+                        target.done += len(chunk)
+                        part.received += len(chunk)
+                        nbytes += len(chunk)
+                        if target.done >= target.length or self._stopped() or self._target(part) is not target:
+                            break
+            if self._target(part) is not target:
+                # 其他连接已改为单连接下载整个资源，这一段不再需要
+                ok = True
+                return
+            if target.done < target.length:
+                raise IOError(f"分段响应不完整: {target.done}/{target.length}")
+            ok = True
+        finally:
+            if self.limiter:
+                self.limiter.release(token, ok, nbytes, ttfb)
+
+    def read_chunks(self, chunk_size=SEGMENT_CHUNK_SIZE):
+        """按顺序读出下载好的文件，用于整体解密"""
+        with open(self.path, 'rb') as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+"""
+流式解析媒体播放列表
+响应边接收边逐行解析，每解析出一个分片就追加到分片表；几MB的点播播放列表（长时间活动录像、
+亚秒级分片）不必等整个响应下载完、再由 m3u8 构建完整的对象模型，收到开头几KB即可开始下载分片
+"""
+
+import itertools
+import re
+import threading
+from concurrent.futures import Future
+
+import m3u8
+
+from .segtable import KeyInfo, MapInfo, SegmentTable
+
+
+# 读取播放列表响应时每次读取的块大小：慢速链路上收到第一块（含开头的分片）就能开始下载
+PLAYLIST_CHUNK_SIZE = 16 * 1024
+
+# 属性列表中的一项：引号内可以有逗号（与 m3u8 的解析规则相同）
+_ATTRIBUTE = re.compile(r'''((?:[^,"']|"[^"]*"|'[^']*')+)''')
+
+
+def parse_attributes(text):
+    """
+    解析标签的属性列表，如 METHOD=AES-128,URI="key.bin"
+
+    Returns:
+        {属性名（大写）: 值}，值两端的引号已去掉
+    """
+    attributes = {}
+    for param in _ATTRIBUTE.findall(text):
+        name, _, value = param.partition('=')
+        if value.startswith(('"', "'")) and value.endswith(('"', "'")):
+            value = value[1:-1]
+        attributes[name.strip().upper()] = value
+    return attributes
+
+
+def iter_line_batches(chunks):
+    """
+    把响应数据块切成文本行（UTF-8）
+
+    每收到一块数据，生成其中已完整的行组成的列表；不完整的最后一行留到下一块。
+    换行符可以是 \\n、\\r\\n 或 \\r。
+    """
+    remainder = b''
+    for chunk in chunks:
+        if not chunk:
+            continue
+        lines = (remainder + chunk).splitlines(True)
+        remainder = lines.pop() if not lines[-1].endswith((b'\n', b'\r')) else b''
+        yield [line.decode('utf-8', 'replace') for line in lines]
+    if remainder:
+        yield [remainder.decode('utf-8', 'replace')]
+
+
+class MediaPlaylistParser:
+    """
+    逐行解析媒体播放列表，分片依次追加到 SegmentTable
+
+    只处理下载用到的标签：EXTINF、EXT-X-BYTERANGE、EXT-X-KEY、EXT-X-MAP、EXT-X-MEDIA-SEQUENCE、
+    EXT-X-TARGETDURATION、EXT-X-PLAYLIST-TYPE、EXT-X-ENDLIST，其余标签忽略。
+    与 m3u8.loads 一样，只有 EXTINF 或 EXT-X-BYTERANGE 之后的 URI 行才是分片；
+    结尾缺少 URI 的 EXTINF 不计为分片。
+    """
+
+    def __init__(self, table):
+        self.table = table
+        self._duration = None
+        self._byterange = None
+        self._expect_segment = False
+        # 当前生效的密钥和初始化段，同一对象一直沿用到下一个同类标签
+        self._key = None
+        self._map = None
+
+    def feed(self, line):
+        """
+        解析一行
+
+        Returns:
+            这一行是否追加了分片
+        """
+        line = line.strip()
+        if not line:
+            return False
+        if line[0] != '#':
+            if not self._expect_segment:
+                return False
+            self.table.append(line, self._duration, self._byterange, self._key, self._map)
+            self._duration = self._byterange = None
+            self._expect_segment = False
+            return True
+
+        if line.startswith('#EXTINF:'):
+            self._duration = float(line[8:].split(',', 1)[0])
+            self._expect_segment = True
+        elif line.startswith('#EXT-X-BYTERANGE:'):
+            self._byterange = line[17:]
+            self._expect_segment = True
+        elif line.startswith('#EXT-X-KEY:'):
+            attributes = parse_attributes(line[11:])
+            self._key = KeyInfo(attributes.get('METHOD'), attributes.get('URI'), attributes.get('IV'),
+                                attributes.get('KEYFORMAT')) if attributes else None
+        elif line.startswith('#EXT-X-MAP:'):
+            attributes = parse_attributes(line[11:])
+            self._map = MapInfo(attributes.get('URI'), attributes.get('BYTERANGE')) if attributes else None
+        elif line.startswith('#EXT-X-MEDIA-SEQUENCE:'):
+            self.table.media_sequence = int(line[22:])
+        elif line.startswith('#EXT-X-TARGETDURATION:'):
+            self.table.target_duration = int(line[22:])
+        elif line.startswith('#EXT-X-PLAYLIST-TYPE:'):
+            self.table.playlist_type = line[21:].strip().lower()
+        elif line.startswith('#EXT-X-ENDLIST'):
+            self.table.is_endlist = True
+        return False
+
+
+def parse_media_playlist(text, base_url):
+    """一次性解析完整的媒体播放列表文本，返回 SegmentTable"""
+    table = SegmentTable(base_url)
+    parser = MediaPlaylistParser(table)
+    for line in text.splitlines():
+        parser.feed(line)
+    return table
+
+
+class PlaylistStream(SegmentTable):
+    """
+    边接收边解析的分片表
+
+    解析线程追加分片的同时，其他线程可以按序号读取已解析的分片；按顺序迭代时，
+    读到还没解析的位置会等待解析线程（iter_parsed() 不等待，交出 Future）。分片总数、
+    duration、encrypted、is_endlist 等汇总信息在 complete 为 True 之后才完整；接收或
+    解析出错时 error 记录异常，迭代到已解析分片的末尾后抛出。
+    """
+
+    complete = False
+
+    def __init__(self, base_url):
+        super().__init__(base_url)
+        self.error = None
+        self._cond = threading.Condition()
+        # 等待下一批分片的 Future，解析线程解析完一块数据（或解析结束）时完成
+        self._more = None
+        self._callbacks = []
+
+    def iter_parsed(self):
+        """
+        按顺序迭代分片，不等待解析线程
+
+        读到还没解析的位置时交出一个 concurrent.futures.Future，解析出新的分片或解析结束时
+        由解析线程完成；调用方等它完成后再继续迭代，其间可以处理别的事情（调度循环）。
+        """
+        index = 0
+        while True:
+            if index >= len(self):
+                with self._cond:
+                    more = None
+                    if index >= len(self) and not self.complete:
+                        if self._more is None:
+                            self._more = Future()
+                        more = self._more
+                if more is not None:
+                    yield more
+                    continue
+                if index >= len(self):
+                    if self.error is not None:
+                        raise self.error
+                    return
+            yield self[index]
+            index += 1
+
+    def __iter__(self):
+        for item in self.iter_parsed():
+            if isinstance(item, Future):
+                item.result()
+            else:
+                yield item
+
+    def wait(self):
+        """等待解析完成；解析出错时抛出异常"""
+        with self._cond:
+            while not self.complete:
+                self._cond.wait()
+        if self.error is not None:
+            raise self.error
+
+    def after_parsed(self, fn):
+        """
+        解析结束后在解析线程中计算 fn(table)，遍历整个分片表的统计不必占用调度循环
+
+        Returns:
+            concurrent.futures.Future：fn 的返回值，解析出错时为 None（fn 不会被调用）
+        """
+        future = Future()
+
+        def run(table):
+            try:
+                future.set_result(fn(table) if table.error is None else None)
+            except Exception as e:
+                future.set_exception(e)
+
+        with self._cond:
+            if not self.complete:
+                self._callbacks.append(run)
+                return future
+        run(self)
+        return future
+
+    def _notify(self):
+        with self._cond:
+            self._cond.notify_all()
+            more, self._more = self._more, None
+        if more is not None:
+            more.set_result(None)
+
+    def _run(self, parser, batches, response):
+        try:
+            for lines in batches:
+                for line in lines:
+                    parser.feed(line)
+                # 每块数据解析完就通知等待的迭代，接收下一块时不会让已解析的分片干等
+                self._notify()
+        except Exception as e:
+            self.error = e
+        finally:
+            response.close()
+            with self._cond:
+                self.complete = True
+                callbacks, self._callbacks = self._callbacks, []
+            self._notify()
+            for callback in callbacks:
+                callback(self)
+
+
+def stream_playlist(response, base_url):
+    """
+    流式获取播放列表
+
+    在当前线程解析到第一个分片为止；媒体播放列表随后转到后台线程继续接收、解析，
+    调用方拿到分片表就可以开始下载。主播放列表（或没有分片的播放列表）读完整个响应，
+    交给 m3u8 解析。
+
+    Args:
+        response: requests 的流式响应（stream=True）
+        base_url: 播放列表URL，用于解析相对地址
+
+    Returns:
+        (PlaylistStream, None)：媒体播放列表，后台线程仍在解析
+        (None, M3U8)：其他播放列表，m3u8.loads 的结果
+    """
+    table = PlaylistStream(base_url)
+    parser = MediaPlaylistParser(table)
+    batches = iter_line_batches(response.iter_content(PLAYLIST_CHUNK_SIZE))
+    received = []
+    try:
+        for lines in batches:
+            for position, line in enumerate(lines):
+                if parser.feed(line):
+                    rest = itertools.chain([lines[position + 1:]], batches)
+                    threading.Thread(target=table._run, args=(parser, rest, response), daemon=True).start()
+                    return table, None
+            received.extend(lines)
+    except BaseException:
+        response.close()
+        raise
+    response.close()
+    return None, m3u8.loads(''.join(received))
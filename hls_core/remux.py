@@ -0,0 +1,741 @@
+# -*- coding: utf-8 -*-
+"""
+MPEG-TS 转封装为 MP4（纯 Python，不需要 ffmpeg）
+单遍解析 TS 分片流（H.264/H.265 视频、AAC 音频），样本数据边解析边写入临时文件，
+内存中只保留每个样本的大小和时间戳；结束时写出 moov 在前（faststart）的 MP4，
+样本数据用内核拷贝追加在后面
+"""
+
+import os
+import struct
+import sys
+from array import array
+from pathlib import Path
+
+from .merge import copy_file_into
+
+
+TS_PACKET_SIZE = 188
+TS_SYNC_BYTE = 0x47
+
+STREAM_H264 = 0x1B
+STREAM_H265 = 0x24
+STREAM_AAC = 0x0F
+
+# 无法转封装的音视频流类型（MPEG-1/2 视频、MP3、LATM AAC、AC-3、E-AC-3）；
+# 其他类型（ID3 元数据、SCTE-35 等）直接忽略
+UNSUPPORTED_STREAMS = {0x01: "MPEG-1 视频", 0x02: "MPEG-2 视频", 0x03: "MP3", 0x04: "MP3",
+                       0x11: "LATM AAC", 0x81: "AC-3", 0x87: "E-AC-3"}
+
+TS_CLOCK = 90000
+PTS_MASK = (1 << 33) - 1
+
+# 相邻视频帧的时间戳回退或跳变超过这个值时视为不连续（EXT-X-DISCONTINUITY、缺失的分片），
+# 后面的帧紧接在前一帧之后
+MAX_TIMESTAMP_GAP = TS_CLOCK // 2
+
+MOVIE_TIMESCALE = 1000
+AAC_FRAME_SAMPLES = 1024
+AAC_SAMPLE_RATES = (96000, 88200, 64000, 48000, 44100, 32000, 24000, 22050, 16000, 12000, 11025, 8000, 7350)
+
+# 带 chroma_format_idc 等字段的 H.264 profile，avcC 中需要附加这些字段
+H264_HIGH_PROFILES = (100, 110, 122, 244, 44, 83, 86, 118, 128, 138, 139, 134, 135)
+
+MATRIX = (0x00010000, 0, 0, 0, 0x00010000, 0, 0, 0, 0x40000000)
+
+# 样本数据临时文件的写缓冲，以及 write_file() 每次读入的大小
+MDAT_BUFFER_SIZE = 1024 * 1024
+READ_CHUNK_SIZE = 1024 * 1024
+
+# 读入这么多数据仍没有找到 PAT 时判定不是 MPEG-TS，尽早交给调用方换用其他合并方式
+PAT_SEARCH_LIMIT = 4 * 1024 * 1024
+
+
+def _signed33(value):
+    """33 位时间戳差值转为有符号数（处理回绕）"""
+    value &= PTS_MASK
+    return value - (1 << 33) if value >= (1 << 32) else value
+
+
+def _read_timestamp(data, pos):
+    return (((data[pos] >> 1) & 0x07) << 30 | data[pos + 1] << 22 | (data[pos + 2] >> 1) << 15
+            | data[pos + 3] << 7 | data[pos + 4] >> 1)
+
+
+def split_nal_units(data):
+    """按起始码（00 00 01 / 00 00 00 01）切分 Annex B 字节流，返回 NAL 单元列表"""
+    units = []
+    start = data.find(b'\x00\x00\x01')
+    while start >= 0:
+        begin = start + 3
+        start = data.find(b'\x00\x00\x01', begin)
+        # 四字节起始码的第一个 0 留在了上一个单元末尾
+        unit = data[begin:start if start >= 0 else len(data)].rstrip(b'\x00')
+        if unit:
+            units.append(unit)
+    return units
+
+
+def _rbsp(nal):
+    """去掉防竞争字节（00 00 03 中的 03）"""
+    return nal.replace(b'\x00\x00\x03', b'\x00\x00')
+
+
+class _BitReader:
+    """参数集解析用的位读取器（含指数哥伦布编码）"""
+
+    def __init__(self, data):
+        self.value = int.from_bytes(data, 'big')
+        self.bits = len(data) * 8
+        self.pos = 0
+
+    def u(self, n):
+        if self.pos + n > self.bits:
+            raise ValueError("参数集数据不完整")
+        self.pos += n
+        return (self.value >> (self.bits - self.pos)) & ((1 << n) - 1)
+
+    def skip(self, n):
+        self.u(n)
+
+    def ue(self):
+        zeros = 0
+        while not self.u(1):
+            zeros += 1
+            if zeros > 31:
+                raise ValueError("无效的指数哥伦布编码")
+        return (1 << zeros) - 1 + self.u(zeros)
+
+    def se(self):
+        k = self.ue()
+        return (k + 1) // 2 if k & 1 else -(k // 2)
+
+
+def parse_h264_sps(nal):
+    """
+    解析 H.264 SPS
+
+    Returns:
+        dict：width、height、profile、chroma_format、bit_depth_luma、bit_depth_chroma
+    """
+    r = _BitReader(_rbsp(nal)[1:])
+    profile = r.u(8)
+    r.skip(16)
+    r.ue()
+    chroma_format, bit_depth_luma, bit_depth_chroma = 1, 8, 8
+    if profile in H264_HIGH_PROFILES:
+        chroma_format = r.ue()
+        if chroma_format == 3:
+            r.skip(1)
+        bit_depth_luma = r.ue() + 8
+        bit_depth_chroma = r.ue() + 8
+        r.skip(1)
+        if r.u(1):
+            for i in range(8 if chroma_format != 3 else 12):
+                if r.u(1):
+                    # 跳过 scaling_list
+                    last = following = 8
+                    for _ in range(16 if i < 6 else 64):
+                        if following:
+                            following = (last + r.se()) % 256
+                        last = following or last
+    r.ue()
+    poc_type = r.ue()
+    if poc_type == 0:
+        r.ue()
+    elif poc_type == 1:
+        r.skip(1)
+        r.se()
+        r.se()
+        for _ in range(r.ue()):
+            r.se()
+    r.ue()
+    r.skip(1)
+    width_mbs = r.ue() + 1
+    height_units = r.ue() + 1
+    frame_mbs_only = r.u(1)
+    if not frame_mbs_only:
+        r.skip(1)
+    r.skip(1)
+    width = width_mbs * 16
+    height = (2 - frame_mbs_only) * height_units * 16
+    if r.u(1):
+        left, right, top, bottom = r.ue(), r.ue(), r.ue(), r.ue()
+        crop_x = 2 if chroma_format in (1, 2) else 1
+        crop_y = (2 if chroma_format == 1 else 1) * (2 - frame_mbs_only)
+        width -= crop_x * (left + right)
+        height -= crop_y * (top + bottom)
+    return {'width': width, 'height': height, 'profile': profile, 'chroma_format': chroma_format,
+            'bit_depth_luma': bit_depth_luma, 'bit_depth_chroma': bit_depth_chroma}
+
+
+def parse_h265_sps(nal):
+    """
+    解析 H.265 SPS
+
+    Returns:
+        dict：width、height、chroma_format、bit_depth_luma、bit_depth_chroma、
+        profile_tier_level（general 部分的12字节，原样写入 hvcC）、temporal_layers、temporal_id_nested
+    """
+    rbsp = _rbsp(nal)[2:]
+    r = _BitReader(rbsp)
+    r.skip(4)
+    max_sub_layers = r.u(3)
+    nested = r.u(1)
+    r.skip(96)
+    sub_profile, sub_level = [], []
+    for _ in range(max_sub_layers):
+        sub_profile.append(r.u(1))
+        sub_level.append(r.u(1))
+    if max_sub_layers:
+        r.skip(2 * (8 - max_sub_layers))
+    for i in range(max_sub_layers):
+        if sub_profile[i]:
+            r.skip(88)
+        if sub_level[i]:
+            r.skip(8)
+    r.ue()
+    chroma_format = r.ue()
+    if chroma_format == 3:
+        r.skip(1)
+    width = r.ue()
+    height = r.ue()
+    if r.u(1):
+        left, right, top, bottom = r.ue(), r.ue(), r.ue(), r.ue()
+        width -= (2 if chroma_format in (1, 2) else 1) * (left + right)
+        height -= (2 if chroma_format == 1 else 1) * (top + bottom)
+    return {'width': width, 'height': height, 'chroma_format': chroma_format,
+            'bit_depth_luma': r.ue() + 8, 'bit_depth_chroma': r.ue() + 8,
+            'profile_tier_level': rbsp[1:13], 'temporal_layers': max_sub_layers + 1,
+            'temporal_id_nested': nested}
+
+
+def _box(kind, *payloads):
+    data = b''.join(payloads)
+    return struct.pack('>I4s', 8 + len(data), kind) + data
+
+
+def _full_box(kind, version, flags, *payloads):
+    return _box(kind, struct.pack('>I', (version << 24) | flags), *payloads)
+
+
+def _be_array(typecode, values):
+    """数值数组转为大端字节串"""
+    data = array(typecode, values)
+    if sys.byteorder == 'little':
+        data.byteswap()
+    return data.tobytes()
+
+
+def _run_lengths(values):
+    """[(count, value), ...]"""
+    runs = []
+    for value in values:
+        if runs and runs[-1][1] == value:
+            runs[-1][0] += 1
+        else:
+            runs.append([1, value])
+    return runs
+
+
+class _Track:
+    """一个输出轨道：编码参数，以及每个样本的大小、时间戳和所在块"""
+
+    def __init__(self, track_id, stream_type):
+        self.track_id = track_id
+        self.stream_type = stream_type
+        self.is_video = stream_type != STREAM_AAC
+        self.timescale = TS_CLOCK
+        self.sizes = array('I')
+        self.dts = array('q')
+        self.cts = array('i')
+        self.sync = array('I')
+        self.chunk_offsets = array('Q')
+        self.chunk_samples = array('I')
+
+        # 第一个样本的显示时间（原始 90kHz 时间戳），用于对齐各轨道
+        self.first_pts = None
+        self.last_raw_dts = None
+        self.last_duration = 0
+        self.inband_parameters = False
+
+        # 视频：参数集及其解析结果；音频：AudioSpecificConfig 相关字段
+        self.parameter_sets = {}
+        self.info = None
+        self.sample_rate = None
+        self.channels = None
+        self.audio_config = None
+        self.pending = b''
+
+    @property
+    def codec(self):
+        return {STREAM_H264: "H.264", STREAM_H265: "H.265", STREAM_AAC: "AAC"}[self.stream_type]
+
+    @property
+    def duration(self):
+        """轨道时长（轨道时间单位）"""
+        if not self.dts:
+            return 0
+        return self.dts[-1] - self.dts[0] + self.last_duration
+
+    def durations(self):
+        deltas = [b - a for a, b in zip(self.dts, self.dts[1:])]
+        deltas.append(self.last_duration)
+        return deltas
+
+
+class TSRemuxer:
+    """
+    TS 转 MP4 转封装器
+
+    按顺序 write() TS 数据（可以在任意位置切开），全部写完后 finish() 生成 MP4。
+    视频以每个 PES 为一帧，Annex B 起始码转为4字节长度前缀，参数集放进 avcC/hvcC；
+    音频把 ADTS 帧去掉帧头作为样本。视频时间戳回退或大幅跳变时接在前一帧之后，
+    音频按帧连续计时，各轨道按第一个样本的显示时间用编辑列表对齐。
+    """
+
+    def __init__(self, output_file, temp_dir=None):
+        """
+        Args:
+            output_file: 输出的 MP4 文件
+            temp_dir: 样本数据临时文件所在目录，默认与输出文件相同
+        """
+        self.output_file = Path(output_file)
+        self.mdat_path = Path(temp_dir or self.output_file.parent) / f"{self.output_file.name}.mdat"
+        self._mdat = open(self.mdat_path, 'wb', buffering=MDAT_BUFFER_SIZE)
+        self._mdat_size = 0
+        self._buffer = b''
+        self._pmt_pid = None
+        self._pids = {}
+        self._pes = {}
+        self._last_track = None
+        self.tracks = []
+        self.discontinuities = 0
+        self.bytes_in = 0
+
+    # ---- TS 解析 ----
+
+    def write(self, data):
+        """写入一段 TS 数据"""
+        self.bytes_in += len(data)
+        data = self._buffer + data if self._buffer else bytes(data)
+        pos = 0
+        end = len(data) - TS_PACKET_SIZE
+        pids = self._pids
+        pes = self._pes
+        while pos <= end:
+            if data[pos] != TS_SYNC_BYTE:
+                # 丢失同步，找下一个同步字节
+                pos = data.find(b'\x47', pos + 1)
+                if pos < 0:
+                    pos = len(data)
+                continue
+            header = data[pos + 1]
+            pid = (header & 0x1F) << 8 | data[pos + 2]
+            control = data[pos + 3] >> 4 & 0x03
+            start = pos + 4
+            pos += TS_PACKET_SIZE
+            if not control & 0x01:
+                continue
+            if control == 0x03:
+                start += 1 + data[start]
+                if start >= pos:
+                    continue
+            if pid in pids:
+                if header & 0x40:
+                    self._flush_pes(pid)
+                    pes[pid] = [data[start:pos]]
+                elif pid in pes:
+                    pes[pid].append(data[start:pos])
+            elif header & 0x40:
+                if pid == 0:
+                    self._parse_pat(data, start, pos)
+                elif pid == self._pmt_pid:
+                    self._parse_pmt(data, start, pos)
+        self._buffer = data[pos:]
+        if self._pmt_pid is None and self.bytes_in > PAT_SEARCH_LIMIT:
+            raise ValueError("没有找到节目关联表（PAT），输入不是 MPEG-TS")
+        return len(data)
+
+    def write_file(self, path):
+        """按块读入一个 TS 文件"""
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(READ_CHUNK_SIZE)
+                if not chunk:
+                    break
+                self.write(chunk)
+
+    @staticmethod
+    def _section(data, start, end):
+        section = start + 1 + data[start]
+        if section + 3 > end:
+            return None, None
+        length = (data[section + 1] & 0x0F) << 8 | data[section + 2]
+        return section, min(section + 3 + length - 4, end)
+
+    def _parse_pat(self, data, start, end):
+        section, stop = self._section(data, start, end)
+        if section is None:
+            return
+        for pos in range(section + 8, stop - 3, 4):
+            program = data[pos] << 8 | data[pos + 1]
+            if program:
+                self._pmt_pid = (data[pos + 2] & 0x1F) << 8 | data[pos + 3]
+                return
+
+    def _parse_pmt(self, data, start, end):
+        section, stop = self._section(data, start, end)
+        if section is None:
+            return
+        pos = section + 12 + ((data[section + 10] & 0x0F) << 8 | data[section + 11])
+        while pos + 5 <= stop:
+            stream_type = data[pos]
+            pid = (data[pos + 1] & 0x1F) << 8 | data[pos + 2]
+            pos += 5 + ((data[pos + 3] & 0x0F) << 8 | data[pos + 4])
+            if stream_type in UNSUPPORTED_STREAMS:
+                raise ValueError(f"不支持的流类型 {UNSUPPORTED_STREAMS[stream_type]}（0x{stream_type:02x}），无法转封装")
+            if stream_type not in (STREAM_H264, STREAM_H265, STREAM_AAC) or pid in self._pids:
+                continue
+            # 不连续点后 PID 可能改变，同类型的流继续写入原来的轨道
+            track = next((t for t in self.tracks if t.stream_type == stream_type), None)
+            if track is None:
+                track = _Track(len(self.tracks) + 1, stream_type)
+                self.tracks.append(track)
+            self._pids[pid] = track
+
+    def _flush_pes(self, pid):
+        parts = self._pes.pop(pid, None)
+        if not parts:
+            return
+        payload = b''.join(parts)
+        if len(payload) < 9 or payload[:3] != b'\x00\x00\x01':
+            return
+        flags = payload[7]
+        body = 9 + payload[8]
+        pts = _read_timestamp(payload, 9) if flags & 0x80 and len(payload) >= 14 else None
+        dts = _read_timestamp(payload, 14) if flags & 0xC0 == 0xC0 and len(payload) >= 19 else pts
+        track = self._pids[pid]
+        if track.is_video:
+            self._add_video(track, payload[body:], pts, dts)
+        else:
+            self._add_audio(track, payload[body:], pts)
+
+    # ---- 视频 ----
+
+    def _add_video(self, track, data, pts, dts):
+        hevc = track.stream_type == STREAM_H265
+        parts = []
+        keyframe = False
+        for nal in split_nal_units(data):
+            if hevc:
+                nal_type = nal[0] >> 1 & 0x3F
+                is_parameter_set = nal_type in (32, 33, 34)
+                if nal_type == 35:
+                    continue
+                keyframe = keyframe or 16 <= nal_type <= 23
+            else:
+                nal_type = nal[0] & 0x1F
+                is_parameter_set = nal_type in (7, 8)
+                if nal_type == 9:
+                    continue
+                keyframe = keyframe or nal_type == 5
+            if is_parameter_set:
+                known = track.parameter_sets.setdefault(nal_type, nal)
+                if known == nal:
+                    continue
+                # 参数集变化（如不连续点后分辨率改变）时保留在样本中
+                track.inband_parameters = True
+            parts.append(struct.pack('>I', len(nal)))
+            parts.append(nal)
+
+        if track.info is None:
+            # 从第一个带参数集的关键帧开始输出
+            if not keyframe or not self._load_video_info(track):
+                return
+        if not parts:
+            return
+        if dts is None:
+            if track.last_raw_dts is None:
+                return
+            dts = pts = (track.last_raw_dts + track.last_duration) & PTS_MASK
+        self._add_sample(track, parts, self._continue_dts(track, dts), _signed33(pts - dts), keyframe)
+        if track.first_pts is None:
+            track.first_pts = pts
+
+    def _load_video_info(self, track):
+        sets = track.parameter_sets
+        try:
+            if track.stream_type == STREAM_H265:
+                if not all(t in sets for t in (32, 33, 34)):
+                    return False
+                track.info = parse_h265_sps(sets[33])
+            else:
+                if not all(t in sets for t in (7, 8)):
+                    return False
+                track.info = parse_h264_sps(sets[7])
+        except ValueError:
+            return False
+        return True
+
+    def _continue_dts(self, track, raw):
+        """原始 DTS 转为从0开始的连续时间戳，回退或跳变处接在前一帧之后"""
+        last = track.last_raw_dts
+        track.last_raw_dts = raw
+        if last is None:
+            return 0
+        delta = _signed33(raw - last)
+        if delta <= 0 or delta > MAX_TIMESTAMP_GAP:
+            self.discontinuities += 1
+            delta = track.last_duration or TS_CLOCK // 25
+        track.last_duration = delta
+        return track.dts[-1] + delta
+
+    # ---- 音频 ----
+
+    def _add_audio(self, track, data, pts):
+        buffer = track.pending + data if track.pending else data
+        pos = 0
+        frames = 0
+        while pos + 7 <= len(buffer):
+            if buffer[pos] != 0xFF or buffer[pos + 1] & 0xF6 != 0xF0:
+                pos += 1
+                continue
+            header = 7 if buffer[pos + 1] & 0x01 else 9
+            length = (buffer[pos + 3] & 0x03) << 11 | buffer[pos + 4] << 3 | buffer[pos + 5] >> 5
+            if length <= header:
+                pos += 1
+                continue
+            if pos + length > len(buffer):
+                break
+            if track.audio_config is None:
+                self._load_audio_info(track, buffer, pos)
+                if pts is not None:
+                    track.first_pts = (pts + frames * AAC_FRAME_SAMPLES * TS_CLOCK // track.sample_rate) & PTS_MASK
+            dts = len(track.dts) * AAC_FRAME_SAMPLES
+            self._add_sample(track, [buffer[pos + header:pos + length]], dts, 0, True)
+            frames += 1
+            pos += length
+        track.pending = buffer[pos:]
+
+    @staticmethod
+    def _load_audio_info(track, buffer, pos):
+        object_type = (buffer[pos + 2] >> 6) + 1
+        rate_index = buffer[pos + 2] >> 2 & 0x0F
+        channels = (buffer[pos + 2] & 0x01) << 2 | buffer[pos + 3] >> 6
+        if rate_index >= len(AAC_SAMPLE_RATES):
+            raise ValueError(f"无效的 AAC 采样率索引: {rate_index}")
+        track.sample_rate = AAC_SAMPLE_RATES[rate_index]
+        track.timescale = track.sample_rate
+        track.channels = channels
+        track.last_duration = AAC_FRAME_SAMPLES
+        track.audio_config = struct.pack('>H', object_type << 11 | rate_index << 7 | channels << 3)
+
+    # ---- 样本写入 ----
+
+    def _add_sample(self, track, parts, dts, cts, sync):
+        size = 0
+        for part in parts:
+            self._mdat.write(part)
+            size += len(part)
+        if self._last_track is track:
+            track.chunk_samples[-1] += 1
+        else:
+            # 与上一个样本不属于同一轨道时开始新块
+            track.chunk_offsets.append(self._mdat_size)
+            track.chunk_samples.append(1)
+            self._last_track = track
+        self._mdat_size += size
+        track.sizes.append(size)
+        track.dts.append(dts)
+        track.cts.append(cts)
+        if sync:
+            track.sync.append(len(track.sizes))
+
+    # ---- MP4 输出 ----
+
+    def finish(self):
+        """
+        写出 MP4（moov 在前）并删除临时文件
+
+        Raises:
+            ValueError: 没有可以转封装的音视频数据
+        """
+        for pid in list(self._pes):
+            self._flush_pes(pid)
+        self._mdat.close()
+        tracks = [track for track in self.tracks if track.sizes and (track.info or track.audio_config)]
+        try:
+            if not tracks:
+                raise ValueError("没有找到可转封装的 H.264/H.265 视频或 AAC 音频")
+            self.tracks = tracks
+            large = self._mdat_size + 16 > 0xFFFFFFFF
+            ftyp = self._ftyp()
+            # 先按0偏移量生成一次得到 moov 大小，再填入实际的数据起始位置
+            mdat_header = struct.pack('>I4sQ', 1, b'mdat', self._mdat_size + 16) if large \
+                else struct.pack('>I4s', self._mdat_size + 8, b'mdat')
+            moov_size = len(self._moov(0, large))
+            moov = self._moov(len(ftyp) + moov_size + len(mdat_header), large)
+            with open(self.output_file, 'wb') as out:
+                out.write(ftyp)
+                out.write(moov)
+                out.write(mdat_header)
+                copy_file_into(out, self.mdat_path)
+        finally:
+            self.abort()
+
+    def abort(self):
+        """放弃转封装，删除样本数据临时文件"""
+        if not self._mdat.closed:
+            self._mdat.close()
+        try:
+            os.remove(self.mdat_path)
+        except OSError:
+            pass
+
+    def describe(self):
+        """如 "H.264 1280x720，AAC 44100Hz 2ch，时长 00:10:00" """
+        parts = []
+        for track in self.tracks:
+            if track.is_video and track.info:
+                parts.append(f"{track.codec} {track.info['width']}x{track.info['height']}")
+            elif track.audio_config:
+                parts.append(f"{track.codec} {track.sample_rate}Hz {track.channels}ch")
+        seconds = int(self.duration)
+        parts.append(f"时长 {seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}")
+        return "，".join(parts)
+
+    @property
+    def duration(self):
+        """输出时长（秒）"""
+        return max((track.duration / track.timescale for track in self.tracks), default=0.0)
+
+    def _ftyp(self):
+        brands = [b'isom', b'iso2', b'mp41']
+        if any(track.stream_type == STREAM_H264 for track in self.tracks):
+            brands.insert(2, b'avc1')
+        return _box(b'ftyp', b'isom', struct.pack('>I', 0x200), *brands)
+
+    def _start_times(self):
+        """各轨道第一个样本的显示时间相对最早轨道的偏移（秒）"""
+        reference = self.tracks[0].first_pts or 0
+        starts = [_signed33((track.first_pts or reference) - reference) / TS_CLOCK for track in self.tracks]
+        earliest = min(starts)
+        return [start - earliest for start in starts]
+
+    def _moov(self, data_offset, large):
+        traks = []
+        movie_duration = 0
+        for track, start in zip(self.tracks, self._start_times()):
+            delay = round(start * MOVIE_TIMESCALE)
+            media = round(track.duration * MOVIE_TIMESCALE / track.timescale)
+            movie_duration = max(movie_duration, delay + media)
+            traks.append(self._trak(track, delay, media, data_offset, large))
+        version = 1 if movie_duration > 0xFFFFFFFF else 0
+        times = struct.pack('>QQIQ' if version else '>IIII', 0, 0, MOVIE_TIMESCALE, movie_duration)
+        mvhd = _full_box(b'mvhd', version, 0, times, struct.pack('>IH10x', 0x00010000, 0x0100),
+                         struct.pack('>9I', *MATRIX), bytes(24), struct.pack('>I', len(self.tracks) + 1))
+        return _box(b'moov', mvhd, *traks)
+
+    def _trak(self, track, delay, media_duration, data_offset, large):
+        movie_total = delay + media_duration
+        version = 1 if max(movie_total, track.duration) > 0xFFFFFFFF else 0
+        width = height = 0
+        if track.is_video:
+            width, height = track.info['width'], track.info['height']
+        if version:
+            tkhd_times = struct.pack('>QQIIQ', 0, 0, track.track_id, 0, movie_total)
+        else:
+            tkhd_times = struct.pack('>IIIII', 0, 0, track.track_id, 0, movie_total)
+        tkhd = _full_box(b'tkhd', version, 0x03, tkhd_times,
+                         struct.pack('>8xhhH2x', 0, 0, 0 if track.is_video else 0x0100),
+                         struct.pack('>9I', *MATRIX), struct.pack('>II', width << 16, height << 16))
+
+        # 编辑列表：开头空出与最早轨道的时间差，再从第一帧的显示时间开始播放
+        entries = []
+        if delay:
+            entries.append(struct.pack('>Iihh', delay, -1, 1, 0))
+        entries.append(struct.pack('>Iihh', media_duration, track.cts[0] if track.cts else 0, 1, 0))
+        edts = _box(b'edts', _full_box(b'elst', 0, 0, struct.pack('>I', len(entries)), *entries))
+
+        if version:
+            mdhd_times = struct.pack('>QQIQ', 0, 0, track.timescale, track.duration)
+        else:
+            mdhd_times = struct.pack('>IIII', 0, 0, track.timescale, track.duration)
+        mdhd = _full_box(b'mdhd', version, 0, mdhd_times, struct.pack('>HH', 0x55C4, 0))
+        handler, name = (b'vide', b'VideoHandler\x00') if track.is_video else (b'soun', b'SoundHandler\x00')
+        hdlr = _full_box(b'hdlr', 0, 0, struct.pack('>I4s12x', 0, handler), name)
+        if track.is_video:
+            media_header = _full_box(b'vmhd', 0, 1, bytes(8))
+        else:
+            media_header = _full_box(b'smhd', 0, 0, bytes(4))
+        dinf = _box(b'dinf', _full_box(b'dref', 0, 0, struct.pack('>I', 1), _full_box(b'url ', 0, 1)))
+        minf = _box(b'minf', media_header, dinf, self._stbl(track, data_offset, large))
+        return _box(b'trak', tkhd, edts, _box(b'mdia', mdhd, hdlr, minf))
+
+    def _stbl(self, track, data_offset, large):
+        boxes = [_full_box(b'stsd', 0, 0, struct.pack('>I', 1), self._sample_entry(track))]
+
+        runs = _run_lengths(track.durations())
+        boxes.append(_full_box(b'stts', 0, 0, struct.pack('>I', len(runs)),
+                               _be_array('I', [value for run in runs for value in run])))
+        if any(track.cts):
+            runs = _run_lengths(track.cts)
+            version = 1 if min(track.cts) < 0 else 0
+            boxes.append(_full_box(b'ctts', version, 0, struct.pack('>I', len(runs)),
+                                   _be_array('i', [value for run in runs for value in run])))
+        if len(track.sync) < len(track.sizes):
+            boxes.append(_full_box(b'stss', 0, 0, struct.pack('>I', len(track.sync)), _be_array('I', track.sync)))
+
+        chunk_runs = []
+        for chunk, samples in enumerate(track.chunk_samples, 1):
+            if not chunk_runs or chunk_runs[-1][1] != samples:
+                chunk_runs.append((chunk, samples))
+        boxes.append(_full_box(b'stsc', 0, 0, struct.pack('>I', len(chunk_runs)),
+                               _be_array('I', [value for first, samples in chunk_runs for value in (first, samples, 1)])))
+        boxes.append(_full_box(b'stsz', 0, 0, struct.pack('>II', 0, len(track.sizes)), _be_array('I', track.sizes)))
+        offsets = [offset + data_offset for offset in track.chunk_offsets]
+        if large:
+            boxes.append(_full_box(b'co64', 0, 0, struct.pack('>I', len(offsets)), _be_array('Q', offsets)))
+        else:
+            boxes.append(_full_box(b'stco', 0, 0, struct.pack('>I', len(offsets)), _be_array('I', offsets)))
+        return _box(b'stbl', *boxes)
+
+    def _sample_entry(self, track):
+        if not track.is_video:
+            es = self._descriptor(3, struct.pack('>HB', track.track_id, 0),
+                                  self._descriptor(4, struct.pack('>BB3sII', 0x40, 0x15, bytes(3), 0, 0),
+                                                   self._descriptor(5, track.audio_config)),
+                                  self._descriptor(6, b'\x02'))
+            return _box(b'mp4a', bytes(6), struct.pack('>H8xHHHHI', 1, track.channels, 16, 0, 0,
+                                                       (track.sample_rate << 16) & 0xFFFFFFFF),
+                        _full_box(b'esds', 0, 0, es))
+
+        info = track.info
+        sets = track.parameter_sets
+        if track.stream_type == STREAM_H265:
+            kind = b'hev1' if track.inband_parameters else b'hvc1'
+            complete = 0 if track.inband_parameters else 0x80
+            arrays = b''.join(struct.pack('>BHH', complete | nal_type, 1, len(sets[nal_type])) + sets[nal_type]
+                              for nal_type in (32, 33, 34))
+            config = _box(b'hvcC', b'\x01', info['profile_tier_level'],
+                          struct.pack('>HBBBBHBB', 0xF000, 0xFC, 0xFC | info['chroma_format'],
+                                      0xF8 | (info['bit_depth_luma'] - 8), 0xF8 | (info['bit_depth_chroma'] - 8), 0,
+                                      info['temporal_layers'] << 3 | info['temporal_id_nested'] << 2 | 0x03, 3),
+                          arrays)
+        else:
+            kind = b'avc3' if track.inband_parameters else b'avc1'
+            sps, pps = sets[7], sets[8]
+            payload = [bytes((1, sps[1], sps[2], sps[3], 0xFF, 0xE1)), struct.pack('>H', len(sps)), sps,
+                       struct.pack('>BH', 1, len(pps)), pps]
+            if info['profile'] in H264_HIGH_PROFILES:
+                payload.append(bytes((0xFC | info['chroma_format'], 0xF8 | (info['bit_depth_luma'] - 8),
+                                      0xF8 | (info['bit_depth_chroma'] - 8), 0)))
+            config = _box(b'avcC', *payload)
+        return _box(kind, bytes(6), struct.pack('>H16xHHIIIH32sHh', 1, info['width'], info['height'],
+                                                0x00480000, 0x00480000, 0, 1, bytes(32), 0x0018, -1), config)
+
+    @staticmethod
+    def _descriptor(tag, *payloads):
+        data = b''.join(payloads)
+        return struct.pack('>BB', tag, len(data)) + data
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+重试策略
+指数退避 + 随机抖动，按错误类型决定是否重试，并遵循服务器的 Retry-After
+"""
+
+import asyncio
+import random
+import socket
+import threading
+import time
+from collections import Counter
+from email.utils import parsedate_to_datetime
+
+import requests
+
+try:
+    import aiohttp
+except ImportError:  # aiohttp 为可选依赖
+    aiohttp = None
+
+
+# 值得重试的HTTP状态码：超时、限流和服务端临时错误
+RETRYABLE_STATUS = frozenset({408, 425, 429, 500, 502, 503, 504})
+
+# 响应体中途断开时 requests 抛出 ChunkedEncodingError（即使不是分块传输）
+_CONNECTION_ERRORS = (requests.ConnectionError, requests.exceptions.ChunkedEncodingError, ConnectionError)
+if aiohttp is not None:
+    _CONNECTION_ERRORS += (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError)
+
+
+def _status_of(exc):
+    """取出异常对应的HTTP状态码（requests 与 aiohttp 两种异常）"""
+    response = getattr(exc, "response", None)
+    status = getattr(response, "status_code", None)
+    if status is None:
+        status = getattr(exc, "status", None)
+    return status if isinstance(status, int) else None
+
+
+def _retry_after(exc):
+    """解析 Retry-After 响应头（秒数或HTTP日期），返回秒数或 None"""
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None) or getattr(exc, "headers", None)
+    if not headers:
+        return None
+    value = headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def classify_error(exc):
+    """
+    错误分类
+
+    Returns:
+        原因标识，如 "http_429"、"timeout"、"connection"、"other"
+    """
+    status = _status_of(exc)
+    if status is not None:
+        return f"http_{status}"
+    if isinstance(exc, (requests.Timeout, asyncio.TimeoutError, socket.timeout)):
+        return "timeout"
+    if isinstance(exc, _CONNECTION_ERRORS):
+        return "connection"
+    return "other"
+
+
+class RetryStats:
+    """单个任务的重试计数（按原因统计），线程安全"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.retries = Counter()
+        self.resumed = 0
+        self.resumed_bytes = 0
+
+    def record(self, cause):
+        with self._lock:
+            self.retries[cause] += 1
+
+    def record_resume(self, offset):
+        """记录一次 Range 续传，offset 为无需重新下载的字节数"""
+        with self._lock:
+            self.resumed += 1
+            self.resumed_bytes += offset
+
+    @property
+    def total(self):
+        return sum(self.retries.values())
+
+    def summary(self):
+        """如 "http_429×3，timeout×1"，没有重试时为空字符串"""
+        with self._lock:
+            text = "，".join(f"{cause}×{count}" for cause, count in self.retries.most_common())
+            if self.resumed:
+                text += f"；续传 {self.resumed} 次，节省 {self.resumed_bytes / 1024 / 1024:.1f} MB"
+            return text
+
+
+class RetryPolicy:
+    """
+    重试策略
+
+    第 n 次重试前等待 [0, min(max_delay, base_delay * 2^n)] 内的随机时间（full jitter）；
+    服务器返回 Retry-After 时先等待该时长（不超过 max_delay）再叠加上述随机时间。
+    不在 retry_statuses 中的HTTP错误（如 403、404）直接失败，不再重试。
+    """
+
+    def __init__(self, attempts=5, base_delay=0.5, max_delay=30.0, jitter=True, retry_statuses=RETRYABLE_STATUS):
+        """
+        Args:
+            attempts: 最多尝试次数（含第一次）
+            base_delay: 退避基数（秒）
+            max_delay: 单次等待上限（秒）
+            jitter: 是否加入随机抖动，避免大量请求同时重试
+            retry_statuses: 可重试的HTTP状态码集合
+        """
+        self.attempts = max(1, int(attempts))
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.retry_statuses = frozenset(retry_statuses)
+
+    def is_retryable(self, exc):
+        status = _status_of(exc)
+        return status is None or status in self.retry_statuses
+
+    def backoff(self, exc, attempt, stats=None):
+        """
+        第 attempt 次尝试（从0开始）失败后的等待时间
+
+        Returns:
+            等待秒数；不可重试或次数用尽时返回 None
+        """
+        if attempt + 1 >= self.attempts or not self.is_retryable(exc):
+            return None
+        if stats is not None:
+            stats.record(classify_error(exc))
+
+        delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+        if self.jitter:
+            delay = random.uniform(0, delay)
+        retry_after = _retry_after(exc)
+        if retry_after is not None:
+            # 在 Retry-After 之后再叠加抖动，避免被限流的请求在同一时刻一起重试
+            delay += min(retry_after, self.max_delay)
+        return delay
+
+    def call(self, fn, stats=None, cancelled=None):
+        """
+        按策略调用 fn()，直到成功或不再重试
+
+        Args:
+            fn: 无参函数，失败时抛出异常
+            stats: RetryStats，记录重试原因
+            cancelled: 返回 True 时放弃等待并抛出最后一次的异常
+        """
+        attempt = 0
+        while True:
+            try:
+                return fn()
+            except Exception as e:
+                delay = self.backoff(e, attempt, stats)
+                if delay is None or not self.sleep(delay, cancelled):
+                    raise
+            attempt += 1
+
+    @staticmethod
+    def sleep(delay, cancelled=None):
+        """等待 delay 秒，期间被取消时返回 False"""
+        deadline = time.monotonic() + delay
+        while True:
+            if cancelled and cancelled():
+                return False
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return True
+            time.sleep(min(remaining, 0.2))
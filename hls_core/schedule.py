@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+按播放顺序调度分片下载
+正在下载的任务集中在最小的未完成序号附近，输出文件从开头连续增长，
+下载过程中就可以预览或检查已完成的前一部分；任务按需从播放列表中取出，
+内存占用只与预读窗口有关，与分片总数无关
+"""
+
+import os
+from collections import deque
+from concurrent.futures import Future
+
+from .byterange import RangeJob
+
+
+# 默认预读窗口：并发数的倍数（按分片计）
+DEFAULT_LOOKAHEAD_FACTOR = 8
+
+
+def job_indices(job):
+    """任务包含的分片序号：RangeJob 的全部成员，或 (index, segment) 的 index"""
+    if isinstance(job, RangeJob):
+        return [member.index for member in job.members]
+    return [job[0]]
+
+
+class PlaybackScheduler:
+    """
+    播放顺序调度器
+
+    任务按播放列表顺序从 jobs 中逐个取出，只有第一个分片落在 [最小未完成位置, +lookahead)
+    窗口内的任务才会交出；某个分片重试变慢时，后面最多再领先 lookahead 个分片，不会出现
+    开头缺一块、后面全部下完的情况，流式合并的乱序缓冲也随之有界。排队和进行中的状态
+    只保存窗口内的分片，几万个分片的播放列表也不会在开始前预先生成全部任务。
+
+    jobs 暂时取不出任务（播放列表还在后台解析、初始化段正在下载）时交出一个
+    concurrent.futures.Future，take() 不等待，只交出已经可以开始的任务，并把这个 Future
+    记在 waiting；调用方把它和进行中的任务一起等待，完成后再 take()。
+
+    同时统计从开头起连续完成的分片数和字节数（"连续可用"），失败的分片之后不再累计。
+    调用方在同一个线程（或事件循环）中调用 take() 和 complete()。
+    """
+
+    def __init__(self, jobs, concurrency, lookahead=None, total=None):
+        """
+        Args:
+            jobs: 下载任务（按播放列表顺序），元素为 (index, segment) 或 RangeJob；
+                  可以是生成器，交出任务时才逐个取出，需要等待时交出 Future
+            concurrency: 并发数，用于计算默认预读窗口
+            lookahead: 预读窗口（分片数，不小于并发数），None 或 0 表示并发数的 DEFAULT_LOOKAHEAD_FACTOR 倍
+            total: 分片总数；None 时先把 jobs 转为列表统计。播放列表边接收边解析时可以先给
+                   已解析的分片数，解析完成后再更新 total（只影响 pending）
+        """
+        self.lookahead = max(lookahead or DEFAULT_LOOKAHEAD_FACTOR * concurrency, concurrency, 1)
+        if total is None:
+            jobs = list(jobs)
+            total = sum(len(job_indices(job)) for job in jobs if not isinstance(job, Future))
+        self.total = total
+        self._jobs = iter(jobs)
+        # jobs 正在等待的 Future，完成前不再从 jobs 中取任务
+        self.waiting = None
+        # 已取出但还没交出的任务 (位置, 任务)
+        self._next = None
+        self._pulled = 0
+        # 窗口内（已取出、尚未按顺序结算）的分片：序号 -> 位置，以及按位置排列的序号
+        self._position = {}
+        self._order = deque()
+
+        self._settled = {}
+        self._settled_pos = 0
+        self.ready_count = 0
+        self.contiguous_bytes = 0
+        self._ready_blocked = False
+
+    @property
+    def pending(self):
+        """尚未交出的分片数（合并的字节范围请求按其中的分片计）"""
+        issued = self._next[0] if self._next is not None else self._pulled
+        return self.total - issued
+
+    def _peek(self):
+        if self._next is None:
+            if self.waiting is not None:
+                if not self.waiting.done():
+                    return None
+                self.waiting = None
+            job = next(self._jobs, None)
+            while isinstance(job, Future):
+                if not job.done():
+                    self.waiting = job
+                    return None
+                job = next(self._jobs, None)
+            if job is None:
+                return None
+            self._next = (self._pulled, job)
+            for index in job_indices(job):
+                self._position[index] = self._pulled
+                self._order.append(index)
+                self._pulled += 1
+        return self._next
+
+    def take(self, slots):
+        """
+        取出可以开始的任务，不等待 jobs
+
+        Args:
+            slots: 空闲的并发名额
+
+        Returns:
+            任务列表，最多 slots 个，且都在预读窗口内
+        """
+        jobs = []
+        while len(jobs) < slots:
+            entry = self._peek()
+            if entry is None:
+                break
+            position, job = entry
+            if position >= self._settled_pos + self.lookahead:
+                break
+            self._next = None
+            jobs.append(job)
+        return jobs
+
+    def complete(self, result):
+        """
+        登记一个分片的结果
+
+        Args:
+            result: (index, success, file_path)；成功且文件在磁盘上时按文件大小累计连续字节数
+        """
+        index, ok, file_path = result
+        if index not in self._position or index in self._settled:
+            return
+        size = 0
+        if ok and file_path is not None:
+            try:
+                size = os.path.getsize(file_path)
+            except OSError:
+                pass
+        self._settled[index] = (ok, size)
+
+        while self._order and self._order[0] in self._settled:
+            settled = self._order.popleft()
+            del self._position[settled]
+            ok, size = self._settled.pop(settled)
+            self._settled_pos += 1
+            if self._ready_blocked:
+                continue
+            if ok:
+                self.ready_count += 1
+                self.contiguous_bytes += size
+            else:
+                self._ready_blocked = True
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""
+分片写入
+流式接收分片数据，边接收边解密，写入临时文件或交给内存中的合并写入器
+"""
+
+import os
+import re
+import zlib
+from urllib.parse import urljoin
+
+
+# 分片流式下载时每次读取的块大小
+SEGMENT_CHUNK_SIZE = 64 * 1024
+
+_CONTENT_RANGE = re.compile(r'bytes\s+(\d+)-(\d+)/(\d+|\*)')
+
+
+def parse_content_range(value):
+    """
+    解析 Content-Range 响应头
+
+    Returns:
+        (start, end, total)，total 未知时为 None；格式无效时返回 None
+    """
+    match = _CONTENT_RANGE.match(value or '')
+    if not match:
+        return None
+    total = match.group(3)
+    return int(match.group(1)), int(match.group(2)), None if total == '*' else int(total)
+
+
+def segment_file_name(index):
+    """
+    分片临时文件名
+
+    编号至少5位；超过 99999 的分片文件名更长，按文件名排序不再是播放顺序，
+    合并时要按分片编号逐个生成文件名，不能对临时目录排序。
+    """
+    return f"segment_{index:05d}.ts"
+
+
+def absolute_url(item, base_url):
+    """
+    分片、密钥或初始化段的绝对URL
+
+    分片表（SegmentTable）中的记录已经解析为绝对URL，直接返回；m3u8 对象和直播分片按 base_url 解析。
+    """
+    if getattr(item, 'resolved', False):
+        return item.uri
+    return urljoin(base_url, item.uri)
+
+
+class SegmentSink:
+    """
+    单个分片的写入端
+
+    write() 逐块接收响应数据；如果给定解密器则先解密。写入磁盘模式下内存
+    占用只有一个块的大小；内存模式（流式合并）下 finish() 返回分片内容。
+    使用解密进程池时，密文先收集到共享内存，finish() 时交给子进程解密。
+
+    写入磁盘时先写 .part 文件，finish() 成功后才原子重命名为最终文件名，
+    进程中途退出不会留下看似完整的截断分片。
+
+    传输中断时写入端保持不变（解密状态也随之保留），下一次请求用
+    Range: bytes=N- 接着已接收的字节继续，并用 If-Range 确认资源没有变化。
+    """
+
+    def __init__(self, file_path, decryptor=None, in_memory=False, offload=None):
+        """
+        Args:
+            file_path: 分片文件路径（内存模式下不使用）
+            decryptor: StreamingDecryptor 对象，None 表示不需要解密
+            in_memory: 是否在内存中收集分片内容
+            offload: OffloadedDecryption 对象，交给解密进程池处理
+        """
+        self.file_path = file_path
+        self.decryptor = decryptor
+        self.offload = offload
+        self.bytes_received = 0
+        self.bytes_written = 0
+        self.expected_size = None
+        self.crc32 = 0
+        self.total_size = None
+        self._validator = None
+        self._resumable = False
+        self._finished = False
+        self._buffer = bytearray() if in_memory else None
+        self._part_path = None if in_memory else f"{file_path}.part"
+        self._file = None if in_memory else open(self._part_path, 'wb')
+
+    def _emit(self, data):
+        if not data:
+            return
+        self.bytes_written += len(data)
+        self.crc32 = zlib.crc32(data, self.crc32)
+        if self._buffer is not None:
+            self._buffer += data
+        else:
+            self._file.write(data)
+
+    def expect(self, size):
+        """告知分片的预期大小（Content-Length），用于预先分配共享内存"""
+        self.expected_size = size or None
+        if self.offload and size:
+            self.offload.reserve(size)
+
+    def begin(self, headers):
+        """
+        记录完整响应（200）的响应头
+
+        预期大小用于预分配；ETag（仅强校验）或 Last-Modified 以及总长度用于校验续传。
+        """
+        self.expect(int(headers.get('Content-Length') or 0))
+        self.total_size = self.expected_size
+        etag = headers.get('ETag')
+        if etag and etag.startswith('W/'):
+            etag = None
+        self._validator = etag or headers.get('Last-Modified')
+        # 压缩传输时已接收的字节数与资源偏移不对应，无法续传
+        encoding = headers.get('Content-Encoding', 'identity').lower()
+        self._resumable = (encoding == 'identity'
+                           and headers.get('Accept-Ranges', '').lower() != 'none'
+                           and bool(self._validator or self.total_size))
+
+    def resume_headers(self):
+        """续传请求需要附加的请求头；无法续传时返回 None"""
+        if not self._resumable or self._finished or not self.bytes_received:
+            return None
+        headers = {'Range': f'bytes={self.bytes_received}-'}
+        if self._validator:
+            headers['If-Range'] = self._validator
+        return headers
+
+    def continues(self, status, headers):
+        """续传请求的响应能否接在已接收的数据之后（否则需要从头下载）"""
+        if status != 206:
+            return False
+        if headers.get('Content-Encoding', 'identity').lower() != 'identity':
+            return False
+        content_range = parse_content_range(headers.get('Content-Range'))
+        if not content_range or content_range[0] != self.bytes_received:
+            return False
+        total = content_range[2]
+        if self.total_size and total is not None and total != self.total_size:
+            return False
+        return True
+
+    def write(self, chunk):
+        """写入一块原始响应数据"""
+        self.bytes_received += len(chunk)
+        if self.offload:
+            self.offload.write(chunk)
+            return
+        if self.decryptor:
+            chunk = self.decryptor.update(chunk)
+        self._emit(chunk)
+
+    def finish(self):
+        """
+        结束写入
+
+        Returns:
+            内存模式下返回分片内容（bytes），写入磁盘模式下返回 None
+        """
+        self._finished = True
+        if self.offload:
+            plain = self.offload.result()
+            try:
+                self._emit(plain)
+            finally:
+                plain.release()
+                self.offload.release()
+        if self.decryptor:
+            self._emit(self.decryptor.finalize())
+        if self._file is not None:
+            self._file.close()
+            os.replace(self._part_path, self.file_path)
+            return None
+        return bytes(self._buffer)
+
+    def abort(self):
+        """放弃写入并删除不完整的分片文件"""
+        if self.offload:
+            self.offload.release()
+        if self._file is not None:
+            self._file.close()
+            try:
+                os.remove(self._part_path)
+            except OSError:
+                pass
+        self._buffer = None
@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+"""
+紧凑分片表
+点播播放列表解析后降为数组存储：解析好的分片URL拼接在一个缓冲区里按偏移索引，
+时长、字节范围、密钥和初始化段编号各占一个数组，m3u8 的对象模型随即释放；
+几万个分片的播放列表只占几MB，调度、续传清单和合并都按序号从表中取分片
+"""
+
+import re
+from array import array
+from urllib.parse import urljoin
+
+from .byterange import parse_byterange
+
+
+# 无需 urljoin 规整的URI：路径段非空且不带 ; 参数，查询参数非空且没有片段标识；
+# 含 "/." 的（可能有 . 或 .. 路径段）仍交给 urljoin
+_PLAIN_PATH = r'[\w%~=&,+-][\w%~.=&,+-]*(?:/[\w%~.=&,+-]+)*(?:\?[^#]+)?\Z'
+_PLAIN_RELATIVE = re.compile(_PLAIN_PATH)
+_PLAIN_ABSOLUTE = re.compile(r'https?://[\w.:-]+/' + _PLAIN_PATH)
+
+
+class KeyInfo:
+    """EXT-X-KEY 的精简记录，提供下载器用到的 m3u8.Key 属性（uri 已解析为绝对URL）"""
+
+    __slots__ = ('method', 'uri', 'iv', 'keyformat')
+
+    resolved = True
+
+    def __init__(self, method, uri=None, iv=None, keyformat=None):
+        self.method = method
+        self.uri = uri
+        self.iv = iv
+        self.keyformat = keyformat
+
+
+class MapInfo:
+    """EXT-X-MAP 的精简记录（uri 已解析为绝对URL）"""
+
+    __slots__ = ('uri', 'byterange')
+
+    resolved = True
+
+    def __init__(self, uri, byterange=None):
+        self.uri = uri
+        self.byterange = byterange
+
+
+class SegmentRecord:
+    """
+    从分片表取出的一个分片
+
+    提供下载器用到的 m3u8.Segment 属性：uri 为绝对URL，byterange 统一为 "length@offset"；
+    同一密钥、同一初始化段的分片共用同一个 KeyInfo / MapInfo 对象。
+    iv_sequence 为媒体序号，没有显式 IV 时按 RFC 8216 用它作为默认 IV。
+    """
+
+    __slots__ = ('uri', 'duration', 'byterange', 'key', 'init_section', 'iv_sequence')
+
+    # uri 已是绝对URL，使用时不必再按播放列表地址解析
+    resolved = True
+
+    def __init__(self, uri, duration, byterange, key, init_section, iv_sequence):
+        self.uri = uri
+        self.duration = duration
+        self.byterange = byterange
+        self.key = key
+        self.init_section = init_section
+        self.iv_sequence = iv_sequence
+
+
+class SegmentTable:
+    """
+    数组存储的点播分片表
+
+    按序号（从0开始）索引，table[i] 返回新建的 SegmentRecord；迭代时依次生成，
+    不会同时持有全部分片对象。每个分片占 40 字节加URL长度。
+
+    一个线程追加分片时，其他线程可以同时读取已追加的分片（len() 只计入各数组都已写好的分片）。
+    """
+
+    # 是否已包含播放列表的全部分片；边接收边解析的 PlaylistStream 在解析完成前为 False
+    complete = True
+
+    def __init__(self, base_url, media_sequence=0):
+        """
+        Args:
+            base_url: 媒体播放列表URL，用于解析分片、密钥和初始化段的相对地址
+            media_sequence: 第一个分片的媒体序号（EXT-X-MEDIA-SEQUENCE）
+        """
+        self.base_url = base_url
+        # 播放列表所在目录（不含查询参数），普通相对URI直接拼接，不必每个分片都调用 urljoin
+        self._base_dir = urljoin(base_url, '_')[:-1]
+        self.media_sequence = media_sequence or 0
+        self.is_endlist = False
+        self.playlist_type = None
+        self.target_duration = None
+        self.keys = []
+        self.maps = []
+        self._urls = bytearray()
+        self._url_ends = array('Q')
+        self._durations = array('d')
+        self._range_starts = array('q')
+        self._range_lengths = array('q')
+        self._key_ids = array('i')
+        self._map_ids = array('i')
+        self._key_index = {}
+        self._map_index = {}
+        # 相邻分片通常引用同一个密钥/初始化段对象，跳过重复解析
+        self._last_key = (None, -1)
+        self._last_map = (None, -1)
+        # 上一个字节范围分片的 (URL, 结束位置)，省略偏移量时从这里接着算
+        self._last_range = (None, 0)
+
+    @classmethod
+    def from_playlist(cls, playlist, base_url):
+        """由 m3u8 媒体播放列表构建，之后不再引用 playlist 中的任何对象"""
+        table = cls(base_url, playlist.media_sequence)
+        table.is_endlist = bool(playlist.is_endlist)
+        table.playlist_type = playlist.playlist_type
+        table.target_duration = playlist.target_duration
+        for segment in playlist.segments:
+            if segment.uri is None:
+                # 结尾缺少 URI 的 EXTINF（m3u8 仍生成一个分片），与流式解析一样不计为分片
+                continue
+            table.append(segment.uri, segment.duration, segment.byterange, segment.key,
+                         getattr(segment, 'init_section', None))
+        table._last_key = table._last_map = (None, -1)
+        return table
+
+    def resolve(self, uri):
+        """按 base_url 解析URI，结果与 urljoin 相同"""
+        if '/.' not in uri:
+            if _PLAIN_RELATIVE.match(uri):
+                return self._base_dir + uri
+            if _PLAIN_ABSOLUTE.match(uri):
+                return uri
+        return urljoin(self.base_url, uri)
+
+    def _intern_key(self, key):
+        if key is None:
+            return -1
+        if key is self._last_key[0]:
+            return self._last_key[1]
+        ref = (key.method, self.resolve(key.uri) if key.uri else None, key.iv, getattr(key, 'keyformat', None))
+        index = self._key_index.get(ref)
+        if index is None:
+            index = self._key_index[ref] = len(self.keys)
+            self.keys.append(KeyInfo(*ref))
+        self._last_key = (key, index)
+        return index
+
+    def _intern_map(self, section):
+        if section is None or not section.uri:
+            return -1
+        if section is self._last_map[0]:
+            return self._last_map[1]
+        ref = (self.resolve(section.uri), section.byterange)
+        index = self._map_index.get(ref)
+        if index is None:
+            index = self._map_index[ref] = len(self.maps)
+            self.maps.append(MapInfo(*ref))
+        self._last_map = (section, index)
+        return index
+
+    def append(self, uri, duration, byterange=None, key=None, init_section=None):
+        """
+        追加一个分片
+
+        Args:
+            uri: 分片URI（相对 base_url）
+            duration: EXTINF 时长（秒）
+            byterange: EXT-X-BYTERANGE 的值 "length[@offset]"，省略偏移量时接在同一资源上一个范围之后
+            key: m3u8.Key 或 KeyInfo，内容相同的密钥只保存一次
+            init_section: m3u8 的 EXT-X-MAP 对象或 MapInfo
+        """
+        url = self.resolve(uri)
+        self._urls += url.encode('utf-8')
+        self._durations.append(duration or 0.0)
+        if byterange:
+            previous_url, previous_end = self._last_range
+            start, length = parse_byterange(byterange, previous_end if previous_url == url else 0)
+            self._last_range = (url, start + length)
+        else:
+            start, length = 0, -1
+        self._range_starts.append(start)
+        self._range_lengths.append(length)
+        self._key_ids.append(self._intern_key(key))
+        self._map_ids.append(self._intern_map(init_section))
+        # 最后写入URL结束位置：其长度就是分片数，此前其他线程看不到这个分片
+        self._url_ends.append(len(self._urls))
+
+    def __len__(self):
+        return len(self._url_ends)
+
+    def url(self, index):
+        """第 index 个分片的绝对URL"""
+        start = self._url_ends[index - 1] if index else 0
+        return self._urls[start:self._url_ends[index]].decode('utf-8')
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        length = self._range_lengths[index]
+        key_id = self._key_ids[index]
+        map_id = self._map_ids[index]
+        return SegmentRecord(
+            self.url(index),
+            self._durations[index],
+            f"{length}@{self._range_starts[index]}" if length >= 0 else None,
+            self.keys[key_id] if key_id >= 0 else None,
+            self.maps[map_id] if map_id >= 0 else None,
+            self.media_sequence + index,
+        )
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def iter_parsed(self):
+        """按顺序迭代分片；边接收边解析的 PlaylistStream 在需要等待解析线程时交出 Future"""
+        return iter(self)
+
+    @property
+    def duration(self):
+        """总时长（秒）"""
+        return sum(self._durations)
+
+    @property
+    def encrypted(self):
+        """是否有分片加密（METHOD=NONE 的 EXT-X-KEY 不算）"""
+        return any(key is not None and key.method != 'NONE' for key in self.keys)
+
+    @property
+    def nbytes(self):
+        """分片表本身占用的字节数（不含密钥和初始化段记录）"""
+        arrays = (self._url_ends, self._durations, self._range_starts, self._range_lengths,
+                  self._key_ids, self._map_ids)
+        return len(self._urls) + sum(a.itemsize * len(a) for a in arrays)
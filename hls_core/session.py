@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+HTTP 连接池会话
+为播放列表、密钥和分片请求提供复用 TCP/TLS 连接的 requests.Session
+"""
+
+import ssl
+import threading
+import http.cookiejar
+import weakref
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+# 默认连接池参数
+DEFAULT_POOL_CONNECTIONS = 10
+DEFAULT_POOL_MAXSIZE = 10
+
+
+class _NoPersistCookiePolicy(http.cookiejar.DefaultCookiePolicy):
+    """不把响应中的 Set-Cookie 写回会话，保持与逐次 requests.get 相同的行为"""
+
+    def set_ok(self, cookie, request):
+        return False
+
+
+class _SessionSavingSSLSocket(ssl.SSLSocket):
+    """关闭前把 TLS 会话交回所属 SSLContext 缓存"""
+
+    def close(self):
+        context = self.context
+        if isinstance(context, ResumingSSLContext) and self.server_hostname:
+            context._save_session(self.server_hostname, self)
+        super().close()
+
+
+class ResumingSSLContext(ssl.SSLContext):
+    """
+    按主机缓存 TLS 会话的 SSLContext
+
+    新建连接时带上同一主机上次握手得到的会话，服务器支持时即可走会话恢复，
+    省去完整握手。
+    """
+
+    sslsocket_class = _SessionSavingSSLSocket
+
+    def _init_session_cache(self):
+        self._session_lock = threading.Lock()
+        self._sessions = {}
+        self._live_sockets = {}
+        self.handshakes = 0
+        self.resumed = 0
+
+    def _save_session(self, server_hostname, sock):
+        try:
+            session = sock.session
+        except (OSError, ValueError, AttributeError):
+            return
+        if session is None or not (session.has_ticket or session.id):
+            return
+        with self._session_lock:
+            self._sessions[server_hostname] = session
+
+    def _take_session(self, server_hostname):
+        # TLS 1.3 的会话票据在握手后才到达，这里从仍存活的连接上补取
+        sock_ref = self._live_sockets.get(server_hostname)
+        sock = sock_ref() if sock_ref else None
+        if sock is not None:
+            self._save_session(server_hostname, sock)
+        with self._session_lock:
+            return self._sessions.get(server_hostname)
+
+    def wrap_socket(self, sock, *args, server_hostname=None, session=None, **kwargs):
+        if session is None and server_hostname:
+            session = self._take_session(server_hostname)
+        try:
+            ssock = super().wrap_socket(sock, *args, server_hostname=server_hostname, session=session, **kwargs)
+        except ssl.SSLError:
+            if session is None:
+                raise
+            # 会话失效时丢弃缓存，重新做一次完整握手
+            with self._session_lock:
+                self._sessions.pop(server_hostname, None)
+            ssock = super().wrap_socket(sock, *args, server_hostname=server_hostname, **kwargs)
+
+        with self._session_lock:
+            self.handshakes += 1
+            if ssock.session_reused:
+                self.resumed += 1
+            if server_hostname:
+                self._live_sockets[server_hostname] = weakref.ref(ssock)
+        return ssock
+
+
+def create_ssl_context():
+    """创建与 urllib3 默认安全设置一致、并支持会话恢复的 SSLContext"""
+    context = ResumingSSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    context._init_session_cache()
+    context.minimum_version = ssl.TLSVersion.TLSv1_2
+    context.options |= ssl.OP_NO_COMPRESSION
+    if getattr(context, "post_handshake_auth", None) is not None:
+        context.post_handshake_auth = True
+    context.verify_mode = ssl.CERT_REQUIRED
+    context.check_hostname = True
+    context.hostname_checks_common_name = False
+    return context
+
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """所有连接共享同一个 SSLContext 的 HTTPAdapter"""
+
+    def __init__(self, ssl_context=None, **kwargs):
+        self.ssl_context = ssl_context or create_ssl_context()
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+        pool_kwargs.setdefault("ssl_context", self.ssl_context)
+        super().init_poolmanager(connections, maxsize, block=block, **pool_kwargs)
+
+    def proxy_manager_for(self, proxy, **proxy_kwargs):
+        proxy_kwargs.setdefault("ssl_context", self.ssl_context)
+        return super().proxy_manager_for(proxy, **proxy_kwargs)
+
+
+def create_session(pool_maxsize=DEFAULT_POOL_MAXSIZE, pool_connections=DEFAULT_POOL_CONNECTIONS, pool_block=False):
+    """
+    创建带连接池的会话
+
+    Args:
+        pool_maxsize: 每个主机保持的最大连接数，通常与并发数一致
+        pool_connections: 缓存的主机连接池数量
+        pool_block: 连接池耗尽时是否阻塞等待，而不是临时新建连接
+
+    Returns:
+        requests.Session 对象
+    """
+    pool_maxsize = max(1, int(pool_maxsize))
+    session = requests.Session()
+    session.cookies.set_policy(_NoPersistCookiePolicy())
+
+    adapter = PooledHTTPAdapter(
+        pool_connections=max(1, int(pool_connections)),
+        pool_maxsize=pool_maxsize,
+        pool_block=pool_block,
+        max_retries=0,
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.pool_maxsize = pool_maxsize
+    return session
+
+
+def session_stats(session):
+    """返回会话的 TLS 握手统计 (handshakes, resumed)"""
+    adapter = session.get_adapter("https://")
+    context = getattr(adapter, "ssl_context", None)
+    if not isinstance(context, ResumingSSLContext):
+        return 0, 0
+    return context.handshakes, context.resumed
+
+
+_shared_lock = threading.Lock()
+_shared_session = None
+
+
+def get_shared_session(pool_maxsize=DEFAULT_POOL_MAXSIZE, pool_connections=DEFAULT_POOL_CONNECTIONS):
+    """
+    获取进程级共享会话
+
+    同一进程内的多个下载任务复用按主机划分的连接池。请求的连接数超过
+    现有会话时会换用更大的连接池，旧会话上的进行中请求不受影响。
+    """
+    global _shared_session
+    with _shared_lock:
+        if _shared_session is None or _shared_session.pool_maxsize < pool_maxsize:
+            _shared_session = create_session(pool_maxsize, pool_connections)
+        return _shared_session
@@ -0,0 +1,312 @@
+# -*- coding: utf-8 -*-
+"""
+多码率选择
+按策略从主播放列表中选择变体；auto 策略并行试下载几个候选码率的分片，
+按实测吞吐量选择链路能承受的最高码率
+"""
+
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin
+
+import m3u8
+
+from .byterange import parse_byterange
+
+
+DEFAULT_VARIANT_POLICY = "best"
+
+# auto 策略：试下载码率最高的几个候选，每个候选下载的分片数
+AUTO_CANDIDATES = 3
+AUTO_PROBE_SEGMENTS = 2
+
+# 选中的码率不超过实测吞吐量的比例，给网络波动留出余量
+AUTO_HEADROOM = 0.8
+
+
+class VariantPolicy:
+    """
+    码率选择策略
+
+    best            码率最高
+    worst           码率最低
+    max-bandwidth=N 不超过 N bit/s 的最高码率（N 可带 k/M 后缀）
+    resolution=WxH  指定分辨率（也可以只写高度，如 resolution=720），没有时取不超过它的最高分辨率
+    auto            并行试下载候选码率，选链路能承受的最高码率
+    """
+
+    KINDS = ("best", "worst", "max-bandwidth", "resolution", "auto")
+
+    def __init__(self, kind, value=None):
+        self.kind = kind
+        self.value = value
+
+    @classmethod
+    def parse(cls, spec):
+        if isinstance(spec, cls):
+            return spec
+        text = (spec or DEFAULT_VARIANT_POLICY).strip().lower()
+        kind, _, value = text.partition("=")
+        if kind not in cls.KINDS:
+            raise ValueError(f"未知的码率策略: {spec}（可选 best、worst、max-bandwidth=N、resolution=WxH、auto）")
+        if kind == "max-bandwidth":
+            match = re.fullmatch(r"(\d+(?:\.\d+)?)([km]?)", value)
+            if not match:
+                raise ValueError(f"无效的码率上限: {value}")
+            scale = {"": 1, "k": 1000, "m": 1000 * 1000}[match.group(2)]
+            return cls(kind, int(float(match.group(1)) * scale))
+        if kind == "resolution":
+            match = re.fullmatch(r"(?:(\d+)x)?(\d+)p?", value)
+            if not match:
+                raise ValueError(f"无效的分辨率: {value}")
+            width = int(match.group(1)) if match.group(1) else None
+            return cls(kind, (width, int(match.group(2))))
+        if value:
+            raise ValueError(f"码率策略 {kind} 不需要参数")
+        return cls(kind)
+
+    def __str__(self):
+        if self.kind == "max-bandwidth":
+            return f"max-bandwidth={self.value}"
+        if self.kind == "resolution":
+            width, height = self.value
+            return f"resolution={width}x{height}" if width else f"resolution={height}"
+        return self.kind
+
+
+def parse_variant_policy(spec):
+    """解析码率策略字符串，无效时抛出 ValueError"""
+    return VariantPolicy.parse(spec)
+
+
+def variant_bandwidth(playlist):
+    """变体的码率（bit/s），优先使用 AVERAGE-BANDWIDTH"""
+    info = playlist.stream_info
+    return (info.average_bandwidth or info.bandwidth or 0) if info else 0
+
+
+def variant_resolution(playlist):
+    """变体的分辨率 (width, height)，没有声明时为 None"""
+    info = playlist.stream_info
+    return tuple(info.resolution) if info and info.resolution else None
+
+
+def _rank(playlist):
+    resolution = variant_resolution(playlist) or (0, 0)
+    return variant_bandwidth(playlist), resolution[1]
+
+
+def format_bandwidth(bits_per_second):
+    """如 "2.5 Mbps" """
+    if bits_per_second >= 1000 * 1000:
+        return f"{bits_per_second / 1000 / 1000:.1f} Mbps"
+    return f"{bits_per_second / 1000:.0f} kbps"
+
+
+def describe_variant(playlist):
+    """如 "1280x720 2.5 Mbps" """
+    resolution = variant_resolution(playlist)
+    text = format_bandwidth(variant_bandwidth(playlist))
+    return f"{resolution[0]}x{resolution[1]} {text}" if resolution else text
+
+
+def select_variant(playlists, policy):
+    """
+    按静态策略选择变体（auto 之外的策略）
+
+    Args:
+        playlists: 主播放列表的 playlists
+        policy: VariantPolicy 或策略字符串
+    """
+    policy = VariantPolicy.parse(policy)
+    ranked = sorted(playlists, key=_rank)
+    if policy.kind == "worst":
+        return ranked[0]
+    if policy.kind == "max-bandwidth":
+        fitting = [p for p in ranked if variant_bandwidth(p) <= policy.value]
+        return fitting[-1] if fitting else ranked[0]
+    if policy.kind == "resolution":
+        width, height = policy.value
+        exact = [p for p in ranked if variant_resolution(p) and variant_resolution(p)[1] == height
+                 and (width is None or variant_resolution(p)[0] == width)]
+        if exact:
+            return exact[-1]
+        lower = [p for p in ranked if variant_resolution(p) and variant_resolution(p)[1] <= height]
+        if lower:
+            return max(lower, key=lambda p: (variant_resolution(p)[1], variant_bandwidth(p)))
+        return ranked[0]
+    return ranked[-1]
+
+
+class VariantProbe:
+    """一个候选变体的试下载结果"""
+
+    def __init__(self, playlist, url):
+        self.playlist = playlist
+        self.url = url
+        self.bytes = 0
+        self.seconds = 0.0
+        self.segments = 0
+        self.error = None
+
+    @property
+    def throughput(self):
+        """单个候选的下载速度（bit/s）"""
+        return self.bytes * 8 / self.seconds if self.seconds else 0.0
+
+    def to_dict(self):
+        return {
+            "variant": describe_variant(self.playlist),
+            "bandwidth": variant_bandwidth(self.playlist),
+            "segments": self.segments,
+            "bytes": self.bytes,
+            "throughput": round(self.throughput),
+            "error": str(self.error) if self.error else None,
+        }
+
+
+class VariantChoice:
+    """码率选择结果：选中的变体，以及 auto 策略的实测数据"""
+
+    def __init__(self, playlist, url, policy, throughput=None, probes=()):
+        self.playlist = playlist
+        self.url = url
+        self.policy = policy
+        self.throughput = throughput
+        self.probes = list(probes)
+
+    @property
+    def bandwidth(self):
+        return variant_bandwidth(self.playlist)
+
+    def describe(self):
+        text = f"{describe_variant(self.playlist)}（策略 {self.policy}"
+        if self.throughput:
+            text += f"，实测吞吐 {format_bandwidth(self.throughput)}"
+        return text + "）"
+
+    def report(self):
+        """日志行：auto 策略每个候选的实测速度，以及最终选择"""
+        lines = []
+        for probe in self.probes:
+            if probe.error and not probe.segments:
+                lines.append(f"[!]   {describe_variant(probe.playlist)}: 试下载失败 {probe.error}")
+            else:
+                lines.append(f"[*]   {describe_variant(probe.playlist)}: 试下载 {probe.segments} 个分片，{format_bandwidth(probe.throughput)}")
+        if self.probes:
+            if self.throughput:
+                lines.append(f"[*] 链路吞吐 {format_bandwidth(self.throughput)}")
+            else:
+                lines.append("[!] 试下载全部失败，选择最高码率")
+        lines.append(f"[*] 选择码率: {self.describe()}")
+        return lines
+
+    def to_dict(self):
+        resolution = variant_resolution(self.playlist)
+        return {
+            "policy": str(self.policy),
+            "url": self.url,
+            "bandwidth": self.bandwidth,
+            "resolution": f"{resolution[0]}x{resolution[1]}" if resolution else None,
+            "throughput": round(self.throughput) if self.throughput else None,
+            "probes": [probe.to_dict() for probe in self.probes],
+        }
+
+
+def _probe_segments(playlist):
+    """
+    试下载用的分片及其请求头：点播取开头几个，直播取最新的几个
+
+    省略偏移量的 EXT-X-BYTERANGE 接着同一资源上一个分片，所以要从头计算每个分片的字节范围。
+    """
+    jobs = []
+    ends = {}
+    for segment in playlist.segments:
+        headers = None
+        if segment.byterange:
+            start, length = parse_byterange(segment.byterange, ends.get(segment.uri, 0))
+            ends[segment.uri] = start + length
+            headers = {"Range": f"bytes={start}-{start + length - 1}"}
+        jobs.append((segment, headers))
+    if not playlist.is_endlist:
+        return jobs[-AUTO_PROBE_SEGMENTS:]
+    return jobs[:AUTO_PROBE_SEGMENTS]
+
+
+def probe_variants(candidates, base_url, fetch, concurrency):
+    """
+    并行试下载候选变体
+
+    所有候选的分片放进同一个大小为 concurrency 的线程池下载，与正式下载时的并发
+    条件一致；总字节数除以总耗时作为链路在该并发下的吞吐量。
+
+    Args:
+        candidates: 候选变体列表
+        base_url: 主播放列表URL
+        fetch: fetch(url, headers=None) -> bytes
+        concurrency: 并发请求数
+
+    Returns:
+        (probes, throughput)：每个候选的 VariantProbe，以及链路吞吐量（bit/s）
+    """
+    probes = [VariantProbe(playlist, urljoin(base_url, playlist.uri)) for playlist in candidates]
+
+    def load(probe):
+        try:
+            media = m3u8.loads(fetch(probe.url).decode("utf-8", errors="replace"))
+            return [(probe, segment, headers) for segment, headers in _probe_segments(media)]
+        except Exception as e:
+            probe.error = e
+            return []
+
+    def download(job):
+        probe, segment, headers = job
+        started = time.monotonic()
+        try:
+            data = fetch(urljoin(probe.url, segment.uri), headers)
+        except Exception as e:
+            probe.error = e
+            return 0
+        probe.seconds += time.monotonic() - started
+        probe.bytes += len(data)
+        probe.segments += 1
+        return len(data)
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        jobs = [job for jobs in executor.map(load, probes) for job in jobs]
+        started = time.monotonic()
+        total = sum(executor.map(download, jobs))
+        elapsed = time.monotonic() - started
+    throughput = total * 8 / elapsed if total and elapsed > 0 else 0.0
+    return probes, throughput
+
+
+def choose_variant(playlists, policy, base_url, fetch=None, concurrency=1):
+    """
+    按策略选择变体
+
+    Args:
+        playlists: 主播放列表的 playlists
+        policy: VariantPolicy 或策略字符串
+        base_url: 主播放列表URL
+        fetch: auto 策略试下载用的 fetch(url, headers=None) -> bytes
+        concurrency: auto 策略试下载的并发请求数（与正式下载一致）
+
+    Returns:
+        VariantChoice；auto 策略试下载全部失败时按 best 选择
+    """
+    policy = VariantPolicy.parse(policy)
+    if policy.kind != "auto" or fetch is None or len(playlists) == 1:
+        playlist = select_variant(playlists, policy)
+        return VariantChoice(playlist, urljoin(base_url, playlist.uri), policy)
+
+    ranked = sorted(playlists, key=_rank)
+    candidates = ranked[-AUTO_CANDIDATES:]
+    probes, throughput = probe_variants(candidates, base_url, fetch, concurrency)
+    if not throughput:
+        playlist = ranked[-1]
+    else:
+        fitting = [p for p in ranked if variant_bandwidth(p) <= throughput * AUTO_HEADROOM]
+        playlist = fitting[-1] if fitting else ranked[0]
+    return VariantChoice(playlist, urljoin(base_url, playlist.uri), policy, throughput, probes)
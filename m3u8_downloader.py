@@ -7,21 +7,49 @@ M3U8视频下载器
 
 import os
 import sys
+import time
 import argparse
-import requests
+import asyncio
+import multiprocessing
 import m3u8
 import http.cookiejar
 from urllib.parse import urljoin, urlparse
 from pathlib import Path
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
 from tqdm import tqdm
 from datetime import datetime
 from Crypto.Cipher import AES
 from Crypto.Util.Padding import unpad
 
+from hls_core import create_session, get_shared_session, session_stats
+from hls_core import AsyncSegmentEngine, asyncio_available, ENGINES, ENGINE_THREAD, ENGINE_ASYNCIO
+from hls_core import OrderedSegmentWriter, DEFAULT_STREAM_BUFFER, copy_file_into
+from hls_core import FFmpegProcess, ffmpeg_available, format_seconds
+from hls_core import TSRemuxer
+from hls_core import SegmentSink, SEGMENT_CHUNK_SIZE, StreamingDecryptor, segment_iv, absolute_url, segment_file_name
+from hls_core import shared_key_cache, get_decrypt_pool
+from hls_core import AdaptiveLimiter
+from hls_core import RetryPolicy, RetryStats
+from hls_core import SegmentManifest, temp_dir_name
+from hls_core import RangeJob, RangeReceiver, plan_range_jobs, count_range_jobs, parse_byterange, response_offset, DEFAULT_MAX_RANGE_REQUEST
+from hls_core import LivePlaylist
+from hls_core import InitSectionCache, init_section_of, range_header
+from hls_core import PlaybackScheduler, job_indices
+from hls_core import ParallelRangeDownload, split_size, DEFAULT_SEGMENT_CONNECTIONS, DEFAULT_SPLIT_THRESHOLD
+from hls_core import HedgeTracker, watching, DEFAULT_HEDGE_FRACTION
+from hls_core import choose_variant, parse_variant_policy, DEFAULT_VARIANT_POLICY
+from hls_core import equivalent_variants, load_mirrors, SegmentTable, stream_playlist
+
 
 class M3U8Downloader:
-    def __init__(self, url, output_dir="downloads", output_name=None, max_workers=10, cookies=None, cookies_from_browser=None):
+    def __init__(self, url, output_dir="downloads", output_name=None, max_workers=10, cookies=None, cookies_from_browser=None,
+                 pool_size=None, shared_session=False, engine=ENGINE_THREAD,
+                 stream_merge=False, stream_buffer=DEFAULT_STREAM_BUFFER, key_cache=None,
+                 decrypt_processes=0, adaptive=False, retry_policy=None,
+                 max_range_request=DEFAULT_MAX_RANGE_REQUEST, live=False, live_duration=None,
+                 variant=DEFAULT_VARIANT_POLICY, lookahead=None,
+                 segment_connections=DEFAULT_SEGMENT_CONNECTIONS, split_threshold=DEFAULT_SPLIT_THRESHOLD,
+                 ffmpeg_pipe=False, hedge_fraction=DEFAULT_HEDGE_FRACTION, use_mirrors=True):
         """
         初始化M3U8下载器
 
@@ -30,10 +58,55 @@ class M3U8Downloader:
             output_dir: 输出目录
             output_name: 输出文件名（不含扩展名）
             max_workers: 最大并发下载数
+            pool_size: 每个主机的连接池大小（默认与并发数相同）
+            shared_session: 是否使用进程级共享连接池
+            engine: 分片下载引擎，thread（线程池）或 asyncio（事件循环）
+            stream_merge: 边下载边按序写入输出文件，不再单独合并
+            stream_buffer: 流式合并时乱序分片的内存缓冲上限（字节）
+            key_cache: 密钥缓存（KeyCache），默认使用进程级共享缓存
+            decrypt_processes: 解密进程数，大于0时AES解密交给独立进程（多核解密）
+            adaptive: 自适应并发，max_workers 作为上限，按吞吐量和延迟自动调整
+            retry_policy: 重试策略（RetryPolicy），播放列表、密钥和分片请求共用
+            max_range_request: EXT-X-BYTERANGE 分片合并请求的大小上限（字节），0 表示不合并
+            live: 直播录制模式，周期刷新播放列表直到 EXT-X-ENDLIST、达到时长上限或用户中断
+            live_duration: 直播录制时长上限（秒），None 表示不限
+            variant: 多码率播放列表的码率选择策略（best、worst、max-bandwidth=N、resolution=WxH、auto）
+            lookahead: 按播放顺序下载时最多领先最小未完成分片多少个分片，None 表示并发数的8倍
+            segment_connections: 超大分片拆成多少个 Range 请求并行下载，1 表示不拆分
+            split_threshold: 超过多大（字节）的分片才拆分
+            ffmpeg_pipe: 下载开始时启动 ffmpeg，分片按序写入其标准输入，下载与封装同时进行
+            hedge_fraction: 对耗时明显偏长的分片发起对冲请求，上限占分片数的比例，0 表示关闭
+            use_mirrors: 主播放列表中同一码率有多条线路（冗余流）时，分片请求分摊到各线路并自动切换
         """
         self.url = url
         self.output_dir = Path(output_dir)
         self.max_workers = max_workers
+        self.adaptive = adaptive
+        self.limiter = None
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.retry_stats = RetryStats()
+        self.max_range_request = max_range_request
+        self.live = live
+        self.live_duration = live_duration
+        self.variant_policy = parse_variant_policy(variant)
+        self.variant_choice = None
+        self.lookahead = lookahead
+        self.scheduler = None
+        # 下载过程中接收播放列表或获取初始化段的错误
+        self.source_error = None
+        self.segment_connections = segment_connections
+        self.split_threshold = split_threshold
+        self.hedge_fraction = hedge_fraction
+        self.hedger = None
+        self.use_mirrors = use_mirrors
+        self.mirrors = None
+        self.engine = engine
+        self.stream_merge = stream_merge
+        self.ffmpeg_pipe = ffmpeg_pipe
+        self.ffmpeg = None
+        self.media_duration = 0.0
+        self.stream_buffer = stream_buffer
+        self.segment_writer = None
         self.cookies_file = None
         self.cookies_from_browser = None
         self.cookies_from_browser_spec = None
@@ -90,26 +163,52 @@ class M3U8Downloader:
                 self.output_name = None
         else:
             if output_name:
-                self.output_name = f"{output_name}_{timestamp}"
+                base_name = output_name
             else:
                 # 从URL中提取文件名
                 parsed_url = urlparse(url)
                 base_name = Path(parsed_url.path).stem or "video"
-                self.output_name = f"{base_name}_{timestamp}"
+            self.output_name = f"{base_name}_{timestamp}"
 
         # 创建临时目录存储ts分片（仅针对M3U8下载）
+        # 目录名不含时间戳，重新运行同一命令时可以从清单继续下载
         self.temp_dir = None
+        self.manifest = None
         if not self.is_youtube:
-            self.temp_dir = self.output_dir / f"{self.output_name}_temp"
+            self.temp_dir = self.output_dir / temp_dir_name(base_name, url)
             self.temp_dir.mkdir(exist_ok=True)
+            self.manifest = SegmentManifest(self.temp_dir)
 
         # 设置请求头
         self.headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
         }
 
-        # 密钥缓存
-        self.key_cache = {}
+        # 连接池会话，复用TCP/TLS连接
+        self.pool_size = pool_size or max_workers
+        self.shared_session = shared_session
+        if shared_session:
+            self.session = get_shared_session(self.pool_size)
+        else:
+            self.session = create_session(self.pool_size)
+
+        # 密钥缓存（进程级共享，同一密钥只下载一次）
+        self.key_cache = key_cache if key_cache is not None else shared_key_cache
+
+        # 解密进程池（可选），避免解密与网络读取在同一进程内争抢GIL
+        self.decrypt_pool = get_decrypt_pool(decrypt_processes)
+
+        # fMP4 初始化段（EXT-X-MAP）：按 URI 和字节范围缓存，分片序号 -> InitSection
+        self.init_cache = InitSectionCache()
+        self.init_sections = {}
+
+    def close_session(self):
+        """关闭私有连接池（共享连接池由进程内其他任务继续使用）"""
+        handshakes, resumed = session_stats(self.session)
+        if handshakes:
+            print(f"[*] TLS握手 {handshakes} 次，其中会话恢复 {resumed} 次")
+        if not self.shared_session:
+            self.session.close()
 
     @staticmethod
     def _parse_cookies_from_browser(spec):
@@ -167,23 +266,51 @@ class M3U8Downloader:
         """下载并解析m3u8播放列表"""
         print(f"[*] 正在获取M3U8播放列表: {self.url}")
         try:
-            response = requests.get(self.url, headers=self.headers, timeout=30, cookies=self.cookie_jar)
-            response.raise_for_status()
+            response = self.fetch(self.url, stream=True)
 
-            # 解析m3u8
-            playlist = m3u8.loads(response.text)
-
-            # 如果是主播放列表，选择第一个变体
-            if playlist.is_variant:
-                print("[*] 检测到多码率播放列表，选择第一个播放列表")
-                variant_url = urljoin(self.url, playlist.playlists[0].uri)
-                print(f"[*] 使用播放列表: {variant_url}")
-                response = requests.get(variant_url, headers=self.headers, timeout=30, cookies=self.cookie_jar)
-                response.raise_for_status()
+            # 解析m3u8：点播媒体播放列表边接收边解析，解析出第一个分片就开始下载
+            if self.live:
                 playlist = m3u8.loads(response.text)
-                self.url = variant_url  # 更新基础URL
+            else:
+                table, playlist = stream_playlist(response, self.url)
+                if table is not None:
+                    return table
 
-            return playlist
+            # 如果是主播放列表，按码率策略选择变体
+            if playlist.is_variant:
+                print(f"[*] 检测到多码率播放列表（{len(playlist.playlists)} 个码率），策略: {self.variant_policy}")
+                if self.variant_policy.kind == "auto":
+                    print(f"[*] 正在以 {self.max_workers} 个并发试下载候选码率...")
+                choice = choose_variant(playlist.playlists, self.variant_policy, self.url,
+                                        self._probe_fetch, self.max_workers)
+                for line in choice.report():
+                    print(line)
+                self.variant_choice = choice
+                if self.live:
+                    # 直播录制只使用一条线路
+                    print(f"[*] 使用播放列表: {choice.url}")
+                    self.url = choice.url  # 更新基础URL
+                    return m3u8.loads(self.fetch(choice.url).text)
+
+                # 同一码率的冗余流作为镜像线路，需要比对各线路的分片列表，完整获取后再解析
+                urls = [choice.url]
+                if self.use_mirrors:
+                    urls = [urljoin(self.url, p.uri) for p in equivalent_variants(playlist.playlists, choice.playlist)]
+                if len(urls) == 1:
+                    print(f"[*] 使用播放列表: {choice.url}")
+                    self.url = choice.url  # 更新基础URL
+                    table, playlist = stream_playlist(self.fetch(choice.url, stream=True), choice.url)
+                    return table if table is not None else SegmentTable.from_playlist(playlist, choice.url)
+                table, mirrors = load_mirrors(urls, lambda url: self.fetch(url).text)
+                for line in mirrors.describe():
+                    print(line)
+                self.mirrors = mirrors if len(mirrors) > 1 else None
+                print(f"[*] 使用播放列表: {mirrors.primary.url}")
+                self.url = mirrors.primary.url  # 更新基础URL
+                return table
+
+            # 直播录制每次刷新重新解析；点播（流式解析没有找到分片时）降为分片表，m3u8 的对象模型随之释放
+            return playlist if self.live else SegmentTable.from_playlist(playlist, self.url)
         except Exception as e:
             print(f"[!] 获取M3U8播放列表失败: {e}")
             sys.exit(1)
@@ -201,16 +328,10 @@ class M3U8Downloader:
         if not key_obj or key_obj.method == 'NONE' or not key_obj.uri:
             return None, None
 
-        # 检查缓存
-        if key_obj.uri in self.key_cache:
-            return self.key_cache[key_obj.uri]
-
         try:
-            # 下载密钥
-            key_url = urljoin(self.url, key_obj.uri)
-            response = requests.get(key_url, headers=self.headers, timeout=30, cookies=self.cookie_jar)
-            response.raise_for_status()
-            key_bytes = response.content
+            # 从缓存获取密钥，并发请求同一密钥时只下载一次
+            key_url = absolute_url(key_obj, self.url)
+            key_bytes = self.key_cache.get(key_url, lambda: self._fetch_key(key_url))
 
             # 获取IV
             if key_obj.iv:
@@ -221,14 +342,63 @@ class M3U8Downloader:
                 # 如果没有指定IV，使用序列号作为IV（根据HLS规范）
                 iv_bytes = None
 
-            # 缓存密钥
-            self.key_cache[key_obj.uri] = (key_bytes, iv_bytes)
             return key_bytes, iv_bytes
 
         except Exception as e:
             print(f"[!] 获取解密密钥失败: {e}")
             return None, None
 
+    def fetch(self, url, timeout=30, headers=None, stream=False):
+        """按重试策略请求URL，返回响应对象；stream 为 True 时只读取响应头，内容由调用方逐块读取"""
+        if headers:
+            headers = {**self.headers, **headers}
+        def request():
+            response = self.session.get(url, headers=headers or self.headers, timeout=timeout, cookies=self.cookie_jar,
+                                        stream=stream)
+            response.raise_for_status()
+            return response
+        return self.retry_policy.call(request, self.retry_stats)
+
+    def _probe_fetch(self, url, headers=None):
+        """码率试下载用的请求，不重试，返回响应内容"""
+        response = self.session.get(url, headers={**self.headers, **(headers or {})}, timeout=30, cookies=self.cookie_jar)
+        response.raise_for_status()
+        return response.content
+
+    def _fetch_key(self, key_url):
+        """下载密钥"""
+        return self.fetch(key_url).content
+
+    def load_init_sections(self, segments):
+        """
+        获取分片引用的 EXT-X-MAP 初始化段
+
+        每个初始化段（按 URI 和字节范围区分）只下载、解密一次，记录到 init_sections，
+        合并时写在使用它的第一个分片之前。
+
+        Args:
+            segments: [(index, segment), ...]
+        """
+        for index, segment in segments:
+            ref = init_section_of(segment, self.url)
+            if ref is not None:
+                url, byterange = ref
+                self.init_sections[index] = self.init_cache.get(
+                    url, byterange, lambda: self._fetch_init_section(url, byterange, segment, index))
+
+    def _fetch_init_section(self, url, byterange, segment, index):
+        """下载初始化段；分片加密时初始化段使用同一个密钥（按 RFC 8216 应带显式 IV）"""
+        response = self.fetch(url, headers=range_header(byterange) if byterange else None)
+        data = response.content
+        if byterange and response.status_code != 206:
+            # 服务器忽略了 Range，返回整个文件
+            start, length = parse_byterange(byterange)
+            data = data[start:start + length]
+        if segment.key:
+            key_bytes, iv_bytes = self.get_decrypt_key(segment.key)
+            data = self.decrypt_segment(data, key_bytes, iv_bytes, getattr(segment, 'iv_sequence', index))
+        return data
+
     def decrypt_segment(self, data, key_bytes, iv_bytes, segment_index):
         """
         解密TS分片
@@ -267,12 +437,38 @@ class M3U8Downloader:
             print(f"[!] 解密分片失败: {e}")
             return data
 
-    def download_segment(self, segment_info):
+    def open_segment_sink(self, index, file_path, segment, in_memory=None):
+        """
+        创建分片写入端
+
+        加密分片在接收时按16字节块增量解密；流式合并模式下在内存中收集分片内容。
+        in_memory 为 False 时总是写入磁盘（超大分片不在内存中收集）。
+        """
+        decryptor = None
+        offload = None
+        if segment.key:
+            key_bytes, iv_bytes = self.get_decrypt_key(segment.key)
+            # 低延迟直播的单元连续编号，默认IV取所属分片的媒体序号
+            iv = segment_iv(iv_bytes, getattr(segment, 'iv_sequence', index))
+            if key_bytes and self.decrypt_pool:
+                offload = self.decrypt_pool.open(key_bytes, iv)
+            elif key_bytes:
+                try:
+                    decryptor = StreamingDecryptor(key_bytes, iv)
+                except ValueError as e:
+                    print(f"[!] 解密分片失败: {e}")
+        if in_memory is None:
+            in_memory = self.segment_writer is not None
+        return SegmentSink(file_path, decryptor, in_memory=in_memory, offload=offload)
+
+    def download_segment(self, segment_info, race=None, hedge=False):
         """
         下载单个ts分片
 
         Args:
             segment_info: (index, segment) 元组，segment是m3u8.Segment对象
+            race: 对冲时原请求与对冲请求共用的 SegmentRace
+            hedge: 是否为对冲请求（写入单独的临时文件，胜出后再改名）
 
         Returns:
             (index, success, file_path) 元组
@@ -280,76 +476,493 @@ class M3U8Downloader:
         index, segment = segment_info
 
         # 构建完整的URL
-        segment_url = urljoin(self.url, segment.uri)
+        segment_url = absolute_url(segment, self.url)
 
         # 生成本地文件名
-        file_path = self.temp_dir / f"segment_{index:05d}.ts"
+        file_path = self.temp_dir / segment_file_name(index)
+        sink_path = file_path.with_name(f"{file_path.name}.hedge") if hedge else file_path
 
-        # 如果文件已存在，跳过下载
-        if file_path.exists():
+        # 清单中登记过的完整分片直接跳过（断点续传）
+        if not hedge and self.manifest.is_done(index, segment_url, file_path):
+            self.store_segment(index, file_path)
             return (index, True, file_path)
 
-        # 尝试下载，最多重试3次
-        for attempt in range(3):
+        # 按重试策略下载，可重试的错误之间指数退避；中断的传输用 Range 续传
+        # 有镜像线路时每次尝试选择预计最快的线路，失败后换一条还没失败过的线路立即重试
+        sink = None
+        split = None
+        failed = set()
+        for attempt in range(self.retry_policy.attempts):
+            if race and race.lost(hedge):
+                break
+            # 自适应并发时每次尝试都要先取得名额
+            token = self.limiter.acquire() if self.limiter else None
+            mirror = self.mirrors.acquire(failed) if self.mirrors else None
+            request_url = mirror.segment_url(index, segment) if mirror else segment_url
+            ok = False
+            nbytes = 0
+            ttfb = None
+            error = None
+            started = time.monotonic()
             try:
-                response = requests.get(segment_url, headers=self.headers, timeout=30, cookies=self.cookie_jar)
-                response.raise_for_status()
+                headers = self.headers
+                resume = sink.resume_headers() if sink else None
+                if resume:
+                    headers = {**self.headers, **resume}
+
+                with self.session.get(request_url, headers=headers, timeout=30, cookies=self.cookie_jar, stream=True) as response, \
+                        watching(race, hedge, response):
+                    ttfb = time.monotonic() - started
+                    response.raise_for_status()
+                    if sink is None:
+                        split = split_size(response.status_code, response.headers,
+                                           self.segment_connections, self.split_threshold)
+                        if split:
+                            # 超大分片：不读取这个响应，改用多个 Range 请求并行下载
+                            # （对冲请求直接放弃，原请求已在并行下载）
+                            ok = True
+                            break
+                    if sink and not (resume and sink.continues(response.status_code, response.headers)):
+                        # 服务器忽略了 Range 或资源已变化，从头下载
+                        sink.abort()
+                        sink = None
+                    if sink is None:
+                        # 边接收边解密写入，内存中只保留一个数据块
+                        sink = self.open_segment_sink(index, sink_path, segment)
+                        sink.begin(response.headers)
+                    else:
+                        self.retry_stats.record_resume(sink.bytes_received)
+                    for chunk in response.iter_content(SEGMENT_CHUNK_SIZE):
+                        if race and race.lost(hedge):
+                            raise IOError("对冲的另一方已完成")
+                        sink.write(chunk)
+                        nbytes += len(chunk)
+
+                # 对冲中先登记胜出，落败的一方不再写入分片文件
+                if race and not race.claim(hedge):
+                    break
+                # 保存文件，写入磁盘的分片登记到清单
+                data = sink.finish()
+                if data is None and sink_path != file_path:
+                    os.replace(sink_path, file_path)
+                self.store_segment(index, file_path, data)
+                if data is None:
+                    self.manifest.mark_done(index, segment_url, sink.bytes_written, sink.crc32, sink.expected_size)
+
+                ok = True
+                return (index, True, file_path)
+            except Exception as e:
+                error = e
+            finally:
+                if self.limiter:
+                    self.limiter.release(token, ok or bool(race and race.lost(hedge)), nbytes, ttfb)
+                if mirror:
+                    self.mirrors.release(mirror, nbytes, time.monotonic() - started,
+                                         None if race and race.lost(hedge) else ok)
+
+            if race and race.lost(hedge):
+                break
+            # 等待前已归还并发名额；能续传的写入端留给下一次尝试
+            delay = self.retry_policy.backoff(error, attempt, self.retry_stats)
+            if mirror:
+                failed.add(mirror)
+                # 还有没失败过的线路时立即换线，404 等不再重试的错误也换线
+                if attempt + 1 < self.retry_policy.attempts and self.mirrors.untried(failed):
+                    delay = 0
+            if sink and (delay is None or not sink.resume_headers()):
+                sink.abort()
+                sink = None
+            if delay is None:
+                print(f"\n[!] 下载分片 {index} 失败: {error}")
+                return (index, False, None)
+            time.sleep(delay)
+
+        if sink:
+            sink.abort()
+        if split and not hedge:
+            return self.download_segment_parallel(index, segment, segment_url, file_path, split)
+        return (index, False, None)
+
+    def download_segment_parallel(self, index, segment, segment_url, file_path, size):
+        """
+        多连接下载一个超大分片
+
+        分成 segment_connections 个 Range 请求并行写入同一个临时文件的对应偏移，
+        每段按重试策略单独重试，每个请求各占一个并发名额。不加密的分片下载完直接改名为分片文件；
+        加密分片按顺序整体解密写入分片文件。分片总是留在磁盘上，流式合并时把文件交给写入器。
 
-                data = response.content
+        Returns:
+            (index, success, file_path) 元组
+        """
+        def open_response(headers):
+            return self.session.get(segment_url, headers={**self.headers, **headers}, timeout=30,
+                                    cookies=self.cookie_jar, stream=True)
+
+        download = ParallelRangeDownload(segment_url, size, f"{file_path}.multi", self.segment_connections,
+                                         open_response, self.retry_policy, self.retry_stats, limiter=self.limiter)
+        print(f"\n[*] 分片 {index} 大小 {size / 1024 / 1024:.0f} MB，使用 {len(download.parts)} 个连接并行下载")
+        sink = None
+        try:
+            download.run()
+            if download.ranges_ignored:
+                print(f"\n[*] 服务器忽略了 Range 请求，分片 {index} 改为单连接下载")
+            key_bytes = self.get_decrypt_key(segment.key)[0] if segment.key else None
+            if key_bytes:
+                sink = self.open_segment_sink(index, file_path, segment, in_memory=False)
+                sink.expect(size)
+                for chunk in download.read_chunks():
+                    sink.write(chunk)
+                sink.finish()
+                written, crc32 = sink.bytes_written, sink.crc32
+            else:
+                # 不需要解密，省去再读写一遍；CRC32 需要重新读取整个文件，不再计算
+                os.replace(download.path, file_path)
+                written, crc32 = size, None
+            self.store_segment(index, file_path)
+            self.manifest.mark_done(index, segment_url, written, crc32, size)
+            return (index, True, file_path)
+        except Exception as e:
+            if sink:
+                sink.abort()
+            print(f"\n[!] 下载分片 {index} 失败: {e}")
+            return (index, False, None)
+        finally:
+            download.remove()
+
+    def download_job(self, job, race=None, hedge=False):
+        """
+        下载一个任务（单个分片或合并的字节范围请求），返回其中每个分片的结果
 
-                # 检查是否需要解密
-                if segment.key:
-                    key_bytes, iv_bytes = self.get_decrypt_key(segment.key)
-                    if key_bytes:
-                        data = self.decrypt_segment(data, key_bytes, iv_bytes, index)
+        对冲中的分片只由胜出的一方（或双方都失败时最后退出的一方）报告结果，另一方返回空列表。
+        """
+        if isinstance(job, RangeJob):
+            return self.download_range_job(job)
+        result = self.download_segment(job, race, hedge)
+        if race and not result[1] and not race.give_up(hedge):
+            return []
+        return [result]
+
+    def download_range_job(self, job):
+        """
+        下载一组 EXT-X-BYTERANGE 分片
 
-                # 保存文件
-                with open(file_path, 'wb') as f:
-                    f.write(data)
+        同一资源上首尾相接的分片用一次 Range 请求获取，响应按分片切开后分别解密保存；
+        失败重试时只请求尚未完成的分片。
 
-                return (index, True, file_path)
+        Returns:
+            [(index, success, file_path), ...]
+        """
+        results = {}
+        pending = []
+        for member in job.members:
+            file_path = self.temp_dir / segment_file_name(member.index)
+            if self.manifest.is_done(member.index, job.url, file_path):
+                self.store_segment(member.index, file_path)
+                results[member.index] = (member.index, True, file_path)
+            else:
+                pending.append(member)
+
+        attempt = 0
+        while pending:
+            token = self.limiter.acquire() if self.limiter else None
+            ok = False
+            nbytes = 0
+            ttfb = None
+            error = None
+            receiver = None
+            try:
+                start = pending[0].start
+                headers = {**self.headers, 'Range': f'bytes={start}-{pending[-1].end - 1}'}
+                started = time.monotonic()
+                with self.session.get(job.url, headers=headers, timeout=30, cookies=self.cookie_jar, stream=True) as response:
+                    ttfb = time.monotonic() - started
+                    response.raise_for_status()
+                    offset = response_offset(response.status_code, response.headers, start)
+                    receiver = RangeReceiver(pending, offset, self._open_range_sink)
+                    for chunk in response.iter_content(SEGMENT_CHUNK_SIZE):
+                        nbytes += len(chunk)
+                        for member in receiver.feed(chunk):
+                            results[member.index] = self._finish_range_member(member, job.url, receiver.take(member))
+                        # 服务器忽略 Range 返回整个文件时，收够即停
+                        if receiver.done:
+                            break
+                if not receiver.done:
+                    raise IOError(f"字节范围响应不完整: {receiver.offset}/{receiver.end}")
+                ok = True
             except Exception as e:
-                if attempt == 2:  # 最后一次尝试
-                    print(f"\n[!] 下载分片 {index} 失败: {e}")
-                    return (index, False, None)
+                error = e
+                if receiver:
+                    receiver.abort()
+            finally:
+                if self.limiter:
+                    self.limiter.release(token, ok, nbytes, ttfb)
+
+            remaining = [member for member in pending if member.index not in results]
+            # 这次请求已收完部分分片，只是后面断开，不计入失败次数
+            if len(remaining) < len(pending):
+                attempt = 0
+            pending = remaining
+            if not pending:
+                break
+            delay = self.retry_policy.backoff(error, attempt, self.retry_stats)
+            if delay is None:
+                print(f"\n[!] 下载分片 {pending[0].index}-{pending[-1].index} 失败: {error}")
+                break
+            time.sleep(delay)
+            attempt += 1
+
+        for member in pending:
+            results[member.index] = (member.index, False, None)
+        return [results[member.index] for member in job.members]
+
+    def _open_range_sink(self, member):
+        file_path = self.temp_dir / segment_file_name(member.index)
+        sink = self.open_segment_sink(member.index, file_path, member.segment)
+        sink.expect(member.length)
+        return sink
+
+    def _finish_range_member(self, member, url, sink):
+        """保存字节范围请求中接收完整的一个分片"""
+        file_path = self.temp_dir / segment_file_name(member.index)
+        try:
+            data = sink.finish()
+        except Exception:
+            sink.abort()
+            raise
+        self.store_segment(member.index, file_path, data)
+        if data is None:
+            self.manifest.mark_done(member.index, url, sink.bytes_written, sink.crc32, member.length)
+        return (member.index, True, file_path)
+
+    def store_segment(self, index, file_path, data=None):
+        """
+        保存分片
 
-        return (index, False, None)
+        流式合并模式下直接交给按序写入器（连同 fMP4 初始化段），否则写入临时文件。
+        data 为 None 表示分片文件已在磁盘上（断点续传、多连接下载的超大分片）。
+        """
+        if self.segment_writer:
+            init = self.init_sections.pop(index, None)
+            if data is None:
+                self.segment_writer.submit(index, path=file_path, init=init)
+            else:
+                self.segment_writer.submit(index, data, init=init)
+        elif data is not None:
+            with open(file_path, 'wb') as f:
+                f.write(data)
 
-    def download_all_segments(self, playlist):
+    def count_ranges(self, playlist):
+        """统计 EXT-X-BYTERANGE 合并请求，返回 (请求数, 分片数)；遍历整个分片表，流式解析时在解析线程中调用"""
+        return count_range_jobs(plan_range_jobs(enumerate(playlist), self.url, self.max_range_request))
+
+    def describe_playlist(self, playlist, range_counts=None):
         """
-        并发下载所有ts分片
+        输出分片总数、加密和字节范围合并等播放列表信息（流式解析时在解析完成后调用）
 
         Args:
-            playlist: m3u8播放列表对象
+            playlist: 点播播放列表的 SegmentTable
+            range_counts: 已算好的 count_ranges() 结果，None 时在这里统计
         """
-        segments = [(i, seg) for i, seg in enumerate(playlist.segments)]
-        total_segments = len(segments)
+        self.media_duration = playlist.duration
 
         # 检查是否有加密
-        has_encryption = any(seg.key for seg in playlist.segments)
-        if has_encryption:
+        if playlist.encrypted:
             print(f"[*] 检测到加密内容，将自动解密")
 
-        print(f"[*] 共有 {total_segments} 个分片需要下载")
-        print(f"[*] 使用 {self.max_workers} 个线程并发下载")
+        print(f"[*] 共有 {len(playlist)} 个分片需要下载")
+        if not playlist.is_endlist and (playlist.playlist_type or '').lower() != 'vod':
+            print("[*] 播放列表没有 EXT-X-ENDLIST，可能是直播流，只能下载当前已有的分片（使用 --live 持续录制）")
 
-        # 存储下载结果
-        results = []
+        # EXT-X-BYTERANGE 分片按资源合并为较大的 Range 请求；任务在调度时才逐个生成，这里只统计
+        range_jobs, range_segments = range_counts or self.count_ranges(playlist)
+        if range_jobs:
+            print(f"[*] 检测到 EXT-X-BYTERANGE: {range_segments} 个分片合并为 {range_jobs} 个请求")
 
-        # 使用线程池并发下载
-        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-            # 提交所有任务
-            futures = {executor.submit(self.download_segment, seg): seg for seg in segments}
+    def iter_segments(self, playlist):
+        """
+        按播放顺序逐个取出分片，同时获取分片引用的 EXT-X-MAP 初始化段
 
-            # 使用tqdm显示进度
-            with tqdm(total=total_segments, desc="下载进度", unit="片") as pbar:
-                for future in as_completed(futures):
-                    result = future.result()
-                    results.append(result)
-                    pbar.update(1)
+        fMP4 分片的初始化段在交出第一个引用它的分片前获取，合并时只写一次。需要等待时
+        （播放列表还在后台解析、初始化段正在后台线程下载）交出 concurrent.futures.Future，
+        调度循环等它完成后再取，不会阻塞在这里。接收播放列表或获取初始化段出错时
+        记录到 source_error，不再交出后面的分片。
+        """
+        segments = playlist.iter_parsed()
+        index = 0
+        executor = None
+        try:
+            while True:
+                try:
+                    segment = next(segments)
+                except StopIteration:
+                    return
+                except Exception as e:
+                    self.source_error = f"接收播放列表失败: {e}"
+                    return
+                if isinstance(segment, Future):
+                    yield segment
+                    continue
+                try:
+                    ref = init_section_of(segment, self.url)
+                    if ref is None or self.init_cache.cached(*ref):
+                        self.load_init_sections([(index, segment)])
+                    else:
+                        # 初始化段（可能还要先取密钥）在后台线程下载，调度循环不等它
+                        if executor is None:
+                            executor = ThreadPoolExecutor(max_workers=1)
+                        future = executor.submit(self.load_init_sections, [(index, segment)])
+                        yield future
+                        future.result()
+                except Exception as e:
+                    self.source_error = f"下载初始化段（EXT-X-MAP）失败: {e}"
+                    return
+                yield index, segment
+                index += 1
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=False)
+
+    def download_all_segments(self, playlist):
+        """
+        并发下载所有ts分片
+
+        Args:
+            playlist: 点播播放列表的 SegmentTable；PlaylistStream 还在后台解析时先下载已解析的分片，
+                      解析完成后再补全分片总数
+        """
+        streaming = not playlist.complete
+        if streaming:
+            print(f"[*] 播放列表边接收边解析，已解析 {len(playlist)} 个分片，先开始下载")
+        else:
+            self.describe_playlist(playlist)
+        if self.manifest.completed:
+            print(f"[*] 断点续传: 清单中已有 {self.manifest.completed} 个完成的分片")
+
+        engine = self.engine
+        if engine == ENGINE_ASYNCIO and not asyncio_available():
+            print("[!] 未安装 aiohttp，回退到线程池引擎")
+            engine = ENGINE_THREAD
+
+        # 并发名额：不开启自适应时固定为 max_workers，超大分片的多连接下载也从这里取名额
+        self.limiter = AdaptiveLimiter(self.max_workers, adaptive=self.adaptive)
+        if self.adaptive:
+            print(f"[*] 自适应并发，上限 {self.max_workers}")
+
+        # 按播放顺序调度：正在下载的分片集中在开头未完成的位置附近，输出从头连续可用；
+        # 任务按需从播放列表生成，排队和进行中的任务不超过预读窗口
+        jobs = plan_range_jobs(self.iter_segments(playlist), self.url, self.max_range_request)
+        self.scheduler = PlaybackScheduler(jobs, self.max_workers, self.lookahead, total=len(playlist))
+        # 尾部对冲：耗时明显偏长的分片再发一个相同的请求，先完成的为准；分片总数确定前不对冲
+        self.hedger = (HedgeTracker(0 if streaming else len(playlist), self.max_workers, self.hedge_fraction)
+                       if self.hedge_fraction > 0 else None)
+        # 流式解析时，字节范围合并的统计在解析完成后由解析线程算好，调度循环中只输出结果
+        range_counts = playlist.after_parsed(self.count_ranges) if streaming else None
+
+        def playlist_parsed():
+            """播放列表解析完成：输出播放列表信息，补全分片总数；解析出错时返回 False"""
+            nonlocal streaming
+            streaming = False
+            if playlist.error is not None:
+                return False
+            print()
+            self.describe_playlist(playlist, range_counts.result())
+            self.scheduler.total = len(playlist)
+            if self.hedger:
+                self.hedger.set_total(len(playlist))
+            return True
+
+        def update_progress(pbar):
+            if streaming and range_counts.done() and playlist_parsed():
+                pbar.total = len(playlist)
+            pbar.update(1)
+            postfix = f"连续 {self.ready_bytes() / 1024 / 1024:.1f} MB"
+            if self.ffmpeg:
+                postfix += f"，已封装 {format_seconds(self.ffmpeg.progress.out_time)}"
+            if self.adaptive:
+                postfix += f"，并发 {self.limiter.limit}"
+            pbar.set_postfix_str(postfix)
+
+        if engine == ENGINE_ASYNCIO:
+            print(f"[*] 使用 asyncio 引擎，{self.max_workers} 个并发请求")
+            with tqdm(total=None if streaming else len(playlist), desc="下载进度", unit="片") as pbar:
+                async_engine = AsyncSegmentEngine(
+                    self, self.max_workers,
+                    log=lambda message: print(f"\n{message}"),
+                    on_result=lambda result: update_progress(pbar),
+                    limiter=self.limiter, hedger=self.hedger
+                )
+                failed = asyncio.run(async_engine.run(jobs, self.scheduler))
+        else:
+            print(f"[*] 使用 {self.max_workers} 个线程并发下载")
+
+            # 只保留失败的结果，内存占用与分片总数无关
+            failed = []
+
+            # 使用线程池并发下载，同时进行的任务不超过线程数，空出名额时按播放顺序补充；
+            # 对冲请求使用额外的线程，落败的请求在下一个数据块处自行结束，不再等待
+            hedger = self.hedger
+            executor = ThreadPoolExecutor(max_workers=self.max_workers * 2 if hedger else self.max_workers)
+            try:
+                in_flight = {}
+                with tqdm(total=None if streaming else len(playlist), desc="下载进度", unit="片") as pbar:
+                    while True:
+                        # 另一方已胜出的请求不会再报告结果
+                        for future in [future for future, (race, hedge) in in_flight.items()
+                                       if race and race.lost(hedge)]:
+                            del in_flight[future]
+                        primary = sum(1 for race, hedge in in_flight.values() if not hedge)
+                        for job in self.scheduler.take(self.max_workers - primary):
+                            race = hedger.start(job) if hedger else None
+                            in_flight[executor.submit(self.download_job, job, race)] = (race, False)
+                            primary += 1
+                        if hedger:
+                            for job, race in hedger.due(self.scheduler.pending + primary):
+                                in_flight[executor.submit(self.download_job, job, race, True)] = (race, True)
+                        # 播放列表还在解析或初始化段正在下载时，调度器的 waiting 完成后再取任务；
+                        # 已完成却没被取走说明名额已满，等进行中的任务即可
+                        waiting = self.scheduler.waiting
+                        if not in_flight and waiting is None:
+                            break
+                        waits = [*in_flight, waiting] if waiting is not None and not waiting.done() else in_flight
+                        timeout = hedger.next_check(self.scheduler.pending + primary) if hedger else None
+                        done, _ = wait(waits, timeout=timeout, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            if in_flight.pop(future, None) is None:
+                                continue
+                            for result in future.result():
+                                if hedger:
+                                    hedger.done(result[0])
+                                self.scheduler.complete(result)
+                                if not result[1]:
+                                    failed.append(result)
+                                update_progress(pbar)
+            finally:
+                executor.shutdown(wait=False)
+
+        if streaming and not self.source_error:
+            # 最后几个分片可能在统计算好之前就已完成
+            range_counts.result()
+            playlist_parsed()
+
+        if self.init_sections:
+            print(f"[*] 检测到 fMP4 分片，初始化段 {self.init_cache.fetches} 个，输出为分片MP4（fragmented MP4）")
+        if self.adaptive:
+            limit, peak, decreases = self.limiter.summary()
+            print(f"[*] 自适应并发: 最终 {limit}，峰值 {peak}，退让 {decreases} 次")
+        if self.retry_stats.total:
+            print(f"[*] 重试 {self.retry_stats.total} 次: {self.retry_stats.summary()}")
+        if self.hedger and self.hedger.hedges:
+            print(f"[*] {self.hedger.summary()}")
+        if self.mirrors:
+            print("[*] 各线路下载统计:")
+            for line in self.mirrors.report():
+                print(line)
+
+        if self.source_error:
+            print(f"\n[!] {self.source_error}")
+            return False
 
         # 检查是否所有分片都下载成功
-        failed = [r for r in results if not r[1]]
         if failed:
             print(f"\n[!] 有 {len(failed)} 个分片下载失败")
             return False
@@ -357,35 +970,238 @@ class M3U8Downloader:
         print("[✓] 所有分片下载完成")
         return True
 
-    def merge_segments(self):
+    def ready_bytes(self):
+        """从开头起连续下载完成的字节数（流式合并时为已写入输出文件的字节数）"""
+        if self.segment_writer:
+            return self.segment_writer.bytes_written
+        return self.scheduler.contiguous_bytes if self.scheduler else 0
+
+    def record_live(self, playlist, output_file):
+        """
+        录制直播/事件播放列表
+
+        按目标时长周期刷新播放列表，只把新出现的分片交给线程池，分片按媒体序号
+        顺序边下载边写入输出文件。遇到 EXT-X-ENDLIST、达到时长上限、直播长时间
+        没有新分片或用户按 Ctrl+C 时停止，已下载的部分保留在输出文件中。
+
+        Args:
+            playlist: 首次获取的媒体播放列表
+            output_file: 输出文件路径
+        """
+        tracker = LivePlaylist(self.live_duration)
+        limit_text = f"，时长上限 {self.live_duration} 秒" if self.live_duration else ""
+        print(f"[*] 直播录制模式{limit_text}，按 Ctrl+C 结束录制")
+        if self.engine == ENGINE_ASYNCIO:
+            print("[*] 直播录制使用线程池下载分片")
+
+        self.limiter = AdaptiveLimiter(self.max_workers, adaptive=self.adaptive)
+        in_flight = {}
+        completed = 0
+        failed = 0
+        reload_failures = 0
+        interrupted = False
+
+        def collect(done):
+            nonlocal completed, failed
+            for future in done:
+                job = in_flight.pop(future)
+                if future.cancelled():
+                    results = [(index, False, None) for index in job_indices(job)]
+                else:
+                    results = future.result()
+                for index, ok, _ in results:
+                    if ok:
+                        completed += 1
+                        pbar.update(1)
+                        continue
+                    # 直播分片错过就不会再出现，跳过它继续写入后面的分片
+                    self.segment_writer.skip(index)
+                    if not tracker.hint_failed(index):
+                        # 预加载提示失败时，该部分分片出现在播放列表后会重新下载
+                        failed += 1
+                        pbar.update(1)
+                pbar.set_postfix_str(f"已录制 {tracker.recorded_duration:.0f} 秒")
+
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        pbar = tqdm(desc="录制进度", unit="片")
+        try:
+            while True:
+                loaded_at = time.monotonic()
+                low_latency = tracker.low_latency
+                gap, segments = tracker.update(playlist)
+                if tracker.low_latency and not low_latency:
+                    blocking = "，阻塞式刷新" if tracker.can_block_reload else ""
+                    print(f"\n[*] 低延迟HLS：部分分片目标 {tracker.part_target} 秒{blocking}")
+                if segments and self.segment_writer is None:
+                    self.segment_writer = self.open_segment_writer(output_file, start_index=segments[0][0])
+                if gap:
+                    print(f"\n[!] 刷新不及时，错过 {len(gap)} 个分片（序号 {gap.start}-{gap.stop - 1}）")
+                    for index in gap:
+                        self.segment_writer.skip(index)
+                try:
+                    self.load_init_sections(segments)
+                except Exception as e:
+                    # 没有初始化段的 fMP4 分片无法播放，跳过这次刷新的新分片
+                    print(f"\n[!] 下载初始化段（EXT-X-MAP）失败，跳过 {len(segments)} 个分片: {e}")
+                    for index, _ in segments:
+                        self.init_sections.pop(index, None)
+                        self.segment_writer.skip(index)
+                    failed += len(segments)
+                    pbar.update(len(segments))
+                    segments = []
+                for job in plan_range_jobs(segments, self.url, self.max_range_request):
+                    in_flight[executor.submit(self.download_job, job)] = job
+
+                if tracker.done:
+                    reason = "到达 EXT-X-ENDLIST" if tracker.ended else "达到时长上限"
+                    print(f"\n[*] {reason}，等待剩余分片下载完成")
+                    break
+
+                # 等待下次刷新期间处理已完成的分片
+                collect([future for future in in_flight if future.done()])
+                deadline = loaded_at + tracker.reload_delay(bool(segments))
+                if tracker.stalled:
+                    print(f"\n[*] 直播已有 {tracker.stall_targets} 个目标时长没有新分片，结束录制")
+                    break
+                while True:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    if not in_flight:
+                        time.sleep(remaining)
+                        break
+                    done, _ = wait(in_flight, timeout=remaining, return_when=FIRST_COMPLETED)
+                    collect(done)
+
+                try:
+                    if tracker.blocking:
+                        # 服务器挂起请求，直到下一个（部分）分片可用
+                        response = self.fetch(tracker.reload_url(self.url), tracker.reload_timeout)
+                    else:
+                        response = self.fetch(self.url)
+                    playlist = m3u8.loads(response.text)
+                    reload_failures = 0
+                except Exception as e:
+                    reload_failures += 1
+                    print(f"\n[!] 刷新播放列表失败（第 {reload_failures} 次）: {e}")
+                    if reload_failures >= 3:
+                        print("[!] 无法继续刷新播放列表，结束录制")
+                        break
+                    playlist = m3u8.M3U8()
+        except KeyboardInterrupt:
+            # 未开始的分片不再下载，正在下载的分片写完后结束
+            interrupted = True
+            print("\n[*] 用户结束录制，等待正在下载的分片")
+            for future in in_flight:
+                future.cancel()
+
+        try:
+            while in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                collect(done)
+        finally:
+            executor.shutdown(wait=not interrupted)
+            pbar.close()
+
+        if self.retry_stats.total:
+            print(f"[*] 重试 {self.retry_stats.total} 次: {self.retry_stats.summary()}")
+        if self.segment_writer is None:
+            print("[!] 没有录制到任何分片")
+            return False
+
+        self.segment_writer.close()
+        if self.ffmpeg and not self.finish_ffmpeg():
+            return False
+        size_mb = self.segment_writer.bytes_written / (1024 * 1024)
+        print(f"[✓] 录制完成: {completed} 个分片，{tracker.recorded_duration:.0f} 秒，{size_mb:.1f} MB")
+        if failed or tracker.missed:
+            print(f"[!] 其中下载失败 {failed} 个，错过 {tracker.missed} 个分片")
+        return completed > 0
+
+    def merge_segments(self, total_segments):
         """合并所有ts分片为MP4文件"""
         output_file = self.output_dir / f"{self.output_name}.mp4"
 
         print(f"[*] 正在合并分片到: {output_file}")
 
-        # 获取所有ts文件并排序
-        ts_files = sorted(self.temp_dir.glob("segment_*.ts"))
+        # 按分片编号生成文件列表（超过 99999 个分片时文件名排序与播放顺序不一致）
+        ts_files = [self.temp_dir / segment_file_name(index) for index in range(total_segments)]
 
         if not ts_files:
             print("[!] 没有找到任何ts分片文件")
             return False
+        missing = sum(1 for path in ts_files if not path.exists())
+        if missing:
+            print(f"[!] 缺少 {missing} 个ts分片文件")
+            return False
 
         try:
+            # fMP4 分片拼接在初始化段之后就是有效的分片MP4，不需要 ffmpeg
+            if self.init_sections:
+                return self.merge_binary(ts_files, output_file)
+
             # 尝试使用ffmpeg合并（如果可用）
             if self.merge_with_ffmpeg(ts_files, output_file):
                 return True
 
-            # 如果ffmpeg不可用，使用二进制合并
-            print("[*] FFmpeg不可用，使用二进制合并方式")
+            # ffmpeg不可用时用内置转封装生成标准MP4，不支持的编码再退回二进制合并
+            print("[*] FFmpeg不可用，使用内置转封装")
+            if self.merge_remux(ts_files, output_file):
+                return True
+            print("[*] 使用二进制合并方式")
             return self.merge_binary(ts_files, output_file)
 
         except Exception as e:
             print(f"[!] 合并失败: {e}")
             return False
 
+    def open_segment_writer(self, output_file, start_index=0):
+        """
+        创建按序写入器
+
+        ffmpeg 管道模式下先启动 ffmpeg，写入器的输出就是它的标准输入；
+        没有安装 ffmpeg 时退回流式合并，分片直接写入输出文件。
+        """
+        if self.ffmpeg_pipe:
+            if ffmpeg_available():
+                print(f"[*] FFmpeg 管道模式，分片按序写入 ffmpeg，下载同时封装: {output_file}")
+                self.ffmpeg = FFmpegProcess.pipe(output_file)
+                return OrderedSegmentWriter(self.ffmpeg.stdin, self.temp_dir, self.stream_buffer, start_index)
+            print("[!] 未找到FFmpeg，改为流式合并（分片按序直接写入输出文件）")
+        return OrderedSegmentWriter(output_file, self.temp_dir, self.stream_buffer, start_index)
+
+    def finish_ffmpeg(self):
+        """等待管道模式的 ffmpeg 处理完剩余数据（写入器关闭后调用）"""
+        process, self.ffmpeg = self.ffmpeg, None
+        returncode = process.wait()
+        if returncode != 0:
+            print(f"[!] FFmpeg封装失败（退出码 {returncode}）: {process.error}")
+            return False
+        print(f"[✓] FFmpeg封装完成: {process.progress.describe()}")
+        return True
+
+    def finish_stream_merge(self, total_segments):
+        """结束流式合并，检查所有分片是否都已写入"""
+        writer = self.segment_writer
+        writer.close()
+        if self.ffmpeg and not self.finish_ffmpeg():
+            return False
+        if writer.next_index != total_segments:
+            print(f"[!] 流式合并不完整: {writer.next_index}/{total_segments}")
+            return False
+        if writer.output_file is None:
+            # 写入的是 ffmpeg 管道，结果已由 finish_ffmpeg 报告
+            return True
+
+        size_mb = writer.bytes_written / (1024 * 1024)
+        print(f"[✓] 流式合并完成: {size_mb:.1f} MB，溢出到磁盘 {writer.spilled} 个分片")
+        return True
+
     def merge_with_ffmpeg(self, ts_files, output_file):
-        """使用ffmpeg合并ts文件"""
-        import subprocess
+        """使用ffmpeg合并ts文件，按 -progress 输出显示进度"""
+        if not ffmpeg_available():
+            print("[!] 未找到FFmpeg，请确保FFmpeg已安装并添加到PATH")
+            return False
 
         try:
             # 创建文件列表
@@ -395,24 +1211,21 @@ class M3U8Downloader:
                     # 使用相对路径或绝对路径
                     f.write(f"file '{ts_file.absolute()}'\n")
 
-            # 使用ffmpeg合并
-            cmd = [
-                'ffmpeg',
-                '-f', 'concat',
-                '-safe', '0',
-                '-i', str(filelist_path),
-                '-c', 'copy',
-                '-y',  # 覆盖已存在的文件
-                str(output_file)
-            ]
+            # 使用ffmpeg合并，进度条按已输出的媒体时长前进
+            with tqdm(total=round(self.media_duration) or None, desc="合并进度", unit="秒") as pbar:
+                def on_progress(progress):
+                    pbar.update(round(progress.out_time) - pbar.n)
+                    if progress.speed:
+                        pbar.set_postfix_str(progress.speed)
 
-            result = subprocess.run(cmd, capture_output=True, text=True)
+                process = FFmpegProcess.concat(filelist_path, output_file, on_progress)
+                returncode = process.wait()
 
-            if result.returncode == 0:
+            if returncode == 0:
                 print("[✓] 使用FFmpeg合并完成")
                 return True
             else:
-                print(f"[!] FFmpeg合并失败: {result.stderr}")
+                print(f"[!] FFmpeg合并失败: {process.error}")
                 return False
 
         except FileNotFoundError:
@@ -422,17 +1235,49 @@ class M3U8Downloader:
             print(f"[!] FFmpeg合并出错: {e}")
             return False
 
+    def merge_remux(self, ts_files, output_file):
+        """不依赖 ffmpeg 把 TS 分片转封装为 MP4（单遍流式处理，内存占用与文件大小无关）"""
+        remuxer = TSRemuxer(output_file, self.temp_dir)
+        try:
+            start = time.monotonic()
+            with tqdm(total=len(ts_files), desc="转封装进度", unit="片") as pbar:
+                for ts_file in ts_files:
+                    remuxer.write_file(ts_file)
+                    pbar.update(1)
+            remuxer.finish()
+        except (ValueError, OSError) as e:
+            remuxer.abort()
+            print(f"[!] 转封装失败: {e}")
+            return False
+
+        elapsed = max(time.monotonic() - start, 1e-6)
+        size_mb = remuxer.bytes_in / (1024 * 1024)
+        print(f"[✓] 转封装完成: {remuxer.describe()}，{size_mb:.1f} MB，{size_mb / elapsed:.1f} MB/s")
+        if remuxer.discontinuities:
+            print(f"[*] 已接续 {remuxer.discontinuities} 处时间戳不连续")
+        return True
+
     def merge_binary(self, ts_files, output_file):
-        """使用二进制方式合并ts文件"""
+        """使用二进制方式合并ts文件（内核态拷贝，数据不经过Python内存）"""
         try:
+            start = time.monotonic()
+            total_bytes = 0
+            init_key = None
             with open(output_file, 'wb') as outfile:
                 with tqdm(total=len(ts_files), desc="合并进度", unit="片") as pbar:
-                    for ts_file in ts_files:
-                        with open(ts_file, 'rb') as infile:
-                            outfile.write(infile.read())
+                    for index, ts_file in enumerate(ts_files):
+                        # fMP4：初始化段只在开头和发生变化的位置写入
+                        init = self.init_sections.get(index)
+                        if init is not None and init.key != init_key:
+                            outfile.write(init.data)
+                            total_bytes += len(init)
+                            init_key = init.key
+                        total_bytes += copy_file_into(outfile, ts_file)
                         pbar.update(1)
 
-            print("[✓] 二进制合并完成")
+            elapsed = max(time.monotonic() - start, 1e-6)
+            size_mb = total_bytes / (1024 * 1024)
+            print(f"[✓] 二进制合并完成: {size_mb:.1f} MB，{size_mb / elapsed:.1f} MB/s")
             return True
         except Exception as e:
             print(f"[!] 二进制合并失败: {e}")
@@ -446,6 +1291,8 @@ class M3U8Downloader:
         print("[*] 正在清理临时文件...")
         try:
             import shutil
+            if self.manifest:
+                self.manifest.close()
             shutil.rmtree(self.temp_dir)
             print("[✓] 临时文件清理完成")
         except Exception as e:
@@ -539,17 +1386,32 @@ class M3U8Downloader:
             # 1. 下载并解析m3u8
             playlist = self.download_m3u8()
 
-            # 2. 下载所有分片
-            success = self.download_all_segments(playlist)
-            if not success:
-                print("[!] 分片下载未完全成功")
-                return False
-
-            # 3. 合并分片
-            success = self.merge_segments()
-            if not success:
-                print("[!] 分片合并失败")
-                return False
+            output_file = self.output_dir / f"{self.output_name}.mp4"
+            if self.live:
+                # 2-3. 直播录制，分片按序直接写入输出文件
+                if not self.record_live(playlist, output_file):
+                    return False
+            else:
+                if self.ffmpeg_pipe:
+                    self.segment_writer = self.open_segment_writer(output_file)
+                elif self.stream_merge:
+                    print(f"[*] 流式合并模式，分片按序直接写入: {output_file}")
+                    self.segment_writer = OrderedSegmentWriter(output_file, self.temp_dir, self.stream_buffer)
+
+                # 2. 下载所有分片
+                success = self.download_all_segments(playlist)
+                if not success:
+                    print("[!] 分片下载未完全成功")
+                    return False
+
+                # 3. 合并分片
+                if self.segment_writer:
+                    success = self.finish_stream_merge(len(playlist))
+                else:
+                    success = self.merge_segments(len(playlist))
+                if not success:
+                    print("[!] 分片合并失败")
+                    return False
 
             # 4. 清理临时文件
             if not keep_temp:
@@ -557,7 +1419,6 @@ class M3U8Downloader:
             else:
                 print(f"[*] 临时文件保留在: {self.temp_dir}")
 
-            output_file = self.output_dir / f"{self.output_name}.mp4"
             print(f"\n[✓] 下载完成: {output_file}")
             return True
 
@@ -567,6 +1428,24 @@ class M3U8Downloader:
         except Exception as e:
             print(f"\n[!] 下载过程出错: {e}")
             return False
+        finally:
+            if self.segment_writer:
+                self.segment_writer.close()
+            if self.ffmpeg:
+                # 下载失败或中断，放弃未完成的封装
+                if self.ffmpeg.failed:
+                    print(f"[!] FFmpeg已提前退出: {self.ffmpeg.error}")
+                self.ffmpeg.kill()
+            if self.manifest:
+                self.manifest.close()
+            self.close_session()
+
+
+def _variant_arg(value):
+    try:
+        return parse_variant_policy(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
 
 
 def main():
@@ -578,14 +1457,50 @@ def main():
   %(prog)s -u https://example.com/video.m3u8
   %(prog)s -u https://example.com/video.m3u8 -o my_video -d ./videos
   %(prog)s -u https://example.com/video.m3u8 -w 20 --keep-temp
+  %(prog)s -u https://example.com/video.m3u8 -w 200 --engine asyncio
+  %(prog)s -u https://example.com/live.m3u8 --live --live-duration 3600
+  %(prog)s -u https://example.com/master.m3u8 --variant resolution=720
+  %(prog)s -u https://example.com/master.m3u8 --variant auto -w 16
         """
     )
 
     parser.add_argument('-u', '--url', required=True, help='M3U8播放列表URL')
     parser.add_argument('-o', '--output', help='输出文件名（不含扩展名）')
     parser.add_argument('-d', '--dir', default='downloads', help='输出目录（默认: downloads）')
-    parser.add_argument('-w', '--workers', type=int, default=10, help='并发下载线程数（默认: 10）')
+    parser.add_argument('-w', '--workers', type=int, default=10, help='并发下载线程数，asyncio 引擎下为并发请求数（默认: 10）')
+    parser.add_argument('--adaptive', action='store_true', help='自适应并发：以 -w 为上限，按吞吐量和延迟自动增减并发数')
+    parser.add_argument('--engine', choices=ENGINES, default=ENGINE_THREAD, help='分片下载引擎（默认: thread）')
     parser.add_argument('--keep-temp', action='store_true', help='保留临时文件')
+    parser.add_argument('--stream-merge', action='store_true', help='边下载边按序写入输出文件（跳过单独的合并步骤）')
+    parser.add_argument('--ffmpeg-pipe', action='store_true',
+                        help='下载开始时启动 ffmpeg，分片按序写入其标准输入，边下载边封装为MP4')
+    parser.add_argument('--stream-buffer', type=int, default=DEFAULT_STREAM_BUFFER // (1024 * 1024),
+                        help='流式合并时乱序分片的内存缓冲上限，单位MB（默认: 64）')
+    parser.add_argument('--decrypt-procs', type=int, default=0,
+                        help='解密进程数，大于0时在独立进程中并行解密加密分片（默认: 0，不启用）')
+    parser.add_argument('--retries', type=int, default=5, help='每个请求最多尝试次数（默认: 5）')
+    parser.add_argument('--retry-delay', type=float, default=0.5, help='重试退避基数，单位秒，每次重试翻倍并加随机抖动（默认: 0.5）')
+    parser.add_argument('--retry-max-delay', type=float, default=30.0, help='单次重试等待上限，单位秒（默认: 30）')
+    parser.add_argument('--range-merge', type=int, default=DEFAULT_MAX_RANGE_REQUEST // (1024 * 1024),
+                        help='EXT-X-BYTERANGE 分片合并请求的大小上限，单位MB，0 表示逐个请求（默认: 8）')
+    parser.add_argument('--live', action='store_true',
+                        help='直播录制：按目标时长刷新播放列表，持续下载新分片并写入输出文件，直到直播结束或按 Ctrl+C')
+    parser.add_argument('--live-duration', type=float, help='直播录制时长上限，单位秒（默认不限）')
+    parser.add_argument('--variant', type=_variant_arg, default=DEFAULT_VARIANT_POLICY,
+                        help='多码率播放列表的码率选择: best、worst、max-bandwidth=N（如 3M）、resolution=WxH（如 720）、'
+                             'auto（按 -w 并发试下载候选码率，选链路能承受的最高码率）（默认: best）')
+    parser.add_argument('--lookahead', type=int,
+                        help='按播放顺序下载，最多领先开头未完成的分片多少个分片（默认: 并发数的8倍）')
+    parser.add_argument('--segment-connections', type=int, default=DEFAULT_SEGMENT_CONNECTIONS,
+                        help='超大分片拆成多少个 Range 请求并行下载，1 表示不拆分（默认: 4）')
+    parser.add_argument('--split-threshold', type=int, default=DEFAULT_SPLIT_THRESHOLD // (1024 * 1024),
+                        help='超过多大的分片才拆分，单位MB（默认: 64）')
+    parser.add_argument('--hedge', type=float, default=DEFAULT_HEDGE_FRACTION,
+                        help='尾部对冲：耗时明显偏长的分片再发一个相同的请求，先完成的为准；'
+                             '参数为对冲请求上限占分片数的比例，0 表示关闭（默认: 0.05）')
+    parser.add_argument('--no-mirrors', action='store_true',
+                        help='不使用冗余线路：主播放列表中同一码率有多个地址时只从第一个下载')
+    parser.add_argument('--pool-size', type=int, help='每个主机的连接池大小（默认与并发数相同）')
 
     parser.add_argument('--cookies', help='Netscape 格式的 cookies 文件路径')
     parser.add_argument('--cookies-from-browser', help='从浏览器导入 cookies，格式: BROWSER[+KEYRING][:PROFILE][::CONTAINER]')
@@ -597,6 +1512,23 @@ def main():
         output_dir=args.dir,
         output_name=args.output,
         max_workers=args.workers,
+        pool_size=args.pool_size,
+        engine=args.engine,
+        stream_merge=args.stream_merge,
+        ffmpeg_pipe=args.ffmpeg_pipe,
+        stream_buffer=args.stream_buffer * 1024 * 1024,
+        decrypt_processes=args.decrypt_procs,
+        adaptive=args.adaptive,
+        retry_policy=RetryPolicy(args.retries, args.retry_delay, args.retry_max_delay),
+        max_range_request=args.range_merge * 1024 * 1024,
+        live=args.live,
+        live_duration=args.live_duration,
+        variant=args.variant,
+        lookahead=args.lookahead,
+        segment_connections=args.segment_connections,
+        split_threshold=args.split_threshold * 1024 * 1024,
+        hedge_fraction=args.hedge,
+        use_mirrors=not args.no_mirrors,
         cookies=args.cookies,
         cookies_from_browser=args.cookies_from_browser
     )
@@ -608,4 +1540,5 @@ def main():
 
 
 if __name__ == '__main__':
+    multiprocessing.freeze_support()
     main()
@@ -8,22 +8,49 @@ import os
 import sys
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox, scrolledtext
+import time
 import threading
-import requests
+import asyncio
+import multiprocessing
 from requests.cookies import RequestsCookieJar
 import m3u8
 import http.cookiejar
 from urllib.parse import urljoin, urlparse
 from pathlib import Path
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
 import queue
 from datetime import datetime
 from Crypto.Cipher import AES
 from Crypto.Util.Padding import unpad
 
+from hls_core import create_session, get_shared_session, session_stats
+from hls_core import AsyncSegmentEngine, asyncio_available, ENGINES, ENGINE_THREAD, ENGINE_ASYNCIO
+from hls_core import OrderedSegmentWriter, DEFAULT_STREAM_BUFFER, copy_file_into
+from hls_core import FFmpegProcess, ffmpeg_available, format_seconds
+from hls_core import TSRemuxer
+from hls_core import SegmentSink, SEGMENT_CHUNK_SIZE, StreamingDecryptor, segment_iv, absolute_url, segment_file_name
+from hls_core import shared_key_cache, get_decrypt_pool
+from hls_core import AdaptiveLimiter
+from hls_core import RetryPolicy, RetryStats
+from hls_core import SegmentManifest, temp_dir_name
+from hls_core import RangeJob, RangeReceiver, plan_range_jobs, count_range_jobs, parse_byterange, response_offset, DEFAULT_MAX_RANGE_REQUEST
+from hls_core import choose_variant, parse_variant_policy, DEFAULT_VARIANT_POLICY
+from hls_core import equivalent_variants, load_mirrors, SegmentTable, stream_playlist
+from hls_core import InitSectionCache, init_section_of, range_header
+from hls_core import PlaybackScheduler
+from hls_core import ParallelRangeDownload, split_size, DEFAULT_SEGMENT_CONNECTIONS, DEFAULT_SPLIT_THRESHOLD
+from hls_core import HedgeTracker, watching, DEFAULT_HEDGE_FRACTION
+
 
 class M3U8DownloaderGUI:
-    def __init__(self, url, output_dir, output_name=None, max_workers=10, callback=None, use_proxy=False, proxy_url=None, cookies_file=None, cookies_from_browser=None, preloaded_cookie_jar=None):
+    def __init__(self, url, output_dir, output_name=None, max_workers=10, callback=None, use_proxy=False, proxy_url=None, cookies_file=None, cookies_from_browser=None, preloaded_cookie_jar=None,
+                 pool_size=None, shared_session=False, engine=ENGINE_THREAD,
+                 stream_merge=False, stream_buffer=DEFAULT_STREAM_BUFFER, key_cache=None,
+                 decrypt_processes=0, adaptive=False, retry_policy=None,
+                 max_range_request=DEFAULT_MAX_RANGE_REQUEST, variant=DEFAULT_VARIANT_POLICY,
+                 lookahead=None, segment_connections=DEFAULT_SEGMENT_CONNECTIONS,
+                 split_threshold=DEFAULT_SPLIT_THRESHOLD, ffmpeg_pipe=False,
+                 hedge_fraction=DEFAULT_HEDGE_FRACTION, use_mirrors=True):
         """
         初始化M3U8下载器
 
@@ -35,10 +62,53 @@ class M3U8DownloaderGUI:
             callback: 进度回调函数 callback(message, progress)
             use_proxy: 是否使用代理
             proxy_url: 代理地址（例如：http://127.0.0.1:7890）
+            pool_size: 每个主机的连接池大小（默认与并发数相同）
+            shared_session: 是否使用进程级共享连接池（批量/Web任务间复用连接）
+            engine: 分片下载引擎，thread（线程池）或 asyncio（事件循环）
+            stream_merge: 边下载边按序写入输出文件，不再单独合并
+            stream_buffer: 流式合并时乱序分片的内存缓冲上限（字节）
+            key_cache: 密钥缓存（KeyCache），默认使用进程级共享缓存
+            decrypt_processes: 解密进程数，大于0时AES解密交给独立进程（多核解密）
+            adaptive: 自适应并发，max_workers 作为上限，按吞吐量和延迟自动调整
+            retry_policy: 重试策略（RetryPolicy），播放列表、密钥和分片请求共用
+            max_range_request: EXT-X-BYTERANGE 分片合并请求的大小上限（字节），0 表示不合并
+            variant: 多码率播放列表的码率选择策略（best、worst、max-bandwidth=N、resolution=WxH、auto）
+            lookahead: 按播放顺序下载时最多领先最小未完成分片多少个分片，None 表示并发数的8倍
+            segment_connections: 超大分片拆成多少个 Range 请求并行下载，1 表示不拆分
+            split_threshold: 超过多大（字节）的分片才拆分
+            ffmpeg_pipe: 下载开始时启动 ffmpeg，分片按序写入其标准输入，下载与封装同时进行
+            hedge_fraction: 对耗时明显偏长的分片发起对冲请求，上限占分片数的比例，0 表示关闭
+            use_mirrors: 主播放列表中同一码率有多条线路（冗余流）时，分片请求分摊到各线路并自动切换
         """
         self.url = url
         self.output_dir = Path(output_dir)
         self.max_workers = max_workers
+        self.adaptive = adaptive
+        self.limiter = None
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.retry_stats = RetryStats()
+        self.max_range_request = max_range_request
+        self.variant_policy = parse_variant_policy(variant)
+        self.variant_choice = None
+        self.lookahead = lookahead
+        self.scheduler = None
+        # 流式解析时由解析线程算好的字节范围合并统计（concurrent.futures.Future）
+        self._range_counts = None
+        # 下载过程中接收播放列表或获取初始化段的错误
+        self.source_error = None
+        self.segment_connections = segment_connections
+        self.split_threshold = split_threshold
+        self.hedge_fraction = hedge_fraction
+        self.hedger = None
+        self.use_mirrors = use_mirrors
+        self.mirrors = None
+        self.engine = engine
+        self.stream_merge = stream_merge
+        self.stream_buffer = stream_buffer
+        self.ffmpeg_pipe = ffmpeg_pipe
+        self.ffmpeg = None
+        self.media_duration = 0.0
+        self.segment_writer = None
         self.callback = callback
         self.cancel_flag = False
         self.cookies_file = None
@@ -95,6 +165,7 @@ class M3U8DownloaderGUI:
         # 如果指定了文件名，直接使用；否则使用时间戳
         if output_name and output_name.strip():
             self.output_name = output_name.strip()
+            base_name = self.output_name
         else:
             # 未指定文件名，使用时间戳
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -102,8 +173,10 @@ class M3U8DownloaderGUI:
             base_name = Path(parsed_url.path).stem or "video"
             self.output_name = f"{base_name}_{timestamp}"
 
-        # 创建临时目录存储ts分片
+        # 临时目录存储ts分片，目录名不含时间戳，任务重启后从清单继续下载
+        self.temp_dir_name = temp_dir_name(base_name, url)
         self.temp_dir = None
+        self.manifest = None
 
         # 设置请求头
         self.headers = {
@@ -126,8 +199,34 @@ class M3U8DownloaderGUI:
             }
             self.log("[*] 已禁用代理")
 
-        # 密钥缓存
-        self.key_cache = {}
+        # 连接池会话，复用TCP/TLS连接
+        self.pool_size = pool_size or max_workers
+        self.shared_session = shared_session
+        if shared_session:
+            self.session = get_shared_session(self.pool_size)
+        else:
+            self.session = create_session(self.pool_size)
+
+        # 密钥缓存（进程级共享，批量/Web任务之间复用）
+        self.key_cache = key_cache if key_cache is not None else shared_key_cache
+
+        # 解密进程池（可选），避免解密与网络读取在同一进程内争抢GIL；
+        # 进程池在进程内共享，按第一次启用时的进程数创建，之后的任务沿用
+        self.decrypt_pool = get_decrypt_pool(decrypt_processes)
+        if self.decrypt_pool and self.decrypt_pool.processes != decrypt_processes:
+            self.log(f"[*] 解密进程池已按 {self.decrypt_pool.processes} 个进程创建，重启程序后新的进程数才生效")
+
+        # fMP4 初始化段（EXT-X-MAP）：按 URI 和字节范围缓存，分片序号 -> InitSection
+        self.init_cache = InitSectionCache()
+        self.init_sections = {}
+
+    def close_session(self):
+        """关闭私有连接池（共享连接池由其他任务继续使用）"""
+        handshakes, resumed = session_stats(self.session)
+        if handshakes:
+            self.log(f"[*] TLS握手 {handshakes} 次，其中会话恢复 {resumed} 次")
+        if not self.shared_session:
+            self.session.close()
 
     def _ensure_cookie_jar(self):
         if self.cookie_jar is None:
@@ -195,22 +294,38 @@ class M3U8DownloaderGUI:
         """下载并解析m3u8播放列表"""
         self.log("[*] 正在获取M3U8播放列表...")
         try:
-            response = requests.get(self.url, headers=self.headers, proxies=self.proxies, timeout=30, cookies=self.cookie_jar)
-            response.raise_for_status()
+            # 媒体播放列表边接收边解析，解析出第一个分片就开始下载
+            table, playlist = stream_playlist(self.fetch(self.url, stream=True), self.url)
+            if table is not None:
+                return table
 
-            # 解析m3u8
-            playlist = m3u8.loads(response.text)
-
-            # 如果是主播放列表，选择第一个变体
+            # 如果是主播放列表，按码率策略选择变体
             if playlist.is_variant:
-                self.log("[*] 检测到多码率播放列表，选择第一个")
-                variant_url = urljoin(self.url, playlist.playlists[0].uri)
-                response = requests.get(variant_url, headers=self.headers, proxies=self.proxies, timeout=30, cookies=self.cookie_jar)
-                response.raise_for_status()
-                playlist = m3u8.loads(response.text)
-                self.url = variant_url
-
-            return playlist
+                self.log(f"[*] 检测到多码率播放列表（{len(playlist.playlists)} 个码率），策略: {self.variant_policy}")
+                if self.variant_policy.kind == "auto":
+                    self.log(f"[*] 正在以 {self.max_workers} 个并发试下载候选码率...")
+                choice = choose_variant(playlist.playlists, self.variant_policy, self.url,
+                                        self._probe_fetch, self.max_workers)
+                for line in choice.report():
+                    self.log(line)
+                self.variant_choice = choice
+                # 同一码率的冗余流作为镜像线路，需要比对各线路的分片列表，完整获取后再解析
+                urls = [choice.url]
+                if self.use_mirrors:
+                    urls = [urljoin(self.url, p.uri) for p in equivalent_variants(playlist.playlists, choice.playlist)]
+                if len(urls) == 1:
+                    self.url = choice.url
+                    table, playlist = stream_playlist(self.fetch(choice.url, stream=True), choice.url)
+                    return table if table is not None else SegmentTable.from_playlist(playlist, choice.url)
+                table, mirrors = load_mirrors(urls, lambda url: self.fetch(url).text)
+                for line in mirrors.describe():
+                    self.log(line)
+                self.mirrors = mirrors if len(mirrors) > 1 else None
+                self.url = mirrors.primary.url
+                return table
+
+            # 流式解析没有找到分片时降为分片表，m3u8 的对象模型随之释放
+            return SegmentTable.from_playlist(playlist, self.url)
         except Exception as e:
             self.log(f"[!] 获取M3U8失败: {e}")
             return None
@@ -220,14 +335,10 @@ class M3U8DownloaderGUI:
         if not key_obj or key_obj.method == 'NONE' or not key_obj.uri:
             return None, None
 
-        if key_obj.uri in self.key_cache:
-            return self.key_cache[key_obj.uri]
-
         try:
-            key_url = urljoin(self.url, key_obj.uri)
-            response = requests.get(key_url, headers=self.headers, proxies=self.proxies, timeout=30, cookies=self.cookie_jar)
-            response.raise_for_status()
-            key_bytes = response.content
+            # 并发请求同一密钥时只下载一次
+            key_url = absolute_url(key_obj, self.url)
+            key_bytes = self.key_cache.get(key_url, lambda: self._fetch_key(key_url))
 
             if key_obj.iv:
                 iv_hex = key_obj.iv.replace('0x', '')
@@ -235,12 +346,55 @@ class M3U8DownloaderGUI:
             else:
                 iv_bytes = None
 
-            self.key_cache[key_obj.uri] = (key_bytes, iv_bytes)
             return key_bytes, iv_bytes
         except Exception as e:
             self.log(f"[!] 获取解密密钥失败: {e}")
             return None, None
 
+    def fetch(self, url, headers=None, stream=False):
+        """按重试策略请求URL，返回响应对象；stream 为 True 时只读取响应头，内容由调用方逐块读取"""
+        if headers:
+            headers = {**self.headers, **headers}
+        def request():
+            response = self.session.get(url, headers=headers or self.headers, proxies=self.proxies, timeout=30,
+                                        cookies=self.cookie_jar, stream=stream)
+            response.raise_for_status()
+            return response
+        return self.retry_policy.call(request, self.retry_stats, cancelled=lambda: self.cancel_flag)
+
+    def _probe_fetch(self, url, headers=None):
+        """码率试下载用的请求，不重试，返回响应内容"""
+        response = self.session.get(url, headers={**self.headers, **(headers or {})}, proxies=self.proxies,
+                                    timeout=30, cookies=self.cookie_jar)
+        response.raise_for_status()
+        return response.content
+
+    def _fetch_key(self, key_url):
+        """下载密钥"""
+        return self.fetch(key_url).content
+
+    def load_init_sections(self, segments):
+        """获取分片引用的 EXT-X-MAP 初始化段，每个（按 URI 和字节范围区分）只下载、解密一次"""
+        for index, segment in segments:
+            ref = init_section_of(segment, self.url)
+            if ref is not None:
+                url, byterange = ref
+                self.init_sections[index] = self.init_cache.get(
+                    url, byterange, lambda: self._fetch_init_section(url, byterange, segment, index))
+
+    def _fetch_init_section(self, url, byterange, segment, index):
+        """下载初始化段；分片加密时初始化段使用同一个密钥（按 RFC 8216 应带显式 IV）"""
+        response = self.fetch(url, headers=range_header(byterange) if byterange else None)
+        data = response.content
+        if byterange and response.status_code != 206:
+            # 服务器忽略了 Range，返回整个文件
+            start, length = parse_byterange(byterange)
+            data = data[start:start + length]
+        if segment.key:
+            key_bytes, iv_bytes = self.get_decrypt_key(segment.key)
+            data = self.decrypt_segment(data, key_bytes, iv_bytes, getattr(segment, 'iv_sequence', index))
+        return data
+
     def decrypt_segment(self, data, key_bytes, iv_bytes, segment_index):
         """解密TS分片"""
         if not key_bytes:
@@ -263,74 +417,429 @@ class M3U8DownloaderGUI:
             self.log(f"[!] 解密分片失败: {e}")
             return data
 
-    def download_segment(self, segment_info):
-        """下载单个ts分片"""
+    def open_segment_sink(self, index, file_path, segment, in_memory=None):
+        """创建分片写入端，加密分片在接收时增量解密；in_memory 为 False 时总是写入磁盘"""
+        decryptor = None
+        offload = None
+        if segment.key:
+            key_bytes, iv_bytes = self.get_decrypt_key(segment.key)
+            # 默认IV取分片的媒体序号
+            iv = segment_iv(iv_bytes, getattr(segment, 'iv_sequence', index))
+            if key_bytes and self.decrypt_pool:
+                offload = self.decrypt_pool.open(key_bytes, iv)
+            elif key_bytes:
+                try:
+                    decryptor = StreamingDecryptor(key_bytes, iv)
+                except ValueError as e:
+                    self.log(f"[!] 解密分片失败: {e}")
+        if in_memory is None:
+            in_memory = self.segment_writer is not None
+        return SegmentSink(file_path, decryptor, in_memory=in_memory, offload=offload)
+
+    def download_segment(self, segment_info, race=None, hedge=False):
+        """下载单个ts分片；对冲请求（hedge）写入单独的临时文件，胜出后再改名"""
         if self.cancel_flag:
             return (segment_info[0], False, None)
 
         index, segment = segment_info
-        segment_url = urljoin(self.url, segment.uri)
-        file_path = self.temp_dir / f"segment_{index:05d}.ts"
+        segment_url = absolute_url(segment, self.url)
+        file_path = self.temp_dir / segment_file_name(index)
+        sink_path = file_path.with_name(f"{file_path.name}.hedge") if hedge else file_path
 
-        if file_path.exists():
+        # 清单中登记过的完整分片直接跳过（断点续传）
+        if not hedge and self.manifest.is_done(index, segment_url, file_path):
+            self.store_segment(index, file_path)
             return (index, True, file_path)
 
-        for attempt in range(3):
-            if self.cancel_flag:
-                return (index, False, None)
+        # 中断的传输保留写入端，下一次尝试用 Range 续传；有镜像线路时失败后换线重试
+        sink = None
+        split = None
+        failed = set()
+        for attempt in range(self.retry_policy.attempts):
+            if self.cancel_flag or (race and race.lost(hedge)):
+                break
+            # 自适应并发时每次尝试都要先取得名额
+            token = self.limiter.acquire() if self.limiter else None
+            mirror = self.mirrors.acquire(failed) if self.mirrors else None
+            request_url = mirror.segment_url(index, segment) if mirror else segment_url
+            ok = False
+            nbytes = 0
+            ttfb = None
+            error = None
+            started = time.monotonic()
             try:
-                response = requests.get(segment_url, headers=self.headers, proxies=self.proxies, timeout=30, cookies=self.cookie_jar)
-                response.raise_for_status()
+                headers = self.headers
+                resume = sink.resume_headers() if sink else None
+                if resume:
+                    headers = {**self.headers, **resume}
+
+                with self.session.get(request_url, headers=headers, proxies=self.proxies, timeout=30, cookies=self.cookie_jar, stream=True) as response, \
+                        watching(race, hedge, response):
+                    ttfb = time.monotonic() - started
+                    response.raise_for_status()
+                    if sink is None:
+                        split = split_size(response.status_code, response.headers,
+                                           self.segment_connections, self.split_threshold)
+                        if split:
+                            # 超大分片：不读取这个响应，改用多个 Range 请求并行下载
+                            # （对冲请求直接放弃，原请求已在并行下载）
+                            ok = True
+                            break
+                    if sink and not (resume and sink.continues(response.status_code, response.headers)):
+                        # 服务器忽略了 Range 或资源已变化，从头下载
+                        sink.abort()
+                        sink = None
+                    if sink is None:
+                        # 边接收边解密写入，内存中只保留一个数据块
+                        sink = self.open_segment_sink(index, sink_path, segment)
+                        sink.begin(response.headers)
+                    else:
+                        self.retry_stats.record_resume(sink.bytes_received)
+                    for chunk in response.iter_content(SEGMENT_CHUNK_SIZE):
+                        if self.cancel_flag:
+                            raise RuntimeError("下载已取消")
+                        if race and race.lost(hedge):
+                            raise IOError("对冲的另一方已完成")
+                        sink.write(chunk)
+                        nbytes += len(chunk)
+
+                # 对冲中先登记胜出，落败的一方不再写入分片文件
+                if race and not race.claim(hedge):
+                    break
+                data = sink.finish()
+                if data is None and sink_path != file_path:
+                    os.replace(sink_path, file_path)
+                self.store_segment(index, file_path, data)
+                if data is None:
+                    self.manifest.mark_done(index, segment_url, sink.bytes_written, sink.crc32, sink.expected_size)
+                ok = True
+                return (index, True, file_path)
+            except Exception as e:
+                error = e
+            finally:
+                if self.limiter:
+                    self.limiter.release(token, ok or self.cancel_flag or bool(race and race.lost(hedge)), nbytes, ttfb)
+                if mirror:
+                    abandoned = self.cancel_flag or bool(race and race.lost(hedge))
+                    self.mirrors.release(mirror, nbytes, time.monotonic() - started, None if abandoned else ok)
+
+            if race and race.lost(hedge):
+                break
+            delay = self.retry_policy.backoff(error, attempt, self.retry_stats)
+            if mirror:
+                failed.add(mirror)
+                # 还有没失败过的线路时立即换线，404 等不再重试的错误也换线
+                if attempt + 1 < self.retry_policy.attempts and self.mirrors.untried(failed):
+                    delay = 0
+            if sink and (delay is None or not sink.resume_headers()):
+                sink.abort()
+                sink = None
+            if delay is None:
+                self.log(f"[!] 分片 {index} 下载失败: {error}")
+                return (index, False, None)
+            if not self.retry_policy.sleep(delay, lambda: self.cancel_flag):
+                break
 
-                data = response.content
+        if sink:
+            sink.abort()
+        if split and not hedge and not self.cancel_flag:
+            return self.download_segment_parallel(index, segment, segment_url, file_path, split)
+        return (index, False, None)
 
-                # 检查是否需要解密
-                if segment.key:
-                    key_bytes, iv_bytes = self.get_decrypt_key(segment.key)
-                    if key_bytes:
-                        data = self.decrypt_segment(data, key_bytes, iv_bytes, index)
+    def download_segment_parallel(self, index, segment, segment_url, file_path, size):
+        """
+        多连接下载一个超大分片：Range 请求并行写入临时文件的对应偏移，每个请求各占一个并发名额；
+        不加密的分片完成后直接改名，加密的整体解密写入分片文件，流式合并时把文件交给写入器
+        """
+        def open_response(headers):
+            return self.session.get(segment_url, headers={**self.headers, **headers}, proxies=self.proxies,
+                                    timeout=30, cookies=self.cookie_jar, stream=True)
+
+        download = ParallelRangeDownload(segment_url, size, f"{file_path}.multi", self.segment_connections,
+                                         open_response, self.retry_policy, self.retry_stats,
+                                         lambda: self.cancel_flag, limiter=self.limiter)
+        self.log(f"[*] 分片 {index} 大小 {size / 1024 / 1024:.0f} MB，使用 {len(download.parts)} 个连接并行下载")
+        sink = None
+        try:
+            download.run()
+            if download.ranges_ignored:
+                self.log(f"[*] 服务器忽略了 Range 请求，分片 {index} 改为单连接下载")
+            key_bytes = self.get_decrypt_key(segment.key)[0] if segment.key else None
+            if key_bytes:
+                sink = self.open_segment_sink(index, file_path, segment, in_memory=False)
+                sink.expect(size)
+                for chunk in download.read_chunks():
+                    sink.write(chunk)
+                sink.finish()
+                written, crc32 = sink.bytes_written, sink.crc32
+            else:
+                # 不需要解密，省去再读写一遍；CRC32 需要重新读取整个文件，不再计算
+                os.replace(download.path, file_path)
+                written, crc32 = size, None
+            self.store_segment(index, file_path)
+            self.manifest.mark_done(index, segment_url, written, crc32, size)
+            return (index, True, file_path)
+        except Exception as e:
+            if sink:
+                sink.abort()
+            self.log(f"[!] 分片 {index} 下载失败: {e}")
+            return (index, False, None)
+        finally:
+            download.remove()
+
+    def download_job(self, job, race=None, hedge=False):
+        """
+        下载一个任务（单个分片或合并的字节范围请求），返回其中每个分片的结果
 
-                with open(file_path, 'wb') as f:
-                    f.write(data)
-                return (index, True, file_path)
+        对冲中的分片只由胜出的一方（或双方都失败时最后退出的一方）报告结果，另一方返回空列表。
+        """
+        if isinstance(job, RangeJob):
+            return self.download_range_job(job)
+        result = self.download_segment(job, race, hedge)
+        if race and not result[1] and not race.give_up(hedge):
+            return []
+        return [result]
+
+    def download_range_job(self, job):
+        """下载一组 EXT-X-BYTERANGE 分片：一次 Range 请求，按分片切开保存"""
+        results = {}
+        pending = []
+        for member in job.members:
+            file_path = self.temp_dir / segment_file_name(member.index)
+            if self.manifest.is_done(member.index, job.url, file_path):
+                self.store_segment(member.index, file_path)
+                results[member.index] = (member.index, True, file_path)
+            else:
+                pending.append(member)
+
+        attempt = 0
+        while pending and not self.cancel_flag:
+            token = self.limiter.acquire() if self.limiter else None
+            ok = False
+            nbytes = 0
+            ttfb = None
+            error = None
+            receiver = None
+            try:
+                start = pending[0].start
+                headers = {**self.headers, 'Range': f'bytes={start}-{pending[-1].end - 1}'}
+                started = time.monotonic()
+                with self.session.get(job.url, headers=headers, proxies=self.proxies, timeout=30, cookies=self.cookie_jar, stream=True) as response:
+                    ttfb = time.monotonic() - started
+                    response.raise_for_status()
+                    offset = response_offset(response.status_code, response.headers, start)
+                    receiver = RangeReceiver(pending, offset, self._open_range_sink)
+                    for chunk in response.iter_content(SEGMENT_CHUNK_SIZE):
+                        if self.cancel_flag:
+                            raise RuntimeError("下载已取消")
+                        nbytes += len(chunk)
+                        for member in receiver.feed(chunk):
+                            results[member.index] = self._finish_range_member(member, job.url, receiver.take(member))
+                        # 服务器忽略 Range 返回整个文件时，收够即停
+                        if receiver.done:
+                            break
+                if not receiver.done:
+                    raise IOError(f"字节范围响应不完整: {receiver.offset}/{receiver.end}")
+                ok = True
             except Exception as e:
-                if attempt == 2:
-                    self.log(f"[!] 分片 {index} 下载失败: {e}")
-                    return (index, False, None)
-        return (index, False, None)
+                error = e
+            finally:
+                if receiver:
+                    receiver.abort()
+                if self.limiter:
+                    self.limiter.release(token, ok or self.cancel_flag, nbytes, ttfb)
+
+            remaining = [member for member in pending if member.index not in results]
+            # 这次请求已收完部分分片，只是后面断开，不计入失败次数
+            if len(remaining) < len(pending):
+                attempt = 0
+            pending = remaining
+            if not pending:
+                break
+            delay = self.retry_policy.backoff(error, attempt, self.retry_stats)
+            if delay is None:
+                self.log(f"[!] 分片 {pending[0].index}-{pending[-1].index} 下载失败: {error}")
+                break
+            if not self.retry_policy.sleep(delay, lambda: self.cancel_flag):
+                break
+            attempt += 1
 
-    def download_all_segments(self, playlist):
-        """并发下载所有ts分片"""
-        segments = [(i, seg) for i, seg in enumerate(playlist.segments)]
-        total_segments = len(segments)
+        for member in pending:
+            results[member.index] = (member.index, False, None)
+        return [results[member.index] for member in job.members]
 
-        # 检查是否有加密
-        has_encryption = any(seg.key for seg in playlist.segments)
-        if has_encryption:
-            self.log("[*] 检测到加密内容，将自动解密")
+    def _open_range_sink(self, member):
+        file_path = self.temp_dir / segment_file_name(member.index)
+        sink = self.open_segment_sink(member.index, file_path, member.segment)
+        sink.expect(member.length)
+        return sink
 
-        self.log(f"[*] 共 {total_segments} 个分片，使用 {self.max_workers} 线程下载")
+    def _finish_range_member(self, member, url, sink):
+        """保存字节范围请求中接收完整的一个分片"""
+        file_path = self.temp_dir / segment_file_name(member.index)
+        try:
+            data = sink.finish()
+        except Exception:
+            sink.abort()
+            raise
+        self.store_segment(member.index, file_path, data)
+        if data is None:
+            self.manifest.mark_done(member.index, url, sink.bytes_written, sink.crc32, member.length)
+        return (member.index, True, file_path)
+
+    def store_segment(self, index, file_path, data=None):
+        """
+        保存分片
 
-        completed = 0
-        failed = []
+        流式合并模式下直接交给按序写入器（连同 fMP4 初始化段），否则写入临时文件。
+        data 为 None 表示分片文件已在磁盘上（断点续传、多连接下载的超大分片）。
+        """
+        if self.segment_writer:
+            init = self.init_sections.pop(index, None)
+            if data is None:
+                self.segment_writer.submit(index, path=file_path, init=init)
+            else:
+                self.segment_writer.submit(index, data, init=init)
+        elif data is not None:
+            with open(file_path, 'wb') as f:
+                f.write(data)
 
-        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-            futures = {executor.submit(self.download_segment, seg): seg for seg in segments}
+    def _count_ranges(self, playlist):
+        """统计 EXT-X-BYTERANGE 合并请求，返回 (请求数, 分片数)；遍历整个分片表，流式解析时在解析线程中调用"""
+        return count_range_jobs(plan_range_jobs(enumerate(playlist), self.url, self.max_range_request))
 
-            for future in as_completed(futures):
-                if self.cancel_flag:
-                    executor.shutdown(wait=False)
-                    return False
+    def _describe_playlist(self, playlist, range_counts=None):
+        """输出加密和字节范围合并等播放列表信息（流式解析时在解析完成后调用，range_counts 为已算好的统计）"""
+        self.media_duration = playlist.duration
 
-                result = future.result()
-                completed += 1
-                progress = int((completed / total_segments) * 100)
+        # EXT-X-BYTERANGE 分片按资源合并为较大的 Range 请求；任务在调度时才逐个生成，这里只统计
+        range_jobs, range_segments = range_counts or self._count_ranges(playlist)
+        if range_jobs:
+            self.log(f"[*] 检测到 EXT-X-BYTERANGE: {range_segments} 个分片合并为 {range_jobs} 个请求")
 
-                if result[1]:
-                    self.log(f"[*] 下载进度: {completed}/{total_segments}", progress)
-                else:
-                    failed.append(result[0])
+        # 检查是否有加密
+        if playlist.encrypted:
+            self.log("[*] 检测到加密内容，将自动解密")
+
+    def _iter_segments(self, playlist):
+        """
+        按播放顺序逐个取出分片，同时获取分片引用的 EXT-X-MAP 初始化段
+
+        fMP4 分片的初始化段在交出第一个引用它的分片前获取，合并时只写一次。需要等待时
+        （播放列表还在后台解析、初始化段正在后台线程下载）交出 concurrent.futures.Future，
+        调度循环等它完成后再取，不会阻塞在这里。接收播放列表或获取初始化段出错时
+        记录到 source_error，不再交出后面的分片。
+        """
+        segments = playlist.iter_parsed()
+        index = 0
+        executor = None
+        try:
+            while True:
+                try:
+                    segment = next(segments)
+                except StopIteration:
+                    return
+                except Exception as e:
+                    self.source_error = f"接收播放列表失败: {e}"
+                    return
+                if isinstance(segment, Future):
+                    yield segment
+                    continue
+                try:
+                    ref = init_section_of(segment, self.url)
+                    if ref is None or self.init_cache.cached(*ref):
+                        self.load_init_sections([(index, segment)])
+                    else:
+                        # 初始化段（可能还要先取密钥）在后台线程下载，调度循环不等它
+                        if executor is None:
+                            executor = ThreadPoolExecutor(max_workers=1)
+                        future = executor.submit(self.load_init_sections, [(index, segment)])
+                        yield future
+                        future.result()
+                except Exception as e:
+                    self.source_error = f"下载初始化段（EXT-X-MAP）失败: {e}"
+                    return
+                yield index, segment
+                index += 1
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=False)
+
+    def _prepare_segments(self, playlist):
+        """输出下载信息并创建调度器，返回下载任务（按需生成）"""
+        if playlist.complete:
+            self._describe_playlist(playlist)
+        else:
+            self.log(f"[*] 播放列表边接收边解析，已解析 {len(playlist)} 个分片，先开始下载")
+        if self.manifest.completed:
+            self.log(f"[*] 断点续传: 清单中已有 {self.manifest.completed} 个完成的分片")
+
+        # 并发名额：不开启自适应时固定为 max_workers，超大分片的多连接下载也从这里取名额
+        self.limiter = AdaptiveLimiter(self.max_workers, adaptive=self.adaptive)
+        if self.adaptive:
+            self.log(f"[*] 自适应并发，上限 {self.max_workers}")
+
+        # 按播放顺序调度：正在下载的分片集中在开头未完成的位置附近，输出从头连续可用；
+        # 任务按需从播放列表生成，排队和进行中的任务不超过预读窗口
+        jobs = plan_range_jobs(self._iter_segments(playlist), self.url, self.max_range_request)
+        self.scheduler = PlaybackScheduler(jobs, self.max_workers, self.lookahead, total=len(playlist))
+        # 尾部对冲：耗时明显偏长的分片再发一个相同的请求，先完成的为准；分片总数确定前不对冲
+        self.hedger = (HedgeTracker(len(playlist) if playlist.complete else 0, self.max_workers, self.hedge_fraction)
+                       if self.hedge_fraction > 0 else None)
+        # 流式解析时，字节范围合并的统计在解析完成后由解析线程算好，调度循环中只输出结果
+        self._range_counts = None if playlist.complete else playlist.after_parsed(self._count_ranges)
+        return jobs
+
+    def _playlist_parsed(self, playlist):
+        """
+        流式解析完成后输出播放列表信息，补全调度器的分片总数和对冲上限
 
+        Returns:
+            分片总数；还在解析（或统计还没算好）、解析出错时返回 None
+        """
+        if not self._range_counts.done() or playlist.error is not None:
+            return None
+        self._describe_playlist(playlist, self._range_counts.result())
+        self.log(f"[*] 播放列表解析完成，共 {len(playlist)} 个分片")
+        self.scheduler.total = len(playlist)
+        if self.hedger:
+            self.hedger.set_total(len(playlist))
+        return len(playlist)
+
+    def ready_bytes(self):
+        """从开头起连续下载完成的字节数（流式合并时为已写入输出文件的字节数）"""
+        if self.segment_writer:
+            return self.segment_writer.bytes_written
+        return self.scheduler.contiguous_bytes if self.scheduler else 0
+
+    def _progress_message(self, completed, total_segments):
+        """分片进度消息，附带从开头起连续可用的分片数和大小；自适应并发时附带当前并发数"""
+        message = f"[*] 下载进度: {completed}/{total_segments or '?'}"
+        message += f"，连续可用 {self.scheduler.ready_count} 片（{self.ready_bytes() / 1024 / 1024:.1f} MB）"
+        if self.ffmpeg:
+            message += f"，已封装 {format_seconds(self.ffmpeg.progress.out_time)}"
+        if self.adaptive:
+            message += f"，并发 {self.limiter.limit}"
+        return message
+
+    def _finish_segments(self, failed):
+        """汇总分片下载结果"""
+        if self.init_sections:
+            self.log(f"[*] 检测到 fMP4 分片，初始化段 {self.init_cache.fetches} 个，输出为分片MP4（fragmented MP4）")
+        if self.adaptive:
+            limit, peak, decreases = self.limiter.summary()
+            self.log(f"[*] 自适应并发: 最终 {limit}，峰值 {peak}，退让 {decreases} 次")
+        if self.retry_stats.total:
+            self.log(f"[*] 重试 {self.retry_stats.total} 次: {self.retry_stats.summary()}")
+        if self.hedger and self.hedger.hedges:
+            self.log(f"[*] {self.hedger.summary()}")
+        if self.mirrors:
+            self.log("[*] 各线路下载统计:")
+            for line in self.mirrors.report():
+                self.log(line)
+        if self.source_error:
+            self.log(f"[!] {self.source_error}")
+            return False
         if failed:
             self.log(f"[!] {len(failed)} 个分片下载失败")
             return False
@@ -338,59 +847,280 @@ class M3U8DownloaderGUI:
         self.log("[✓] 所有分片下载完成", 100)
         return True
 
-    def merge_segments(self):
+    def download_all_segments(self, playlist):
+        """并发下载所有ts分片"""
+        if self.engine == ENGINE_ASYNCIO:
+            if asyncio_available():
+                return asyncio.run(self.download_all_segments_async(playlist))
+            self.log("[!] 未安装 aiohttp，回退到线程池引擎")
+
+        self._prepare_segments(playlist)
+        total_segments = len(playlist) if playlist.complete else None
+
+        if total_segments is not None:
+            self.log(f"[*] 共 {total_segments} 个分片，使用 {self.max_workers} 线程下载")
+        else:
+            self.log(f"[*] 使用 {self.max_workers} 线程下载")
+
+        completed = 0
+        failed = []
+
+        # 同时进行的任务不超过线程数，空出名额时按播放顺序补充；
+        # 对冲请求使用额外的线程，落败的请求在下一个数据块处自行结束，不再等待
+        hedger = self.hedger
+        executor = ThreadPoolExecutor(max_workers=self.max_workers * 2 if hedger else self.max_workers)
+        try:
+            # future -> (SegmentRace, 是否为对冲请求)
+            in_flight = {}
+            while True:
+                if self.cancel_flag:
+                    return False
+                # 另一方已胜出的请求不会再报告结果
+                for future in [future for future, (race, hedge) in in_flight.items() if race and race.lost(hedge)]:
+                    del in_flight[future]
+                primary = sum(1 for race, hedge in in_flight.values() if not hedge)
+                for job in self.scheduler.take(self.max_workers - primary):
+                    race = hedger.start(job) if hedger else None
+                    in_flight[executor.submit(self.download_job, job, race)] = (race, False)
+                    primary += 1
+                if hedger:
+                    for job, race in hedger.due(self.scheduler.pending + primary):
+                        in_flight[executor.submit(self.download_job, job, race, True)] = (race, True)
+                # 播放列表还在解析或初始化段正在下载时，调度器的 waiting 完成后再取任务；
+                # 已完成却没被取走说明名额已满，等进行中的任务即可
+                waiting = self.scheduler.waiting
+                if not in_flight and waiting is None:
+                    break
+                waits = [*in_flight, waiting] if waiting is not None and not waiting.done() else in_flight
+                timeout = hedger.next_check(self.scheduler.pending + primary) if hedger else None
+                done, _ = wait(waits, timeout=timeout, return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    if in_flight.pop(future, None) is None:
+                        continue
+                    for result in future.result():
+                        if hedger:
+                            hedger.done(result[0])
+                        self.scheduler.complete(result)
+                        completed += 1
+                        if total_segments is None:
+                            total_segments = self._playlist_parsed(playlist)
+                        progress = int((completed / total_segments) * 100) if total_segments else None
+
+                        if result[1]:
+                            self.log(self._progress_message(completed, total_segments), progress)
+                        else:
+                            failed.append(result[0])
+        finally:
+            executor.shutdown(wait=False)
+
+        if total_segments is None and not self.source_error:
+            # 最后几个分片可能在统计算好之前就已完成
+            self._range_counts.result()
+            self._playlist_parsed(playlist)
+        return self._finish_segments(failed)
+
+    async def download_all_segments_async(self, playlist):
+        """使用 asyncio 引擎下载所有分片（download_all_segments 在当前线程新建的事件循环中运行）"""
+        jobs = self._prepare_segments(playlist)
+        total_segments = len(playlist) if playlist.complete else None
+
+        if total_segments is not None:
+            self.log(f"[*] 共 {total_segments} 个分片，使用 asyncio 引擎 {self.max_workers} 并发下载")
+        else:
+            self.log(f"[*] 使用 asyncio 引擎 {self.max_workers} 并发下载")
+
+        completed = 0
+        failed = []
+
+        def on_result(result):
+            nonlocal completed, total_segments
+            completed += 1
+            if total_segments is None:
+                total_segments = self._playlist_parsed(playlist)
+            progress = int((completed / total_segments) * 100) if total_segments else None
+            if result[1]:
+                self.log(self._progress_message(completed, total_segments), progress)
+            else:
+                failed.append(result[0])
+
+        engine = AsyncSegmentEngine(self, self.max_workers, log=self.log, on_result=on_result, limiter=self.limiter,
+                                    hedger=self.hedger)
+        await engine.run(jobs, self.scheduler)
+
+        if self.cancel_flag:
+            return False
+        if total_segments is None and not self.source_error:
+            # 最后几个分片可能在统计算好之前就已完成
+            await asyncio.wrap_future(self._range_counts)
+            self._playlist_parsed(playlist)
+        return self._finish_segments(failed)
+
+    def merge_segments(self, total_segments):
         """合并ts分片"""
         output_file = self.output_dir / f"{self.output_name}.mp4"
         self.log(f"[*] 正在合并到: {output_file.name}")
 
-        ts_files = sorted(self.temp_dir.glob("segment_*.ts"))
+        # 按分片编号生成文件列表（超过 99999 个分片时文件名排序与播放顺序不一致）
+        ts_files = [self.temp_dir / segment_file_name(index) for index in range(total_segments)]
         if not ts_files:
             self.log("[!] 没有找到ts文件")
             return False
+        missing = sum(1 for path in ts_files if not path.exists())
+        if missing:
+            self.log(f"[!] 缺少 {missing} 个ts文件")
+            return False
 
         try:
+            # fMP4 分片拼接在初始化段之后就是有效的分片MP4，不需要 ffmpeg
+            if self.init_sections:
+                return self.merge_binary(ts_files, output_file)
             # 尝试FFmpeg
             if self.merge_with_ffmpeg(ts_files, output_file):
                 return True
-            # 二进制合并
+            # 内置转封装，不支持的编码再退回二进制合并
+            if self.merge_remux(ts_files, output_file):
+                return True
+            if self.cancel_flag:
+                return False
             self.log("[*] 使用二进制合并")
             return self.merge_binary(ts_files, output_file)
         except Exception as e:
             self.log(f"[!] 合并失败: {e}")
             return False
 
+    def start_stream_merge(self):
+        """
+        流式合并模式下创建按序写入器
+
+        ffmpeg 管道模式下先启动 ffmpeg，写入器的输出就是它的标准输入；
+        没有安装 ffmpeg 时退回流式合并，分片直接写入输出文件。
+        """
+        if not (self.stream_merge or self.ffmpeg_pipe):
+            return
+        output_file = self.output_dir / f"{self.output_name}.mp4"
+        if self.ffmpeg_pipe:
+            if ffmpeg_available():
+                self.log(f"[*] FFmpeg 管道模式，分片按序写入 ffmpeg，下载同时封装: {output_file.name}")
+                self.ffmpeg = FFmpegProcess.pipe(output_file)
+                self.segment_writer = OrderedSegmentWriter(self.ffmpeg.stdin, self.temp_dir, self.stream_buffer)
+                return
+            self.log("[!] 未找到FFmpeg，改为流式合并（分片按序直接写入输出文件）")
+        else:
+            self.log(f"[*] 流式合并模式，分片按序直接写入: {output_file.name}")
+        self.segment_writer = OrderedSegmentWriter(output_file, self.temp_dir, self.stream_buffer)
+
+    def finish_merge(self, playlist):
+        """完成合并：流式模式下检查写入结果，否则合并临时分片"""
+        if not self.segment_writer:
+            return self.merge_segments(len(playlist))
+
+        writer = self.segment_writer
+        writer.close()
+        if self.ffmpeg and not self.finish_ffmpeg():
+            return False
+        total_segments = len(playlist)
+        if writer.next_index != total_segments:
+            self.log(f"[!] 流式合并不完整: {writer.next_index}/{total_segments}")
+            return False
+        if writer.output_file is None:
+            # 写入的是 ffmpeg 管道，结果已由 finish_ffmpeg 报告
+            return True
+
+        size_mb = writer.bytes_written / (1024 * 1024)
+        self.log(f"[✓] 流式合并完成: {size_mb:.1f} MB，溢出到磁盘 {writer.spilled} 个分片")
+        return True
+
+    def finish_ffmpeg(self):
+        """等待管道模式的 ffmpeg 处理完剩余数据（写入器关闭后调用）"""
+        process, self.ffmpeg = self.ffmpeg, None
+        returncode = process.wait()
+        if returncode != 0:
+            self.log(f"[!] FFmpeg封装失败（退出码 {returncode}）: {process.error}")
+            return False
+        self.log(f"[✓] FFmpeg封装完成: {process.progress.describe()}", 100)
+        return True
+
     def merge_with_ffmpeg(self, ts_files, output_file):
-        """使用ffmpeg合并"""
-        import subprocess
+        """使用ffmpeg合并，-progress 输出换算成进度回调"""
+        if not ffmpeg_available():
+            return False
         try:
             filelist_path = self.temp_dir / "filelist.txt"
             with open(filelist_path, 'w', encoding='utf-8') as f:
                 for ts_file in ts_files:
                     f.write(f"file '{ts_file.absolute()}'\n")
 
-            cmd = ['ffmpeg', '-f', 'concat', '-safe', '0', '-i',
-                   str(filelist_path), '-c', 'copy', '-y', str(output_file)]
+            reported = -1
+
+            def on_progress(progress):
+                nonlocal reported
+                percent = min(int(progress.out_time * 100 / self.media_duration), 100) if self.media_duration else None
+                # 每个百分点只报告一次，避免刷屏
+                if percent is not None and percent <= reported:
+                    return
+                reported = percent if percent is not None else reported
+                self.log(f"[*] FFmpeg合并进度: {progress.describe(self.media_duration)}", percent)
 
-            result = subprocess.run(cmd, capture_output=True, text=True)
-            if result.returncode == 0:
+            process = FFmpegProcess.concat(filelist_path, output_file, on_progress)
+            returncode = process.wait()
+            if returncode == 0:
                 self.log("[✓] FFmpeg合并完成")
                 return True
+            self.log(f"[!] FFmpeg合并失败: {process.error}")
             return False
-        except:
+        except Exception as e:
+            self.log(f"[!] FFmpeg合并出错: {e}")
+            return False
+
+    def merge_remux(self, ts_files, output_file):
+        """不依赖 ffmpeg 把 TS 分片转封装为 MP4（单遍流式处理，内存占用与文件大小无关）"""
+        self.log("[*] 使用内置转封装")
+        remuxer = TSRemuxer(output_file, self.temp_dir)
+        try:
+            start = time.monotonic()
+            for i, ts_file in enumerate(ts_files):
+                if self.cancel_flag:
+                    remuxer.abort()
+                    return False
+                remuxer.write_file(ts_file)
+                progress = int(((i + 1) / len(ts_files)) * 100)
+                self.log(f"[*] 转封装进度: {i+1}/{len(ts_files)}", progress)
+            remuxer.finish()
+        except (ValueError, OSError) as e:
+            remuxer.abort()
+            self.log(f"[!] 转封装失败: {e}")
             return False
 
+        elapsed = max(time.monotonic() - start, 1e-6)
+        size_mb = remuxer.bytes_in / (1024 * 1024)
+        self.log(f"[✓] 转封装完成: {remuxer.describe()}，{size_mb:.1f} MB，{size_mb / elapsed:.1f} MB/s")
+        if remuxer.discontinuities:
+            self.log(f"[*] 已接续 {remuxer.discontinuities} 处时间戳不连续")
+        return True
+
     def merge_binary(self, ts_files, output_file):
-        """二进制合并"""
+        """二进制合并（内核态拷贝，数据不经过Python内存）"""
         try:
+            start = time.monotonic()
+            total_bytes = 0
+            init_key = None
             with open(output_file, 'wb') as outfile:
                 for i, ts_file in enumerate(ts_files):
                     if self.cancel_flag:
                         return False
-                    with open(ts_file, 'rb') as infile:
-                        outfile.write(infile.read())
+                    # fMP4：初始化段只在开头和发生变化的位置写入
+                    init = self.init_sections.get(i)
+                    if init is not None and init.key != init_key:
+                        outfile.write(init.data)
+                        total_bytes += len(init)
+                        init_key = init.key
+                    total_bytes += copy_file_into(outfile, ts_file)
                     progress = int(((i + 1) / len(ts_files)) * 100)
                     self.log(f"[*] 合并进度: {i+1}/{len(ts_files)}", progress)
-            self.log("[✓] 合并完成")
+            elapsed = max(time.monotonic() - start, 1e-6)
+            size_mb = total_bytes / (1024 * 1024)
+            self.log(f"[✓] 合并完成: {size_mb:.1f} MB，{size_mb / elapsed:.1f} MB/s")
             return True
         except Exception as e:
             self.log(f"[!] 合并失败: {e}")
@@ -404,11 +1134,19 @@ class M3U8DownloaderGUI:
         self.log("[*] 清理临时文件...")
         try:
             import shutil
+            if self.manifest:
+                self.manifest.close()
             shutil.rmtree(self.temp_dir)
             self.log("[✓] 临时文件已清理")
         except Exception as e:
             self.log(f"[!] 清理失败: {e}")
 
+    def _prepare_temp_dir(self):
+        """创建分片临时目录并加载断点续传清单"""
+        self.temp_dir = self.output_dir / self.temp_dir_name
+        self.temp_dir.mkdir(exist_ok=True)
+        self.manifest = SegmentManifest(self.temp_dir)
+
     def download(self):
         """执行下载"""
         try:
@@ -418,16 +1156,16 @@ class M3U8DownloaderGUI:
                 return self.download_youtube()
 
             # 原有的M3U8下载逻辑
-            self.temp_dir = self.output_dir / f"{self.output_name}_temp"
-            self.temp_dir.mkdir(exist_ok=True)
+            self._prepare_temp_dir()
             playlist = self.download_m3u8()
-            if not playlist:
+            if playlist is None:
                 return False
 
+            self.start_stream_merge()
             if not self.download_all_segments(playlist):
                 return False
 
-            if not self.merge_segments():
+            if not self.finish_merge(playlist):
                 return False
 
             self.cleanup()
@@ -439,6 +1177,17 @@ class M3U8DownloaderGUI:
         except Exception as e:
             self.log(f"[!] 错误: {e}")
             return False
+        finally:
+            if self.segment_writer:
+                self.segment_writer.close()
+            if self.ffmpeg:
+                # 下载失败或取消，放弃未完成的封装
+                if self.ffmpeg.failed:
+                    self.log(f"[!] FFmpeg已提前退出: {self.ffmpeg.error}")
+                self.ffmpeg.kill()
+            if self.manifest:
+                self.manifest.close()
+            self.close_session()
 
     def download_youtube(self):
         """使用 yt-dlp 命令行工具下载 YouTube 视频"""
@@ -594,6 +1343,12 @@ class BatchApplication(tk.Tk):
         # 变量
         self.dir_var = tk.StringVar(value=r"G:\BaiduNetdiskDownload\片片")
         self.threads_var = tk.StringVar(value="10")
+        self.engine_var = tk.StringVar(value=ENGINE_THREAD)
+        self.stream_merge_var = tk.BooleanVar(value=False)
+        self.ffmpeg_pipe_var = tk.BooleanVar(value=False)
+        self.adaptive_var = tk.BooleanVar(value=False)
+        self.decrypt_procs_var = tk.StringVar(value="0")
+        self.variant_var = tk.StringVar(value=DEFAULT_VARIANT_POLICY)
         self.url_input_var = tk.StringVar()
         self.filename_input_var = tk.StringVar()
         self.cookies_file_var = tk.StringVar()
@@ -768,7 +1523,18 @@ class BatchApplication(tk.Tk):
 
         # Threads
         ttk.Label(settings_frame, text="并发线程:").grid(row=0, column=0, sticky=tk.W)
-        ttk.Entry(settings_frame, textvariable=self.threads_var, width=10).grid(row=0, column=1, sticky=tk.W, padx=(10, 0))
+        threads_frame = ttk.Frame(settings_frame)
+        threads_frame.grid(row=0, column=1, sticky=tk.W, padx=(10, 0))
+        ttk.Entry(threads_frame, textvariable=self.threads_var, width=10).pack(side=tk.LEFT)
+        ttk.Combobox(threads_frame, textvariable=self.engine_var, values=ENGINES, state='readonly', width=8).pack(side=tk.LEFT, padx=(5, 0))
+        ttk.Checkbutton(threads_frame, text="边下边合并", variable=self.stream_merge_var).pack(side=tk.LEFT, padx=(10, 0))
+        ttk.Checkbutton(threads_frame, text="边下边封装", variable=self.ffmpeg_pipe_var).pack(side=tk.LEFT, padx=(10, 0))
+        ttk.Checkbutton(threads_frame, text="自适应并发", variable=self.adaptive_var).pack(side=tk.LEFT, padx=(10, 0))
+        ttk.Label(threads_frame, text="解密进程:").pack(side=tk.LEFT, padx=(10, 0))
+        ttk.Entry(threads_frame, textvariable=self.decrypt_procs_var, width=4).pack(side=tk.LEFT, padx=(5, 0))
+        ttk.Label(threads_frame, text="码率:").pack(side=tk.LEFT, padx=(10, 0))
+        ttk.Combobox(threads_frame, textvariable=self.variant_var, values=("best", "worst", "auto", "resolution=720"),
+                     width=14).pack(side=tk.LEFT, padx=(5, 0))
 
         # Proxy
         self.proxy_check = ttk.Checkbutton(settings_frame, text="启用代理", variable=self.use_proxy_var, command=self.toggle_proxy)
@@ -965,12 +1731,24 @@ class BatchApplication(tk.Tk):
             messagebox.showerror("错误", "请选择保存目录")
             return
 
+        # asyncio 引擎不占用线程，允许更高的并发请求数
+        max_threads = 500 if self.engine_var.get() == ENGINE_ASYNCIO else 50
         try:
             threads = int(self.threads_var.get())
-            if threads < 1 or threads > 50:
+            if threads < 1 or threads > max_threads:
+                raise ValueError
+        except:
+            messagebox.showerror("错误", f"线程数必须是1-{max_threads}之间的整数")
+            return
+
+        # 0 表示不启用；解密进程池在进程内共享，第一次启用后改动需重启程序才生效
+        max_procs = os.cpu_count() or 1
+        try:
+            decrypt_procs = int(self.decrypt_procs_var.get())
+            if decrypt_procs < 0 or decrypt_procs > max_procs:
                 raise ValueError
         except:
-            messagebox.showerror("错误", "线程数必须是1-50之间的整数")
+            messagebox.showerror("错误", f"解密进程数必须是0-{max_procs}之间的整数")
             return
 
         # 清空日志
@@ -990,6 +1768,7 @@ class BatchApplication(tk.Tk):
         """执行批量下载"""
         output_dir = self.dir_var.get().strip()
         threads = int(self.threads_var.get())
+        decrypt_procs = int(self.decrypt_procs_var.get())
         cookies_file = self.cookies_file_var.get().strip() or None
         cookies_browser = self.cookies_browser_var.get().strip() or None
         base_cookie_jar = self.browser_cookie_jar
@@ -1026,7 +1805,15 @@ class BatchApplication(tk.Tk):
                     proxy_url=self.proxy_url_var.get(),
                     cookies_file=cookies_file,
                     cookies_from_browser=cookies_browser,
-                    preloaded_cookie_jar=task_cookie_jar
+                    preloaded_cookie_jar=task_cookie_jar,
+                    shared_session=True,
+                    key_cache=shared_key_cache,
+                    engine=self.engine_var.get(),
+                    stream_merge=self.stream_merge_var.get(),
+                    ffmpeg_pipe=self.ffmpeg_pipe_var.get(),
+                    decrypt_processes=decrypt_procs,
+                    adaptive=self.adaptive_var.get(),
+                    variant=self.variant_var.get()
                 )
             except (FileNotFoundError, ValueError) as exc:
                 fail_count += 1
@@ -1122,4 +1909,5 @@ def main():
 
 
 if __name__ == '__main__':
+    multiprocessing.freeze_support()
     main()
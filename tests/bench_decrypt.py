@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+解密吞吐量对比：进程内解密 vs 解密进程池（--decrypt-procs）
+
+在本地生成 AES-128 加密的播放列表并用本地 HTTP 服务器提供，分别以
+decrypt_processes=0 和 N 下载同一个播放列表，报告总耗时和吞吐量并校验输出一致。
+结果取决于CPU核数（单核机器上进程池只会更慢），因此不作为 pytest 用例，直接运行：
+
+    python tests/bench_decrypt.py [--segments 24] [--size-mb 8] [--workers 8] [--procs 4]
+"""
+
+import argparse
+import hashlib
+import os
+import sys
+import tempfile
+import time
+from functools import partial
+from http.server import SimpleHTTPRequestHandler
+
+from Crypto.Cipher import AES
+from Crypto.Util.Padding import pad
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from conftest import LocalServer  # noqa: E402
+
+from m3u8_downloader import M3U8Downloader  # noqa: E402
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def build_playlist(directory, segments, size):
+    """生成 segments 个 size 字节的加密分片（每个分片显式 IV）"""
+    key = os.urandom(16)
+    with open(os.path.join(directory, 'key.bin'), 'wb') as f:
+        f.write(key)
+    lines = ['#EXTM3U', '#EXT-X-VERSION:3', '#EXT-X-TARGETDURATION:10', '#EXT-X-MEDIA-SEQUENCE:0']
+    plain = os.urandom(size)
+    for index in range(segments):
+        iv = index.to_bytes(16, 'big')
+        with open(os.path.join(directory, f'seg{index}.ts'), 'wb') as f:
+            f.write(AES.new(key, AES.MODE_CBC, iv).encrypt(pad(plain, AES.block_size)))
+        lines += [f'#EXT-X-KEY:METHOD=AES-128,URI="key.bin",IV=0x{iv.hex()}', '#EXTINF:10.0,', f'seg{index}.ts']
+    lines.append('#EXT-X-ENDLIST')
+    with open(os.path.join(directory, 'index.m3u8'), 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+def run(url, output_dir, name, workers, procs):
+    downloader = M3U8Downloader(url, output_dir, name, workers, decrypt_processes=procs)
+    start = time.perf_counter()
+    downloader.download()
+    elapsed = time.perf_counter() - start
+    path = os.path.join(output_dir, downloader.output_name + '.mp4')
+    with open(path, 'rb') as f:
+        digest = hashlib.md5(f.read()).hexdigest()
+    size = os.path.getsize(path)
+    os.remove(path)
+    return elapsed, size, digest
+
+
+def main():
+    parser = argparse.ArgumentParser(description='解密吞吐量对比')
+    parser.add_argument('--segments', type=int, default=24)
+    parser.add_argument('--size-mb', type=float, default=8)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--procs', type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        site = os.path.join(directory, 'site')
+        os.mkdir(site)
+        build_playlist(site, args.segments, int(args.size_mb * 1024 * 1024))
+        server = LocalServer(partial(QuietHandler, directory=site))
+        try:
+            url = server.url('/index.m3u8')
+            results = {}
+            for procs in (0, args.procs):
+                results[procs] = run(url, directory, f'procs{procs}', args.workers, procs)
+        finally:
+            server.close()
+
+    print(f"\nCPU 核数: {os.cpu_count()}，{args.segments} 个 {args.size_mb}MB 分片，{args.workers} 线程")
+    for procs, (elapsed, size, digest) in results.items():
+        label = '进程内解密' if procs == 0 else f'解密进程池 ({procs} 进程)'
+        print(f"  {label}: {elapsed:.2f}s, {size / elapsed / 1024 / 1024:.0f} MB/s, md5 {digest}")
+    digests = {digest for _, _, digest in results.values()}
+    print("  输出一致" if len(digests) == 1 else "  [!] 输出不一致")
+    return 0 if len(digests) == 1 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
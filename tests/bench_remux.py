@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+内置转封装吞吐量：合成一段 H.264 + AAC 的 TS 片段（与 test_remux 相同的生成方式），
+用 TSRemuxer 按文件转为 MP4，报告耗时、吞吐量和输出的样本数，并与直接拷贝文件的耗时对比。
+结果取决于机器，因此不作为 pytest 用例，直接运行：
+
+    python tests/bench_remux.py [--seconds 60] [--frame-kb 20] [--segments 10]
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+TESTS = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [TESTS, os.path.dirname(TESTS)]
+from test_remux import FRAME_TICKS, synthetic_ts  # noqa: E402
+
+from hls_core import TSRemuxer, segment_file_name  # noqa: E402
+
+
+def build_segments(directory, seconds, frame_kb, segments):
+    """生成 segments 个分片文件，总时长 seconds 秒，每个分片从新的时间戳开始"""
+    frames = max(1, seconds * 25 // segments)
+    paths = []
+    for index in range(segments):
+        data, _, _ = synthetic_ts([(frames, 900000 + index * frames * FRAME_TICKS)], int(frame_kb * 1024))
+        path = os.path.join(directory, segment_file_name(index))
+        with open(path, 'wb') as f:
+            f.write(data)
+        paths.append(path)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description='内置转封装吞吐量')
+    parser.add_argument('--seconds', type=int, default=60)
+    parser.add_argument('--frame-kb', type=float, default=20)
+    parser.add_argument('--segments', type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        paths = build_segments(directory, args.seconds, args.frame_kb, args.segments)
+        size = sum(os.path.getsize(path) for path in paths)
+
+        start = time.perf_counter()
+        with open(os.path.join(directory, 'copy.ts'), 'wb') as out:
+            for path in paths:
+                with open(path, 'rb') as f:
+                    shutil.copyfileobj(f, out)
+        copy_elapsed = time.perf_counter() - start
+
+        output = os.path.join(directory, 'out.mp4')
+        start = time.perf_counter()
+        remuxer = TSRemuxer(output)
+        for path in paths:
+            remuxer.write_file(path)
+        remuxer.finish()
+        elapsed = time.perf_counter() - start
+        output_size = os.path.getsize(output)
+
+    samples = '，'.join(f"{track.codec} {len(track.sizes)} 个样本" for track in remuxer.tracks)
+    print(f"\n{args.segments} 个分片，共 {size / 1024 / 1024:.1f} MB，{remuxer.describe()}")
+    print(f"  转封装: {elapsed:.2f}s, {size / elapsed / 1024 / 1024:.0f} MB/s，输出 {output_size / 1024 / 1024:.1f} MB（{samples}）")
+    print(f"  二进制拷贝: {copy_elapsed:.2f}s, {size / max(copy_elapsed, 1e-6) / 1024 / 1024:.0f} MB/s")
+    expected = args.segments * max(1, args.seconds * 25 // args.segments)
+    video = remuxer.tracks[0]
+    print("  样本数正确" if len(video.sizes) == expected else f"  [!] 视频样本数 {len(video.sizes)}，应为 {expected}")
+    return 0 if len(video.sizes) == expected else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
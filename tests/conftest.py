@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""
+测试公共部分
+在仓库根目录运行: python -m pytest
+"""
+
+import os
+import sys
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+class LocalServer:
+    """在后台线程运行的本地 HTTP 服务器，端口自动分配"""
+
+    def __init__(self, handler, wrap_socket=None):
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self.httpd.daemon_threads = True
+        if wrap_socket is not None:
+            self.httpd.socket = wrap_socket(self.httpd.socket)
+        self.port = self.httpd.server_address[1]
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+
+    def url(self, path, scheme='http'):
+        return f"{scheme}://127.0.0.1:{self.port}{path}"
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def serve():
+    """serve(handler_class, wrap_socket=None) 启动本地服务器，测试结束时关闭"""
+    servers = []
+
+    def start(handler, wrap_socket=None):
+        server = LocalServer(handler, wrap_socket)
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.close()
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+asyncio（aiohttp）引擎端到端：本地服务器上的加密播放列表，分片返回 500 后重试、
+传输中断后用 Range 续传（解密状态接着用），命令行版和 GUI/Web 版下载器都走同一引擎
+"""
+
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+from Crypto.Cipher import AES
+from Crypto.Util.Padding import pad
+
+from hls_core import ENGINE_ASYNCIO, RetryPolicy, asyncio_available
+
+from m3u8_downloader import M3U8Downloader
+from m3u8_downloader_gui import M3U8DownloaderGUI
+
+
+pytestmark = pytest.mark.skipif(not asyncio_available(), reason='asyncio 引擎需要 aiohttp')
+
+KEY = bytes(range(16, 32))
+SEGMENTS = 6
+# 第一次请求返回 500 的分片，和第一次只发出一部分就断开的分片
+FAILING = {1, 4}
+DROPPED = {2, 5}
+
+
+def plain(index):
+    return bytes([index]) * 3000 + bytes(range(256)) * (1000 + index)
+
+
+def encrypted(index):
+    # 没有显式 IV，按媒体序列号生成
+    return AES.new(KEY, AES.MODE_CBC, index.to_bytes(16, 'big')).encrypt(pad(plain(index), AES.block_size))
+
+
+class FlakyHandler(BaseHTTPRequestHandler):
+    """AES-128 加密的点播播放列表；记录密钥请求次数和每个分片请求的 (Range, If-Range)"""
+
+    protocol_version = 'HTTP/1.1'
+    lock = threading.Lock()
+    key_requests = 0
+    requests = {}
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path == '/vod.m3u8':
+            lines = ['#EXTM3U', '#EXT-X-TARGETDURATION:4', '#EXT-X-KEY:METHOD=AES-128,URI="key.bin"']
+            for index in range(SEGMENTS):
+                lines += ['#EXTINF:4.0,', f'seg{index}.ts']
+            self.reply(200, ('\n'.join(lines + ['#EXT-X-ENDLIST']) + '\n').encode())
+            return
+        if self.path == '/key.bin':
+            with self.lock:
+                FlakyHandler.key_requests += 1
+            self.reply(200, KEY)
+            return
+        index = int(self.path[len('/seg'):-len('.ts')])
+        with self.lock:
+            seen = FlakyHandler.requests.setdefault(index, [])
+            seen.append((self.headers.get('Range'), self.headers.get('If-Range')))
+            first = len(seen) == 1
+        body = encrypted(index)
+        headers = {'ETag': f'"seg{index}"', 'Accept-Ranges': 'bytes'}
+        if first and index in FAILING:
+            self.reply(500, b'upstream error')
+        elif first and index in DROPPED:
+            # 断在 AES 块中间
+            self.reply(200, body, headers, cut=len(body) // 2 + 5)
+        elif self.headers.get('Range') and self.headers.get('If-Range') == headers['ETag']:
+            start = int(self.headers['Range'][len('bytes='):-1])
+            headers['Content-Range'] = f'bytes {start}-{len(body) - 1}/{len(body)}'
+            self.reply(206, body[start:], headers)
+        else:
+            self.reply(200, body, headers)
+
+    def reply(self, status, body, headers=None, cut=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body if cut is None else body[:cut])
+        if cut is not None:
+            # 先让客户端读走已发出的数据再断开；断开时还没读取的数据会连同错误一起丢弃
+            self.wfile.flush()
+            time.sleep(0.1)
+            self.close_connection = True
+
+
+def run_cli(url, tmp_path):
+    downloader = M3U8Downloader(url, str(tmp_path), 'vod', max_workers=3, engine=ENGINE_ASYNCIO,
+                                retry_policy=RetryPolicy(attempts=3, base_delay=0.01, max_delay=0.05))
+    assert downloader.download(keep_temp=True)
+    return downloader
+
+
+def run_gui(url, tmp_path):
+    # Web 服务在工作线程中调用 download()，asyncio 引擎在该线程的事件循环里运行
+    downloader = M3U8DownloaderGUI(url, str(tmp_path), 'vod', max_workers=3, engine=ENGINE_ASYNCIO,
+                                   retry_policy=RetryPolicy(attempts=3, base_delay=0.01, max_delay=0.05))
+    downloader.cleanup = lambda: None
+    result = []
+    thread = threading.Thread(target=lambda: result.append(downloader.download()))
+    thread.start()
+    thread.join(60)
+    assert result == [True]
+    return downloader
+
+
+@pytest.mark.parametrize('run', [run_cli, run_gui], ids=['cli', 'gui'])
+def test_retry_decrypt_and_resume(serve, tmp_path, run):
+    FlakyHandler.key_requests = 0
+    FlakyHandler.requests = {}
+    server = serve(FlakyHandler)
+    downloader = run(server.url('/vod.m3u8'), tmp_path)
+
+    for index in range(SEGMENTS):
+        assert (downloader.temp_dir / f'segment_{index:05d}.ts').read_bytes() == plain(index)
+    # 所有分片共用一个密钥，只请求一次
+    assert FlakyHandler.key_requests == 1
+
+    for index, seen in FlakyHandler.requests.items():
+        if index in FAILING:
+            # 500 之后从头重新请求
+            assert seen == [(None, None), (None, None)]
+        elif index in DROPPED:
+            # 中断后只请求剩下的部分，并用 ETag 确认资源没有变化
+            assert len(seen) == 2 and seen[0] == (None, None)
+            assert seen[1][0].startswith('bytes=') and seen[1][1] == f'"seg{index}"'
+        else:
+            assert seen == [(None, None)]
+    assert downloader.retry_stats.retries['http_500'] == len(FAILING)
+    assert downloader.retry_stats.resumed == len(DROPPED)
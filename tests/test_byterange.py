@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""EXT-X-BYTERANGE：解析、合并成 Range 请求，以及按分片切开响应"""
+
+import re
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler
+from types import SimpleNamespace
+
+import pytest
+
+from hls_core import (
+    RangeJob,
+    RangeReceiver,
+    count_range_jobs,
+    parse_byterange,
+    plan_range_jobs,
+    response_offset,
+)
+
+from m3u8_downloader import M3U8Downloader
+
+
+BASE = 'https://cdn.example.com/video/index.m3u8'
+
+
+def seg(uri, byterange=None):
+    return SimpleNamespace(uri=uri, byterange=byterange)
+
+
+def test_parse_byterange():
+    assert parse_byterange('1000@500') == (500, 1000)
+    assert parse_byterange('1000', previous_end=1500) == (1500, 1000)
+    with pytest.raises(ValueError):
+        parse_byterange('1000')
+
+
+def describe(jobs):
+    out = []
+    for job in jobs:
+        if isinstance(job, RangeJob):
+            out.append((job.url.rsplit('/', 1)[-1], [m.index for m in job.members], job.start, job.end))
+        elif isinstance(job, Future):
+            out.append('future')
+        else:
+            out.append(job[0])
+    return out
+
+
+def test_contiguous_ranges_are_merged_per_resource():
+    segments = [
+        seg('main.ts', '100@0'), seg('main.ts', '100'), seg('main.ts', '100'),
+        seg('main.ts', '100@1000'),                # 不相接，另起请求
+        seg('other.ts', '50@0'), seg('other.ts', '50'),
+        seg('plain.ts'),                           # 普通分片原样保留
+        seg('main.ts', '100'),                     # 接着 main.ts 的上一个范围（1100）
+    ]
+    jobs = list(plan_range_jobs(enumerate(segments), BASE))
+    assert describe(jobs) == [
+        ('main.ts', [0, 1, 2], 0, 300),
+        ('main.ts', [3], 1000, 1100),
+        ('other.ts', [4, 5], 0, 100),
+        6,
+        ('main.ts', [7], 1100, 1200),
+    ]
+    assert jobs[0].url == 'https://cdn.example.com/video/main.ts'
+    assert count_range_jobs(jobs) == (4, 7)
+
+
+def test_max_request_bytes_splits_jobs():
+    segments = [seg('main.ts', '100') for _ in range(5)]
+    segments[0] = seg('main.ts', '100@0')
+    assert [len(job) for job in plan_range_jobs(enumerate(segments), BASE, max_request_bytes=250)] == [2, 2, 1]
+    assert [len(job) for job in plan_range_jobs(enumerate(segments), BASE, max_request_bytes=0)] == [1] * 5
+
+
+def test_future_flushes_pending_job_first():
+    waiting = Future()
+    items = [(0, seg('main.ts', '100@0')), (1, seg('main.ts', '100')), waiting, (2, seg('main.ts', '100'))]
+    jobs = list(plan_range_jobs(iter(items), BASE))
+    assert describe(jobs) == [('main.ts', [0, 1], 0, 200), 'future', ('main.ts', [2], 200, 300)]
+    assert jobs[1] is waiting
+
+
+def test_plan_is_lazy():
+    consumed = []
+
+    def segments():
+        for index in range(1000):
+            consumed.append(index)
+            yield index, seg(f'{index}.ts')
+
+    jobs = plan_range_jobs(segments(), BASE)
+    assert next(jobs)[0] == 0
+    assert consumed == [0]
+
+
+@pytest.mark.parametrize('status, headers, offset', [
+    (206, {'Content-Range': 'bytes 1000-1999/5000'}, 1000),
+    (200, {}, 0),
+])
+def test_response_offset(status, headers, offset):
+    assert response_offset(status, headers, 1000) == offset
+
+
+def test_response_offset_rejects_range_past_request():
+    with pytest.raises(ValueError):
+        response_offset(206, {'Content-Range': 'bytes 1500-1999/5000'}, 1000)
+    with pytest.raises(ValueError):
+        response_offset(206, {}, 1000)
+
+
+class Sink:
+    def __init__(self):
+        self.data = bytearray()
+        self.aborted = False
+
+    def write(self, chunk):
+        self.data += chunk
+
+    def abort(self):
+        self.aborted = True
+
+
+def receive(members, offset, body, chunk_size):
+    receiver = RangeReceiver(members, offset, lambda member: Sink())
+    completed = {}
+    for i in range(0, len(body), chunk_size):
+        for member in receiver.feed(body[i:i + chunk_size]):
+            completed[member.index] = bytes(receiver.take(member).data)
+        if receiver.done:
+            break
+    return completed
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 100, 4096])
+def test_receiver_splits_response_into_segments(chunk_size):
+    resource = bytes(range(256)) * 20
+    job = next(iter(plan_range_jobs(
+        [(0, seg('a.ts', '300@1000')), (1, seg('a.ts', '1')), (2, seg('a.ts', '699'))], BASE)))
+    expected = {m.index: resource[m.start:m.end] for m in job.members}
+
+    # 206：响应从请求起点开始
+    assert receive(job.members, job.start, resource[job.start:job.end], chunk_size) == expected
+    # 200：服务器忽略 Range 返回整个资源，跳过前面不需要的部分
+    assert receive(job.members, 0, resource, chunk_size) == expected
+
+
+def test_receiver_abort_discards_partial_segments():
+    job = next(iter(plan_range_jobs([(0, seg('a.ts', '100@0')), (1, seg('a.ts', '100'))], BASE)))
+    sinks = []
+
+    def open_sink(member):
+        sinks.append(Sink())
+        return sinks[-1]
+
+    receiver = RangeReceiver(job.members, 0, open_sink)
+    assert [m.index for m in receiver.feed(b'x' * 150)] == [0]
+    receiver.take(job.members[0])
+    receiver.abort()
+    assert [sink.aborted for sink in sinks] == [False, True]
+    assert not receiver.done
+
+
+RESOURCE = bytes(range(256)) * 64
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """单个资源 + 按字节范围切分的播放列表，记录分片请求"""
+
+    protocol_version = 'HTTP/1.1'
+    ranges = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path == '/video.m3u8':
+            lines = ['#EXTM3U', '#EXT-X-VERSION:4', '#EXT-X-TARGETDURATION:4', '#EXTINF:4.0,',
+                     '#EXT-X-BYTERANGE:1000@0', 'all.ts']
+            for _ in range(15):
+                lines += ['#EXTINF:4.0,', '#EXT-X-BYTERANGE:1000', 'all.ts']
+            self.reply(200, ('\n'.join(lines + ['#EXT-X-ENDLIST']) + '\n').encode())
+            return
+        match = re.fullmatch(r'bytes=(\d+)-(\d+)', self.headers.get('Range', ''))
+        start, end = int(match.group(1)), int(match.group(2)) + 1
+        RangeHandler.ranges.append((start, end))
+        self.reply(206, RESOURCE[start:end], {'Content-Range': f'bytes {start}-{end - 1}/{len(RESOURCE)}'})
+
+    def reply(self, status, body, headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def test_downloader_coalesces_byterange_requests(serve, tmp_path):
+    RangeHandler.ranges = []
+    server = serve(RangeHandler)
+    downloader = M3U8Downloader(server.url('/video.m3u8'), str(tmp_path), 'video', max_workers=2)
+    downloader.download(keep_temp=True)
+
+    # 16 个首尾相接的 1000 字节分片合并成一个 Range 请求
+    assert RangeHandler.ranges == [(0, 16000)]
+    for index in range(16):
+        assert (downloader.temp_dir / f'segment_{index:05d}.ts').read_bytes() == RESOURCE[index * 1000:(index + 1) * 1000]
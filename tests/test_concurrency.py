@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""
+自适应并发：慢启动翻倍到上限、吞吐量下降后改为每轮加1、失败（429/503/超时）和
+TTFB 升高时按比例退让到下限，以及本地服务器限流时下载器的退让
+"""
+
+import threading
+from http.server import BaseHTTPRequestHandler
+from types import SimpleNamespace
+
+import pytest
+
+from hls_core import AdaptiveLimiter, RetryPolicy
+from hls_core import concurrency as concurrency_module
+
+from m3u8_downloader import M3U8Downloader
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(concurrency_module, 'time', SimpleNamespace(monotonic=clock))
+    return clock
+
+
+def run_round(limiter, clock, nbytes=1000, ttfb=0.1, seconds=1.0):
+    """占满当前并发，经过 seconds 秒后全部成功完成（一轮采样窗口）"""
+    tokens = [limiter.try_acquire() for _ in range(limiter.limit)]
+    assert None not in tokens and limiter.try_acquire() is None
+    clock.now += seconds
+    for token in tokens:
+        limiter.release(token, True, nbytes, ttfb)
+    return limiter.limit
+
+
+def test_slow_start_doubles_up_to_ceiling(clock):
+    limiter = AdaptiveLimiter(48, initial=2)
+    assert [run_round(limiter, clock) for _ in range(6)] == [4, 8, 16, 32, 48, 48]
+    assert limiter.summary() == (48, 48, 0)
+    assert limiter.in_flight == 0
+
+
+def test_throughput_drop_ends_slow_start(clock):
+    limiter = AdaptiveLimiter(100, initial=4)
+    assert run_round(limiter, clock) == 8
+    # 每个请求的字节数减半，8 个请求的吞吐量与上一轮 4 个请求相同：仍在增长，继续翻倍
+    assert run_round(limiter, clock, nbytes=500) == 16
+    # 吞吐量下降：并发不变，退出慢启动
+    assert run_round(limiter, clock, nbytes=100) == 16
+    # 之后每轮加1
+    assert [run_round(limiter, clock) for _ in range(3)] == [17, 18, 19]
+    assert limiter.decreases == 0
+
+
+def test_additive_growth_stops_at_ceiling(clock):
+    limiter = AdaptiveLimiter(6, initial=4)
+    run_round(limiter, clock, nbytes=10_000)
+    run_round(limiter, clock, nbytes=1)
+    assert [run_round(limiter, clock, nbytes=10_000) for _ in range(3)] == [6, 6, 6]
+
+
+@pytest.mark.parametrize('failure', [
+    SimpleNamespace(name='http_429', ttfb=0.05),
+    SimpleNamespace(name='http_503', ttfb=0.05),
+    SimpleNamespace(name='timeout', ttfb=None),
+], ids=lambda failure: failure.name)
+def test_failures_back_off_to_floor(clock, failure):
+    limiter = AdaptiveLimiter(64, initial=32, min_limit=3)
+    tokens = [limiter.acquire() for _ in range(32)]
+    # 限流、服务端错误和超时都以失败归还名额：并发减半
+    limiter.release(tokens.pop(), False, 0, failure.ttfb)
+    assert limiter.limit == 16
+    # 退让前发出的请求再失败不重复退让
+    for token in tokens[:10]:
+        limiter.release(token, False, 0, failure.ttfb)
+    assert limiter.limit == 16 and limiter.decreases == 1
+    for token in tokens[10:]:
+        limiter.release(token, True, 1000, 0.1)
+
+    # 之后发出的请求失败继续退让，不低于下限
+    limits = []
+    for _ in range(4):
+        limiter.release(limiter.acquire(), False, 0, failure.ttfb)
+        limits.append(limiter.limit)
+    assert limits == [8, 4, 3, 3]
+    assert limiter.summary() == (3, 32, 5)
+
+    # 退让后退出慢启动，恢复时每轮只加1
+    assert [run_round(limiter, clock) for _ in range(2)] == [4, 5]
+
+
+def test_ttfb_rise_backs_off(clock):
+    limiter = AdaptiveLimiter(64, initial=8)
+    assert run_round(limiter, clock, ttfb=0.1) == 16
+    # TTFB 中位数超过基线的 1.5 倍：乘以 0.75
+    assert run_round(limiter, clock, ttfb=0.2) == 12
+    assert limiter.decreases == 1
+    # 基线上浮 10%（0.11），0.17 仍超过它的 1.5 倍；0.15 不超过，按吞吐量加1
+    assert run_round(limiter, clock, ttfb=0.17) == 9
+    assert run_round(limiter, clock, ttfb=0.15) == 10
+
+
+def test_not_adaptive_is_fixed(clock):
+    limiter = AdaptiveLimiter(5, adaptive=False)
+    assert limiter.limit == limiter.min_limit == 5
+    tokens = [limiter.acquire() for _ in range(5)]
+    assert limiter.try_acquire() is None
+    for token in tokens:
+        limiter.release(token, False)
+    assert limiter.summary() == (5, 5, 0)
+
+
+def test_bounds_are_clamped():
+    assert AdaptiveLimiter(4, initial=10).limit == 4
+    assert AdaptiveLimiter(4, initial=0, min_limit=2).limit == 2
+    limiter = AdaptiveLimiter(0, min_limit=3)
+    assert (limiter.max_limit, limiter.min_limit, limiter.limit) == (1, 1, 1)
+
+
+def test_acquire_blocks_until_release():
+    limiter = AdaptiveLimiter(1, initial=1)
+    token = limiter.acquire()
+    acquired = threading.Event()
+    thread = threading.Thread(target=lambda: (limiter.acquire(), acquired.set()))
+    thread.start()
+    assert not acquired.wait(0.1)
+    limiter.release(token, True)
+    assert acquired.wait(10)
+    thread.join(10)
+
+
+SEGMENTS = 12
+
+
+class ThrottlingHandler(BaseHTTPRequestHandler):
+    """每个分片的第一次请求返回 429（奇数分片）或 503（偶数分片），之后正常"""
+
+    protocol_version = 'HTTP/1.1'
+    lock = threading.Lock()
+    requests = {}
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path == '/vod.m3u8':
+            lines = ['#EXTM3U', '#EXT-X-TARGETDURATION:4']
+            for index in range(SEGMENTS):
+                lines += ['#EXTINF:4.0,', f'seg{index}.ts']
+            self.reply(200, ('\n'.join(lines + ['#EXT-X-ENDLIST']) + '\n').encode())
+            return
+        index = int(self.path[len('/seg'):-len('.ts')])
+        with self.lock:
+            count = ThrottlingHandler.requests[index] = ThrottlingHandler.requests.get(index, 0) + 1
+        if count == 1:
+            self.reply(429 if index % 2 else 503, b'busy', {'Retry-After': '0'})
+        else:
+            self.reply(200, bytes([index]) * 2000)
+
+    def reply(self, status, body, headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def test_downloader_backs_off_on_throttling(serve, tmp_path):
+    ThrottlingHandler.requests = {}
+    server = serve(ThrottlingHandler)
+    downloader = M3U8Downloader(server.url('/vod.m3u8'), str(tmp_path), 'vod', max_workers=8, adaptive=True,
+                                retry_policy=RetryPolicy(attempts=4, base_delay=0.01, max_delay=0.05))
+    assert downloader.download(keep_temp=True)
+
+    limit, peak, decreases = downloader.limiter.summary()
+    assert decreases >= 1
+    assert 1 <= limit <= peak <= 8
+    assert downloader.retry_stats.retries['http_429'] + downloader.retry_stats.retries['http_503'] == SEGMENTS
+    for index in range(SEGMENTS):
+        assert (downloader.temp_dir / f'segment_{index:05d}.ts').read_bytes() == bytes([index]) * 2000
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""分片解密：增量 AES-128-CBC 解密，以及解密进程池（共享内存）"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from Crypto.Cipher import AES
+from Crypto.Util.Padding import pad
+
+from hls_core import DecryptPool, StreamingDecryptor, segment_iv
+
+
+KEY = bytes(range(16))
+IV = bytes(range(16, 32))
+
+
+def encrypt(plain, key=KEY, iv=IV):
+    return AES.new(key, AES.MODE_CBC, iv).encrypt(pad(plain, AES.block_size))
+
+
+def decrypt_in_chunks(data, chunk_size, key=KEY, iv=IV):
+    decryptor = StreamingDecryptor(key, iv)
+    out = [decryptor.update(data[i:i + chunk_size]) for i in range(0, len(data), chunk_size)]
+    out.append(decryptor.finalize())
+    return b''.join(out)
+
+
+@pytest.mark.parametrize('size', [0, 1, 15, 16, 17, 188 * 1000])
+@pytest.mark.parametrize('chunk_size', [1, 7, 16, 4096, 65536])
+def test_matches_whole_segment_decryption(size, chunk_size):
+    plain = os.urandom(size)
+    assert decrypt_in_chunks(encrypt(plain), chunk_size) == plain
+
+
+def test_accepts_memoryview_and_bytearray_chunks():
+    plain = os.urandom(10000)
+    data = encrypt(plain)
+    decryptor = StreamingDecryptor(KEY, IV)
+    out = decryptor.update(memoryview(data)[:5000]) + decryptor.update(bytearray(data[5000:]))
+    assert out + decryptor.finalize() == plain
+
+
+def test_holds_back_last_block_until_finalize():
+    decryptor = StreamingDecryptor(KEY, IV)
+    # 只收到一个完整块时还不知道是不是最后一块（带填充），先不输出
+    assert decryptor.update(encrypt(b'a' * 10)) == b''
+    assert decryptor.finalize() == b'a' * 10
+
+
+def test_invalid_padding_keeps_decrypted_data():
+    plain = os.urandom(32)
+    data = AES.new(KEY, AES.MODE_CBC, IV).encrypt(plain[:-1] + b'\x00')
+    assert decrypt_in_chunks(data, 5) == plain[:-1] + b'\x00'
+
+
+def test_unaligned_tail_is_kept_as_is():
+    plain = b'b' * 20
+    data = encrypt(plain) + b'xyz'
+    # 无法对齐16字节的尾部原样接在明文后面
+    assert decrypt_in_chunks(data, 9) == plain + b'xyz'
+
+
+def test_segment_iv_defaults_to_media_sequence():
+    assert segment_iv(None, 0) == bytes(16)
+    assert segment_iv(None, 258) == (258).to_bytes(16, 'big')
+    assert segment_iv(IV, 258) == IV
+
+
+def test_default_iv_round_trip():
+    plain = os.urandom(4000)
+    iv = segment_iv(None, 7)
+    assert decrypt_in_chunks(encrypt(plain, iv=iv), 1000, iv=iv) == plain
+
+
+@pytest.fixture(scope='module')
+def decrypt_pool():
+    pool = DecryptPool(2)
+    yield pool
+    pool.shutdown()
+
+
+def offloaded(pool, data, size_hint=None, chunk_size=65536, key=KEY, iv=IV):
+    job = pool.open(key, iv, size_hint)
+    try:
+        for i in range(0, len(data), chunk_size):
+            job.write(data[i:i + chunk_size])
+        return bytes(job.result())
+    finally:
+        job.release()
+
+
+@pytest.mark.parametrize('size', [0, 15, 16, 188 * 1000, 3 * 1024 * 1024 + 5])
+def test_pool_matches_streaming_decryptor(decrypt_pool, size):
+    plain = os.urandom(size)
+    data = encrypt(plain)
+    assert offloaded(decrypt_pool, data) == plain == decrypt_in_chunks(data, 4096)
+
+
+def test_pool_grows_shared_memory_past_size_hint(decrypt_pool):
+    plain = os.urandom(2 * 1024 * 1024)
+    # 预留 1MB（Content-Length 不准确）时写入过程中换用更大的共享内存
+    assert offloaded(decrypt_pool, encrypt(plain), size_hint=1024) == plain
+
+
+def test_pool_keeps_invalid_padding_and_unaligned_tail(decrypt_pool):
+    data = AES.new(KEY, AES.MODE_CBC, IV).encrypt(b'c' * 31 + b'\x00') + b'xyz'
+    assert offloaded(decrypt_pool, data) == decrypt_in_chunks(data, 7) == b'c' * 31 + b'\x00xyz'
+
+
+def test_pool_decrypts_concurrent_segments(decrypt_pool):
+    plains = [os.urandom(100000 + i) for i in range(16)]
+    ivs = [segment_iv(None, i) for i in range(16)]
+    with ThreadPoolExecutor(4) as executor:
+        results = list(executor.map(lambda i: offloaded(decrypt_pool, encrypt(plains[i], iv=ivs[i]), iv=ivs[i]),
+                                    range(16)))
+    assert results == plains
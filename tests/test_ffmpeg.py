@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+FFmpeg 子进程：-progress 输出的解析（含 progress=end 和缺失字段），用模拟的 ffmpeg 脚本
+检查后台线程的进度回调和错误输出，以及安装了 ffmpeg 时的管道封装
+"""
+
+import os
+import stat
+import sys
+
+import pytest
+
+from hls_core import FFmpegProcess, ffmpeg_available, format_seconds
+from hls_core.ffmpeg import STDERR_TAIL_LINES, FFmpegProgress, parse_progress
+
+
+BLOCKS = """\
+frame=120
+fps=0.00
+out_time_us=4000000
+out_time_ms=4000000
+out_time=00:00:04.000000
+total_size=1048576
+speed=41.2x
+progress=continue
+frame=300
+out_time_us=10500000
+total_size=2621440
+speed=40.7x
+progress=end
+"""
+
+
+def test_parse_progress_blocks():
+    blocks = list(parse_progress(BLOCKS.splitlines(keepends=True)))
+    assert [(b.out_time, b.total_size, b.speed, b.done) for b in blocks] == [
+        (4.0, 1048576, '41.2x', False),
+        (10.5, 2621440, '40.7x', True),
+    ]
+    assert blocks[1].describe(duration=60) == "00:00:10/00:01:00，2.5 MB，40.7x"
+    assert blocks[0].describe() == "00:00:04，1.0 MB，41.2x"
+
+
+def test_parse_progress_missing_and_invalid_fields():
+    lines = [
+        # 刚启动时还没有时间和大小
+        'progress=continue\n',
+        # 旧版本只有 out_time_ms（单位实际是微秒）；speed 为 N/A
+        'out_time_ms=2500000\r\n', 'total_size=N/A\n', 'speed=N/A\n', 'progress=continue\n',
+        # 开头的负时间戳；没有 = 的行忽略
+        'out_time_us=-23220\n', 'garbage line\n', 'total_size=100\n', 'progress=continue\n',
+        'out_time_us=N/A\n', 'progress=end\n',
+        # 最后一块没有 progress= 行（进程被中断）时不产出
+        'out_time_us=99000000\n', 'total_size=5\n',
+    ]
+    blocks = list(parse_progress(lines))
+    # 每块的字段不沿用上一块
+    assert [(b.out_time, b.total_size, b.speed, b.done) for b in blocks] == [
+        (0.0, 0, None, False),
+        (2.5, 0, None, False),
+        (0.0, 100, None, False),
+        (0.0, 0, None, True),
+    ]
+    assert FFmpegProgress().describe() == "00:00:00，0.0 MB"
+
+
+def test_format_seconds():
+    assert format_seconds(0) == "00:00:00"
+    assert format_seconds(3723.9) == "01:02:03"
+    assert format_seconds(100 * 3600) == "100:00:00"
+
+
+FAKE_FFMPEG = '''\
+#!{python}
+# 模拟 ffmpeg：读完标准输入后按读到的字节数输出进度块，错误输出写 stderr
+import sys
+
+args = sys.argv[1:]
+size = len(sys.stdin.buffer.read()) if 'pipe:0' in args else 0
+out = sys.stdout
+for i in range(1, 4):
+    out.write(f"out_time_us={{i * 1000000}}\\ntotal_size={{size * i // 3}}\\nspeed=2x\\n")
+    out.write("progress=" + ("end" if i == 3 else "continue") + "\\n")
+    out.flush()
+for n in range({errors}):
+    sys.stderr.write(f"error line {{n}}\\n")
+with open(args[-1], 'wb') as f:
+    f.write(b'mp4')
+sys.exit({code})
+'''
+
+
+@pytest.fixture
+def fake_ffmpeg(tmp_path, monkeypatch):
+    """把模拟的 ffmpeg 放到 PATH 最前面；返回 install(errors, code)"""
+    if sys.platform == 'win32':
+        pytest.skip('模拟 ffmpeg 脚本需要 POSIX')
+    bin_dir = tmp_path / 'bin'
+    bin_dir.mkdir()
+    monkeypatch.setenv('PATH', str(bin_dir) + os.pathsep + os.environ.get('PATH', ''))
+
+    def install(errors=0, code=0):
+        script = bin_dir / 'ffmpeg'
+        script.write_text(FAKE_FFMPEG.format(python=sys.executable, errors=errors, code=code))
+        script.chmod(script.stat().st_mode | stat.S_IXUSR)
+    return install
+
+
+def test_pipe_reports_progress_from_background_thread(fake_ffmpeg, tmp_path):
+    fake_ffmpeg()
+    assert ffmpeg_available()
+    seen = []
+    process = FFmpegProcess.pipe(tmp_path / 'out.mp4', on_progress=seen.append)
+    process.stdin.write(b'x' * 3000)
+    assert process.wait() == 0
+
+    assert [(p.out_time, p.total_size, p.done) for p in seen] == [(1.0, 1000, False), (2.0, 2000, False), (3.0, 3000, True)]
+    assert process.progress is seen[-1]
+    assert not process.failed and process.error == ''
+    assert (tmp_path / 'out.mp4').read_bytes() == b'mp4'
+
+
+def test_failure_keeps_stderr_tail(fake_ffmpeg, tmp_path):
+    fake_ffmpeg(errors=STDERR_TAIL_LINES + 5, code=1)
+    filelist = tmp_path / 'filelist.txt'
+    filelist.write_text('')
+
+    def broken(progress):
+        raise RuntimeError('回调出错不影响读取')
+
+    process = FFmpegProcess.concat(filelist, tmp_path / 'out.mp4', on_progress=broken)
+    assert process.wait() == 1
+    assert process.failed and process.progress.done
+    lines = process.error.splitlines()
+    assert len(lines) == STDERR_TAIL_LINES
+    assert lines[0] == 'error line 5' and lines[-1] == f'error line {STDERR_TAIL_LINES + 4}'
+
+
+@pytest.mark.skipif(not ffmpeg_available(), reason='没有安装 ffmpeg')
+def test_real_ffmpeg_pipe(tmp_path):
+    from test_remux import synthetic_ts
+
+    data, _, _ = synthetic_ts([(50, 900000)])
+    seen = []
+    process = FFmpegProcess.pipe(tmp_path / 'out.mp4', on_progress=seen.append)
+    process.stdin.write(data)
+    assert process.wait() == 0, process.error
+    assert seen and seen[-1].done and process.progress.out_time > 0
+    assert (tmp_path / 'out.mp4').stat().st_size > 0
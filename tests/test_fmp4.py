@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""fMP4 初始化段：按 URL 和字节范围去重、加密初始化段的解密，以及输出开头只写一次初始化段"""
+
+import re
+import threading
+from http.server import BaseHTTPRequestHandler
+from types import SimpleNamespace
+
+import pytest
+from Crypto.Cipher import AES
+from Crypto.Util.Padding import pad
+
+from hls_core import InitSectionCache, init_section_of
+
+from m3u8_downloader import M3U8Downloader
+from m3u8_downloader_gui import M3U8DownloaderGUI
+
+
+BASE = 'https://cdn.example.com/vod/index.m3u8'
+
+
+def test_init_section_of_normalises_byterange():
+    segment = SimpleNamespace(init_section=SimpleNamespace(uri='media.mp4', byterange='720'))
+    assert init_section_of(segment, BASE) == ('https://cdn.example.com/vod/media.mp4', '720@0')
+    segment.init_section.byterange = '720@0'
+    assert init_section_of(segment, BASE) == ('https://cdn.example.com/vod/media.mp4', '720@0')
+    assert init_section_of(SimpleNamespace(init_section=None), BASE) is None
+    assert init_section_of(SimpleNamespace(), BASE) is None
+
+
+def test_cache_fetches_each_range_once():
+    cache = InitSectionCache()
+    calls = []
+
+    def fetcher(name):
+        def fetch():
+            calls.append(name)
+            return name.encode()
+        return fetch
+
+    first = cache.get('https://cdn/media.mp4', '720@0', fetcher('a'))
+    again = cache.get('https://cdn/media.mp4', '720@0', fetcher('b'))
+    other = cache.get('https://cdn/media.mp4', '720@1000', fetcher('c'))
+    assert calls == ['a', 'c'] and cache.fetches == 2
+    assert again.data == first.data == b'a' and again.key == first.key
+    assert other.key != first.key and len(other) == 1
+    assert cache.cached('https://cdn/media.mp4', '720@0') and not cache.cached('https://cdn/other.mp4', None)
+
+
+def test_cache_concurrent_requests_fetch_once():
+    cache = InitSectionCache()
+    calls = []
+    release = threading.Event()
+
+    def fetch():
+        calls.append(1)
+        assert release.wait(10)
+        return b'init'
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get('https://cdn/i.mp4', None, fetch)))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    release.set()
+    for thread in threads:
+        thread.join(10)
+    assert len(calls) == 1 and [section.data for section in results] == [b'init'] * 8
+
+
+KEY = bytes(range(16))
+MEDIA_SEQUENCE = 7
+INIT = b'\x00\x00\x00\x18ftypiso6' + b'\x00' * 12 + b'\x00\x00\x02\xd0moov' + bytes(range(256)) * 2 + b'\x01' * 196
+SEGMENTS = [b'\x00\x00\x00\x10moof' + bytes([index]) * 8 + b'mdat' + bytes([index + 1]) * (1000 + index)
+            for index in range(4)]
+
+
+def encrypt(data, sequence):
+    """没有显式 IV 时按媒体序列号生成 IV"""
+    return AES.new(KEY, AES.MODE_CBC, sequence.to_bytes(16, 'big')).encrypt(pad(data, AES.block_size))
+
+
+# media.mp4 开头是加密的初始化段（用第一个引用它的分片的 IV），后面的内容不属于初始化段
+ENCRYPTED_INIT = encrypt(INIT, MEDIA_SEQUENCE)
+MEDIA = ENCRYPTED_INIT + b'\xee' * 4096
+
+
+class InitHandler(BaseHTTPRequestHandler):
+    """
+    同一个带字节范围的 EXT-X-MAP 出现两次（第二次省略偏移量），记录对 media.mp4 的请求；
+    honour_range 为 False 时忽略 Range 返回整个文件
+    """
+
+    protocol_version = 'HTTP/1.1'
+    honour_range = True
+    lock = threading.Lock()
+    init_requests = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path == '/vod.m3u8':
+            byterange = f'{len(ENCRYPTED_INIT)}'
+            lines = ['#EXTM3U', '#EXT-X-VERSION:7', '#EXT-X-TARGETDURATION:4',
+                     f'#EXT-X-MEDIA-SEQUENCE:{MEDIA_SEQUENCE}',
+                     f'#EXT-X-MAP:URI="media.mp4",BYTERANGE="{byterange}@0"',
+                     '#EXT-X-KEY:METHOD=AES-128,URI="key.bin"']
+            for index in range(len(SEGMENTS)):
+                if index == 2:
+                    lines.append(f'#EXT-X-MAP:URI="media.mp4",BYTERANGE="{byterange}"')
+                lines += ['#EXTINF:4.0,', f'seg{index}.m4s']
+            self.reply(200, ('\n'.join(lines + ['#EXT-X-ENDLIST']) + '\n').encode())
+        elif self.path == '/key.bin':
+            self.reply(200, KEY)
+        elif self.path == '/media.mp4':
+            range_value = self.headers.get('Range')
+            with self.lock:
+                InitHandler.init_requests.append(range_value)
+            match = re.fullmatch(r'bytes=(\d+)-(\d+)', range_value or '')
+            if match and self.honour_range:
+                start, end = int(match.group(1)), int(match.group(2)) + 1
+                self.reply(206, MEDIA[start:end], {'Content-Range': f'bytes {start}-{end - 1}/{len(MEDIA)}'})
+            else:
+                self.reply(200, MEDIA)
+        else:
+            index = int(self.path[len('/seg'):-len('.m4s')])
+            self.reply(200, encrypt(SEGMENTS[index], MEDIA_SEQUENCE + index))
+
+    def reply(self, status, body, headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def run_cli(url, tmp_path):
+    downloader = M3U8Downloader(url, str(tmp_path), 'vod', max_workers=3)
+    assert downloader.download()
+    return downloader
+
+
+def run_gui(url, tmp_path):
+    downloader = M3U8DownloaderGUI(url, str(tmp_path), 'vod', max_workers=3)
+    assert downloader.download()
+    return downloader
+
+
+@pytest.mark.parametrize('honour_range', [True, False])
+@pytest.mark.parametrize('run', [run_cli, run_gui], ids=['cli', 'gui'])
+def test_encrypted_byteranged_init_section_written_once(serve, tmp_path, run, honour_range):
+    InitHandler.init_requests = []
+    InitHandler.honour_range = honour_range
+    server = serve(InitHandler)
+    downloader = run(server.url('/vod.m3u8'), tmp_path)
+
+    # 两个 EXT-X-MAP 规整后是同一个字节范围，只请求一次
+    assert InitHandler.init_requests == [f'bytes=0-{len(ENCRYPTED_INIT) - 1}']
+    assert downloader.init_cache.fetches == 1
+
+    # 初始化段解密后只写在输出开头，后面直接拼接各分片
+    output = tmp_path / f'{downloader.output_name}.mp4'
+    assert output.read_bytes() == INIT + b''.join(SEGMENTS)
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""尾部对冲：胜负判定、对冲时机与上限，以及本地慢速分片上的对冲下载"""
+
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+from types import SimpleNamespace
+
+import pytest
+
+from hls_core import ENGINE_ASYNCIO, ENGINES, HedgeTracker, RangeJob, SegmentRace, asyncio_available
+from hls_core import hedge as hedge_module
+from hls_core.byterange import RangeMember
+
+from m3u8_downloader import M3U8Downloader
+
+
+def test_first_success_wins():
+    race = SegmentRace()
+    assert race.join()
+    assert race.claim(True)
+    assert race.lost(False) and not race.lost(True)
+    assert not race.claim(False)
+    # 落败的一方退出时不报告结果
+    assert not race.give_up(False)
+    assert race.give_up(True)
+
+
+def test_failure_reported_once_when_both_fail():
+    race = SegmentRace()
+    race.join()
+    assert not race.give_up(True)
+    assert race.give_up(False)
+
+
+def test_winner_that_fails_to_save_reports_failure():
+    race = SegmentRace()
+    race.join()
+    race.claim(False)
+    # 胜出后保存分片失败：由胜出的一方报告失败，被中断的另一方不报告
+    assert not race.give_up(True)
+    assert race.give_up(False)
+
+
+def test_no_hedge_after_result():
+    race = SegmentRace()
+    race.claim(False)
+    assert not race.join()
+    assert not race.hedged
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(hedge_module, 'time', SimpleNamespace(monotonic=clock))
+    return clock
+
+
+def job(index):
+    return index, SimpleNamespace(uri=f'{index}.ts')
+
+
+def finish(tracker, clock, index, latency):
+    tracker.start(job(index))
+    clock.now += latency
+    tracker.done(index)
+
+
+def test_hedges_slow_segment_after_enough_samples(clock):
+    tracker = HedgeTracker(total=1000, tail=4)
+    slow = tracker.start(job(100))
+    for index in range(7):
+        finish(tracker, clock, index, 1.0)
+    # 样本不足时不对冲
+    assert tracker.due(remaining=900) == [] and tracker.next_check(900) is None
+    finish(tracker, clock, 7, 1.0)
+
+    # 已运行 8 秒，阈值为第95百分位的2倍（2秒）
+    hedges = tracker.due(remaining=900)
+    assert [(j[0], race) for j, race in hedges] == [(100, slow)]
+    assert slow.hedged and tracker.hedges == 1
+    # 每个分片最多对冲一次
+    assert tracker.due(remaining=900) == []
+
+    slow.claim(True)
+    tracker.done(100)
+    assert tracker.wins == 1
+    assert tracker.summary() == "对冲请求 1 次，其中 1 次先于原请求完成"
+
+
+def test_tail_uses_median_threshold(clock):
+    tracker = HedgeTracker(total=1000, tail=4)
+    for index in range(19):
+        finish(tracker, clock, index, 1.0)
+    finish(tracker, clock, 19, 1.9)
+    tracker.start(job(50))
+    clock.now += 3.0
+    # 第95百分位 1.9 秒的2倍是 3.8 秒，还不对冲；进入尾部阶段后按中位数的2倍（2秒）
+    assert tracker.next_check(remaining=100) == pytest.approx(0.8)
+    assert tracker.due(remaining=100) == []
+    assert [j[0] for j, _ in tracker.due(remaining=3)] == [50]
+
+
+def test_budget_and_range_jobs(clock):
+    tracker = HedgeTracker(total=40, tail=4, max_fraction=0.05)
+    assert tracker.budget == 2
+    member = RangeMember(200, SimpleNamespace(uri='all.ts'), 0, 100)
+    assert tracker.start(RangeJob('https://cdn.example.com/all.ts', [member])) is None
+    for index in range(8):
+        finish(tracker, clock, index, 1.0)
+    for index in (100, 101, 102):
+        tracker.start(job(index))
+    clock.now += 10
+    assert len(tracker.due(remaining=100)) == 2
+    assert tracker.due(remaining=100) == []
+
+    assert HedgeTracker(total=0, tail=4).budget == 0
+    assert HedgeTracker(total=1000, tail=4, max_fraction=0).budget == 0
+
+
+SEGMENTS = 30
+SLOW_SEGMENT = 25
+
+
+def segment_data(index):
+    return bytes([index]) * (2000 + index)
+
+
+class StragglerHandler(BaseHTTPRequestHandler):
+    """分片 SLOW_SEGMENT 的第一次请求落在慢节点上（发完响应头后长时间没有数据），之后的请求正常"""
+
+    protocol_version = 'HTTP/1.1'
+    lock = threading.Lock()
+    requests = {}
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path == '/vod.m3u8':
+            lines = ['#EXTM3U', '#EXT-X-TARGETDURATION:4']
+            for index in range(SEGMENTS):
+                lines += ['#EXTINF:4.0,', f'seg{index}.ts']
+            body = ('\n'.join(lines + ['#EXT-X-ENDLIST']) + '\n').encode()
+            slow = False
+        else:
+            index = int(self.path[len('/seg'):-len('.ts')])
+            with self.lock:
+                count = StragglerHandler.requests[index] = StragglerHandler.requests.get(index, 0) + 1
+            body = segment_data(index)
+            slow = index == SLOW_SEGMENT and count == 1
+            time.sleep(0.02)
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        try:
+            if slow:
+                self.wfile.write(body[:100])
+                self.wfile.flush()
+                time.sleep(10)
+            self.wfile.write(body)
+        except OSError:
+            pass
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_hedge_finishes_straggler(serve, tmp_path, engine):
+    if engine == ENGINE_ASYNCIO and not asyncio_available():
+        pytest.skip('asyncio 引擎需要 aiohttp')
+    StragglerHandler.requests = {}
+    server = serve(StragglerHandler)
+    downloader = M3U8Downloader(server.url('/vod.m3u8'), str(tmp_path), 'vod', max_workers=4,
+                                engine=engine, hedge_fraction=0.05)
+    started = time.monotonic()
+    downloader.download(keep_temp=True)
+
+    # 对冲请求先完成，不必等慢节点的10秒
+    assert time.monotonic() - started < 8
+    assert StragglerHandler.requests[SLOW_SEGMENT] == 2
+    assert downloader.hedger.hedges == 1 and downloader.hedger.wins == 1
+    for index in range(SEGMENTS):
+        assert (downloader.temp_dir / f'segment_{index:05d}.ts').read_bytes() == segment_data(index)
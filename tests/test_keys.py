@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""密钥缓存：冷密钥并发请求只下载一次、TTL 过期、LRU 淘汰，以及下载失败不缓存"""
+
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from hls_core import KeyCache
+from hls_core import keys as keys_module
+
+
+THREADS = 8
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(keys_module, 'time', SimpleNamespace(monotonic=clock))
+    return clock
+
+
+@pytest.fixture
+def waiters(monkeypatch):
+    """统计在进行中的下载上等待的线程数"""
+    count = SimpleNamespace(value=0, lock=threading.Lock())
+
+    class CountingEvent(threading.Event):
+        def wait(self, timeout=None):
+            with count.lock:
+                count.value += 1
+            return super().wait(timeout)
+
+    class Flight(keys_module._Flight):
+        def __init__(self):
+            super().__init__()
+            self.event = CountingEvent()
+
+    monkeypatch.setattr(keys_module, '_Flight', Flight)
+    return count
+
+
+def wait_for(predicate, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, '等待超时'
+        time.sleep(0.005)
+
+
+def run_threads(target):
+    results = [None] * THREADS
+    threads = []
+    for i in range(THREADS):
+        def work(i=i):
+            try:
+                results[i] = ('ok', target())
+            except Exception as e:
+                results[i] = ('error', e)
+        thread = threading.Thread(target=work)
+        thread.start()
+        threads.append(thread)
+    return threads, results
+
+
+def test_cold_key_is_fetched_once(waiters):
+    cache = KeyCache()
+    release = threading.Event()
+    calls = []
+
+    def fetch():
+        calls.append(threading.current_thread())
+        assert release.wait(10)
+        return b'k' * 16
+
+    threads, results = run_threads(lambda: cache.get('https://cdn/key.bin', fetch))
+    # 其余线程都在等待第一个线程的下载时才放行
+    wait_for(lambda: waiters.value == THREADS - 1)
+    release.set()
+    for thread in threads:
+        thread.join(10)
+
+    assert len(calls) == 1
+    assert results == [('ok', b'k' * 16)] * THREADS
+    assert cache.fetches == 1 and cache.hits == THREADS - 1
+    assert cache.get('https://cdn/key.bin', fetch) == b'k' * 16 and len(calls) == 1
+
+
+def test_failed_fetch_is_raised_to_every_waiter_and_not_cached(waiters):
+    cache = KeyCache()
+    release = threading.Event()
+    error = IOError('403 Forbidden')
+    calls = []
+
+    def failing():
+        calls.append(1)
+        assert release.wait(10)
+        raise error
+
+    threads, results = run_threads(lambda: cache.get('https://cdn/key.bin', failing))
+    wait_for(lambda: waiters.value == THREADS - 1)
+    release.set()
+    for thread in threads:
+        thread.join(10)
+
+    assert len(calls) == 1
+    assert results == [('error', error)] * THREADS
+    assert cache.fetches == 0 and cache.peek('https://cdn/key.bin') is None
+    # 失败不缓存，下一次请求重新下载
+    assert cache.get('https://cdn/key.bin', lambda: b'fresh') == b'fresh'
+    assert cache.fetches == 1
+
+
+def test_entry_expires_after_ttl(clock):
+    cache = KeyCache(ttl=60)
+    values = iter([b'first', b'second'])
+    fetch = lambda: next(values)  # noqa: E731
+    assert cache.get('https://cdn/key.bin', fetch) == b'first'
+    clock.now += 59
+    assert cache.get('https://cdn/key.bin', fetch) == b'first'
+    clock.now += 1
+    assert cache.peek('https://cdn/key.bin') is None
+    assert cache.get('https://cdn/key.bin', fetch) == b'second'
+    assert cache.fetches == 2 and cache.hits == 1
+
+
+def test_no_ttl_never_expires(clock):
+    cache = KeyCache(ttl=None)
+    cache.get('https://cdn/key.bin', lambda: b'key')
+    clock.now += 10 ** 9
+    assert cache.peek('https://cdn/key.bin') == b'key'
+
+
+def test_lru_eviction_at_capacity():
+    cache = KeyCache(max_entries=2)
+    cache.get('a', lambda: b'A')
+    cache.get('b', lambda: b'B')
+    # 访问 a 后 b 成为最久未使用的条目
+    assert cache.get('a', lambda: b'unused') == b'A'
+    cache.get('c', lambda: b'C')
+    assert cache.peek('b') is None
+    assert cache.peek('a') == b'A' and cache.peek('c') == b'C'
+    # peek 也刷新使用顺序
+    cache.get('d', lambda: b'D')
+    assert cache.peek('a') is None and cache.peek('c') == b'C' and cache.peek('d') == b'D'
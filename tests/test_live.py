@@ -0,0 +1,302 @@
+# -*- coding: utf-8 -*-
+"""直播播放列表：按媒体序号去重、错过的分片、结束与时长上限、刷新间隔；低延迟HLS的部分分片与阻塞式刷新；以及本地录制"""
+
+import hashlib
+import re
+import time
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import parse_qs, urlsplit
+
+import m3u8
+
+from hls_core import LivePlaylist
+
+from m3u8_downloader import M3U8Downloader
+
+
+def live_playlist(first, count, target=4, endlist=False, duration=4.0):
+    lines = ['#EXTM3U', '#EXT-X-VERSION:3', f'#EXT-X-TARGETDURATION:{target}', f'#EXT-X-MEDIA-SEQUENCE:{first}']
+    for sequence in range(first, first + count):
+        lines += [f'#EXTINF:{duration},', f'seg{sequence}.ts']
+    if endlist:
+        lines.append('#EXT-X-ENDLIST')
+    return m3u8.loads('\n'.join(lines) + '\n')
+
+
+def sequences(update):
+    gap, segments = update
+    return list(gap), [index for index, _ in segments]
+
+
+def test_only_new_segments_are_returned():
+    live = LivePlaylist()
+    assert sequences(live.update(live_playlist(10, 3))) == ([], [10, 11, 12])
+    assert sequences(live.update(live_playlist(10, 3))) == ([], [])
+    assert sequences(live.update(live_playlist(11, 3))) == ([], [13])
+    _, segments = live.update(live_playlist(13, 4))
+    assert [segment.uri for _, segment in segments] == ['seg14.ts', 'seg15.ts', 'seg16.ts']
+    assert live.segments == 7 and live.missed == 0
+
+
+def test_segments_dropped_before_refresh_are_reported_as_gap():
+    live = LivePlaylist()
+    live.update(live_playlist(0, 3))
+    assert sequences(live.update(live_playlist(6, 3))) == ([3, 4, 5], [6, 7, 8])
+    assert live.missed == 3
+
+
+def test_endlist_finishes_after_last_segments():
+    live = LivePlaylist()
+    live.update(live_playlist(0, 3))
+    assert sequences(live.update(live_playlist(1, 4, endlist=True))) == ([], [3, 4])
+    assert live.ended and live.done
+
+
+def test_duration_limit_stops_recording():
+    live = LivePlaylist(duration_limit=10)
+    # 4 秒一个分片，累计达到 10 秒的第三个分片之后不再交出
+    assert sequences(live.update(live_playlist(0, 5))) == ([], [0, 1, 2])
+    assert live.limit_reached and live.done
+    assert sequences(live.update(live_playlist(1, 6))) == ([], [])
+
+
+def test_reload_delay_and_stall():
+    live = LivePlaylist(stall_targets=2)
+    live.update(live_playlist(0, 3, target=6))
+    assert live.reload_delay(changed=True) == 6
+    assert not live.stalled
+    # 没有变化时间隔减半，连续 2 个目标时长没有新分片视为停止
+    for _ in range(3):
+        assert live.reload_delay(changed=False) == 3
+    assert not live.stalled
+    live.reload_delay(changed=False)
+    assert live.stalled
+    live.reload_delay(changed=True)
+    assert not live.stalled
+
+
+def test_plain_live_playlist_does_not_block():
+    live = LivePlaylist()
+    live.update(live_playlist(0, 3))
+    assert not live.blocking and not live.low_latency
+    url = 'https://live.example.com/index.m3u8?token=abc'
+    assert live.reload_url(url) == url
+
+
+SLIDING_SEGMENTS = 9
+
+
+def live_segment_data(sequence):
+    return bytes([sequence]) * (500 + sequence)
+
+
+class SlidingHandler(BaseHTTPRequestHandler):
+    """每次刷新新增3个分片、窗口4个分片的直播，9个分片后结束"""
+
+    protocol_version = 'HTTP/1.1'
+    reloads = 0
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.startswith('/live.m3u8'):
+            SlidingHandler.reloads += 1
+            produced = min(3 * SlidingHandler.reloads, SLIDING_SEGMENTS)
+            first = max(0, produced - 4)
+            lines = ['#EXTM3U', '#EXT-X-TARGETDURATION:1', f'#EXT-X-MEDIA-SEQUENCE:{first}']
+            for sequence in range(first, produced):
+                lines += ['#EXTINF:1.0,', f'seg{sequence}.ts']
+            if produced == SLIDING_SEGMENTS:
+                lines.append('#EXT-X-ENDLIST')
+            body = ('\n'.join(lines) + '\n').encode()
+        else:
+            body = live_segment_data(int(self.path[len('/seg'):-len('.ts')]))
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def test_records_sliding_live_playlist(serve, tmp_path):
+    SlidingHandler.reloads = 0
+    server = serve(SlidingHandler)
+    downloader = M3U8Downloader(server.url('/live.m3u8'), str(tmp_path), 'live', max_workers=2, live=True)
+    downloader.download()
+
+    output = tmp_path / f'{downloader.output_name}.mp4'
+    assert output.read_bytes() == b''.join(live_segment_data(sequence) for sequence in range(SLIDING_SEGMENTS))
+    assert SlidingHandler.reloads == 3
+
+
+# 低延迟HLS：每个分片由 PARTS 个部分分片组成
+PARTS = 4
+
+
+def part_data(msn, part):
+    return hashlib.sha256(f"{msn}.{part}".encode()).digest() * (300 + (msn * 7 + part) % 40)
+
+
+def ll_playlist_text(produced, total=None, part_target=0.1, block=True, hint=True, byterange=False):
+    """
+    已生成 produced 个部分分片时的低延迟播放列表
+
+    最后两个完整分片和正在生成的分片列出 EXT-X-PART，窗口保留最后3个完整分片；
+    produced 达到 total 个分片时写 EXT-X-ENDLIST。
+    """
+    full, in_progress = divmod(produced, PARTS)
+    first = max(0, full - 3)
+    lines = ['#EXTM3U', '#EXT-X-VERSION:9', f'#EXT-X-TARGETDURATION:{max(1, round(part_target * PARTS))}',
+             f'#EXT-X-SERVER-CONTROL:CAN-BLOCK-RELOAD={"YES" if block else "NO"},PART-HOLD-BACK={part_target * 3:.3f}',
+             f'#EXT-X-PART-INF:PART-TARGET={part_target:.3f}', f'#EXT-X-MEDIA-SEQUENCE:{first}']
+
+    def parts(msn, count):
+        offset = 0
+        for part in range(count):
+            if byterange:
+                length = len(part_data(msn, part))
+                value = f"{length}@{offset}" if part == 0 else f"{length}"
+                lines.append(f'#EXT-X-PART:DURATION={part_target:.3f},URI="s{msn}.ts",BYTERANGE={value}')
+                offset += length
+            else:
+                lines.append(f'#EXT-X-PART:DURATION={part_target:.3f},URI="s{msn}.p{part}.ts"')
+
+    for msn in range(first, full):
+        if msn >= full - 2:
+            parts(msn, PARTS)
+        lines += [f'#EXTINF:{part_target * PARTS:.3f},', f's{msn}.ts']
+    if total is not None and full >= total:
+        lines.append('#EXT-X-ENDLIST')
+    else:
+        parts(full, in_progress)
+        if hint and not byterange:
+            lines.append(f'#EXT-X-PRELOAD-HINT:TYPE=PART,URI="s{full}.p{in_progress}.ts"')
+    return '\n'.join(lines) + '\n'
+
+
+def ll_playlist(produced, **kwargs):
+    return m3u8.loads(ll_playlist_text(produced, **kwargs))
+
+
+def unit_names(units):
+    return [(index, unit.uri, unit.iv_sequence) for index, unit in units]
+
+
+def test_low_latency_takes_segments_then_parts_then_hint():
+    live = LivePlaylist()
+    # 已生成 2 个完整分片 + 第3个分片的 2 个部分分片
+    gap, units = live.update(ll_playlist(2 * PARTS + 2))
+    assert live.low_latency and live.blocking and list(gap) == []
+    assert unit_names(units) == [
+        (0, 's0.ts', 0), (1, 's1.ts', 1),
+        (2, 's2.p0.ts', 2), (3, 's2.p1.ts', 2),
+        (4, 's2.p2.ts', 2),  # 预加载提示
+    ]
+    assert live.reload_url('https://live.example.com/ll.m3u8?token=abc') == \
+        'https://live.example.com/ll.m3u8?token=abc&_HLS_msn=2&_HLS_part=2'
+    assert live.reload_delay(changed=True) == 0
+
+
+def test_hinted_part_is_not_requested_twice():
+    live = LivePlaylist()
+    live.update(ll_playlist(2 * PARTS + 2))
+    # 提示的 s2.p2 已出现在列表中，第3个分片也已完成：只交出 s2.p3 和新的提示
+    _, units = live.update(ll_playlist(3 * PARTS))
+    assert unit_names(units) == [(5, 's2.p3.ts', 2), (6, 's3.p0.ts', 3)]
+    _, units = live.update(ll_playlist(3 * PARTS + 1))
+    assert unit_names(units) == [(7, 's3.p1.ts', 3)]
+    assert live.reload_url('https://live.example.com/ll.m3u8') == \
+        'https://live.example.com/ll.m3u8?_HLS_msn=3&_HLS_part=1'
+
+
+def test_failed_hint_is_retaken_from_playlist():
+    live = LivePlaylist()
+    _, units = live.update(ll_playlist(2 * PARTS + 2))
+    assert live.hint_failed(units[-1][0])
+    _, units = live.update(ll_playlist(2 * PARTS + 3))
+    assert unit_names(units) == [(5, 's2.p2.ts', 2), (6, 's2.p3.ts', 2)]
+
+
+def test_byterange_parts_continue_across_refreshes():
+    live = LivePlaylist()
+    _, units = live.update(ll_playlist(2 * PARTS + 1, byterange=True))
+    assert [unit.byterange for _, unit in units[2:]] == [f"{len(part_data(2, 0))}@0"]
+    _, units = live.update(ll_playlist(2 * PARTS + 3, byterange=True))
+    start = len(part_data(2, 0))
+    assert [unit.byterange for _, unit in units] == [
+        f"{len(part_data(2, 1))}@{start}",
+        f"{len(part_data(2, 2))}@{start + len(part_data(2, 1))}",
+    ]
+
+
+def test_without_blocking_reload_polls_every_part_target():
+    live = LivePlaylist()
+    live.update(ll_playlist(2 * PARTS, block=False, part_target=0.5))
+    assert live.low_latency and not live.blocking
+    assert live.reload_delay(changed=True) == 0.5
+    assert live.reload_delay(changed=False) == 0.25
+
+
+class LowLatencyHandler(BaseHTTPRequestHandler):
+    """
+    低延迟HLS服务器：每 PART_TARGET 秒生成一个部分分片，共 TOTAL 个分片
+
+    支持 _HLS_msn/_HLS_part 阻塞式刷新；部分分片在生成前被请求时挂起到生成为止（预加载提示）。
+    """
+
+    protocol_version = 'HTTP/1.1'
+    PART_TARGET = 0.1
+    TOTAL = 5
+    started = 0.0
+    blocked = 0
+    part_requests = 0
+
+    def log_message(self, *args):
+        pass
+
+    @classmethod
+    def produced(cls):
+        # 开始时已有 2 个完整分片
+        return min(int((time.monotonic() - cls.started) / cls.PART_TARGET) + 2 * PARTS, cls.TOTAL * PARTS)
+
+    def wait_for(self, msn, part):
+        deadline = time.monotonic() + 3 * self.PART_TARGET * PARTS + 1
+        while msn * PARTS + part >= self.produced() and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        if url.path == '/ll.m3u8':
+            if '_HLS_msn' in query:
+                LowLatencyHandler.blocked += 1
+                self.wait_for(int(query['_HLS_msn'][0]), int(query.get('_HLS_part', ['0'])[0]))
+            body = ll_playlist_text(self.produced(), self.TOTAL, self.PART_TARGET).encode()
+        elif match := re.fullmatch(r'/s(\d+)\.p(\d+)\.ts', url.path):
+            LowLatencyHandler.part_requests += 1
+            msn, part = int(match.group(1)), int(match.group(2))
+            self.wait_for(msn, part)
+            body = part_data(msn, part)
+        else:
+            msn = int(re.fullmatch(r'/s(\d+)\.ts', url.path).group(1))
+            body = b''.join(part_data(msn, part) for part in range(PARTS))
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def test_records_low_latency_stream(serve, tmp_path):
+    LowLatencyHandler.started = time.monotonic()
+    LowLatencyHandler.blocked = LowLatencyHandler.part_requests = 0
+    server = serve(LowLatencyHandler)
+    downloader = M3U8Downloader(server.url('/ll.m3u8'), str(tmp_path), 'll', max_workers=4, live=True)
+    downloader.download()
+
+    # 输出是从第一个分片开始、连续到最后一个分片的全部部分分片
+    output = (tmp_path / f'{downloader.output_name}.mp4').read_bytes()
+    expected = b''.join(part_data(msn, part) for msn in range(LowLatencyHandler.TOTAL) for part in range(PARTS))
+    assert output == expected
+    # 正在生成的分片按部分分片下载，刷新使用阻塞式请求
+    assert LowLatencyHandler.part_requests >= PARTS
+    assert LowLatencyHandler.blocked > 0
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""断点续传清单：登记、重启后加载，以及下载器只信任清单中完整的分片"""
+
+import zlib
+from http.server import BaseHTTPRequestHandler
+
+from hls_core import SegmentManifest, temp_dir_name
+from hls_core.manifest import MANIFEST_NAME
+
+from m3u8_downloader import M3U8Downloader
+
+
+def test_temp_dir_name_is_stable_per_url():
+    url = 'https://cdn.example.com/video/index.m3u8'
+    assert temp_dir_name('movie', url) == temp_dir_name('movie', url)
+    assert temp_dir_name('movie', url) != temp_dir_name('movie', url + '?v=2')
+    assert temp_dir_name('movie', url).startswith('movie_') and temp_dir_name('movie', url).endswith('_temp')
+
+
+def test_marked_segments_survive_restart(tmp_path):
+    segment = tmp_path / 'segment_00003.ts'
+    segment.write_bytes(b'x' * 100)
+    manifest = SegmentManifest(tmp_path)
+    manifest.mark_done(3, 'https://cdn.example.com/a/3.ts?token=1', 100, zlib.crc32(b'x' * 100), expected=100)
+    manifest.close()
+
+    reloaded = SegmentManifest(tmp_path)
+    assert reloaded.completed == 1
+    # 签名参数变化不影响，路径不同或文件大小不一致都不算完成
+    assert reloaded.is_done(3, 'https://cdn.example.com/a/3.ts?token=2', segment)
+    assert not reloaded.is_done(3, 'https://cdn.example.com/b/3.ts', segment)
+    assert not reloaded.is_done(4, 'https://cdn.example.com/a/3.ts', segment)
+    segment.write_bytes(b'x' * 60)
+    assert not reloaded.is_done(3, 'https://cdn.example.com/a/3.ts', segment)
+    # 大小相同但内容损坏：CRC32 不一致
+    segment.write_bytes(b'x' * 99 + b'y')
+    assert not reloaded.is_done(3, 'https://cdn.example.com/a/3.ts', segment)
+    segment.unlink()
+    assert not reloaded.is_done(3, 'https://cdn.example.com/a/3.ts', segment)
+
+
+def test_truncated_last_line_is_ignored(tmp_path):
+    manifest = SegmentManifest(tmp_path)
+    manifest.mark_done(0, 'https://cdn.example.com/0.ts', 10, 1)
+    manifest.close()
+    # 进程在写清单时退出，只留下半行
+    with open(tmp_path / MANIFEST_NAME, 'a', encoding='utf-8') as f:
+        f.write('{"index": 1, "url": "https://cdn.exa')
+
+    reloaded = SegmentManifest(tmp_path)
+    assert reloaded.completed == 1
+    reloaded.mark_done(2, 'https://cdn.example.com/2.ts', 10, 2)
+    reloaded.close()
+    # 新的登记从新的一行开始，不与残缺的行粘在一起
+    assert SegmentManifest(tmp_path).completed == 2
+
+
+def test_entry_without_crc32_checks_size_only(tmp_path):
+    # 不解密的多连接分片登记时不计算 CRC32
+    segment = tmp_path / 'segment_00000.ts'
+    segment.write_bytes(b'z' * 64)
+    manifest = SegmentManifest(tmp_path)
+    manifest.mark_done(0, 'https://cdn.example.com/0.ts', 64, None, 64)
+    assert manifest.is_done(0, 'https://cdn.example.com/0.ts', segment)
+
+
+SEGMENTS = 5
+
+
+def segment_data(index):
+    return bytes([index]) * (1000 + index)
+
+
+class LoggingHandler(BaseHTTPRequestHandler):
+    """提供 SEGMENTS 个分片的点播播放列表，记录请求路径"""
+
+    protocol_version = 'HTTP/1.1'
+    paths = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        LoggingHandler.paths.append(self.path)
+        if self.path == '/video.m3u8':
+            lines = ['#EXTM3U', '#EXT-X-TARGETDURATION:4']
+            for index in range(SEGMENTS):
+                lines += ['#EXTINF:4.0,', f'seg{index}.ts']
+            body = ('\n'.join(lines + ['#EXT-X-ENDLIST']) + '\n').encode()
+        else:
+            body = segment_data(int(self.path[len('/seg'):-len('.ts')]))
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def test_downloader_resumes_only_from_complete_segments(serve, tmp_path):
+    LoggingHandler.paths = []
+    server = serve(LoggingHandler)
+    url = server.url('/video.m3u8')
+
+    # 模拟上次中断：分片0、1已登记；分片2写了一半（未登记）；分片3登记了但文件被截断；
+    # 分片4登记了、大小也对，但内容已损坏
+    temp_dir = tmp_path / temp_dir_name('video', url)
+    temp_dir.mkdir()
+    manifest = SegmentManifest(temp_dir)
+    for index in (0, 1, 3, 4):
+        data = segment_data(index)
+        manifest.mark_done(index, server.url(f'/seg{index}.ts'), len(data), zlib.crc32(data), len(data))
+    manifest.close()
+    (temp_dir / 'segment_00000.ts').write_bytes(segment_data(0))
+    (temp_dir / 'segment_00001.ts').write_bytes(segment_data(1))
+    (temp_dir / 'segment_00002.ts').write_bytes(segment_data(2)[:300])
+    (temp_dir / 'segment_00003.ts').write_bytes(segment_data(3)[:300])
+    (temp_dir / 'segment_00004.ts').write_bytes(b'\xff' * len(segment_data(4)))
+
+    downloader = M3U8Downloader(url, str(tmp_path), 'video', max_workers=2)
+    assert downloader.temp_dir == temp_dir
+    downloader.download(keep_temp=True)
+
+    assert sorted(p for p in LoggingHandler.paths if p.endswith('.ts')) == ['/seg2.ts', '/seg3.ts', '/seg4.ts']
+    for index in range(SEGMENTS):
+        assert (temp_dir / f'segment_{index:05d}.ts').read_bytes() == segment_data(index)
+    assert SegmentManifest(temp_dir).completed == SEGMENTS
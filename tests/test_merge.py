@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+"""
+按序合并写入器：乱序提交按序写出、超过缓冲上限落盘为 pending_*.ts、跳过和重复的分片、初始化段、写入失败；
+以及追加分片文件时内核拷贝的回退顺序（copy_file_range → sendfile → readinto）
+"""
+
+import errno
+import io
+import os
+import random
+import sys
+
+import pytest
+
+from hls_core import OrderedSegmentWriter
+from hls_core import merge as merge_module
+from hls_core.fmp4 import InitSection
+
+
+def segment_data(index):
+    return bytes([index % 256]) * (100 + index)
+
+
+def expected_output(indexes):
+    return b''.join(segment_data(index) for index in indexes)
+
+
+def test_out_of_order_segments_are_written_in_order(tmp_path):
+    order = list(range(50))
+    random.Random(7).shuffle(order)
+    writer = OrderedSegmentWriter(tmp_path / 'out.ts', tmp_path)
+    written = []
+    for index in order:
+        writer.submit(index, segment_data(index))
+        written.append(writer.next_index)
+        # 只有连续前缀写出，其余留在缓冲区
+        assert writer.bytes_written == len(expected_output(range(writer.next_index)))
+        assert writer.pending_count == len(written) - writer.next_index
+    writer.close()
+
+    assert (tmp_path / 'out.ts').read_bytes() == expected_output(range(50))
+    assert written == sorted(written) and written[-1] == 50
+    assert (writer.buffered_bytes, writer.spilled) == (0, 0)
+
+
+def test_buffer_cap_spills_to_pending_files(tmp_path):
+    spill_dir = tmp_path / 'spill'
+    spill_dir.mkdir()
+    # 能放下分片 1、2，之后的乱序分片落盘
+    writer = OrderedSegmentWriter(tmp_path / 'out.ts', spill_dir, max_buffer_bytes=210)
+    for index in (1, 2, 3, 4):
+        writer.submit(index, segment_data(index))
+    assert writer.buffered_bytes == len(segment_data(1)) + len(segment_data(2))
+    assert writer.spilled == 2
+    assert sorted(p.name for p in spill_dir.iterdir()) == ['pending_00003.ts', 'pending_00004.ts']
+    assert (spill_dir / 'pending_00004.ts').read_bytes() == segment_data(4)
+    assert writer.bytes_written == 0
+
+    # 轮到时写入并删除落盘的文件
+    writer.submit(0, segment_data(0))
+    assert writer.next_index == 5 and writer.buffered_bytes == 0
+    assert list(spill_dir.iterdir()) == []
+    writer.close()
+    assert (tmp_path / 'out.ts').read_bytes() == expected_output(range(5))
+
+
+def test_file_segments_are_copied_not_removed(tmp_path):
+    segment = tmp_path / 'segment_00001.ts'
+    segment.write_bytes(segment_data(1))
+    writer = OrderedSegmentWriter(tmp_path / 'out.ts', tmp_path, max_buffer_bytes=0)
+    writer.submit(1, path=segment)
+    # 磁盘上的分片不占缓冲，也不再落盘一次
+    assert (writer.buffered_bytes, writer.spilled) == (0, 0)
+    writer.submit(0, segment_data(0))
+    writer.close()
+    assert (tmp_path / 'out.ts').read_bytes() == expected_output(range(2))
+    assert segment.read_bytes() == segment_data(1)
+
+
+def test_skipped_duplicate_and_stale_segments(tmp_path):
+    writer = OrderedSegmentWriter(tmp_path / 'out.ts', tmp_path, start_index=10)
+    writer.submit(12, segment_data(12))
+    writer.skip(11)
+    writer.submit(12, b'duplicate')
+    writer.submit(9, b'before start')
+    assert writer.pending_count == 2
+    writer.submit(10, segment_data(10))
+    assert writer.next_index == 13
+    # 已写过的序号再提交或跳过都忽略
+    writer.submit(10, b'late')
+    writer.skip(12)
+    writer.skip(13)
+    writer.submit(14, segment_data(14))
+    writer.close()
+    assert (tmp_path / 'out.ts').read_bytes() == expected_output([10, 12, 14])
+
+
+def test_init_section_written_when_it_changes(tmp_path):
+    first = InitSection('https://cdn.example.com/init1.mp4', None, b'INIT1')
+    same = InitSection('https://cdn.example.com/init1.mp4', None, b'INIT1')
+    second = InitSection('https://cdn.example.com/init2.mp4', None, b'INIT2')
+    output = io.BytesIO()
+    output.close = lambda: None
+    writer = OrderedSegmentWriter(output, tmp_path)
+    for index, init in reversed(list(enumerate([first, same, second, first]))):
+        writer.submit(index, b'seg%d' % index, init=init)
+    writer.close()
+    assert output.getvalue() == b'INIT1seg0seg1INIT2seg2INIT1seg3'
+    assert writer.init_sections == 3 and writer.bytes_written == len(output.getvalue())
+
+
+def test_close_discards_pending_spills(tmp_path):
+    writer = OrderedSegmentWriter(tmp_path / 'out.ts', tmp_path, max_buffer_bytes=0)
+    writer.submit(3, segment_data(3))
+    assert (tmp_path / 'pending_00003.ts').exists()
+    writer.close()
+    assert not (tmp_path / 'pending_00003.ts').exists()
+    assert writer.pending_count == 0 and (tmp_path / 'out.ts').read_bytes() == b''
+
+
+class FailingOutput(io.BytesIO):
+    """写入第 fail_at 次时报错，模拟磁盘写满或管道断开"""
+
+    def __init__(self, fail_at):
+        super().__init__()
+        self.fail_at = fail_at
+        self.writes = 0
+
+    def write(self, data):
+        self.writes += 1
+        if self.writes == self.fail_at:
+            raise OSError(28, 'No space left on device')
+        return super().write(data)
+
+
+def test_write_error_stops_further_writes(tmp_path):
+    output = FailingOutput(fail_at=2)
+    writer = OrderedSegmentWriter(output, tmp_path)
+    writer.submit(1, segment_data(1))
+    writer.submit(2, segment_data(2))
+    with pytest.raises(OSError):
+        writer.submit(0, segment_data(0))
+    assert writer.error is not None and writer.next_index == 1
+    # 输出可能只写了半个分片，之后轮到写入时都报同一个错误
+    writer.submit(3, segment_data(3))
+    with pytest.raises(OSError) as excinfo:
+        writer.skip(1)
+    assert excinfo.value is writer.error
+    assert output.getvalue() == segment_data(0)
+    writer.close()
+
+
+class Syscalls:
+    """
+    记录 copy_file_range / sendfile 的调用和实际复制的字节数；
+    mode 为 fail 时抛出 OSError，short 时第一次只复制 1000 字节、之后返回 0（如到达文件系统限制）
+    """
+
+    def __init__(self, monkeypatch, copy_file_range='real', sendfile='real'):
+        self.calls = []
+        self.copied = {}
+        for name, mode in (('copy_file_range', copy_file_range), ('sendfile', sendfile)):
+            if mode == 'missing':
+                monkeypatch.delattr(merge_module.os, name, raising=False)
+            elif hasattr(merge_module.os, name):
+                monkeypatch.setattr(merge_module.os, name, self._wrap(name, getattr(merge_module.os, name), mode))
+
+    def _wrap(self, name, real, mode):
+        def call(*args):
+            self.calls.append(name)
+            if mode == 'fail':
+                raise OSError(errno.EXDEV, 'Invalid cross-device link')
+            if mode == 'short':
+                if self.calls.count(name) > 1:
+                    return 0
+                args = args[:2] + (min(args[2], 1000),) + args[3:]
+            n = real(*args)
+            self.copied[name] = self.copied.get(name, 0) + n
+            return n
+        return call
+
+
+COPY_DATA = bytes(range(256)) * 4000 + b'tail'
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason='内核拷贝的回退顺序按 Linux 检查')
+@pytest.mark.parametrize('copy_file_range, sendfile, copied', [
+    ('real', 'real', {'copy_file_range': len(COPY_DATA)}),
+    ('fail', 'real', {'sendfile': len(COPY_DATA)}),
+    ('missing', 'real', {'sendfile': len(COPY_DATA)}),
+    # 都不可用时全部由 readinto 复制
+    ('fail', 'fail', {}),
+    ('missing', 'missing', {}),
+    # 内核拷贝只完成一部分时，不再改用 sendfile，剩下的用 readinto 补齐
+    ('short', 'real', {'copy_file_range': 1000}),
+])
+def test_copy_file_into_fallback_chain(tmp_path, monkeypatch, copy_file_range, sendfile, copied):
+    if copy_file_range == 'real' and not hasattr(os, 'copy_file_range'):
+        pytest.skip('没有 os.copy_file_range')
+    syscalls = Syscalls(monkeypatch, copy_file_range, sendfile)
+    # 缓冲区小于文件，readinto 要循环多次
+    monkeypatch.setattr(merge_module, 'COPY_BUFFER_SIZE', 100000)
+    source = tmp_path / 'segment.ts'
+    source.write_bytes(COPY_DATA)
+
+    with open(tmp_path / 'out.ts', 'wb') as outfile:
+        # 追加在输出文件的当前位置，包括 Python 缓冲区里还没写出的数据
+        outfile.write(b'head')
+        assert merge_module.copy_file_into(outfile, source) == len(COPY_DATA)
+        outfile.write(b'end')
+    assert (tmp_path / 'out.ts').read_bytes() == b'head' + COPY_DATA + b'end'
+
+    assert syscalls.copied == copied
+
+
+def test_copy_file_into_empty_file(tmp_path):
+    (tmp_path / 'empty.ts').write_bytes(b'')
+    with open(tmp_path / 'out.ts', 'wb') as outfile:
+        assert merge_module.copy_file_into(outfile, tmp_path / 'empty.ts') == 0
+    assert (tmp_path / 'out.ts').read_bytes() == b''
+
+
+def test_writer_copies_file_segments_with_fallback(tmp_path, monkeypatch):
+    Syscalls(monkeypatch, 'missing', 'missing')
+    for index in range(3):
+        (tmp_path / f'segment_{index:05d}.ts').write_bytes(segment_data(index))
+    writer = OrderedSegmentWriter(tmp_path / 'out.ts', tmp_path)
+    for index in (2, 0, 1):
+        writer.submit(index, path=tmp_path / f'segment_{index:05d}.ts')
+    writer.close()
+    assert (tmp_path / 'out.ts').read_bytes() == expected_output(range(3))
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""冗余线路：获取各线路的播放列表、出错线路的降级与恢复，以及两台本地服务器之间的自动切换"""
+
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+from types import SimpleNamespace
+
+import m3u8
+import pytest
+
+from hls_core import Mirror, MirrorSet, equivalent_variants, load_mirrors
+from hls_core import mirrors as mirrors_module
+
+from m3u8_downloader import M3U8Downloader
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(mirrors_module, 'time', SimpleNamespace(monotonic=clock))
+    return clock
+
+
+def media_playlist(count, media_sequence=0):
+    lines = ['#EXTM3U', '#EXT-X-TARGETDURATION:4', f'#EXT-X-MEDIA-SEQUENCE:{media_sequence}']
+    for index in range(count):
+        lines += ['#EXTINF:4.0,', f'seg{index}.ts']
+    return '\n'.join(lines + ['#EXT-X-ENDLIST']) + '\n'
+
+
+def test_equivalent_variants():
+    master = m3u8.loads('\n'.join([
+        '#EXTM3U',
+        '#EXT-X-STREAM-INF:BANDWIDTH=2000000,RESOLUTION=1280x720,CODECS="avc1.64001f,mp4a.40.2"', 'a/720.m3u8',
+        '#EXT-X-STREAM-INF:BANDWIDTH=800000,RESOLUTION=640x360,CODECS="avc1.64001f,mp4a.40.2"', 'a/360.m3u8',
+        '#EXT-X-STREAM-INF:BANDWIDTH=2000000,RESOLUTION=1280x720,CODECS="avc1.64001f,mp4a.40.2"', 'b/720.m3u8',
+        '#EXT-X-STREAM-INF:BANDWIDTH=2000000,RESOLUTION=1280x720,CODECS="hvc1.1.6.L93.B0"', 'c/720.m3u8',
+    ]) + '\n')
+    chosen = master.playlists[2]
+    assert [p.uri for p in equivalent_variants(master.playlists, chosen)] == ['a/720.m3u8', 'b/720.m3u8']
+
+
+def test_load_mirrors_skips_unreachable_and_mismatched():
+    texts = {
+        'https://a/index.m3u8': media_playlist(5),
+        'https://c/index.m3u8': media_playlist(4),
+        'https://d/index.m3u8': media_playlist(5, media_sequence=9),
+        'https://e/index.m3u8': media_playlist(5),
+    }
+
+    def fetch(url):
+        if url not in texts:
+            raise IOError(f'502 {url}')
+        return texts[url]
+
+    urls = ['https://b/index.m3u8', 'https://a/index.m3u8', 'https://c/index.m3u8', 'https://d/index.m3u8',
+            'https://e/index.m3u8', 'https://a/index.m3u8']
+    table, mirrors = load_mirrors(urls, fetch)
+    # 首选线路获取失败时，第一条能获取的线路作为主线路；重复的URL只获取一次
+    assert [mirror.url for mirror in mirrors.mirrors] == ['https://a/index.m3u8', 'https://e/index.m3u8']
+    assert mirrors.primary.table is None and len(table) == 5
+    assert mirrors.mirrors[1].segment_url(3, None) == 'https://e/seg3.ts'
+    assert [url for url, _ in mirrors.skipped] == ['https://b/index.m3u8', 'https://c/index.m3u8', 'https://d/index.m3u8']
+
+    with pytest.raises(IOError, match='502 https://x'):
+        load_mirrors(['https://x/index.m3u8', 'https://y/index.m3u8'], fetch)
+
+
+def test_failing_mirror_is_demoted_then_retried(clock):
+    primary, backup = Mirror('https://a/index.m3u8'), Mirror('https://b/index.m3u8')
+    mirrors = MirrorSet([primary, backup])
+
+    first = mirrors.acquire()
+    assert first is primary
+    mirrors.release(first, 0, 0.1, ok=False)
+    # 暂停期间只选其他线路
+    for _ in range(3):
+        mirror = mirrors.acquire()
+        assert mirror is backup
+        mirrors.release(mirror, 1000, 0.1)
+    # 分片已在正常线路上失败时，没失败过的线路优先，即使它在暂停中
+    assert mirrors.acquire(exclude={backup}) is primary
+    mirrors.release(primary, 0, 0.0, ok=None)
+
+    # 暂停 MIRROR_COOLDOWN 秒后重新试用
+    clock.now += mirrors_module.MIRROR_COOLDOWN
+    assert mirrors.acquire() is primary
+    # 连续失败时暂停时间翻倍
+    mirrors.release(primary, 0, 0.1, ok=False)
+    clock.now += mirrors_module.MIRROR_COOLDOWN
+    assert mirrors.acquire() is backup
+    mirrors.release(backup, 1000, 0.1)
+    clock.now += mirrors_module.MIRROR_COOLDOWN
+    assert mirrors.acquire() is primary
+    mirrors.release(primary, 1000, 0.1)
+    assert primary._streak == 0 and primary.failures == 2 and primary.rate == pytest.approx(10000)
+
+    # 所有线路都暂停时仍然选一条，不会无线路可用
+    mirrors.release(mirrors.acquire(), 0, 0.1, ok=False)
+    mirrors.release(mirrors.acquire(), 0, 0.1, ok=False)
+    assert mirrors.acquire() in (primary, backup)
+
+
+def test_faster_mirror_gets_more_concurrency(clock):
+    slow, fast = Mirror('https://a/index.m3u8'), Mirror('https://b/index.m3u8')
+    mirrors = MirrorSet([slow, fast])
+    # 还没测速的线路按已知最快的速度估计，同时发出的两个请求各占一条线路
+    first, second = mirrors.acquire(), mirrors.acquire()
+    assert (first, second) == (slow, fast)
+    mirrors.release(slow, 1000, 1.0)
+    mirrors.release(fast, 4000, 1.0)
+    assert (slow.rate, fast.rate) == (1000, 4000)
+    picked = [mirrors.acquire() for _ in range(5)]
+    assert picked.count(fast) == 4 and picked.count(slow) == 1
+    # 中途放弃（ok=None）不计入速度，也不暂停线路
+    mirrors.release(slow, 10, 5.0, ok=None)
+    assert slow.rate == 1000 and slow.failures == 0
+
+
+SEGMENTS = 40
+FAILING_REQUESTS = 3
+
+
+def segment_data(index):
+    return bytes([index]) * (3000 + index)
+
+
+class MirrorHandler(BaseHTTPRequestHandler):
+    """
+    同一个处理类用于两台服务器：good 为正常线路；bad 线路播放列表正常，
+    但前 FAILING_REQUESTS 个分片请求返回 500，之后恢复
+    """
+
+    protocol_version = 'HTTP/1.1'
+    lock = threading.Lock()
+    master = ''
+    segment_requests = {}
+    served = {}
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path == '/master.m3u8':
+            self.reply(200, MirrorHandler.master.encode())
+            return
+        name, resource = self.path.strip('/').split('/', 1)
+        if resource == 'index.m3u8':
+            self.reply(200, media_playlist(SEGMENTS).encode())
+            return
+        index = int(resource[len('seg'):-len('.ts')])
+        with self.lock:
+            count = MirrorHandler.segment_requests[name] = MirrorHandler.segment_requests.get(name, 0) + 1
+            failing = name == 'bad' and count <= FAILING_REQUESTS
+            if not failing:
+                MirrorHandler.served.setdefault(name, []).append(index)
+        time.sleep(0.01)
+        if failing:
+            self.reply(500, b'upstream error')
+        else:
+            self.reply(200, segment_data(index))
+
+    def reply(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def test_segments_move_to_healthy_mirror(serve, tmp_path, monkeypatch):
+    # 缩短暂停时间，下载过程中出错的线路会重新试用
+    monkeypatch.setattr(mirrors_module, 'MIRROR_COOLDOWN', 0.05)
+    bad, good = serve(MirrorHandler), serve(MirrorHandler)
+    variant = '#EXT-X-STREAM-INF:BANDWIDTH=1000000,RESOLUTION=640x360'
+    # 出错的线路排在前面，作为主线路
+    MirrorHandler.master = '\n'.join(['#EXTM3U', variant, bad.url('/bad/index.m3u8'),
+                                      variant, good.url('/good/index.m3u8')]) + '\n'
+    MirrorHandler.segment_requests = {}
+    MirrorHandler.served = {}
+
+    downloader = M3U8Downloader(good.url('/master.m3u8'), str(tmp_path), 'mirrored', max_workers=2)
+    assert downloader.download(keep_temp=True)
+
+    for index in range(SEGMENTS):
+        assert (downloader.temp_dir / f'segment_{index:05d}.ts').read_bytes() == segment_data(index)
+    primary, backup = downloader.mirrors.mirrors
+    assert primary.host == bad.url('').split('//')[1] and backup.host == good.url('').split('//')[1]
+    assert primary.failures == FAILING_REQUESTS
+    # 失败的分片换到正常线路重试，出错的线路恢复后重新分到请求
+    assert len(MirrorHandler.served['good']) > len(MirrorHandler.served['bad']) > 0
+    assert sorted(MirrorHandler.served['good'] + MirrorHandler.served['bad']) == list(range(SEGMENTS))
+    # 每次失败都计入重试统计（换线重试不等待）
+    assert downloader.retry_stats.retries['http_500'] == FAILING_REQUESTS
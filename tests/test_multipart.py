@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+超大分片的多连接下载：拆分条件和分段、本地支持 Range 的服务器上并行下载后拼回的内容、
+分段中断后接着续传，以及服务器忽略 Range 时改为单连接下载
+"""
+
+import os
+import threading
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+import requests
+
+from hls_core import ParallelRangeDownload, RetryPolicy, RetryStats, split_size
+from hls_core.multipart import MIN_PART_SIZE, split_ranges
+
+from m3u8_downloader import M3U8Downloader
+
+
+SIZE = 4 * MIN_PART_SIZE + 12345
+DATA = os.urandom(SIZE)
+
+
+def test_split_size():
+    headers = {'Accept-Ranges': 'bytes', 'Content-Length': str(SIZE)}
+    assert split_size(200, headers, 4, SIZE) == SIZE
+    assert split_size(200, headers, 4, SIZE + 1) is None
+    assert split_size(200, headers, 1, 0) is None
+    assert split_size(206, headers, 4, 0) is None
+    assert split_size(200, {'Content-Length': str(SIZE)}, 4, 0) is None
+    assert split_size(200, {**headers, 'Content-Encoding': 'gzip'}, 4, 0) is None
+    assert split_size(200, {'Accept-Ranges': 'bytes', 'Content-Length': 'x'}, 4, 0) is None
+
+
+def test_split_ranges():
+    assert split_ranges(10, 3, min_part=1) == [(0, 4), (4, 8), (8, 10)]
+    # 每段不小于 min_part
+    assert split_ranges(10, 4, min_part=5) == [(0, 5), (5, 10)]
+    assert split_ranges(3, 4, min_part=5) == [(0, 3)]
+    ranges = split_ranges(SIZE, 8)
+    assert len(ranges) == 4 and ranges[0][0] == 0 and ranges[-1][1] == SIZE
+    assert all(a[1] == b[0] for a, b in zip(ranges, ranges[1:]))
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """
+    提供 DATA；honour_range 为 False 时忽略 Range 总是返回 200 和整个资源（仍声明 Accept-Ranges）；
+    drop_once 为 True 时第一个从非零偏移开始的 Range 请求只发一半就断开
+    """
+
+    protocol_version = 'HTTP/1.1'
+    lock = threading.Lock()
+    honour_range = True
+    drop_once = False
+    ranges = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path == '/vod.m3u8':
+            body = b'#EXTM3U\n#EXT-X-TARGETDURATION:600\n#EXTINF:600.0,\nbig.ts\n#EXT-X-ENDLIST\n'
+            self.reply(200, body)
+            return
+        range_value = self.headers.get('Range')
+        with self.lock:
+            RangeHandler.ranges.append(range_value)
+            drop = False
+            if range_value and RangeHandler.drop_once and not range_value.startswith('bytes=0-'):
+                RangeHandler.drop_once = False
+                drop = True
+        if not range_value or not self.honour_range:
+            self.reply(200, DATA)
+            return
+        start, end = (int(value) for value in range_value[len('bytes='):].split('-'))
+        body = DATA[start:end + 1]
+        headers = {'Content-Range': f'bytes {start}-{end}/{SIZE}'}
+        if drop:
+            self.reply(206, body, headers, cut=len(body) // 2)
+        else:
+            self.reply(206, body, headers)
+
+    def reply(self, status, body, headers=None, cut=None):
+        self.send_response(status)
+        self.send_header('Accept-Ranges', 'bytes')
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body if cut is None else body[:cut])
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端已改为单连接下载，关闭了多余的连接
+            pass
+        if cut is not None:
+            self.close_connection = True
+
+
+@pytest.fixture
+def range_server(serve):
+    def start(honour_range=True, drop_once=False):
+        RangeHandler.honour_range = honour_range
+        RangeHandler.drop_once = drop_once
+        RangeHandler.ranges = []
+        return serve(RangeHandler)
+    return start
+
+
+def run_download(server, tmp_path, connections=4):
+    url = server.url('/big.ts')
+
+    def open_response(headers):
+        return requests.get(url, headers=headers, timeout=30, stream=True)
+
+    download = ParallelRangeDownload(url, SIZE, str(tmp_path / 'big.ts.multi'), connections, open_response,
+                                     RetryPolicy(attempts=3, base_delay=0.01, max_delay=0.05), RetryStats())
+    download.run()
+    return download
+
+
+def test_parts_are_reassembled(range_server, tmp_path):
+    server = range_server()
+    download = run_download(server, tmp_path)
+    assert (tmp_path / 'big.ts.multi').read_bytes() == DATA
+    assert not download.ranges_ignored
+    assert sorted(RangeHandler.ranges) == sorted(f'bytes={start}-{end - 1}' for start, end in split_ranges(SIZE, 4))
+    assert b''.join(download.read_chunks()) == DATA
+
+
+def test_interrupted_part_resumes_from_its_offset(range_server, tmp_path):
+    server = range_server(drop_once=True)
+    download = run_download(server, tmp_path)
+    assert (tmp_path / 'big.ts.multi').read_bytes() == DATA
+    # 中断的分段只重新请求剩下的部分
+    assert len(RangeHandler.ranges) == 5
+    assert sum(part.received for part in download.parts) == SIZE
+    assert download.stats.retries['connection'] == 1
+
+
+def test_ignored_range_falls_back_to_single_stream(range_server, tmp_path):
+    server = range_server(honour_range=False)
+    download = run_download(server, tmp_path)
+    assert (tmp_path / 'big.ts.multi').read_bytes() == DATA
+    assert download.ranges_ignored
+    # 只有一个连接接收了整个资源，其他连接收到 200 后直接放弃，不重复传输资源开头
+    assert sorted(part.received for part in download.parts) == [0, 0, 0, SIZE]
+
+
+@pytest.mark.parametrize('honour_range', [True, False], ids=['range', 'range-ignored'])
+def test_downloader_splits_large_segment(range_server, tmp_path, honour_range):
+    server = range_server(honour_range=honour_range)
+    downloader = M3U8Downloader(server.url('/vod.m3u8'), str(tmp_path), 'vod', max_workers=4,
+                                segment_connections=4, split_threshold=MIN_PART_SIZE)
+    assert downloader.download(keep_temp=True)
+    assert (downloader.temp_dir / 'segment_00000.ts').read_bytes() == DATA
+    # 第一个请求不带 Range，得知大小后改为多连接
+    assert RangeHandler.ranges[0] is None and len(RangeHandler.ranges) == 5
+    assert not os.path.exists(downloader.temp_dir / 'segment_00000.ts.multi')
@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+"""
+流式解析媒体播放列表：与 m3u8.loads 的结果一致（tests/fixtures 下的播放列表和随机生成的
+播放列表），后台解析时 iter_parsed() 不阻塞，以及调度器在等待解析时先交出已解析的分片
+"""
+
+import random
+import threading
+from concurrent.futures import Future
+from pathlib import Path
+
+import m3u8
+import pytest
+
+from hls_core import (
+    PlaybackScheduler,
+    SegmentTable,
+    parse_media_playlist,
+    plan_range_jobs,
+    stream_playlist,
+)
+
+
+FIXTURES = Path(__file__).parent / 'fixtures'
+MEDIA_FIXTURES = sorted(path.name for path in FIXTURES.glob('*.m3u8') if path.name != 'master.m3u8')
+BASES = [
+    'https://cdn.example.com/vod/a/index.m3u8',
+    'https://cdn.example.com/vod/index.m3u8?token=1',
+    'http://cdn:8080/path/',
+]
+
+
+class FakeResponse:
+    """按随机大小分块返回数据的流式响应"""
+
+    def __init__(self, data, rng=None, sizes=(1, 2, 3, 7, 64, 1000)):
+        self.data = data
+        self.rng = rng or random.Random(0)
+        self.sizes = sizes
+        self.closed = False
+
+    def iter_content(self, size):
+        position = 0
+        while position < len(self.data):
+            n = self.rng.choice(self.sizes + (size,))
+            yield self.data[position:position + n]
+            position += n
+
+    def close(self):
+        self.closed = True
+
+
+def record(segment):
+    # m3u8 按 uri/method/iv 合并密钥对象，KEYFORMAT 不同的密钥会沿用第一个的 keyformat，不比较
+    key = segment.key and (segment.key.method, segment.key.uri, segment.key.iv)
+    init = segment.init_section and (segment.init_section.uri, segment.init_section.byterange)
+    return segment.uri, segment.duration, segment.byterange, key, init, segment.iv_sequence
+
+
+def dump(table):
+    return ([record(segment) for segment in table], table.media_sequence, table.is_endlist, table.playlist_type,
+            table.target_duration, table.encrypted, round(table.duration, 6), len(table))
+
+
+def streamed(text, base, rng=None):
+    response = FakeResponse(text.encode('utf-8'), rng)
+    table, playlist = stream_playlist(response, base)
+    assert playlist is None
+    table.wait()
+    assert table.complete and response.closed
+    return table
+
+
+def check_equivalent(text, base, rng=None):
+    expected = dump(SegmentTable.from_playlist(m3u8.loads(text), base))
+    assert dump(parse_media_playlist(text, base)) == expected
+    assert dump(streamed(text, base, rng)) == expected
+
+
+@pytest.mark.parametrize('base', BASES)
+@pytest.mark.parametrize('name', MEDIA_FIXTURES)
+def test_matches_m3u8_on_fixtures(name, base):
+    text = (FIXTURES / name).read_text(encoding='utf-8')
+    check_equivalent(text, base)
+    # CRLF 换行、结尾没有换行
+    check_equivalent(text.replace('\n', '\r\n'), base)
+    check_equivalent(text.rstrip('\n'), base)
+
+
+def random_playlist(rng):
+    newline = rng.choice(['\n', '\r\n'])
+    lines = ['#EXTM3U', f'#EXT-X-VERSION:{rng.randint(3, 7)}']
+    if rng.random() < 0.8:
+        lines.append(f'#EXT-X-TARGETDURATION:{rng.randint(1, 12)}')
+    if rng.random() < 0.7:
+        lines.append(f'#EXT-X-MEDIA-SEQUENCE:{rng.randint(0, 99999)}')
+    if rng.random() < 0.5:
+        lines.append(f"#EXT-X-PLAYLIST-TYPE:{rng.choice(['VOD', 'EVENT', 'vod'])}")
+    resources = ['a.ts', 'b.mp4', 'http://cdn.x/y/z.ts?t=1']
+    for i in range(rng.randint(0, 200)):
+        r = rng.random()
+        if r < 0.05:
+            method = rng.choice(['AES-128', 'NONE', 'SAMPLE-AES'])
+            attributes = ['METHOD=' + method]
+            if method != 'NONE':
+                attributes.append('URI=' + rng.choice([f'"key{rng.randint(0, 3)}.bin"', '"https://k.x/a,b?x=1"', "'k.bin'"]))
+                if rng.random() < 0.5:
+                    attributes.append(f'IV=0x{rng.getrandbits(128):032x}')
+                if rng.random() < 0.3:
+                    attributes.append('KEYFORMAT="identity"')
+            lines.append('#EXT-X-KEY:' + ','.join(attributes))
+        elif r < 0.08:
+            lines.append('#EXT-X-MAP:URI="%s"%s' % (rng.choice(['init.mp4', '../i/init.mp4', 'http://h/i.mp4']),
+                                                     rng.choice(['', ',BYTERANGE="720@0"', ',BYTERANGE="100@5"'])))
+        elif r < 0.1:
+            lines.append('#EXT-X-DISCONTINUITY')
+        elif r < 0.12:
+            lines.append(f'#EXT-X-PROGRAM-DATE-TIME:2024-01-01T00:00:{rng.randint(0, 59):02d}.000Z')
+        elif r < 0.13:
+            lines.append(f'# comment {i}')
+        elif r < 0.15:
+            lines.append(rng.choice(['', '   ']))
+        if rng.random() < 0.3:
+            byterange = str(rng.randint(1, 5000)) + (f'@{rng.randint(0, 10 ** 7)}' if rng.random() < 0.4 else '')
+            tags = ['#EXT-X-BYTERANGE:' + byterange, f'#EXTINF:{rng.uniform(0, 10):.3f},t{i}']
+            rng.shuffle(tags)
+            lines += tags + [rng.choice(resources)]
+        else:
+            lines.append(rng.choice([f'#EXTINF:{rng.uniform(0, 10):.6f},', f'#EXTINF:{rng.randint(1, 9)},title, with comma',
+                                     f'#EXTINF:{rng.randint(1, 9)}']))
+            lines.append(rng.choice([f'seg{i}.ts', f'd/seg{i}.ts?sig={i:x}', f'/abs/s{i}.ts', f'https://c{i % 3}.x/s{i}.ts',
+                                     f'中文{i}.ts', f's{i}.ts  ', f'../up/{i}.ts']))
+        if rng.random() < 0.02:
+            lines.append(f'orphan-uri-{i}.ts')
+    if rng.random() < 0.7:
+        lines.append('#EXT-X-ENDLIST')
+    return newline.join(lines) + rng.choice([newline, ''])
+
+
+def test_matches_m3u8_on_random_playlists():
+    rng = random.Random(1)
+    for _ in range(150):
+        text = random_playlist(rng)
+        if '#EXTINF' not in text and '#EXT-X-BYTERANGE' not in text:
+            continue
+        check_equivalent(text, rng.choice(BASES), rng)
+
+
+def test_master_playlist_is_left_to_m3u8():
+    text = (FIXTURES / 'master.m3u8').read_text(encoding='utf-8')
+    response = FakeResponse(text.encode('utf-8'))
+    table, playlist = stream_playlist(response, BASES[0])
+    assert table is None and response.closed
+    assert playlist.is_variant
+    assert [p.uri for p in playlist.playlists] == ['low/index.m3u8', 'high/index.m3u8']
+
+
+class GatedResponse:
+    """先发出 first 部分，gate 放行后再发出其余部分（或抛出 error）"""
+
+    def __init__(self, first, rest, error=None):
+        self.first = first
+        self.rest = rest
+        self.error = error
+        self.gate = threading.Event()
+        self.closed = False
+
+    def iter_content(self, size):
+        yield self.first
+        assert self.gate.wait(10)
+        if self.error is not None:
+            raise self.error
+        yield self.rest
+
+    def close(self):
+        self.closed = True
+
+
+def split_playlist(count, cut):
+    lines = ['#EXTM3U', '#EXT-X-TARGETDURATION:4']
+    for index in range(count):
+        lines += ['#EXTINF:4.0,', f'seg{index}.ts']
+    text = '\n'.join(lines + ['#EXT-X-ENDLIST']) + '\n'
+    position = text.index(f'seg{cut}.ts')
+    return text[:position].encode(), text[position:].encode()
+
+
+def test_iter_parsed_yields_future_instead_of_blocking():
+    response = GatedResponse(*split_playlist(10, cut=3))
+    table, _ = stream_playlist(response, BASES[0])
+    items = table.iter_parsed()
+    assert [next(items).uri.rsplit('/', 1)[-1] for _ in range(3)] == ['seg0.ts', 'seg1.ts', 'seg2.ts']
+
+    waiting = next(items)
+    assert isinstance(waiting, Future) and not waiting.done()
+    assert not table.complete
+
+    response.gate.set()
+    waiting.result(timeout=10)
+    rest = [item for item in items if not isinstance(item, Future)]
+    assert [segment.uri.rsplit('/', 1)[-1] for segment in rest] == [f'seg{i}.ts' for i in range(3, 10)]
+    assert table.complete and table.is_endlist and response.closed
+
+
+def enumerate_items(items):
+    """与下载器的 iter_segments 相同：Future 原样交出，分片按顺序编号"""
+    index = 0
+    for item in items:
+        if isinstance(item, Future):
+            yield item
+        else:
+            yield index, item
+            index += 1
+
+
+def test_scheduler_takes_parsed_segments_while_parser_waits():
+    response = GatedResponse(*split_playlist(10, cut=3))
+    table, _ = stream_playlist(response, BASES[0])
+    scheduler = PlaybackScheduler(plan_range_jobs(enumerate_items(table.iter_parsed()), BASES[0]), concurrency=8,
+                                  total=len(table))
+
+    # 已解析的分片立即交出，剩下的要等解析线程：take() 不等待，把 Future 记在 waiting
+    assert [index for index, _ in scheduler.take(8)] == [0, 1, 2]
+    assert scheduler.waiting is not None and not scheduler.waiting.done()
+    assert scheduler.take(8) == []
+
+    response.gate.set()
+    scheduler.waiting.result(timeout=10)
+    table.wait()
+    scheduler.total = len(table)
+    assert [index for index, _ in scheduler.take(8)] == list(range(3, 10))
+    assert scheduler.pending == 0 and scheduler.waiting is None
+
+
+def test_receive_error_is_raised_after_parsed_segments():
+    response = GatedResponse(*split_playlist(10, cut=3), error=IOError('connection reset'))
+    table, _ = stream_playlist(response, BASES[0])
+    counted = table.after_parsed(len)
+    response.gate.set()
+
+    with pytest.raises(IOError):
+        list(table)
+    assert len(table) == 3 and table.complete and response.closed
+    # 解析出错时 after_parsed 的结果为 None，不调用 fn
+    assert counted.result(timeout=10) is None
+
+
+def test_after_parsed_runs_once_parsing_finishes():
+    response = GatedResponse(*split_playlist(10, cut=3))
+    table, _ = stream_playlist(response, BASES[0])
+    seen = []
+    counted = table.after_parsed(lambda t: seen.append(threading.current_thread()) or len(t))
+    assert not counted.done()
+    response.gate.set()
+    assert counted.result(timeout=10) == 10
+    # 在解析线程中计算；解析完成后再调用则立即计算
+    assert seen[0] is not threading.current_thread()
+    assert table.after_parsed(len).result(timeout=0) == 10
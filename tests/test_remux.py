@@ -0,0 +1,388 @@
+# -*- coding: utf-8 -*-
+"""
+TS 转 MP4：用合成的 TS 流（PAT、PMT、H.264 和 ADTS 的 PES，中间有时间戳不连续）
+经 write()/finish() 转封装，再解析输出的 box 核对样本数、时长、偏移量和 moov 的位置
+"""
+
+import random
+import struct
+
+import pytest
+
+from hls_core import TSRemuxer
+
+
+PMT_PID = 0x1000
+VIDEO_PID = 0x100
+AUDIO_PID = 0x101
+
+FRAME_TICKS = 3600          # 25fps，90kHz
+SAMPLE_RATE = 48000
+SAMPLE_RATE_INDEX = 3
+ADTS_PER_PES = 3
+
+
+class BitWriter:
+    def __init__(self):
+        self.bits = []
+
+    def u(self, n, value):
+        self.bits += [(value >> (n - 1 - i)) & 1 for i in range(n)]
+
+    def ue(self, value):
+        code = value + 1
+        self.u(code.bit_length() * 2 - 1, code)
+
+    def rbsp(self):
+        self.bits.append(1)
+        while len(self.bits) % 8:
+            self.bits.append(0)
+        return bytes(int(''.join(map(str, self.bits[i:i + 8])), 2) for i in range(0, len(self.bits), 8))
+
+
+def h264_sps(width, height):
+    """Baseline profile SPS（宽高须为16的倍数）"""
+    w = BitWriter()
+    w.u(8, 66)
+    w.u(8, 0)
+    w.u(8, 30)
+    w.ue(0)
+    w.ue(0)                     # log2_max_frame_num_minus4
+    w.ue(0)                     # pic_order_cnt_type
+    w.ue(0)
+    w.ue(1)                     # max_num_ref_frames
+    w.u(1, 0)
+    w.ue(width // 16 - 1)
+    w.ue(height // 16 - 1)
+    w.u(1, 1)                   # frame_mbs_only_flag
+    w.u(1, 1)
+    w.u(1, 0)                   # frame_cropping_flag
+    w.u(1, 0)                   # vui_parameters_present_flag
+    return b'\x67' + w.rbsp()
+
+
+SPS = h264_sps(320, 240)
+PPS = b'\x68\xce\x38\x80'
+
+
+PATTERN = bytes(range(1, 251))
+
+
+def filler(number, size):
+    """size 字节的不含0的内容，随 number 变化"""
+    shift = number % len(PATTERN)
+    return ((PATTERN[shift:] + PATTERN[:shift]) * (size // len(PATTERN) + 1))[:size]
+
+
+def frame_nal(number, keyframe, size=1500):
+    """一帧的切片 NAL：内容不含起始码、不以0结尾"""
+    return (b'\x65' if keyframe else b'\x41') + filler(number, size)
+
+
+def adts_payload(number, size=200):
+    return filler(number * 7, size)
+
+
+def adts_frame(payload, channels=2):
+    length = 7 + len(payload)
+    header = bytes((0xFF, 0xF1, (1 << 6) | (SAMPLE_RATE_INDEX << 2) | (channels >> 2),
+                    ((channels & 3) << 6) | (length >> 11), (length >> 3) & 0xFF, ((length & 7) << 5) | 0x1F, 0xFC))
+    return header + payload
+
+
+def timestamp(prefix, value):
+    return bytes((prefix << 4 | (value >> 29) & 0x0E | 1, (value >> 22) & 0xFF, (value >> 14) & 0xFE | 1,
+                  (value >> 7) & 0xFF, (value << 1) & 0xFE | 1))
+
+
+def pes(stream_id, payload, pts, dts=None):
+    if dts is None:
+        header = b'\x80\x80\x05' + timestamp(0x2, pts)
+    else:
+        header = b'\x80\xc0\x0a' + timestamp(0x3, pts) + timestamp(0x1, dts)
+    # 视频 PES 长度写0（不限长度），音频写实际长度
+    length = 0 if stream_id == 0xE0 else len(header) + len(payload)
+    return b'\x00\x00\x01' + bytes((stream_id,)) + struct.pack('>H', length) + header + payload
+
+
+class TSWriter:
+    """把 PSI 段和 PES 切成 188 字节的 TS 包，最后一个包用适配域填充"""
+
+    def __init__(self):
+        self.counters = {}
+        self.packets = []
+
+    def _packet(self, pid, payload, start):
+        counter = self.counters.get(pid, 0)
+        self.counters[pid] = (counter + 1) & 0x0F
+        header = struct.pack('>BHB', 0x47, (0x4000 if start else 0) | pid, counter)
+        if len(payload) == 184:
+            return header[:3] + bytes((0x10 | counter,)) + payload
+        stuffing = 183 - len(payload)
+        adaptation = bytes((stuffing,)) + (b'\x00' + b'\xff' * (stuffing - 1) if stuffing else b'')
+        return header[:3] + bytes((0x30 | counter,)) + adaptation + payload
+
+    def write(self, pid, data):
+        for pos in range(0, len(data), 184):
+            self.packets.append(self._packet(pid, data[pos:pos + 184], pos == 0))
+
+    def psi(self, pid, table_id, extension, body):
+        length = 5 + len(body) + 4
+        section = struct.pack('>BHHBBB', table_id, 0xB000 | length, extension, 0xC1, 0, 0) + body + b'\x00' * 4
+        self.packets.append(self._packet(pid, b'\x00' + section + b'\xff' * (183 - len(section)), True))
+
+    def tables(self):
+        self.psi(0, 0x00, 1, struct.pack('>HH', 1, 0xE000 | PMT_PID))
+        streams = struct.pack('>BHH', 0x1B, 0xE000 | VIDEO_PID, 0xF000) + struct.pack('>BHH', 0x0F, 0xE000 | AUDIO_PID, 0xF000)
+        self.psi(PMT_PID, 0x02, 1, struct.pack('>HH', 0xE000 | VIDEO_PID, 0xF000) + streams)
+
+    def data(self):
+        return b''.join(self.packets)
+
+
+def build_clip(writer, frames, start_pts, first_frame=0, first_audio=0, frame_size=1500):
+    """
+    一段 frames 帧的片段：开头是带参数集的关键帧，显示时间比解码时间晚一帧；
+    音频按片段时长生成 ADTS 帧，每个 PES 装 ADTS_PER_PES 帧
+
+    Returns:
+        (frame NAL 列表, ADTS 负载列表)
+    """
+    writer.tables()
+    nals, audio = [], []
+    audio_count = frames * FRAME_TICKS * SAMPLE_RATE // (90000 * 1024)
+    audio_ticks = 1024 * 90000 / SAMPLE_RATE
+    next_audio = 0
+    for i in range(frames):
+        nal = frame_nal(first_frame + i, keyframe=i == 0, size=frame_size)
+        nals.append(nal)
+        access_unit = b'\x00\x00\x00\x01\x09\xf0'
+        if i == 0:
+            access_unit += b'\x00\x00\x00\x01' + SPS + b'\x00\x00\x00\x01' + PPS
+        access_unit += b'\x00\x00\x01' + nal
+        dts = start_pts + i * FRAME_TICKS
+        writer.write(VIDEO_PID, pes(0xE0, access_unit, dts + FRAME_TICKS, dts))
+        while next_audio < audio_count and next_audio * audio_ticks <= (i + 1) * FRAME_TICKS:
+            group = [adts_payload(first_audio + n) for n in range(next_audio, min(next_audio + ADTS_PER_PES, audio_count))]
+            audio += group
+            writer.write(AUDIO_PID, pes(0xC0, b''.join(adts_frame(p) for p in group), start_pts + round(next_audio * audio_ticks)))
+            next_audio += len(group)
+    return nals, audio
+
+
+def synthetic_ts(clips, frame_size=1500):
+    """
+    clips: [(frames, start_pts), ...]，相邻片段的时间戳不连续（如 EXT-X-DISCONTINUITY）
+
+    Returns:
+        (TS 数据, 全部帧 NAL, 全部 ADTS 负载)
+    """
+    writer = TSWriter()
+    nals, audio = [], []
+    for frames, start_pts in clips:
+        clip_nals, clip_audio = build_clip(writer, frames, start_pts, len(nals), len(audio), frame_size)
+        nals += clip_nals
+        audio += clip_audio
+    return writer.data(), nals, audio
+
+
+CONTAINERS = {b'moov', b'trak', b'mdia', b'minf', b'stbl', b'edts', b'dinf'}
+
+
+def parse_boxes(data, start=0, end=None):
+    """[(类型, 负载起点, 负载终点, 子box)]"""
+    boxes = []
+    pos = start
+    end = len(data) if end is None else end
+    while pos + 8 <= end:
+        size, kind = struct.unpack_from('>I4s', data, pos)
+        header = 8
+        if size == 1:
+            size = struct.unpack_from('>Q', data, pos + 8)[0]
+            header = 16
+        body = pos + header
+        stop = min(pos + size, end)
+        children = parse_boxes(data, body, stop) if kind in CONTAINERS else []
+        boxes.append((kind, body, stop, children))
+        pos += size
+    return boxes
+
+
+def child(boxes, kind):
+    return next(box for box in boxes if box[0] == kind)
+
+
+def find(boxes, *path):
+    for kind in path[:-1]:
+        boxes = child(boxes, kind)[3]
+    return child(boxes, path[-1])
+
+
+def full_box_entries(data, box, fmt):
+    """全box（version/flags 之后是条目数）的条目列表"""
+    _, body, stop, _ = box
+    count = struct.unpack_from('>I', data, body + 4)[0]
+    size = struct.calcsize(fmt)
+    entries = [struct.unpack_from(fmt, data, body + 8 + i * size) for i in range(count)]
+    assert body + 8 + count * size == stop
+    return entries
+
+
+def track_info(data, trak):
+    children = trak[3]
+    mdhd = find(children, b'mdia', b'mdhd')
+    timescale, duration = struct.unpack_from('>II', data, mdhd[1] + 12)
+    hdlr = find(children, b'mdia', b'hdlr')
+    stbl = find(children, b'mdia', b'minf', b'stbl')[3]
+    stsz = child(stbl, b'stsz')
+    _, count = struct.unpack_from('>II', data, stsz[1] + 4)
+    sizes = struct.unpack_from(f'>{count}I', data, stsz[1] + 12)
+    kinds = [box[0] for box in stbl]
+    offsets_box = child(stbl, b'co64' if b'co64' in kinds else b'stco')
+    offsets = [entry[0] for entry in full_box_entries(data, offsets_box, '>Q' if offsets_box[0] == b'co64' else '>I')]
+    return {
+        'handler': data[hdlr[1] + 8:hdlr[1] + 12],
+        'timescale': timescale,
+        'duration': duration,
+        'sizes': sizes,
+        'stts': full_box_entries(data, child(stbl, b'stts'), '>II'),
+        'ctts': full_box_entries(data, child(stbl, b'ctts'), '>Ii') if b'ctts' in kinds else None,
+        'stss': [entry[0] for entry in full_box_entries(data, child(stbl, b'stss'), '>I')] if b'stss' in kinds else None,
+        'stsc': full_box_entries(data, child(stbl, b'stsc'), '>III'),
+        'offsets': offsets,
+        'offset_box': offsets_box[0],
+    }
+
+
+def sample_offsets(info):
+    """由 stsc、块偏移量和样本大小算出每个样本在文件中的位置"""
+    stsc = info['stsc']
+    offsets = []
+    sample = 0
+    for chunk, offset in enumerate(info['offsets'], 1):
+        per_chunk = next(samples for first, samples, _ in reversed(stsc) if first <= chunk)
+        for _ in range(per_chunk):
+            offsets.append(offset)
+            offset += info['sizes'][sample]
+            sample += 1
+    assert sample == len(info['sizes'])
+    return offsets
+
+
+def remux(tmp_path, data, chunk_sizes=(188, 1000, 7, 65536, 4096)):
+    """按随机大小切开写入，返回 (remuxer, MP4 数据)"""
+    output = tmp_path / 'out.mp4'
+    remuxer = TSRemuxer(output)
+    rng = random.Random(0)
+    pos = 0
+    while pos < len(data):
+        size = rng.choice(chunk_sizes)
+        remuxer.write(data[pos:pos + size])
+        pos += size
+    remuxer.finish()
+    assert not remuxer.mdat_path.exists()
+    return remuxer, output.read_bytes()
+
+
+CLIPS = [(30, 900000), (30, 0)]
+
+
+@pytest.fixture(scope='module')
+def clip():
+    return synthetic_ts(CLIPS)
+
+
+def test_boxes_and_sample_tables(tmp_path, clip):
+    data, nals, audio = clip
+    remuxer, mp4 = remux(tmp_path, data)
+    boxes = parse_boxes(mp4)
+
+    # faststart：ftyp、moov 在 mdat 之前
+    assert [box[0] for box in boxes] == [b'ftyp', b'moov', b'mdat']
+    assert boxes[2][2] == len(mp4)
+    mdat_start, mdat_end = boxes[2][1], boxes[2][2]
+
+    video, sound = (track_info(mp4, trak) for trak in child(boxes, b'moov')[3] if trak[0] == b'trak')
+    assert video['handler'] == b'vide' and sound['handler'] == b'soun'
+
+    # 视频：每帧一个样本，第二段的时间戳回到0，接在前一帧之后
+    assert len(video['sizes']) == len(nals) == 60
+    assert video['timescale'] == 90000
+    assert video['stts'] == [(60, FRAME_TICKS)]
+    assert video['duration'] == 60 * FRAME_TICKS
+    assert video['ctts'] == [(60, FRAME_TICKS)]
+    assert video['stss'] == [1, 31]
+    assert remuxer.discontinuities == 1
+
+    # 音频：每个 ADTS 帧一个样本，时长按 1024 个采样计
+    assert len(sound['sizes']) == len(audio)
+    assert sound['timescale'] == SAMPLE_RATE
+    assert sound['stts'] == [(len(audio), 1024)]
+    assert sound['duration'] == len(audio) * 1024
+    assert remuxer.duration == pytest.approx(60 * FRAME_TICKS / 90000)
+    assert remuxer.describe() == "H.264 320x240，AAC 48000Hz 2ch，时长 00:00:02"
+
+    # 样本内容：视频为4字节长度前缀的 NAL（参数集放进 avcC，AUD 丢弃），音频为去掉帧头的 ADTS 负载
+    assert video['offset_box'] == sound['offset_box'] == b'stco'
+    for info, samples in ((video, [struct.pack('>I', len(nal)) + nal for nal in nals]), (sound, audio)):
+        assert list(info['sizes']) == [len(sample) for sample in samples]
+        for offset, sample in zip(sample_offsets(info), samples):
+            assert mdat_start <= offset and offset + len(sample) <= mdat_end
+            assert mp4[offset:offset + len(sample)] == sample
+    assert sum(video['sizes']) + sum(sound['sizes']) == mdat_end - mdat_start
+
+
+def test_avcc_carries_parameter_sets(tmp_path, clip):
+    _, mp4 = remux(tmp_path, clip[0])
+    boxes = parse_boxes(mp4)
+    trak = next(box for box in child(boxes, b'moov')[3] if box[0] == b'trak')
+    stsd = find(trak[3], b'mdia', b'minf', b'stbl', b'stsd')
+    entry = mp4[stsd[1] + 8:stsd[2]]
+    assert entry[4:8] == b'avc1'
+    width, height = struct.unpack_from('>HH', entry, 8 + 24)
+    assert (width, height) == (320, 240)
+    avcc = entry[entry.index(b'avcC') + 4:]
+    assert avcc[:4] == bytes((1, 66, 0, 30))
+    sps_length = struct.unpack_from('>H', avcc, 6)[0]
+    assert avcc[8:8 + sps_length] == SPS
+    assert avcc[8 + sps_length + 3:] == PPS
+
+
+def test_large_mdat_uses_co64(tmp_path, clip):
+    data, nals, _ = clip
+    output = tmp_path / 'large.mp4'
+    remuxer = TSRemuxer(output)
+    # 不实际写出 4 GiB：让样本偏移量从 5 GiB 开始，mdat 超过32位后块偏移量改用 co64
+    remuxer._mdat_size = 5 << 30
+    remuxer.write(data)
+    remuxer.finish()
+    mp4 = output.read_bytes()
+    boxes = parse_boxes(mp4)
+    assert [box[0] for box in boxes[:2]] == [b'ftyp', b'moov']
+    # mdat 用64位大小
+    mdat = boxes[2]
+    assert mdat[0] == b'mdat' and mdat[1] - 16 == child(boxes, b'moov')[2]
+    assert struct.unpack_from('>I', mp4, mdat[1] - 16)[0] == 1
+
+    video = track_info(mp4, next(box for box in child(boxes, b'moov')[3] if box[0] == b'trak'))
+    assert video['offset_box'] == b'co64'
+    assert video['offsets'][0] == mdat[1] + (5 << 30)
+    assert all(offset > 0xFFFFFFFF for offset in video['offsets'])
+    assert len(video['sizes']) == len(nals)
+
+
+def test_rejects_non_ts_and_unsupported_streams(tmp_path):
+    remuxer = TSRemuxer(tmp_path / 'empty.mp4')
+    remuxer.write(b'\x47' + b'\x1f\xff\x10' + b'\xff' * 184)
+    with pytest.raises(ValueError):
+        remuxer.finish()
+    assert not remuxer.mdat_path.exists()
+
+    writer = TSWriter()
+    writer.psi(0, 0x00, 1, struct.pack('>HH', 1, 0xE000 | PMT_PID))
+    writer.psi(PMT_PID, 0x02, 1, struct.pack('>HH', 0xE000 | VIDEO_PID, 0xF000)
+               + struct.pack('>BHH', 0x02, 0xE000 | VIDEO_PID, 0xF000))
+    remuxer = TSRemuxer(tmp_path / 'mpeg2.mp4')
+    with pytest.raises(ValueError, match='MPEG-2'):
+        remuxer.write(writer.data())
+    remuxer.abort()
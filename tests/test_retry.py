@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""重试策略：错误分类、指数退避、Retry-After 与取消"""
+
+import socket
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler
+from time import time
+
+import pytest
+import requests
+
+from hls_core import RetryPolicy, RetryStats, classify_error
+
+
+def http_error(status, headers=None):
+    response = requests.Response()
+    response.status_code = status
+    response.headers.update(headers or {})
+    return requests.HTTPError(f"{status}", response=response)
+
+
+@pytest.mark.parametrize('exc, cause', [
+    (http_error(429), 'http_429'),
+    (http_error(404), 'http_404'),
+    (requests.Timeout(), 'timeout'),
+    (socket.timeout(), 'timeout'),
+    (requests.ConnectionError(), 'connection'),
+    (requests.exceptions.ChunkedEncodingError(), 'connection'),
+    (ConnectionResetError(), 'connection'),
+    (ValueError('bad key'), 'other'),
+])
+def test_classify_error(exc, cause):
+    assert classify_error(exc) == cause
+
+
+def test_backoff_grows_exponentially_up_to_max_delay():
+    policy = RetryPolicy(attempts=10, base_delay=0.5, max_delay=3, jitter=False)
+    delays = [policy.backoff(requests.Timeout(), attempt) for attempt in range(6)]
+    assert delays == [0.5, 1, 2, 3, 3, 3]
+
+
+def test_jitter_stays_within_exponential_bound():
+    policy = RetryPolicy(attempts=10, base_delay=1, max_delay=30)
+    for attempt in range(6):
+        for _ in range(50):
+            assert 0 <= policy.backoff(requests.Timeout(), attempt) <= min(30, 2 ** attempt)
+
+
+def test_gives_up_after_attempts_and_on_permanent_errors():
+    policy = RetryPolicy(attempts=3, jitter=False)
+    assert policy.backoff(http_error(503), 1) is not None
+    assert policy.backoff(http_error(503), 2) is None
+    assert policy.backoff(http_error(404), 0) is None
+    assert policy.backoff(http_error(403), 0) is None
+    assert RetryPolicy(attempts=3, retry_statuses={404}).backoff(http_error(404), 0) is not None
+
+
+def test_retry_after_seconds_and_http_date():
+    policy = RetryPolicy(base_delay=0.5, max_delay=30, jitter=False)
+    assert policy.backoff(http_error(429, {'Retry-After': '4'}), 0) == 4.5
+    # Retry-After 不超过 max_delay
+    assert policy.backoff(http_error(503, {'Retry-After': '3600'}), 0) == 30.5
+    delay = policy.backoff(http_error(503, {'Retry-After': formatdate(time() + 10, usegmt=True)}), 0)
+    assert 9 <= delay - 0.5 <= 10
+    assert policy.backoff(http_error(503, {'Retry-After': 'soon'}), 0) == 0.5
+
+
+def test_call_retries_and_counts_causes():
+    policy = RetryPolicy(attempts=5, base_delay=0, jitter=False)
+    stats = RetryStats()
+    failures = [http_error(429), requests.Timeout(), http_error(429)]
+
+    def fetch():
+        if failures:
+            raise failures.pop(0)
+        return 'ok'
+
+    assert policy.call(fetch, stats) == 'ok'
+    assert stats.total == 3
+    assert stats.retries == {'http_429': 2, 'timeout': 1}
+    assert stats.summary() == 'http_429×2，timeout×1'
+
+
+def test_call_raises_last_error_without_retrying_permanent_errors():
+    policy = RetryPolicy(attempts=5, base_delay=0, jitter=False)
+    stats = RetryStats()
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        raise http_error(404)
+
+    with pytest.raises(requests.HTTPError):
+        policy.call(fetch, stats)
+    assert len(calls) == 1 and stats.total == 0
+
+
+def test_cancel_interrupts_backoff():
+    policy = RetryPolicy(attempts=5, base_delay=60, jitter=False)
+
+    def fetch():
+        raise requests.Timeout()
+
+    with pytest.raises(requests.Timeout):
+        policy.call(fetch, cancelled=lambda: True)
+    assert RetryPolicy.sleep(60, cancelled=lambda: True) is False
+    assert RetryPolicy.sleep(0.01) is True
+
+
+def test_resume_summary():
+    stats = RetryStats()
+    stats.record('connection')
+    stats.record_resume(3 * 1024 * 1024)
+    assert stats.summary() == 'connection×1；续传 1 次，节省 3.0 MB'
+
+
+class ThrottlingHandler(BaseHTTPRequestHandler):
+    """前两次请求返回 429 + Retry-After，之后正常返回"""
+
+    protocol_version = 'HTTP/1.1'
+    requests_seen = 0
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        ThrottlingHandler.requests_seen += 1
+        if ThrottlingHandler.requests_seen <= 2:
+            self.send_response(429)
+            self.send_header('Retry-After', '0')
+            self.send_header('Content-Length', '0')
+        else:
+            self.send_response(200)
+            self.send_header('Content-Length', '2')
+        self.end_headers()
+        if ThrottlingHandler.requests_seen > 2:
+            self.wfile.write(b'ok')
+
+
+def test_retries_throttled_requests_against_local_server(serve):
+    ThrottlingHandler.requests_seen = 0
+    server = serve(ThrottlingHandler)
+    policy = RetryPolicy(attempts=5, base_delay=0.01, jitter=False)
+    stats = RetryStats()
+
+    def fetch():
+        response = requests.get(server.url('/segment.ts'), timeout=5)
+        response.raise_for_status()
+        return response.content
+
+    assert policy.call(fetch, stats) == b'ok'
+    assert stats.retries == {'http_429': 2}
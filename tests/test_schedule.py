@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""播放顺序调度：预读窗口、连续可用统计、合并的字节范围任务，以及超长播放列表的内存占用"""
+
+import tracemalloc
+from collections import deque
+from types import SimpleNamespace
+
+from hls_core import PlaybackScheduler, job_indices, parse_media_playlist, plan_range_jobs
+
+
+def plain_jobs(count):
+    return [(index, SimpleNamespace(uri=f'{index}.ts', byterange=None)) for index in range(count)]
+
+
+def indices(jobs):
+    return [index for job in jobs for index in job_indices(job)]
+
+
+def write_segment(tmp_path, index, size):
+    path = tmp_path / f'segment_{index:05d}.ts'
+    path.write_bytes(b'x' * size)
+    return path
+
+
+def test_take_stays_within_lookahead_window():
+    scheduler = PlaybackScheduler(plain_jobs(100), concurrency=4, lookahead=10)
+    assert scheduler.total == 100 and scheduler.pending == 100
+    assert indices(scheduler.take(4)) == [0, 1, 2, 3]
+    assert indices(scheduler.take(100)) == [4, 5, 6, 7, 8, 9]
+    assert scheduler.take(100) == []
+    assert scheduler.pending == 90
+
+    # 后面的分片完成不推动窗口，最小的未完成分片完成后窗口前移
+    for index in range(1, 10):
+        scheduler.complete((index, True, None))
+    assert scheduler.take(100) == []
+    scheduler.complete((0, True, None))
+    assert indices(scheduler.take(100)) == list(range(10, 20))
+
+
+def test_default_lookahead_is_multiple_of_concurrency():
+    scheduler = PlaybackScheduler(plain_jobs(1000), concurrency=3)
+    assert len(scheduler.take(1000)) == 24
+    assert PlaybackScheduler(plain_jobs(10), concurrency=4, lookahead=2).lookahead == 4
+
+
+def test_contiguous_progress(tmp_path):
+    scheduler = PlaybackScheduler(plain_jobs(6), concurrency=6)
+    scheduler.take(6)
+    scheduler.complete((1, True, write_segment(tmp_path, 1, 200)))
+    assert (scheduler.ready_count, scheduler.contiguous_bytes) == (0, 0)
+    scheduler.complete((0, True, write_segment(tmp_path, 0, 100)))
+    assert (scheduler.ready_count, scheduler.contiguous_bytes) == (2, 300)
+    # 失败的分片之后不再累计，重复登记被忽略
+    scheduler.complete((2, False, None))
+    scheduler.complete((3, True, write_segment(tmp_path, 3, 400)))
+    scheduler.complete((3, True, write_segment(tmp_path, 3, 400)))
+    assert (scheduler.ready_count, scheduler.contiguous_bytes) == (2, 300)
+
+
+def test_range_jobs_count_their_members():
+    segments = [SimpleNamespace(uri='all.ts', byterange='100@0')]
+    segments += [SimpleNamespace(uri='all.ts', byterange='100') for _ in range(5)]
+    segments += [SimpleNamespace(uri='tail.ts', byterange=None)]
+    jobs = plan_range_jobs(enumerate(segments), 'https://cdn.example.com/index.m3u8', max_request_bytes=300)
+    scheduler = PlaybackScheduler(jobs, concurrency=1, lookahead=4)
+    assert scheduler.total == 7
+
+    # 窗口按分片计：第二个 RangeJob 从位置3开始，仍在窗口内；之后的分片要等窗口前移
+    assert [len(job) for job in scheduler.take(10)] == [3, 3]
+    assert scheduler.take(10) == []
+    for index in (0, 1, 2):
+        scheduler.complete((index, True, None))
+    assert indices(scheduler.take(10)) == [6]
+    assert scheduler.pending == 0
+
+
+def test_jobs_are_pulled_lazily():
+    pulled = []
+
+    def jobs():
+        for index in range(10 ** 6):
+            pulled.append(index)
+            yield index, SimpleNamespace(uri=f'{index}.ts', byterange=None)
+
+    scheduler = PlaybackScheduler(jobs(), concurrency=2, lookahead=4, total=10 ** 6)
+    assert indices(scheduler.take(10)) == [0, 1, 2, 3]
+    # 只多取出一个等待交出的任务
+    assert pulled == [0, 1, 2, 3, 4]
+
+
+def synthetic_table(count):
+    lines = ['#EXTM3U', '#EXT-X-VERSION:3', '#EXT-X-TARGETDURATION:4', '#EXT-X-MEDIA-SEQUENCE:0']
+    for index in range(count):
+        lines += ['#EXTINF:4.0,', f'media/segment_{index:06d}.ts?token=0123456789abcdef']
+    lines.append('#EXT-X-ENDLIST')
+    return parse_media_playlist('\n'.join(lines) + '\n', 'https://cdn.example.com/vod/index.m3u8')
+
+
+def scheduling_peak(table, concurrency=8):
+    """
+    模拟下载循环按播放顺序调度整个分片表，返回调度过程中新分配内存的峰值（字节）
+
+    每次交出的任务立即完成，窗口中的分片不断前移直到全部调度完。
+    """
+    tracemalloc.start()
+    try:
+        baseline = tracemalloc.get_traced_memory()[0]
+        jobs = plan_range_jobs(enumerate(table), table.base_url)
+        scheduler = PlaybackScheduler(jobs, concurrency, total=len(table))
+        in_flight = deque()
+        scheduled = 0
+        while True:
+            for job in scheduler.take(concurrency - len(in_flight)):
+                in_flight.append(job)
+            if not in_flight:
+                break
+            index = in_flight.popleft()[0]
+            scheduler.complete((index, True, None))
+            scheduled += 1
+        peak = tracemalloc.get_traced_memory()[1] - baseline
+    finally:
+        tracemalloc.stop()
+    assert scheduled == len(table) and scheduler.ready_count == len(table)
+    return peak
+
+
+def test_scheduling_memory_is_bounded_by_window():
+    small = synthetic_table(10_000)
+    large = synthetic_table(100_000)
+    small_peak = scheduling_peak(small)
+    large_peak = scheduling_peak(large)
+
+    # 峰值只与预读窗口有关：10 倍的分片数不增加内存，且远小于每个分片一个任务对象
+    assert large_peak < 256 * 1024
+    assert large_peak < small_peak * 1.5 + 16 * 1024
+    assert large_peak < large.nbytes / 4
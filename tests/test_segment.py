@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+分片写入端的续传：Range/If-Range 请求头、206 响应接着 .part 文件追加、
+校验值不符（200）时截断重来、弱 ETag 不发 If-Range，以及下载器对中断分片的续传
+"""
+
+import os
+import threading
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+from Crypto.Cipher import AES
+from Crypto.Util.Padding import pad
+
+from hls_core import ENGINE_ASYNCIO, ENGINES, RetryPolicy, SegmentSink, StreamingDecryptor, asyncio_available
+from hls_core.segment import SEGMENT_CHUNK_SIZE
+
+from m3u8_downloader import M3U8Downloader
+
+
+# 四个读取块；传输断在块边界上，下载器读取不完整的块时会连同已收到的部分一起丢弃
+BODY = bytes(range(256)) * (SEGMENT_CHUNK_SIZE // 64)
+HALF = len(BODY) // 2
+
+
+def full_headers(**extra):
+    headers = {'Content-Length': str(len(BODY))}
+    headers.update(extra)
+    return headers
+
+
+def partial_headers(start, total=len(BODY)):
+    return {'Content-Range': f'bytes {start}-{total - 1}/{total}', 'Content-Length': str(total - start)}
+
+
+def test_206_continues_appending_to_part_file(tmp_path):
+    path = tmp_path / 'segment_00000.ts'
+    sink = SegmentSink(path)
+    sink.begin(full_headers(ETag='"v1"', **{'Last-Modified': 'Wed, 01 Jan 2025 00:00:00 GMT'}))
+    sink.write(BODY[:HALF])
+    # 传输中断：.part 文件保留已写入的部分，最终文件还不存在
+    assert os.path.getsize(f'{path}.part') == HALF and not path.exists()
+    # 强 ETag 优先于 Last-Modified
+    assert sink.resume_headers() == {'Range': f'bytes={HALF}-', 'If-Range': '"v1"'}
+
+    assert sink.continues(206, partial_headers(HALF))
+    sink.write(BODY[HALF:])
+    assert sink.finish() is None
+    assert path.read_bytes() == BODY and not os.path.exists(f'{path}.part')
+    assert sink.bytes_written == len(BODY)
+    # 完成后不再续传
+    assert sink.resume_headers() is None
+
+
+def test_200_or_mismatched_range_restarts(tmp_path):
+    sink = SegmentSink(tmp_path / 'segment_00000.ts')
+    sink.begin(full_headers(ETag='"v1"'))
+    sink.write(BODY[:HALF])
+    # If-Range 不符时服务器返回 200 和整个新资源
+    assert not sink.continues(200, full_headers(ETag='"v2"'))
+    # 起点不对、总长度变化、压缩传输的 206 也不能接上
+    assert not sink.continues(206, partial_headers(HALF + 1))
+    assert not sink.continues(206, partial_headers(HALF, total=len(BODY) + 10))
+    assert not sink.continues(206, {**partial_headers(HALF), 'Content-Encoding': 'gzip'})
+    assert not sink.continues(206, {})
+
+    # 调用方放弃旧的写入端（删除 .part），新的写入端从头写
+    sink.abort()
+    assert not os.path.exists(tmp_path / 'segment_00000.ts.part')
+    restarted = SegmentSink(tmp_path / 'segment_00000.ts')
+    restarted.begin(full_headers(ETag='"v2"'))
+    restarted.write(BODY[::-1])
+    restarted.finish()
+    assert (tmp_path / 'segment_00000.ts').read_bytes() == BODY[::-1]
+
+
+def test_weak_etag_sends_no_if_range(tmp_path):
+    sink = SegmentSink(tmp_path / 'a.ts')
+    sink.begin(full_headers(ETag='W/"v1"'))
+    sink.write(BODY[:HALF])
+    # 弱 ETag 不能用于 If-Range；只凭总长度校验
+    assert sink.resume_headers() == {'Range': f'bytes={HALF}-'}
+    sink.abort()
+
+    sink = SegmentSink(tmp_path / 'b.ts')
+    sink.begin(full_headers(ETag='W/"v1"', **{'Last-Modified': 'Wed, 01 Jan 2025 00:00:00 GMT'}))
+    sink.write(BODY[:HALF])
+    assert sink.resume_headers() == {'Range': f'bytes={HALF}-', 'If-Range': 'Wed, 01 Jan 2025 00:00:00 GMT'}
+    sink.abort()
+
+
+@pytest.mark.parametrize('headers', [
+    {'Content-Length': str(len(BODY)), 'ETag': '"v1"', 'Content-Encoding': 'gzip'},
+    {'Content-Length': str(len(BODY)), 'ETag': '"v1"', 'Accept-Ranges': 'none'},
+    {'ETag': 'W/"v1"'},
+    {},
+], ids=['gzip', 'accept-ranges-none', 'weak-etag-no-length', 'no-validator'])
+def test_not_resumable(tmp_path, headers):
+    sink = SegmentSink(tmp_path / 'a.ts')
+    sink.begin(headers)
+    sink.write(BODY[:HALF])
+    assert sink.resume_headers() is None
+    sink.abort()
+
+
+def test_resume_keeps_decryption_state(tmp_path):
+    key, iv = bytes(range(16)), bytes(16)
+    encrypted = AES.new(key, AES.MODE_CBC, iv).encrypt(pad(BODY, AES.block_size))
+    path = tmp_path / 'segment_00000.ts'
+    sink = SegmentSink(path, StreamingDecryptor(key, iv))
+    sink.begin({'Content-Length': str(len(encrypted)), 'ETag': '"v1"'})
+    # 断在 AES 块中间
+    cut = 300 * 16 + 7
+    sink.write(encrypted[:cut])
+    assert sink.resume_headers() == {'Range': f'bytes={cut}-', 'If-Range': '"v1"'}
+    assert sink.continues(206, partial_headers(cut, total=len(encrypted)))
+    sink.write(encrypted[cut:])
+    sink.finish()
+    assert path.read_bytes() == BODY
+
+
+def segment_body(version):
+    return BODY if version == 1 else BODY[::-1]
+
+
+class ResumeHandler(BaseHTTPRequestHandler):
+    """
+    分片第一次请求只发出一半数据就断开连接；之后的请求按 mode 处理：
+    match 资源未变，按 Range 返回206；changed 资源已更新（ETag 变化），If-Range 不符时返回200；
+    weak 只有弱 ETag，按 Range 返回206
+    """
+
+    protocol_version = 'HTTP/1.1'
+    lock = threading.Lock()
+    mode = 'match'
+    requests = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path == '/vod.m3u8':
+            body = b'#EXTM3U\n#EXT-X-TARGETDURATION:4\n#EXTINF:4.0,\nseg0.ts\n#EXT-X-ENDLIST\n'
+            self.reply(200, body, {})
+            return
+        with self.lock:
+            ResumeHandler.requests.append((self.headers.get('Range'), self.headers.get('If-Range')))
+            first = len(ResumeHandler.requests) == 1
+        version = 1 if first or self.mode != 'changed' else 2
+        etag = f'W/"v{version}"' if self.mode == 'weak' else f'"v{version}"'
+        body = segment_body(version)
+        headers = {'ETag': etag, 'Accept-Ranges': 'bytes'}
+        if first:
+            self.send_response(200)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body[:HALF])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        range_value = self.headers.get('Range')
+        if_range = self.headers.get('If-Range')
+        if range_value and (if_range is None or if_range == etag):
+            start = int(range_value[len('bytes='):-1])
+            headers['Content-Range'] = f'bytes {start}-{len(body) - 1}/{len(body)}'
+            self.reply(206, body[start:], headers)
+        else:
+            self.reply(200, body, headers)
+
+    def reply(self, status, body, headers):
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+@pytest.mark.parametrize('mode, if_range, expected, resumed', [
+    ('match', '"v1"', 1, 1),
+    ('changed', '"v1"', 2, 0),
+    ('weak', None, 1, 1),
+])
+def test_downloader_resumes_interrupted_segment(serve, tmp_path, engine, mode, if_range, expected, resumed):
+    if engine == ENGINE_ASYNCIO and not asyncio_available():
+        pytest.skip('asyncio 引擎需要 aiohttp')
+    ResumeHandler.mode = mode
+    ResumeHandler.requests = []
+    server = serve(ResumeHandler)
+    downloader = M3U8Downloader(server.url('/vod.m3u8'), str(tmp_path), 'vod', max_workers=1, engine=engine,
+                                retry_policy=RetryPolicy(attempts=3, base_delay=0.01, max_delay=0.05))
+    assert downloader.download(keep_temp=True)
+
+    assert ResumeHandler.requests == [(None, None), (f'bytes={HALF}-', if_range)]
+    # 资源变化时截断重来，不会把旧的前半部分和新资源拼在一起
+    assert (downloader.temp_dir / 'segment_00000.ts').read_bytes() == segment_body(expected)
+    assert downloader.retry_stats.resumed == resumed
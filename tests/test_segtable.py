@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""紧凑分片表：URL解析与 urljoin 一致、字节范围规整、密钥和初始化段共用记录，以及按分片表顺序合并"""
+
+import random
+from types import SimpleNamespace
+from urllib.parse import urljoin
+
+import m3u8
+import pytest
+
+from hls_core import SegmentTable, absolute_url, segment_file_name
+
+from m3u8_downloader import M3U8Downloader
+
+
+BASES = [
+    'https://cdn.example.com/vod/a/index.m3u8',
+    'https://cdn.example.com/vod/a/index.m3u8?token=1&x=2',
+    'http://cdn:8080/',
+    'https://cdn/a/b/',
+    'https://cdn/index.m3u8#frag',
+    'http://cdn/a/b/c.m3u8;p=1',
+    'http://cdn/a//b/c.m3u8',
+    'http://cdn/a/./b/../c.m3u8',
+    'http://cdn',
+    'https://cdn/a/b/c.m3u8?',
+]
+
+URIS = [
+    's0.ts', 'seg/1/s0.ts', 's0.ts?sig=abc', 's0.ts#t', '/abs/s0.ts', '//other/s.ts', '../up/s.ts', './s.ts',
+    'a/./b.ts', 'a/../b.ts', 'https://x.com/a/s.ts', 'http://x.com/a/../s.ts', '?q=1', '#f', '', 'seg:1.ts',
+    'a/b:c.ts', 'HTTPS://X.com/s.ts', 'a%20b.ts', '中文.ts', 's.ts?u=http://a/../b', 'ftp://x/y', 'a//b.ts', '..',
+    '.hidden.ts', 'a/.hidden', 'https://x.com', 'https://x.com/a?b=../c', 'https://x.com:443/a/b.ts?x=1',
+    'http://[::1]/a.ts', 's.ts?', 'a/', 'a;b.ts',
+]
+
+
+@pytest.mark.parametrize('base', BASES)
+def test_resolve_matches_urljoin(base):
+    table = SegmentTable(base)
+    for uri in URIS:
+        assert table.resolve(uri) == urljoin(base, uri), uri
+
+
+def test_resolve_matches_urljoin_on_random_uris():
+    rng = random.Random(0)
+    alphabet = 'ab/.?#:%-_=&中 ~;,+@Z9'
+    prefixes = ['http://', 'https://', '//', '/', 'http://x.com/', 'https://x:1/']
+    tables = [SegmentTable(base) for base in BASES]
+    for _ in range(20000):
+        uri = ''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 12)))
+        if rng.random() < 0.3:
+            uri = rng.choice(prefixes) + uri
+        table = rng.choice(tables)
+        assert table.resolve(uri) == urljoin(table.base_url, uri), (table.base_url, uri)
+
+
+PLAYLIST = '''#EXTM3U
+#EXT-X-VERSION:7
+#EXT-X-TARGETDURATION:4
+#EXT-X-MEDIA-SEQUENCE:100
+#EXT-X-MAP:URI="init.mp4"
+#EXT-X-KEY:METHOD=AES-128,URI="keys/1.key",IV=0x000102030405060708090a0b0c0d0e0f
+#EXTINF:4.0,
+#EXT-X-BYTERANGE:1000@0
+media.mp4
+#EXTINF:4.0,
+#EXT-X-BYTERANGE:1000
+media.mp4
+#EXTINF:3.5,
+other.mp4
+#EXT-X-MAP:URI="init2.mp4",BYTERANGE="720@0"
+#EXT-X-KEY:METHOD=NONE
+#EXTINF:4.0,
+#EXT-X-BYTERANGE:500
+media.mp4
+#EXT-X-KEY:METHOD=AES-128,URI="keys/1.key",IV=0x000102030405060708090a0b0c0d0e0f
+#EXTINF:2.0,
+https://other.example.com/abs.mp4?sig=1
+#EXT-X-ENDLIST
+'''
+
+BASE = 'https://cdn.example.com/vod/index.m3u8?token=abc'
+
+
+@pytest.fixture
+def table():
+    return SegmentTable.from_playlist(m3u8.loads(PLAYLIST), BASE)
+
+
+def test_segments_are_resolved_records(table):
+    assert len(table) == 5
+    assert table.media_sequence == 100 and table.is_endlist and table.target_duration == 4
+    assert [table.url(i) for i in range(len(table))] == [
+        'https://cdn.example.com/vod/media.mp4',
+        'https://cdn.example.com/vod/media.mp4',
+        'https://cdn.example.com/vod/other.mp4',
+        'https://cdn.example.com/vod/media.mp4',
+        'https://other.example.com/abs.mp4?sig=1',
+    ]
+    assert [segment.duration for segment in table] == [4.0, 4.0, 3.5, 4.0, 2.0]
+    assert table.duration == 17.5
+    assert [segment.iv_sequence for segment in table] == [100, 101, 102, 103, 104]
+    assert table[-1].uri == table[4].uri
+
+
+def test_byterange_is_normalised_to_length_at_offset(table):
+    # 省略偏移量的范围接在同一资源上一个范围之后，中间隔着其他资源也一样
+    assert [segment.byterange for segment in table] == ['1000@0', '1000@1000', None, '500@2000', None]
+
+
+def test_keys_and_maps_are_interned(table):
+    segments = list(table)
+    assert len(table.keys) == 2 and len(table.maps) == 2
+    assert segments[0].key is segments[1].key is segments[4].key
+    assert segments[0].key.uri == 'https://cdn.example.com/vod/keys/1.key'
+    assert segments[0].key.iv == '0x000102030405060708090a0b0c0d0e0f'
+    assert segments[3].key.method == 'NONE' and segments[3].key.uri is None
+    assert segments[0].init_section is segments[2].init_section
+    assert segments[0].init_section.uri == 'https://cdn.example.com/vod/init.mp4'
+    assert segments[3].init_section.byterange == '720@0'
+    assert table.encrypted
+
+
+def test_method_none_is_not_encrypted():
+    playlist = m3u8.loads('#EXTM3U\n#EXT-X-TARGETDURATION:4\n#EXT-X-KEY:METHOD=NONE\n#EXTINF:4,\na.ts\n#EXT-X-ENDLIST\n')
+    table = SegmentTable.from_playlist(playlist, BASE)
+    assert table[0].key.method == 'NONE'
+    assert not table.encrypted
+
+
+def test_absolute_url_skips_rejoining_resolved_records(table):
+    record = table[4]
+    assert record.resolved
+    # 已解析的记录直接使用自己的 uri，即使传入的是别的 base_url
+    assert absolute_url(record, 'https://elsewhere.example.com/x/') == 'https://other.example.com/abs.mp4?sig=1'
+    assert absolute_url(record.key, 'https://elsewhere.example.com/x/') == 'https://cdn.example.com/vod/keys/1.key'
+    # m3u8 对象和直播分片仍按 base_url 解析
+    assert absolute_url(SimpleNamespace(uri='../seg.ts'), 'https://cdn.example.com/a/b/index.m3u8') == \
+        'https://cdn.example.com/a/seg.ts'
+
+
+def test_append_and_size():
+    table = SegmentTable('https://cdn.example.com/live/index.m3u8', media_sequence=5)
+    for index in range(1000):
+        table.append(f'seg{index}.ts', 4.0)
+    assert len(table) == 1000 and table[999].iv_sequence == 1004
+    assert table.url(999) == 'https://cdn.example.com/live/seg999.ts'
+    # 每个分片 40 字节加URL长度
+    assert table.nbytes == 40 * 1000 + sum(len(table.url(i)) for i in range(1000))
+
+
+def test_trailing_extinf_without_uri_is_not_a_segment():
+    # 播放列表写到一半（或生成方出错）时结尾的 EXTINF 没有 URI
+    playlist = m3u8.loads('#EXTM3U\n#EXT-X-TARGETDURATION:4\n#EXTINF:4,\na.ts\n#EXTINF:4,\n')
+    assert [segment.uri for segment in playlist.segments] == ['a.ts', None]
+    table = SegmentTable.from_playlist(playlist, BASE)
+    assert len(table) == 1 and table.duration == 4
+
+
+def test_merge_follows_table_order_past_99999(tmp_path, monkeypatch):
+    downloader = M3U8Downloader('https://cdn.example.com/vod/index.m3u8', str(tmp_path), 'big')
+    monkeypatch.setattr(downloader, 'merge_with_ffmpeg', lambda ts_files, output_file: False)
+    monkeypatch.setattr(downloader, 'merge_remux', lambda ts_files, output_file: False)
+    total = 100_002
+    for index in range(total):
+        (downloader.temp_dir / segment_file_name(index)).touch()
+    # segment_100000.ts 按文件名排序会排在 segment_10000.ts 和 segment_10001.ts 之间
+    marked = [9999, 10000, 99998, 99999, 100000, 100001]
+    for index in marked:
+        (downloader.temp_dir / segment_file_name(index)).write_bytes(f'<{index}>'.encode())
+    assert segment_file_name(99999) == 'segment_99999.ts' and segment_file_name(100000) == 'segment_100000.ts'
+
+    assert downloader.merge_segments(total)
+    output = tmp_path / f'{downloader.output_name}.mp4'
+    assert output.read_bytes() == b''.join(f'<{index}>'.encode() for index in marked)
+
+    # 缺少分片时不合并
+    (downloader.temp_dir / segment_file_name(100000)).unlink()
+    assert not downloader.merge_segments(total)
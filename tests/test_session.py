@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""连接池会话：本地 HTTPS 服务器上统计 TLS 握手次数"""
+
+import shutil
+import ssl
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+import requests
+
+from hls_core import create_session, session_stats
+
+
+REQUESTS = 60
+WORKERS = 4
+
+
+@pytest.fixture(scope='module')
+def certificate(tmp_path_factory):
+    """127.0.0.1 的自签名证书 (cert, key)"""
+    if shutil.which('openssl') is None:
+        pytest.skip('需要 openssl 生成测试证书')
+    directory = tmp_path_factory.mktemp('tls')
+    cert, key = directory / 'cert.pem', directory / 'key.pem'
+    subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+                    '-subj', '/CN=127.0.0.1', '-addext', 'subjectAltName=IP:127.0.0.1',
+                    '-keyout', str(key), '-out', str(cert)], check=True, capture_output=True)
+    return str(cert), str(key)
+
+
+class CountingHandler(BaseHTTPRequestHandler):
+    """每个 TLS 连接计一次握手，并记录其中的会话恢复"""
+
+    protocol_version = 'HTTP/1.1'
+    lock = threading.Lock()
+    handshakes = 0
+    resumed = 0
+
+    def setup(self):
+        super().setup()
+        with self.lock:
+            CountingHandler.handshakes += 1
+            CountingHandler.resumed += bool(self.connection.session_reused)
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        body = b'x' * 4096
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def https_server(serve, certificate):
+    cert, key = certificate
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert, key)
+    CountingHandler.handshakes = CountingHandler.resumed = 0
+    return serve(CountingHandler, lambda sock: context.wrap_socket(sock, server_side=True))
+
+
+def trusting_session(cert, pool_maxsize):
+    session = create_session(pool_maxsize=pool_maxsize)
+    session.get_adapter('https://').ssl_context.load_verify_locations(cert)
+    return session
+
+
+def test_bare_requests_handshake_per_request(https_server, certificate):
+    """改造前的做法：每次 requests.get 都是一次新的 TCP+TLS 握手"""
+    url = https_server.url('/segment.ts', 'https')
+    for _ in range(REQUESTS // 4):
+        requests.get(url, verify=certificate[0], timeout=10).raise_for_status()
+    assert CountingHandler.handshakes == REQUESTS // 4
+
+
+def test_pooled_session_reuses_connections(https_server, certificate):
+    session = trusting_session(certificate[0], WORKERS)
+    url = https_server.url('/segment.ts', 'https')
+
+    def fetch(_):
+        response = session.get(url, timeout=10)
+        response.raise_for_status()
+        return len(response.content)
+
+    with ThreadPoolExecutor(WORKERS) as executor:
+        assert sum(executor.map(fetch, range(REQUESTS))) == REQUESTS * 4096
+    session.close()
+
+    # 连接数不超过连接池大小，与请求数无关
+    assert 1 <= CountingHandler.handshakes <= WORKERS
+    handshakes, _ = session_stats(session)
+    assert handshakes == CountingHandler.handshakes
+
+
+def test_new_connection_resumes_tls_session(https_server, certificate):
+    session = trusting_session(certificate[0], 1)
+    url = https_server.url('/segment.ts', 'https')
+    session.get(url, timeout=10).raise_for_status()
+    # 关闭池中的连接，下一个请求必须新建连接
+    session.get_adapter('https://').poolmanager.clear()
+    session.get(url, timeout=10).raise_for_status()
+    session.close()
+
+    assert CountingHandler.handshakes == 2
+    assert CountingHandler.resumed == 1
+    assert session_stats(session) == (2, 1)
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+多码率选择：策略字符串解析、各静态策略在一个小主播放列表上的选择（含没有合适码率、
+没有声明分辨率时的回退），以及 auto 策略用模拟吞吐量的 fetch 试下载后的选择
+"""
+
+import threading
+from types import SimpleNamespace
+
+import m3u8
+import pytest
+
+from hls_core import VariantPolicy, choose_variant, select_variant
+from hls_core import variants as variants_module
+
+
+MASTER_URL = 'https://cdn.example.com/live/master.m3u8'
+
+MASTER = m3u8.loads('\n'.join([
+    '#EXTM3U',
+    '#EXT-X-STREAM-INF:BANDWIDTH=5000000,RESOLUTION=1920x1080', '1080.m3u8',
+    '#EXT-X-STREAM-INF:BANDWIDTH=800000,RESOLUTION=640x360', '360.m3u8',
+    # 峰值码率超过 2.5M，平均码率不超过：按平均码率
+    '#EXT-X-STREAM-INF:BANDWIDTH=2600000,AVERAGE-BANDWIDTH=2200000,RESOLUTION=1280x720', '720.m3u8',
+    '#EXT-X-STREAM-INF:BANDWIDTH=2800000,RESOLUTION=1280x720', '720hi.m3u8',
+    '#EXT-X-STREAM-INF:BANDWIDTH=2000000,RESOLUTION=960x720', '720sd.m3u8',
+    '#EXT-X-STREAM-INF:BANDWIDTH=1500000,RESOLUTION=960x540', '540.m3u8',
+]) + '\n')
+
+# 只有码率、没有声明分辨率
+AUDIO_ONLY = m3u8.loads('\n'.join([
+    '#EXTM3U',
+    '#EXT-X-STREAM-INF:BANDWIDTH=256000', 'high.m3u8',
+    '#EXT-X-STREAM-INF:BANDWIDTH=64000', 'low.m3u8',
+    '#EXT-X-STREAM-INF:BANDWIDTH=128000', 'mid.m3u8',
+]) + '\n')
+
+
+@pytest.mark.parametrize('spec, kind, value, text', [
+    (None, 'best', None, 'best'),
+    ('  WORST ', 'worst', None, 'worst'),
+    ('max-bandwidth=2.5m', 'max-bandwidth', 2500000, 'max-bandwidth=2500000'),
+    ('max-bandwidth=800K', 'max-bandwidth', 800000, 'max-bandwidth=800000'),
+    ('max-bandwidth=1200000', 'max-bandwidth', 1200000, 'max-bandwidth=1200000'),
+    ('resolution=720', 'resolution', (None, 720), 'resolution=720'),
+    ('resolution=720p', 'resolution', (None, 720), 'resolution=720'),
+    ('resolution=1280x720', 'resolution', (1280, 720), 'resolution=1280x720'),
+    ('auto', 'auto', None, 'auto'),
+])
+def test_parse(spec, kind, value, text):
+    policy = VariantPolicy.parse(spec)
+    assert (policy.kind, policy.value, str(policy)) == (kind, value, text)
+    assert VariantPolicy.parse(policy) is policy
+    assert VariantPolicy.parse(str(policy)).value == value
+
+
+@pytest.mark.parametrize('spec', ['fastest', 'max-bandwidth=', 'max-bandwidth=2.5g', 'resolution=hd',
+                                  'resolution=x720', 'best=1'])
+def test_parse_rejects_invalid(spec):
+    with pytest.raises(ValueError):
+        VariantPolicy.parse(spec)
+
+
+@pytest.mark.parametrize('master, spec, uri', [
+    (MASTER, 'best', '1080.m3u8'),
+    (MASTER, 'worst', '360.m3u8'),
+    (MASTER, 'max-bandwidth=2.5m', '720.m3u8'),
+    (MASTER, 'max-bandwidth=2000k', '720sd.m3u8'),
+    # 没有不超过上限的码率：取最低码率
+    (MASTER, 'max-bandwidth=100k', '360.m3u8'),
+    # 同一分辨率有多个变体时取码率最高的
+    (MASTER, 'resolution=720', '720hi.m3u8'),
+    (MASTER, 'resolution=1280x720', '720hi.m3u8'),
+    (MASTER, 'resolution=960x720', '720sd.m3u8'),
+    # 没有这个分辨率：取不超过它的最高分辨率；宽度不符也不算精确匹配
+    (MASTER, 'resolution=900', '720hi.m3u8'),
+    (MASTER, 'resolution=1920x720', '720hi.m3u8'),
+    (MASTER, 'resolution=600', '540.m3u8'),
+    # 所有分辨率都更高：取最低码率
+    (MASTER, 'resolution=240', '360.m3u8'),
+    # 没有声明分辨率：按分辨率选择时回退到最低码率，其他策略只看码率
+    (AUDIO_ONLY, 'resolution=720', 'low.m3u8'),
+    (AUDIO_ONLY, 'best', 'high.m3u8'),
+    (AUDIO_ONLY, 'max-bandwidth=200k', 'mid.m3u8'),
+])
+def test_select_variant(master, spec, uri):
+    assert select_variant(master.playlists, spec).uri == uri
+
+
+def test_static_choice_does_not_probe():
+    def fetch(url, headers=None):
+        raise AssertionError('静态策略不应试下载')
+
+    choice = choose_variant(MASTER.playlists, 'resolution=720', MASTER_URL, fetch)
+    assert choice.url == 'https://cdn.example.com/live/720hi.m3u8'
+    assert choice.throughput is None and choice.probes == []
+    assert choice.describe() == '1280x720 2.8 Mbps（策略 resolution=720）'
+    # 只有一个变体时 auto 也不试下载
+    single = choose_variant(MASTER.playlists[:1], 'auto', MASTER_URL, fetch)
+    assert single.playlist.uri == '1080.m3u8' and single.probes == []
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class Link:
+    """
+    模拟链路的 fetch：媒体播放列表立即返回，分片按 rate（bit/s）推进假时钟；
+    failing 中的 URL 抛出 IOError
+    """
+
+    SEGMENT_BYTES = 250000
+
+    def __init__(self, clock, rate, failing=()):
+        self.clock = clock
+        self.rate = rate
+        self.failing = set(failing)
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def __call__(self, url, headers=None):
+        with self.lock:
+            self.requests.append((url, headers))
+        name = url.rsplit('/', 1)[1]
+        if name in self.failing or '*' in self.failing:
+            raise IOError(f'503 {url}')
+        if name.endswith('.m3u8'):
+            lines = ['#EXTM3U', '#EXT-X-TARGETDURATION:4']
+            for index in range(4):
+                lines += ['#EXTINF:4.0,', f'{name[:-5]}_{index}.ts']
+            return ('\n'.join(lines + ['#EXT-X-ENDLIST']) + '\n').encode()
+        with self.lock:
+            self.clock.now += self.SEGMENT_BYTES * 8 / self.rate
+        return b'\0' * self.SEGMENT_BYTES
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(variants_module, 'time', SimpleNamespace(monotonic=clock))
+    return clock
+
+
+@pytest.mark.parametrize('rate, uri', [
+    # 留出 20% 余量：10M 链路可承受 8M，选最高码率
+    (10_000_000, '1080.m3u8'),
+    # 3.2M × 0.8 = 2.56M：按平均码率 2.2M 的 720 可以，2.8M 的不行
+    (3_200_000, '720.m3u8'),
+    (2_000_000, '540.m3u8'),
+    # 链路太慢，没有能承受的码率：取最低码率
+    (500_000, '360.m3u8'),
+])
+def test_auto_picks_highest_sustainable(clock, rate, uri):
+    link = Link(clock, rate)
+    # 单并发时试下载按顺序进行，实测吞吐量正好等于模拟的链路速度
+    choice = choose_variant(MASTER.playlists, 'auto', MASTER_URL, link, concurrency=1)
+    assert choice.playlist.uri == uri
+    assert choice.throughput == pytest.approx(rate)
+
+    # 只试下载码率最高的几个候选，每个下载开头的几个分片
+    assert sorted(p.playlist.uri for p in choice.probes) == ['1080.m3u8', '720.m3u8', '720hi.m3u8']
+    assert all(p.segments == variants_module.AUTO_PROBE_SEGMENTS and p.error is None for p in choice.probes)
+    segments = sorted(url.rsplit('/', 1)[1] for url, _ in link.requests if url.endswith('.ts'))
+    assert segments == ['1080_0.ts', '1080_1.ts', '720_0.ts', '720_1.ts', '720hi_0.ts', '720hi_1.ts']
+    assert choice.report()[-1].startswith('[*] 选择码率: ')
+    assert choice.to_dict()['probes'][0]['segments'] == variants_module.AUTO_PROBE_SEGMENTS
+
+
+def test_auto_ignores_failed_candidate(clock):
+    link = Link(clock, 10_000_000, failing={'1080.m3u8'})
+    choice = choose_variant(MASTER.playlists, 'auto', MASTER_URL, link, concurrency=1)
+    failed = next(p for p in choice.probes if p.playlist.uri == '1080.m3u8')
+    assert failed.segments == 0 and isinstance(failed.error, IOError)
+    # 其余候选测出的吞吐量仍然有效，链路足够快时还是选最高码率
+    assert choice.throughput == pytest.approx(10_000_000)
+    assert choice.playlist.uri == '1080.m3u8'
+    assert any('试下载失败' in line for line in choice.report())
+
+
+def test_auto_falls_back_to_best_when_all_probes_fail(clock):
+    link = Link(clock, 10_000_000, failing={'*'})
+    choice = choose_variant(MASTER.playlists, 'auto', MASTER_URL, link, concurrency=4)
+    assert choice.playlist.uri == '1080.m3u8'
+    assert not choice.throughput
+    assert len(choice.probes) == variants_module.AUTO_CANDIDATES
+    assert all(p.segments == 0 and p.error for p in choice.probes)
+    report = choice.report()
+    assert '[!] 试下载全部失败，选择最高码率' in report
+    assert choice.to_dict()['throughput'] is None
+
+
+def test_auto_probe_keeps_byterange(clock):
+    def fetch(url, headers=None):
+        calls.append((url, headers))
+        if url.endswith('.m3u8'):
+            return ('#EXTM3U\n#EXT-X-TARGETDURATION:4\n'
+                    '#EXTINF:4.0,\n#EXT-X-BYTERANGE:1000@0\nall.ts\n'
+                    '#EXTINF:4.0,\n#EXT-X-BYTERANGE:1000\nall.ts\n#EXT-X-ENDLIST\n').encode()
+        clock.now += 0.001
+        return b'\0' * 1000
+
+    calls = []
+    choose_variant(MASTER.playlists, 'auto', MASTER_URL, fetch, concurrency=1)
+    ranges = sorted({headers['Range'] for url, headers in calls if url.endswith('.ts')})
+    assert ranges == ['bytes=0-999', 'bytes=1000-1999']
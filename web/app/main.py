@@ -27,6 +27,7 @@ from fastapi import UploadFile, File
 # 导入现有的下载器
 sys.path.append(str(Path(__file__).parent.parent.parent))
 from m3u8_downloader_gui import M3U8DownloaderGUI
+from hls_core import ENGINES, ENGINE_ASYNCIO, shared_key_cache, RetryPolicy, parse_variant_policy
 
 app = FastAPI(title="HLS-Downloader-Plus Web API", version="4.0.0")
 
@@ -55,6 +56,7 @@ class DownloadTask(BaseModel):
     started_at: Optional[datetime] = None
     completed_at: Optional[datetime] = None
     error_message: Optional[str] = None
+    variant_info: Optional[str] = None  # 码率选择结果（JSON）：策略、选中的码率、实测吞吐
 
 class Config(BaseModel):
     download_dir: str = "downloads"
@@ -64,6 +66,13 @@ class Config(BaseModel):
     proxy_url: str = ""
     cookies_file: str = ""
     cookies_from_browser: str = ""
+    stream_merge: bool = False
+    ffmpeg_pipe: bool = False
+    decrypt_processes: int = 0
+    adaptive_concurrency: bool = False
+    retry_attempts: int = 5
+    variant_policy: str = "best"  # best, worst, max-bandwidth=N, resolution=WxH, auto
+    download_engine: str = ENGINE_ASYNCIO  # thread（线程池）或 asyncio（事件循环）
     theme: str = "dark"  # light, dark, auto
 
 class BrowserCookieRequest(BaseModel):
@@ -97,9 +106,15 @@ class DatabaseManager:
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 started_at TIMESTAMP,
                 completed_at TIMESTAMP,
-                error_message TEXT
+                error_message TEXT,
+                variant_info TEXT
             )
         ''')
+
+        # 旧数据库补充新增的列
+        columns = {row[1] for row in cursor.execute('PRAGMA table_info(tasks)')}
+        if 'variant_info' not in columns:
+            cursor.execute('ALTER TABLE tasks ADD COLUMN variant_info TEXT')
         
         # 配置表
         cursor.execute('''
@@ -119,6 +134,13 @@ class DatabaseManager:
             "proxy_url": "",
             "cookies_file": "",
             "cookies_from_browser": "",
+            "stream_merge": "false",
+            "ffmpeg_pipe": "false",
+            "decrypt_processes": "0",
+            "adaptive_concurrency": "false",
+            "retry_attempts": "5",
+            "variant_policy": "best",
+            "download_engine": ENGINE_ASYNCIO,
             "theme": "dark"
         }
         
@@ -220,6 +242,11 @@ class DatabaseManager:
         config_dict['max_concurrent_downloads'] = int(config_dict.get('max_concurrent_downloads', 3))
         config_dict['default_threads'] = int(config_dict.get('default_threads', 10))
         config_dict['use_proxy'] = config_dict.get('use_proxy', 'false').lower() == 'true'
+        config_dict['stream_merge'] = config_dict.get('stream_merge', 'false').lower() == 'true'
+        config_dict['ffmpeg_pipe'] = config_dict.get('ffmpeg_pipe', 'false').lower() == 'true'
+        config_dict['decrypt_processes'] = int(config_dict.get('decrypt_processes', 0))
+        config_dict['adaptive_concurrency'] = config_dict.get('adaptive_concurrency', 'false').lower() == 'true'
+        config_dict['retry_attempts'] = int(config_dict.get('retry_attempts', 5))
         
         return Config(**config_dict)
     
@@ -353,7 +380,16 @@ class DownloadManager:
                         use_proxy=config.use_proxy,
                         proxy_url=config.proxy_url if config.use_proxy else None,
                         cookies_file=config.cookies_file if config.cookies_file else None,
-                        cookies_from_browser=config.cookies_from_browser if config.cookies_from_browser else None
+                        cookies_from_browser=config.cookies_from_browser if config.cookies_from_browser else None,
+                        shared_session=True,
+                        key_cache=shared_key_cache,
+                        engine=config.download_engine,
+                        stream_merge=config.stream_merge,
+                        ffmpeg_pipe=config.ffmpeg_pipe,
+                        decrypt_processes=config.decrypt_processes,
+                        adaptive=config.adaptive_concurrency,
+                        retry_policy=RetryPolicy(attempts=config.retry_attempts),
+                        variant=config.variant_policy
                     )
                     print(f"[DEBUG] 下载器创建成功: {task.id}")
                     print(f"[DEBUG] 代理设置: use_proxy={config.use_proxy}, proxy_url={config.proxy_url}")
@@ -368,13 +404,18 @@ class DownloadManager:
                 self.active_downloads[task.id] = downloader
                 print(f"[DEBUG] 下载器已注册: {task.id}")
                 
-                # 执行下载
+                # 执行下载：整个下载在工作线程中进行（asyncio 引擎在该线程里运行自己的事件循环），
+                # 解密、写盘等同步步骤不会阻塞服务的事件循环
                 print(f"[DEBUG] 开始执行下载: {task.id}")
                 try:
-                    success = await asyncio.get_event_loop().run_in_executor(
-                        None, downloader.download
-                    )
+                    success = await event_loop.run_in_executor(None, downloader.download)
                     print(f"[DEBUG] 下载执行完成，结果: {success}, 任务: {task.id}")
+
+                    if downloader.variant_choice is not None:
+                        db.update_task(
+                            task.id,
+                            variant_info=json.dumps(downloader.variant_choice.to_dict(), ensure_ascii=False)
+                        )
                     
                     if success:
                         db.update_task(
@@ -550,6 +591,12 @@ async def get_config():
 @app.put("/api/config/model")
 async def update_config_model(config: Config):
     """通过模型更新系统配置"""
+    try:
+        parse_variant_policy(config.variant_policy)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if config.download_engine not in ENGINES:
+        raise HTTPException(status_code=400, detail=f"未知的下载引擎: {config.download_engine}（可选 {', '.join(ENGINES)}）")
     db.update_config(config)
     return {"success": True, "message": "配置更新成功"}
 